@@ -1,13 +1,19 @@
-from fastapi import Depends
+from fastapi import Depends, HTTPException, Request, Response
 from app.core.security import get_api_key
+from app.core.rate_limit import (
+    CALLER_ASSERTED_KEY_TYPES,
+    is_trusted_caller,
+    parse_key_types,
+    parse_rate,
+    parse_trusted_keys,
+    rate_limiter,
+    request_identity,
+)
+from app.core.codec import loads
 from fastapi.security.api_key import APIKey
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 from app.config.settings import settings
 from typing import List, Dict, Any
-
-# Setup rate limiter
-limiter = Limiter(key_func=get_remote_address)
+import math
 
 # API documentation settings
 API_TAGS_METADATA: List[Dict[str, Any]] = [
@@ -23,6 +29,14 @@ API_TAGS_METADATA: List[Dict[str, Any]] = [
         "name": "points",
         "description": "Points calculation and session metrics",
     },
+    {
+        "name": "leaderboard",
+        "description": "Global and per-persona leaderboards and ranks",
+    },
+    {
+        "name": "documents",
+        "description": "Document upload for processing and indexing",
+    },
     {
         "name": "admin",
         "description": "Administrative endpoints for system configuration and maintenance",
@@ -31,10 +45,56 @@ API_TAGS_METADATA: List[Dict[str, Any]] = [
 
 # Common dependencies
 def api_key_dependency():
-    """Dependency for routes that require API key authentication."""
-    return Depends(get_api_key)
+    """
+    Dependency for routes that require API key authentication.
+    
+    Returns the dependency callable, to be wrapped by the route as
+    `Depends(api_key_dependency())`.
+    """
+    return get_api_key
 
 
-def get_limiter():
-    """Get the rate limiter instance."""
-    return limiter 
\ No newline at end of file
+def rate_limit(limit: str, scope: str):
+    """
+    Dependency enforcing a shared token-bucket limit on a route.
+    
+    Callers are identified by the `rate_limit_key` setting (API key or client
+    IP; user or session id only for callers listed in `rate_limit_trusted_keys`). Responses carry `X-RateLimit-Limit` and
+    `X-RateLimit-Remaining`; rejected requests get a 429 with `Retry-After`.
+    
+    Args:
+        limit: Limit in slowapi notation, e.g. "10/minute"
+        scope: Name of the bucket group, so routes do not share budgets
+    """
+    parsed = parse_rate(limit)
+    key_types = parse_key_types(settings.rate_limit_key)
+    trusted_keys = parse_trusted_keys(settings.rate_limit_trusted_keys)
+    asserted = any(key_type in CALLER_ASSERTED_KEY_TYPES for key_type in key_types)
+    
+    async def check_rate_limit(request: Request, response: Response):
+        trusted = asserted and is_trusted_caller(request.headers.get("x-api-key"), trusted_keys)
+        body = None
+        if trusted and request.method in ("POST", "PUT", "PATCH"):
+            try:
+                body = loads(await request.body())
+            except Exception:
+                body = None
+        identity = request_identity(
+            key_types,
+            request.headers,
+            request.query_params,
+            body,
+            request.client.host if request.client else None,
+            trusted
+        )
+        result = await rate_limiter.hit_async(f"rl:{scope}:{identity}", parsed)
+        headers = {
+            "X-RateLimit-Limit": str(result.limit),
+            "X-RateLimit-Remaining": str(max(0, result.remaining))
+        }
+        if not result.allowed:
+            headers["Retry-After"] = str(max(1, math.ceil(result.retry_after)))
+            raise HTTPException(status_code=429, detail=f"Rate limit exceeded: {limit}", headers=headers)
+        response.headers.update(headers)
+    
+    return check_rate_limit
@@ -1,7 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
 from app.core.security import get_api_key
 from app.config.prompt_loader import prompt_manager
+from app.services.answer_bank import answer_bank
+from app.services.speculation import speculator
+from app.services.message_store import message_store
+from app.services.analytics import analytics
+from app.models.chat import Persona
+from app.core.metrics import prompt_cache_metrics
+from app.services.usage_service import usage_tracker
+from app.core.tracing import tracer, InMemorySpanExporter
+from app.core.profiling import (
+    loop_lag_monitor,
+    sampling_profiler,
+    start_allocation_tracking,
+    stop_allocation_tracking,
+    allocation_snapshot
+)
+from app.config.settings import settings
+from app.core import prefork
+import asyncio
+from datetime import date, datetime
+from typing import Optional
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/admin", tags=["admin"], include_in_schema=True)
@@ -15,10 +37,295 @@ async def refresh_prompts(api_key: str = Depends(get_api_key)):
     try:
         prompt_manager.refresh()
         logger.info("Prompts refreshed successfully")
-        return {"status": "success", "message": "Prompts refreshed successfully"}
+        return {
+            "status": "success",
+            "message": "Prompts refreshed successfully",
+            "version": prompt_manager.version
+        }
     except Exception as e:
         logger.error(f"Error refreshing prompts: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error refreshing prompts: {str(e)}"
-        ) 
\ No newline at end of file
+        ) 
+
+
+@router.get("/prompts/version", status_code=status.HTTP_200_OK)
+async def prompts_version(api_key: str = Depends(get_api_key)):
+    """
+    Get the version of the loaded prompt set and of each persona prompt.
+    
+    Workers pick up changes to prompts.json on their own, so comparing this
+    across workers shows whether a prompt change has propagated.
+    """
+    prompt_set = prompt_manager.prompt_set
+    return {
+        "version": prompt_set.version,
+        "layout": prompt_manager.layout,
+        "personas": {
+            persona: compiled.version
+            for persona, compiled in prompt_set.personas.items()
+        }
+    }
+
+
+@router.get("/answer-bank", status_code=status.HTTP_200_OK)
+async def answer_bank_info(
+    persona: Optional[Persona] = Query(None, description="Persona to match the message against"),
+    message: Optional[str] = Query(None, description="Question to preview the answer bank match for"),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Get the loaded answer bank version and size, optionally previewing a match.
+    
+    With `persona` and `message`, returns the closest curated answer and its
+    confidence regardless of the threshold, to help tune entries and
+    `ANSWER_BANK_THRESHOLD`.
+    """
+    answer_set = answer_bank.answer_set
+    result = {
+        "version": answer_set.version,
+        "answers": {name: len(index.answers) for name, index in answer_set.indexes.items()},
+        "threshold": settings.answer_bank_threshold
+    }
+    if persona is not None and message:
+        match = answer_bank.match(persona, message, threshold=0.0)
+        result["match"] = None if match is None else {
+            "id": match.answer.id,
+            "confidence": round(match.confidence, 3),
+            "served": match.confidence >= settings.answer_bank_threshold
+        }
+    return result
+
+
+@router.get("/speculation", status_code=status.HTTP_200_OK)
+async def speculation_stats(api_key: str = Depends(get_api_key)):
+    """
+    Get speculative follow-up counters for this worker.
+    
+    Reports live upstream calls in flight, running jobs, tokens spent from
+    the hourly budget, jobs skipped for lack of capacity and how many
+    precomputed answers were served (`hits`) or waited for (`waited`).
+    """
+    return speculator.stats()
+
+
+@router.get("/chat-messages", status_code=status.HTTP_200_OK)
+async def chat_message_store_stats(api_key: str = Depends(get_api_key)):
+    """
+    Get the state of chat message persistence on this worker.
+    
+    Reports rows queued in memory, bytes waiting in the spill file and
+    counters of rows written, spilled, replayed and dropped.
+    """
+    return message_store.stats()
+
+
+@router.get("/analytics", status_code=status.HTTP_200_OK)
+async def analytics_dashboard(
+    window: int = Query(3600, ge=1, description="Seconds to report, rounded up to whole buckets"),
+    persona: Optional[Persona] = Query(None, description="Only report this persona"),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Get chat and session analytics across all workers.
+    
+    Reports message and session counts, distinct sessions, the question
+    quality distribution and percentiles of response latency, session
+    duration and messages per session, in total, per persona and per bucket.
+    """
+    if window > settings.analytics_retention_hours * 3600:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"window must not exceed {settings.analytics_retention_hours} hours"
+        )
+    return await analytics.dashboard(window, persona.value if persona else None)
+
+
+@router.get("/metrics/prompt-cache", status_code=status.HTTP_200_OK)
+async def prompt_cache_stats(api_key: str = Depends(get_api_key)):
+    """
+    Get upstream prompt-cache usage grouped by message prefix hash.
+    
+    Reports prompt tokens and the cached tokens reported in the API's usage
+    field, to measure provider-side prefix caching per persona prompt.
+    """
+    return prompt_cache_metrics.snapshot()
+
+
+@router.get("/usage", status_code=status.HTTP_200_OK)
+async def token_usage(
+    start: Optional[date] = Query(None, description="First day (UTC), defaults to the first of the month"),
+    end: Optional[date] = Query(None, description="Last day (UTC), defaults to today"),
+    api_key_id: Optional[str] = Query(None, description="Only report this caller"),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Get upstream token usage per API key, persona and model.
+    
+    API keys are reported by their id (a hash of the key). Each caller's
+    totals include its configured daily and monthly token quotas.
+    """
+    today = datetime.utcnow().date()
+    end = end or today
+    start = start or end.replace(day=1)
+    if start > end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must not be after end")
+    
+    rows = await usage_tracker.query(start.isoformat(), end.isoformat(), api_key_id)
+    callers = {}
+    for row in rows:
+        caller = callers.setdefault(row.api_key, {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "quota": usage_tracker.quota_for(row.api_key)._asdict()
+        })
+        caller["requests"] += row.requests
+        caller["prompt_tokens"] += row.prompt_tokens
+        caller["completion_tokens"] += row.completion_tokens
+    
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "callers": callers,
+        "rows": [row._asdict() for row in rows]
+    }
+
+
+@router.get("/traces/{trace_id}", status_code=status.HTTP_200_OK)
+async def get_trace(trace_id: str, api_key: str = Depends(get_api_key)):
+    """
+    Get the spans of a recent trace, ordered by start time.
+    
+    The trace id is returned to callers in the `x-trace-id` response header.
+    Only available with the in-memory span exporter (`TRACING_EXPORTER=memory`).
+    """
+    if not isinstance(tracer.exporter, InMemorySpanExporter):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Traces are not kept in memory with the configured exporter"
+        )
+    spans = tracer.exporter.get_trace(trace_id.lower())
+    if not spans:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Trace {trace_id} not found")
+    return {
+        "traceId": trace_id.lower(),
+        "durationMs": round((max(s.end_ns for s in spans) - spans[0].start_ns) / 1e6, 3),
+        "spans": [s.to_dict() for s in spans]
+    }
+
+
+def _download(content: str, filename: str) -> PlainTextResponse:
+    """Return text as a file download."""
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    return PlainTextResponse(
+        content,
+        headers={"Content-Disposition": f'attachment; filename="{filename}-{stamp}.txt"'}
+    )
+
+
+@router.post("/profiling/loop-lag/start", status_code=status.HTTP_200_OK)
+async def start_loop_lag_monitor(
+    threshold_ms: float = Query(100, gt=0, description="Record stacks when the loop is blocked this long"),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Start the event-loop lag monitor on this worker.
+    
+    While running, every stall longer than the threshold is recorded with
+    the stack the event loop thread was executing.
+    """
+    if not loop_lag_monitor.running:
+        loop_lag_monitor.threshold = threshold_ms / 1000
+        loop_lag_monitor.start()
+    return loop_lag_monitor.report()
+
+
+@router.post("/profiling/loop-lag/stop", status_code=status.HTTP_200_OK)
+async def stop_loop_lag_monitor(api_key: str = Depends(get_api_key)):
+    """Stop the event-loop lag monitor and return its final report."""
+    loop_lag_monitor.stop()
+    return loop_lag_monitor.report()
+
+
+@router.get("/profiling/loop-lag", status_code=status.HTTP_200_OK)
+async def loop_lag_report(
+    download: bool = Query(False, description="Return the report as a text file"),
+    api_key: str = Depends(get_api_key)
+):
+    """Get event-loop lag statistics and the recorded blocking stacks."""
+    if download:
+        return _download(loop_lag_monitor.report_text(), "loop-lag")
+    return loop_lag_monitor.report()
+
+
+@router.post("/profiling/cpu", status_code=status.HTTP_200_OK)
+async def cpu_profile(
+    seconds: float = Query(10, gt=0, description="Capture duration"),
+    interval_ms: float = Query(5, ge=1, le=1000, description="Sampling interval"),
+    api_key: str = Depends(get_api_key)
+):
+    """
+    Capture a sampling CPU profile of this worker for the given duration.
+    
+    Returns folded stacks (`thread;frame;... count`), which flamegraph.pl
+    and speedscope load directly.
+    """
+    if seconds > settings.profiling_max_seconds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds must be at most {settings.profiling_max_seconds}"
+        )
+    try:
+        folded = await asyncio.to_thread(sampling_profiler.capture, seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return _download(folded, "cpu-profile")
+
+
+@router.post("/profiling/memory/start", status_code=status.HTTP_200_OK)
+async def start_memory_tracking(
+    frames: int = Query(10, ge=1, le=100, description="Frames stored per allocation"),
+    api_key: str = Depends(get_api_key)
+):
+    """Start tracemalloc allocation tracking on this worker."""
+    return {"started": start_allocation_tracking(frames)}
+
+
+@router.get("/profiling/memory/snapshot", status_code=status.HTTP_200_OK)
+async def memory_snapshot(
+    limit: int = Query(25, ge=1, le=500, description="Number of allocation sites"),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    api_key: str = Depends(get_api_key)
+):
+    """Download the top allocation sites since tracking was started."""
+    try:
+        report = await asyncio.to_thread(allocation_snapshot, limit, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return _download(report, "allocations")
+
+
+@router.post("/profiling/memory/stop", status_code=status.HTTP_200_OK)
+async def stop_memory_tracking(api_key: str = Depends(get_api_key)):
+    """Stop tracemalloc allocation tracking and free its traces."""
+    return {"stopped": stop_allocation_tracking()}
+
+
+
+@router.get("/workers", status_code=status.HTTP_200_OK)
+async def get_workers(api_key: str = Depends(get_api_key)):
+    """
+    Get per-worker stats (requests served, open connections, peak memory).
+    
+    Only available when the service runs under the pre-fork launcher
+    (`python run.py --prod`); otherwise the list of workers is empty.
+    """
+    stats = prefork.worker_stats
+    return {
+        "mode": "prefork" if stats is not None else "single",
+        "pid": os.getpid(),
+        "slot": prefork.worker_slot,
+        "workers": stats.snapshot() if stats is not None else []
+    }
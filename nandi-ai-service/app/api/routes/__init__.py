@@ -1,6 +1,6 @@
 # Routes package initialization 
 from fastapi import APIRouter
-from app.api.routes import chat, health, points
+from app.api.routes import chat, chat_ws, health, points, leaderboard, documents
 from app.api.endpoints import admin
 
 # Create API router
@@ -8,8 +8,11 @@ api_router = APIRouter()
 
 # Include route modules
 api_router.include_router(chat.router)
+api_router.include_router(chat_ws.router)
 api_router.include_router(health.router)
 api_router.include_router(points.router)
+api_router.include_router(leaderboard.router)
+api_router.include_router(documents.router)
 
 # Include admin endpoints
 api_router.include_router(admin.router) 
\ No newline at end of file
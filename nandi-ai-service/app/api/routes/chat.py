@@ -1,20 +1,30 @@
-from fastapi import APIRouter, Body, Depends, Request, HTTPException
+from fastapi import APIRouter, Depends, Query, Request, Response, HTTPException
 from fastapi.security.api_key import APIKey
-from app.models.chat import ChatRequest, ChatResponse
-from app.services.ai_service import generate_response
-from app.api.dependencies import api_key_dependency, get_limiter
+from app.models.chat import ChatRequest, ChatResponse, ChatSuggestions
+from app.services import ai_service
+from app.services.speculation import speculator
+from app.services.usage_service import QuotaExceededError
+from app.core.codec import json_body, json_body_openapi, json_bytes_response
+from app.core.compression import should_compress
+from app.api.dependencies import api_key_dependency, rate_limit
+from app.config.settings import settings
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["chat"])
-limiter = get_limiter()
 
 
-@router.post("/chat/generate", response_model=ChatResponse)
-@limiter.limit("10/minute")
+@router.post(
+    "/chat/generate",
+    response_model=ChatResponse,
+    response_model_exclude_none=True,
+    dependencies=[Depends(rate_limit(settings.chat_rate_limit, "chat"))],
+    openapi_extra=json_body_openapi(ChatRequest)
+)
 async def generate_chat_response(
     request: Request,
-    chat_request: ChatRequest = Body(...),
+    response: Response,
+    chat_request: ChatRequest = Depends(json_body(ChatRequest)),
     api_key: APIKey = Depends(api_key_dependency())
 ):
     """
@@ -27,5 +37,47 @@ async def generate_chat_response(
     - Returns AI response with quality score
     
     The quality score is used by the points system to calculate karma points.
+    Callers over their daily or monthly token quota get a 429.
     """
-    return await generate_response(chat_request) 
\ No newline at end of file
+    try:
+        result = await ai_service.generate_response(chat_request, api_key)
+    except QuotaExceededError as e:
+        logger.warning("Rejected chat request: %s", e)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Token quota exceeded for this {e.period}",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    if isinstance(result, ChatResponse):
+        # Cached responses carry their encoded and compressed JSON, so hits
+        # skip serialization and compression
+        body = result.to_json_bytes()
+        encoding = should_compress(request, len(body))
+        if encoding is not None:
+            return json_bytes_response(result.to_compressed_bytes(encoding), response, encoding)
+        return json_bytes_response(body, response)
+    return result
+
+
+@router.get("/chat/suggestions", response_model=ChatSuggestions, response_model_exclude_none=True)
+async def get_chat_suggestions(
+    session_id: str = Query(..., alias="sessionId", min_length=1, description="Chat session ID"),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Get suggested follow-up questions for the latest response of a session
+    
+    With speculation enabled, a few likely follow-up questions are generated
+    in the background after each answer, and their answers are precomputed:
+    sending one of them as the next message (with the same session_id and
+    the conversation as context) is answered instantly. The list is empty
+    until the suggestions are ready, or when speculation was skipped.
+    """
+    suggestions = speculator.suggestions_for(session_id)
+    if suggestions is None:
+        return ChatSuggestions(sessionId=session_id)
+    return ChatSuggestions(
+        sessionId=session_id,
+        responseId=suggestions.response_id,
+        suggestions=list(suggestions.questions)
+    )
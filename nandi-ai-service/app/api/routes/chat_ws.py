@@ -0,0 +1,267 @@
+"""
+WebSocket chat channel for long-lived sessions.
+
+``/api/chat/ws?sessionId=...&persona=karma`` authenticates once (``x-api-key``
+header, or ``apiKey`` query parameter for browsers) and keeps the
+conversation on the server, so each turn is a single small frame.
+
+Client frames (JSON text):
+
+- ``{"type": "message", "message": "...", "persona": "dharma"}`` starts a turn
+  (``persona`` is optional and switches the persona from this turn on)
+- ``{"type": "reset"}`` forgets the conversation so far
+- ``{"type": "ping"}`` is answered with a ``pong``; ``pong`` answers a server ping
+
+Server frames:
+
+- ``ready`` once connected, with the ``sessionId`` and ``persona``
+- ``token`` frames with answer ``text`` as it streams in
+- ``message`` with the complete answer
+- ``quality`` with the response ``id``, ``qualityScore``, ``scoreReason`` and
+  ``promptVersion``, once the score is resolved
+- ``suggestions`` with the ``responseId`` and suggested follow-up questions
+  (``suggestions``), when speculation is enabled; sending one of them as the
+  next message is answered from its precomputed answer
+- ``ping`` when the connection has been quiet for ``CHAT_WS_HEARTBEAT_INTERVAL``
+- ``error`` with a ``status`` and ``detail`` (and ``retryAfter`` for 429s)
+
+One turn streams at a time per connection. Token text that piles up while a
+client is slow to read is sent as fewer, larger frames; a client that does
+not read a frame within ``CHAT_WS_SEND_TIMEOUT`` seconds is disconnected.
+"""
+
+import asyncio
+import logging
+import math
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Query, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+
+from app.config.settings import settings
+from app.core import security
+from app.core.codec import dumps
+from app.core.log_config import bind_log_context, reset_log_context
+from app.core.rate_limit import (
+    is_trusted_caller,
+    parse_key_types,
+    parse_rate,
+    parse_trusted_keys,
+    rate_limiter,
+    request_identity,
+)
+from app.core.tracing import tracer
+from app.models.chat import ChatRequest, ChatSocketFrame, Persona
+from app.services import ai_service
+from app.services.chat_session import ChatSession
+from app.services.speculation import Suggestions, speculator
+from app.services.usage_service import QuotaExceededError
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["chat"])
+
+# Close code for clients that stop reading (RFC 6455 "try again later")
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+
+class ChatConnection:
+    """
+    One authenticated chat WebSocket and its conversation.
+
+    All frames go through ``send``, which serializes writes from the receive
+    loop (pongs, heartbeats) and the streaming turn.
+    """
+
+    def __init__(self, websocket: WebSocket, session: ChatSession, api_key: str, identity: str):
+        self.websocket = websocket
+        self.session = session
+        self.api_key = api_key
+        self.identity = identity
+        self.rate_limit = parse_rate(settings.chat_rate_limit)
+        self.turn: Optional[asyncio.Task] = None
+        self.last_received = time.monotonic()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, frame: Dict[str, Any]):
+        """
+        Send a frame, waiting at most ``chat_ws_send_timeout`` for the client.
+
+        Raises:
+            asyncio.TimeoutError: If the client is not reading
+        """
+        async with self._send_lock:
+            await asyncio.wait_for(
+                self.websocket.send_text(dumps(frame).decode("utf-8")),
+                settings.chat_ws_send_timeout
+            )
+
+    async def run(self):
+        """Receive frames until the client disconnects or goes idle."""
+        await self.send({"type": "ready", "sessionId": self.session.session_id, "persona": self.session.persona.value})
+        speculator.subscribe(self.session.session_id, self._send_suggestions)
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(
+                        self.websocket.receive_text(),
+                        settings.chat_ws_heartbeat_interval
+                    )
+                except asyncio.TimeoutError:
+                    if not await self._heartbeat():
+                        return
+                    continue
+                self.last_received = time.monotonic()
+                await self._handle(text)
+        except WebSocketDisconnect:
+            pass
+        except asyncio.TimeoutError:
+            await self._close_slow()
+        finally:
+            speculator.unsubscribe(self.session.session_id, self._send_suggestions)
+            if self.turn is not None:
+                self.turn.cancel()
+
+    async def _send_suggestions(self, suggestions: Suggestions):
+        """Push follow-up suggestions for the latest answer."""
+        try:
+            await self.send({
+                "type": "suggestions",
+                "responseId": suggestions.response_id,
+                "suggestions": list(suggestions.questions)
+            })
+        except Exception:
+            # A closed or slow socket is handled by the receive loop
+            pass
+
+    async def _heartbeat(self) -> bool:
+        """Ping a quiet client; returns False once the connection was closed as idle."""
+        idle = time.monotonic() - self.last_received
+        if idle >= settings.chat_ws_idle_timeout and (self.turn is None or self.turn.done()):
+            logger.info("Closing idle chat socket", extra={"session_id": self.session.session_id})
+            await self.websocket.close(code=status.WS_1000_NORMAL_CLOSURE, reason="Idle timeout")
+            return False
+        await self.send({"type": "ping"})
+        return True
+
+    async def _handle(self, text: str):
+        try:
+            frame = ChatSocketFrame.model_validate_json(text)
+        except ValidationError as e:
+            await self.send({"type": "error", "status": 422, "detail": e.errors(include_url=False, include_context=False)})
+            return
+
+        if frame.type == "ping":
+            await self.send({"type": "pong"})
+        elif frame.type == "reset":
+            self.session.reset()
+            await self.send({"type": "reset"})
+        elif frame.type == "message":
+            await self._start_turn(frame)
+
+    async def _start_turn(self, frame: ChatSocketFrame):
+        if not frame.message:
+            await self.send({"type": "error", "status": 422, "detail": "message is required"})
+            return
+        if self.turn is not None and not self.turn.done():
+            await self.send({"type": "error", "status": 409, "detail": "A response is still streaming"})
+            return
+        # The same budget as /api/chat/generate, without re-reading the request
+        result = rate_limiter.hit(f"rl:chat:{self.identity}", self.rate_limit)
+        if not result.allowed:
+            await self.send({
+                "type": "error",
+                "status": 429,
+                "detail": f"Rate limit exceeded: {settings.chat_rate_limit}",
+                "retryAfter": max(1, math.ceil(result.retry_after))
+            })
+            return
+        request = self.session.build_request(frame.message, frame.persona)
+        self.turn = asyncio.create_task(self._run_turn(request))
+
+    async def _run_turn(self, request: ChatRequest):
+        token = bind_log_context(
+            chat_id=str(uuid.uuid4()),
+            persona=request.persona.value,
+            session_id=self.session.session_id
+        )
+        events = ai_service.stream_response(request, self.api_key)
+        try:
+            with tracer.start_span(
+                "chat.stream_turn",
+                {"chat.persona": request.persona.value, "chat.turn": self.session.turns + 1}
+            ):
+                async for event in events:
+                    if event.type == "token":
+                        await self.send({"type": "token", "text": event.text})
+                    elif event.type == "message":
+                        await self.send({"type": "message", "message": event.text})
+                    elif event.type == "done":
+                        response = event.response
+                        self.session.record(request.message, response.message)
+                        await self.send({
+                            "type": "quality",
+                            "id": response.id,
+                            "qualityScore": response.qualityScore,
+                            "scoreReason": response.scoreReason,
+                            "promptVersion": response.promptVersion
+                        })
+        except QuotaExceededError as e:
+            logger.warning("Rejected chat turn: %s", e)
+            await self.send({
+                "type": "error",
+                "status": 429,
+                "detail": f"Token quota exceeded for this {e.period}",
+                "retryAfter": e.retry_after
+            })
+        except asyncio.TimeoutError:
+            await self._close_slow()
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logger.error("Chat turn failed: %s", e, exc_info=True)
+        finally:
+            await events.aclose()
+            reset_log_context(token)
+
+    async def _close_slow(self):
+        logger.warning("Closing chat socket of a client that stopped reading", extra={"session_id": self.session.session_id})
+        try:
+            await self.websocket.close(code=SLOW_CLIENT_CLOSE_CODE, reason="Client too slow")
+        except Exception:
+            pass
+
+
+@router.websocket("/chat/ws")
+async def chat_websocket(
+    websocket: WebSocket,
+    session_id: str = Query(..., alias="sessionId", min_length=1, description="Chat session ID"),
+    persona: Persona = Query(Persona.KARMA, description="Initial persona"),
+    api_key: Optional[str] = Query(None, alias="apiKey", description="API key, for clients that cannot set headers")
+):
+    """
+    Chat over a WebSocket bound to one session.
+
+    The API key is checked once per connection; turns stream tokens as they
+    arrive and get their quality score in a separate frame.
+    """
+    api_key = websocket.headers.get(security.API_KEY_NAME) or api_key
+    if api_key != security.API_KEY:
+        logger.warning("Rejected chat socket with an invalid API key")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    identity = request_identity(
+        parse_key_types(settings.rate_limit_key),
+        websocket.headers,
+        websocket.query_params,
+        None,
+        websocket.client.host if websocket.client else None,
+        is_trusted_caller(api_key, parse_trusted_keys(settings.rate_limit_trusted_keys))
+    )
+    await websocket.accept()
+    session = ChatSession(session_id, persona, settings.chat_ws_max_history)
+    logger.info("Chat socket connected", extra={"session_id": session_id, "persona": persona.value})
+    await ChatConnection(websocket, session, api_key, identity).run()
+    logger.info("Chat socket closed", extra={"session_id": session_id, "turns": session.turns})
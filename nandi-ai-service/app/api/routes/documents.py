@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Body, Depends, HTTPException
+from app.models.documents import Document, DocumentResponse
+from app.api.dependencies import rate_limit
+from app.config.settings import settings
+from datetime import datetime
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+router = APIRouter(tags=["documents"])
+
+
+@router.post(
+    "/documents",
+    response_model=DocumentResponse,
+    dependencies=[Depends(rate_limit(settings.documents_rate_limit, "documents"))]
+)
+async def upload_document(document: Document = Body(...)):
+    """
+    Upload a document for processing and indexing
+    
+    This endpoint:
+    - Accepts document text and metadata
+    - Processes the document (in future: embedding, indexing)
+    - Returns a document ID for future reference
+    """
+    try:
+        # Generate a document ID
+        doc_id = f"doc-{uuid.uuid4().hex[:12]}"
+        
+        # In a real implementation, we would:
+        # 1. Create embeddings for the document
+        # 2. Store in a vector database
+        # 3. Index for search/retrieval
+        
+        # For now, just log and return
+        logger.info("Document uploaded: %s with %d characters", doc_id, len(document.text))
+        
+        return DocumentResponse(
+            id=doc_id,
+            timestamp=datetime.utcnow().isoformat() + "Z",
+            status="processed"
+        )
+    except Exception as e:
+        logger.error("Error processing document: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing document: {str(e)}"
+        )
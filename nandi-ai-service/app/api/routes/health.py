@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Request
 from app.config.settings import settings
 from app.core.cache import response_cache
-import psutil
 import platform
 import sys
 from datetime import datetime
@@ -37,6 +36,9 @@ async def health_check():
     
     # Detailed system info
     try:
+        # Imported on first use; it is not needed to serve other requests
+        import psutil
+        
         # Resource usage
         health_data["system"] = {
             "cpu_usage": psutil.cpu_percent(),
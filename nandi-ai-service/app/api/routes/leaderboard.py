@@ -0,0 +1,75 @@
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
+from fastapi.security.api_key import APIKey
+from typing import Optional
+from app.models.chat import Persona
+from app.models.points import LeaderboardEntryResponse, LeaderboardResponse, RankResponse
+from app.services.leaderboard import leaderboard, GLOBAL_BOARD
+from app.services.points_ledger import owner_key
+from app.api.dependencies import api_key_dependency, rate_limit
+from app.config.settings import settings
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter(prefix="/api", tags=["leaderboard"])
+
+
+@router.get(
+    "/leaderboard",
+    response_model=LeaderboardResponse,
+    dependencies=[Depends(rate_limit(settings.leaderboard_rate_limit, "leaderboard"))]
+)
+async def get_leaderboard(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100, description="Number of entries to return"),
+    persona: Optional[Persona] = Query(None, description="Persona board; omit for the global board"),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Get the top of the global or a persona leaderboard
+    
+    The global board ranks owners by accumulated points; persona boards
+    rank them by points earned with that persona.
+    """
+    board = persona.value if persona else GLOBAL_BOARD
+    entries = await leaderboard.top_async(limit, persona=persona.value if persona else None)
+    return LeaderboardResponse(
+        board=board,
+        size=entries[0].size if entries else 0,
+        entries=[
+            LeaderboardEntryResponse(owner=e.owner, points=e.points, rank=e.rank, percentile=e.percentile)
+            for e in entries
+        ]
+    )
+
+
+@router.get(
+    "/leaderboard/rank",
+    response_model=RankResponse,
+    dependencies=[Depends(rate_limit(settings.leaderboard_rate_limit, "leaderboard"))]
+)
+async def get_rank(
+    request: Request,
+    userId: Optional[str] = Query(None, description="Registered user ID"),
+    sessionId: Optional[str] = Query(None, description="Anonymous session ID, used when there is no user ID"),
+    persona: Optional[Persona] = Query(None, description="Persona board; omit for the global board"),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Get the rank and percentile of a user or anonymous session
+    """
+    owner = owner_key(userId, sessionId)
+    if owner is None:
+        raise HTTPException(status_code=400, detail="userId or sessionId is required")
+
+    entry = await leaderboard.rank_async(owner, persona=persona.value if persona else None)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"No points recorded for {owner}")
+
+    return RankResponse(
+        board=persona.value if persona else GLOBAL_BOARD,
+        size=entry.size,
+        owner=entry.owner,
+        points=entry.points,
+        rank=entry.rank,
+        percentile=entry.percentile
+    )
@@ -1,19 +1,43 @@
-from fastapi import APIRouter, Body, Depends, Request, HTTPException
+from fastapi import APIRouter, Body, Depends, Request, Response, HTTPException
+from pydantic import BaseModel
 from fastapi.security.api_key import APIKey
-from app.models.points import SessionMetricsRequest, PointsResponse
-from app.services.points_service import calculate_session_points, get_points_calculations
-from app.api.dependencies import api_key_dependency, get_limiter
+from app.models.points import (
+    SessionMetricsRequest,
+    PointsResponse,
+    BatchSessionMetricsRequest,
+    BatchPointsResponse,
+    SessionMergeRequest,
+    SessionMergeResponse,
+    BatchSessionMergeRequest,
+    BatchSessionMergeResponse
+)
+from app.services import points_service
+from app.services.session_merge import MergeResult, SessionMerge, session_merger
+from app.api.dependencies import api_key_dependency, rate_limit
+from app.config.settings import settings
+from app.core.codec import encode_model, json_body, json_body_openapi, json_bytes_response
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["session"])
-limiter = get_limiter()
 
 
-@router.post("/session/metrics", response_model=PointsResponse)
-@limiter.limit("30/minute")
+def _encoded(result, response: Response):
+    """Return a response model as pre-encoded JSON, skipping FastAPI's re-validation."""
+    if isinstance(result, BaseModel):
+        return json_bytes_response(encode_model(result), response)
+    return result
+
+
+@router.post(
+    "/session/metrics",
+    response_model=PointsResponse,
+    response_model_exclude_none=True,
+    dependencies=[Depends(rate_limit(settings.points_rate_limit, "points"))]
+)
 async def session_metrics(
     request: Request,
+    response: Response,
     session_request: SessionMetricsRequest = Body(...),
     api_key: APIKey = Depends(api_key_dependency())
 ):
@@ -21,22 +45,140 @@ async def session_metrics(
     Calculate points earned from a chat session
     
     This endpoint:
-    - Takes session metrics (duration, message count, persona)
-    - Calculates points based on predefined rules
-    - Returns total points earned and breakdown
+    - Takes session metrics (duration, message count, persona, user or session ID)
+    - Calculates points based on predefined rules and the owner's streak
+    - Returns points earned, accumulated total and breakdown
     """
     try:
-        return await calculate_session_points(session_request)
+        result = await points_service.calculate_session_points(session_request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error calculating points: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"Error calculating points: {str(e)}"
         )
+    return _encoded(result, response)
+
+
+@router.post(
+    "/session/metrics/batch",
+    response_model=BatchPointsResponse,
+    response_model_exclude_none=True,
+    dependencies=[Depends(rate_limit(settings.points_rate_limit, "points_batch"))],
+    openapi_extra=json_body_openapi(BatchSessionMetricsRequest)
+)
+async def session_metrics_batch(
+    request: Request,
+    response: Response,
+    batch_request: BatchSessionMetricsRequest = Depends(json_body(BatchSessionMetricsRequest)),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Calculate points for many chat sessions in one call
+    
+    This endpoint:
+    - Takes up to `points_batch_max_size` session metrics
+    - Calculates base, duration, streak, quality multiplier and milestone points
+      for all sessions in one vectorized pass
+    - Optionally records the awards in the points ledger
+    - Returns results row-wise or as one array per field (`format: "columns"`)
+    """
+    if len(batch_request.sessions) > settings.points_batch_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: at most {settings.points_batch_max_size} sessions per request"
+        )
+    try:
+        result = await points_service.calculate_batch_points(batch_request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error calculating batch points: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error calculating batch points: {str(e)}"
+        )
+    return _encoded(result, response)
+
+
+def _merge_response(result: MergeResult) -> SessionMergeResponse:
+    return SessionMergeResponse(
+        sessionId=result.session_id,
+        userId=result.user_id,
+        pointsMerged=result.points_merged,
+        messagesMerged=result.messages_merged,
+        totalPoints=result.total_points
+    )
+
+
+async def _merge(merges):
+    try:
+        return await session_merger.merge_many(merges)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error merging anonymous sessions: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error merging anonymous sessions: {str(e)}"
+        )
+
+
+@router.post(
+    "/session/merge",
+    response_model=SessionMergeResponse,
+    dependencies=[Depends(rate_limit(settings.points_rate_limit, "merge"))]
+)
+async def merge_session(
+    request: Request,
+    merge_request: SessionMergeRequest = Body(...),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Merge an anonymous session into a registered user
+    
+    This endpoint:
+    - Moves the session's points, stored chat messages and chat sessions to
+      the user in one transaction
+    - Moves the session's leaderboard entries to the user
+    - Returns what was moved and the user's new total; merging a session
+      again moves nothing
+    """
+    results = await _merge([SessionMerge(merge_request.sessionId, merge_request.userId)])
+    return _merge_response(results[0])
+
+
+@router.post(
+    "/session/merge/batch",
+    response_model=BatchSessionMergeResponse,
+    dependencies=[Depends(rate_limit(settings.points_rate_limit, "merge_batch"))]
+)
+async def merge_sessions_batch(
+    request: Request,
+    batch_request: BatchSessionMergeRequest = Body(...),
+    api_key: APIKey = Depends(api_key_dependency())
+):
+    """
+    Merge many anonymous sessions into registered users
+    
+    Intended for migrating existing sessions in bulk. Sessions are merged
+    `session_merge_batch_size` per transaction while chat traffic continues.
+    """
+    if len(batch_request.merges) > settings.session_merge_max_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: at most {settings.session_merge_max_size} sessions per request"
+        )
+    results = await _merge([SessionMerge(m.sessionId, m.userId) for m in batch_request.merges])
+    return BatchSessionMergeResponse(count=len(results), results=[_merge_response(r) for r in results])
 
 
-@router.get("/points/calculations")
-@limiter.limit("30/minute")
+@router.get(
+    "/points/calculations",
+    dependencies=[Depends(rate_limit(settings.points_rate_limit, "points"))]
+)
 async def points_calculations(
     request: Request,
     api_key: APIKey = Depends(api_key_dependency())
@@ -46,4 +188,4 @@ async def points_calculations(
     
     Returns the base values used to calculate points for the client
     """
-    return get_points_calculations() 
\ No newline at end of file
+    return points_service.get_points_calculations() 
\ No newline at end of file
@@ -1,94 +1,454 @@
+import hashlib
 import json
 import os
 import logging
+import threading
 from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PERSONA = "karma"
+
+# Message layouts for the system prefix:
+# - "legacy": one system message with the quality block appended to the persona text
+# - "stable_prefix": the quality block shared by all personas first, then the
+#   persona text, each as its own system message, so the longest possible
+#   byte-identical prefix precedes any variable content for provider-side
+#   prompt caching
+PROMPT_LAYOUTS = ("legacy", "stable_prefix")
+
+# The tiktoken encoding is loaded on the first token count, not at import:
+# get_encoding reads (and on a cold cache downloads) the BPE file
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Return the cl100k_base encoding, or None if tiktoken is unavailable."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except ImportError:
+                    pass  # tiktoken is optional; fall back to an estimate
+                except Exception as e:
+                    logger.warning("Could not load the tiktoken encoding, estimating token counts: %s", e)
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in a piece of prompt text.
+
+    Uses tiktoken when it is installed and its encoding loads, otherwise
+    estimates four characters per token, which is close enough for budgeting
+    and metrics.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+class PersonaPrompt(NamedTuple):
+    """Precompiled, read-only prompt data for a single persona."""
+    persona: str
+    # Content hash of everything that shapes this persona's answers
+    version: str
+    system_prompt: str
+    # Message prefix without the quality evaluation block
+    prefix: Tuple[Mapping[str, str], ...]
+    prefix_tokens: int
+    prefix_hash: str
+    # Message prefix including the quality evaluation block
+    quality_prefix: Tuple[Mapping[str, str], ...]
+    quality_prefix_tokens: int
+    quality_prefix_hash: str
+    fallback: str
+
+
+class PromptSet(NamedTuple):
+    """An immutable snapshot of everything loaded from prompts.json."""
+    # Content hash of the prompts file this set was built from
+    version: str
+    raw: Mapping
+    personas: Mapping[str, PersonaPrompt]
+    quality_prompt: str
+    fallbacks: Mapping[str, str]
+
+
+def _system_message(content: str) -> Mapping[str, str]:
+    return MappingProxyType({"role": "system", "content": content})
+
+
+def _content_version(*parts: str) -> str:
+    """Short, stable hash identifying a piece of prompt content."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:12]
+
+
+def prefix_hash(prefix: Sequence[Mapping[str, str]]) -> str:
+    """Hash of the exact bytes a message prefix serializes to."""
+    return _content_version(*(f"{m['role']}:{m['content']}" for m in prefix))
+
+
+def build_prompt_set(
+    prompts: dict,
+    version: Optional[str] = None,
+    layout: str = "legacy",
+) -> PromptSet:
+    """
+    Compile raw prompts JSON into an immutable PromptSet.
+
+    Args:
+        prompts: The parsed prompts.json content
+        version: Version id of the set; derived from the content if omitted
+        layout: One of PROMPT_LAYOUTS
+
+    Returns:
+        PromptSet: Per-persona message prefixes and token counts
+    """
+    if layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout: {layout}")
+
+    quality_prompt = prompts.get("quality", {}).get("evaluation_prompt", "")
+    fallbacks = dict(prompts.get("fallbacks", {}))
+    # Shared by every persona so it can be cached across personas
+    quality_message = _system_message(quality_prompt.strip())
+
+    personas = {}
+    for persona, config in prompts.get("personas", {}).items():
+        system_prompt = config.get("system_prompt", "")
+        fallback = fallbacks.get(persona, "")
+        prefix = (_system_message(system_prompt),)
+        if layout == "stable_prefix" and quality_prompt:
+            quality_prefix = (quality_message, _system_message(system_prompt))
+        else:
+            quality_prefix = (_system_message(system_prompt + quality_prompt),)
+        personas[persona] = PersonaPrompt(
+            persona=persona,
+            version=_content_version(persona, system_prompt, quality_prompt, fallback),
+            system_prompt=system_prompt,
+            prefix=prefix,
+            prefix_tokens=sum(count_tokens(m["content"]) for m in prefix),
+            prefix_hash=prefix_hash(prefix),
+            quality_prefix=quality_prefix,
+            quality_prefix_tokens=sum(count_tokens(m["content"]) for m in quality_prefix),
+            quality_prefix_hash=prefix_hash(quality_prefix),
+            fallback=fallback,
+        )
+
+    if version is None:
+        version = _content_version(json.dumps(prompts, sort_keys=True))
+
+    return PromptSet(
+        version=version,
+        raw=MappingProxyType(prompts),
+        personas=MappingProxyType(personas),
+        quality_prompt=quality_prompt,
+        fallbacks=MappingProxyType(fallbacks),
+    )
+
+
+EMPTY_PROMPT_SET = build_prompt_set({"personas": {}, "quality": {}, "fallbacks": {}})
+
+
 class PromptManager:
     """
     A utility class for loading and managing prompts from JSON configuration.
+
+    Prompts are compiled into an immutable PromptSet on load. Refreshing
+    builds a complete new set and swaps it in with a single assignment, so
+    concurrent requests always see either the old or the new prompts.
+    Listeners registered with ``add_listener`` are notified after each swap.
     """
-    
-    def __init__(self, prompts_file=None):
+
+    def __init__(self, prompts_file=None, layout: str = "legacy", lazy: bool = False):
         """
         Initialize the PromptManager with the path to the prompts JSON file.
-        
+
         Args:
             prompts_file: Path to prompts JSON file. If None, uses default path.
+            layout: Message layout of the system prefix (see PROMPT_LAYOUTS)
+            lazy: Defer loading to ``load()`` or the first prompt lookup
         """
         if prompts_file is None:
             # Use the default path relative to this file
             base_dir = Path(__file__).resolve().parent
             prompts_file = base_dir / "prompts.json"
-            
+
         self.prompts_file = prompts_file
-        self.prompts = {}
-        self._load_prompts()
-    
+        self.layout = layout
+        self._current_set = EMPTY_PROMPT_SET
+        self._loaded = False
+        self._listeners: List[Callable[[PromptSet, PromptSet], None]] = []
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """Load the prompts file unless it has already been loaded."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            self._load_prompts()
+        except Exception:
+            # Keep the empty prompt set so lookups fall back gracefully
+            pass
+
+    @property
+    def _prompt_set(self) -> PromptSet:
+        if not self._loaded:
+            self.load()
+        return self._current_set
+
     def _load_prompts(self):
-        """Load prompts from the JSON file."""
+        """Load prompts from the JSON file and swap in the compiled set."""
         try:
-            with open(self.prompts_file, 'r') as f:
-                self.prompts = json.load(f)
-            logger.info(f"Successfully loaded prompts from {self.prompts_file}")
+            with open(self.prompts_file, 'rb') as f:
+                content = f.read()
+            prompt_set = build_prompt_set(
+                json.loads(content),
+                version=hashlib.sha256(content).hexdigest()[:12],
+                layout=self.layout
+            )
         except Exception as e:
             logger.error(f"Error loading prompts from {self.prompts_file}: {str(e)}")
-            # Initialize with empty structure to prevent errors
-            self.prompts = {
-                "personas": {},
-                "quality": {},
-                "fallbacks": {}
-            }
-    
+            raise
+
+        previous = self._current_set
+        if prompt_set.version == previous.version:
+            return
+        self._current_set = prompt_set
+        logger.info("Successfully loaded prompts from %s (version %s)", self.prompts_file, prompt_set.version)
+
+        for listener in list(self._listeners):
+            try:
+                listener(previous, prompt_set)
+            except Exception as e:
+                logger.error("Error in prompt change listener %r: %s", listener, e)
+
+    def add_listener(self, listener: Callable[[PromptSet, PromptSet], None]):
+        """
+        Register a callback invoked as ``listener(old_set, new_set)`` after prompts change.
+
+        Args:
+            listener: The callback to register
+        """
+        self._listeners.append(listener)
+
+    @property
+    def prompts(self) -> Mapping:
+        """The raw prompts of the current prompt set (read-only)."""
+        return self._prompt_set.raw
+
+    @property
+    def prompt_set(self) -> PromptSet:
+        """The current compiled prompt set."""
+        return self._prompt_set
+
+    @property
+    def version(self) -> str:
+        """Version id of the current prompt set."""
+        return self._prompt_set.version
+
+    def get_persona(self, persona) -> Optional[PersonaPrompt]:
+        """
+        Get the compiled prompt for a persona, falling back to the default persona.
+
+        Args:
+            persona: The persona identifier (e.g., "karma", "dharma")
+
+        Returns:
+            Optional[PersonaPrompt]: The compiled prompt, or None if no prompts are loaded
+        """
+        personas = self._prompt_set.personas
+        compiled = personas.get(getattr(persona, "value", persona))
+        if compiled is None or not compiled.system_prompt:
+            compiled = personas.get(DEFAULT_PERSONA, compiled)
+        return compiled
+
+    def build_messages(
+        self,
+        persona: Union[str, PersonaPrompt],
+        message: str,
+        context: Optional[Sequence] = None,
+        include_quality: bool = True,
+        passages: Optional[Sequence[str]] = None,
+    ) -> list:
+        """
+        Build the chat completion messages for a request.
+
+        The system messages are the persona's precompiled prefix; only the
+        variable content (passages, conversation context and the user
+        message) is allocated per call, and it always follows the prefix.
+
+        Args:
+            persona: The persona identifier or an already resolved PersonaPrompt
+            message: The user's message
+            context: Previous ConversationMessage objects, if any
+            include_quality: Whether to use the prefix with the quality evaluation block
+            passages: Retrieved reference passages to include, if any
+
+        Returns:
+            list: Messages ready to pass to the chat completions API
+        """
+        compiled = persona if isinstance(persona, PersonaPrompt) else self.get_persona(persona)
+        messages = []
+        if compiled is not None:
+            messages.extend(compiled.quality_prefix if include_quality else compiled.prefix)
+        if passages:
+            messages.append({
+                "role": "system",
+                "content": "Reference passages:\n\n" + "\n\n".join(passages)
+            })
+        if context:
+            messages.extend({"role": msg.role.value, "content": msg.content} for msg in context)
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def get_prefix_tokens(self, persona, include_quality: bool = True) -> int:
+        """Return the precomputed token count of a persona's message prefix."""
+        compiled = persona if isinstance(persona, PersonaPrompt) else self.get_persona(persona)
+        if compiled is None:
+            return 0
+        return compiled.quality_prefix_tokens if include_quality else compiled.prefix_tokens
+
+    def get_prefix_hash(self, persona, include_quality: bool = True) -> Optional[str]:
+        """Return the hash of a persona's message prefix, used to group cache metrics."""
+        compiled = persona if isinstance(persona, PersonaPrompt) else self.get_persona(persona)
+        if compiled is None:
+            return None
+        return compiled.quality_prefix_hash if include_quality else compiled.prefix_hash
+
     def get_persona_prompt(self, persona):
         """
         Get the system prompt for a specific persona.
-        
+
         Args:
             persona: The persona identifier (e.g., "karma", "dharma")
-            
+
         Returns:
             str: The system prompt for the requested persona
         """
-        try:
-            return self.prompts.get("personas", {}).get(persona, {}).get("system_prompt", "")
-        except Exception as e:
-            logger.error(f"Error retrieving prompt for persona {persona}: {str(e)}")
-            return ""
-    
+        compiled = self._prompt_set.personas.get(getattr(persona, "value", persona))
+        return compiled.system_prompt if compiled is not None else ""
+
     def get_quality_prompt(self):
         """
         Get the quality evaluation prompt.
-        
+
         Returns:
             str: The quality evaluation prompt
         """
-        try:
-            return self.prompts.get("quality", {}).get("evaluation_prompt", "")
-        except Exception as e:
-            logger.error(f"Error retrieving quality prompt: {str(e)}")
-            return ""
-    
+        return self._prompt_set.quality_prompt
+
     def get_fallback_response(self, persona):
         """
         Get the fallback response for a specific persona.
-        
+
         Args:
             persona: The persona identifier (e.g., "karma", "dharma")
-            
+
         Returns:
             str: The fallback response for the requested persona
         """
-        try:
-            return self.prompts.get("fallbacks", {}).get(persona, "")
-        except Exception as e:
-            logger.error(f"Error retrieving fallback response for persona {persona}: {str(e)}")
-            return ""
+        return self._prompt_set.fallbacks.get(getattr(persona, "value", persona), "")
 
     def refresh(self):
-        """Reload prompts from the JSON file."""
+        """
+        Reload prompts from the JSON file.
+
+        Raises:
+            Exception: If the file cannot be read or parsed; the previously
+            loaded prompts stay in effect
+        """
         self._load_prompts()
-        
+
+
+class PromptFileWatcher:
+    """
+    Polls the prompts file and reloads the PromptManager when it changes.
+
+    Every worker process runs its own watcher, so an edit to prompts.json
+    reaches all workers within one polling interval instead of only the
+    worker that served ``/admin/prompts/refresh``. Any other object with a
+    ``refresh()`` method (such as the answer bank) can be watched by passing
+    its file as ``path``.
+    """
+
+    def __init__(self, manager: PromptManager, interval: float = 2.0, path=None):
+        self.manager = manager
+        self.path = path if path is not None else manager.prompts_file
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_signature = self._signature()
+        self._failed_signature = None
+
+    def _signature(self):
+        """Cheap change signature of the prompts file (mtime and size)."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self) -> bool:
+        """
+        Reload prompts if the file changed since the last check.
+
+        Returns:
+            bool: True if the file changed and was reloaded successfully
+        """
+        signature = self._signature()
+        if signature is None or signature == self._last_signature:
+            return False
+        if signature == self._failed_signature:
+            return False
+        try:
+            self.manager.refresh()
+        except Exception:
+            # Keep serving the previous prompts; retry once the file changes again
+            self._failed_signature = signature
+            return False
+        self._last_signature = signature
+        self._failed_signature = None
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """Start polling in a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prompt-file-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Watching %s for changes every %ss", self.path, self.interval)
+
+    def stop(self):
+        """Stop polling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
 # Create a singleton instance
-prompt_manager = PromptManager() 
\ No newline at end of file
+prompt_manager = PromptManager(layout=settings.prompt_layout, lazy=True)
@@ -18,29 +18,200 @@ class Settings(BaseSettings):
     environment: str = "development"
     log_level: str = "INFO"
     
+    # Logging pipeline: "json" (one object per line) or "text", a size-rotated
+    # log file (empty disables it) and a bounded queue drained by a thread.
+    # log_sample_rate keeps that fraction of INFO records from log_sampled_loggers.
+    log_format: str = "json"
+    log_file: Optional[str] = "nandi_service.log"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_queue_size: int = 10000
+    log_sample_rate: float = 1.0
+    log_sampled_loggers: str = "app.core.log_config,app.services.ai_service,app.core.cache"
+    
     # Server options
     debug: Optional[bool] = True
     host: Optional[str] = "0.0.0.0"
     cors_origins: Optional[str] = "http://localhost:3000,http://localhost:8080"
     
+    # Pre-fork launcher (python run.py --prod): worker processes (0 = one per CPU),
+    # requests after which a worker is replaced (0 = never) plus a random jitter,
+    # and seconds a stopping worker may spend finishing its requests
+    workers: int = 0
+    max_requests: int = 0
+    max_requests_jitter: int = 0
+    graceful_timeout: float = 30.0
+    
     # OpenAI settings
     default_model: Optional[str] = "gpt-4"
     
-    # Cache settings (included for future Redis integration)
+    # Model routing tiers, smallest first: "name=model:max_tokens,..."
+    # e.g. "small=gpt-4o-mini:256,medium=gpt-4o:512,large=gpt-4:1024"; ":max_tokens"
+    # is optional, so fine-tuned ids like "ft:gpt-4o-mini:org:id" work as they are.
+    # Empty routes everything to default_model.
+    routing_tiers: Optional[str] = ""
+
+    # Quality scoring: "inline" appends the evaluation prompt to the chat
+    # completion, "separate" keeps the completion free of it and relies on
+    # the quality model (if set) or the local heuristic scorer
+    quality_scoring_mode: str = "inline"
+    quality_model: Optional[str] = ""
+    quality_cache_size: int = 2048
+
+    # Cache settings (included for future Redis integration). The "redis" backends
+    # below share this connection and use their local fallback for
+    # redis_failure_cooldown seconds after a Redis error.
     redis_host: Optional[str] = "localhost"
     redis_port: Optional[str] = "6379"
     redis_password: Optional[str] = ""
     redis_db: Optional[str] = "0"
     redis_ttl: Optional[str] = "604800"
+    redis_failure_cooldown: float = 5.0
     celery_broker_url: Optional[str] = "redis://localhost:6379/0"
     celery_result_backend: Optional[str] = "redis://localhost:6379/0"
     
+    # Response compression: encodings in preference order (those whose package
+    # is not installed are skipped) and the smallest body worth compressing
+    compression_encodings: str = "zstd,br,gzip"
+    compression_min_size: int = 512
+    
     # Caching time-to-live in minutes
     cache_ttl_minutes: int = 30
     
+    # Prompt message layout: "legacy" or "stable_prefix" (maximizes provider prompt caching)
+    prompt_layout: str = "legacy"
+    
+    # Seconds between checks of prompts.json for changes (0 disables hot reload)
+    prompts_watch_interval: float = 2.0
+    
+    # Curated answer bank (app/config/answer_bank.json): first-turn questions
+    # matching an entry with at least answer_bank_threshold confidence (0-1)
+    # are answered without an upstream call; when the upstream fails, matches
+    # down to answer_bank_fallback_threshold replace the generic fallback
+    answer_bank_enabled: bool = True
+    answer_bank_threshold: float = 0.7
+    answer_bank_fallback_threshold: float = 0.3
+
+    # Speculative follow-ups: after a turn with a session id, suggest up to
+    # speculation_max_suggestions follow-up questions and precompute their
+    # answers for speculation_ttl seconds. Speculation only starts while fewer
+    # than speculation_max_live_requests live upstream calls are in flight, runs
+    # at most speculation_max_concurrency jobs at once and spends at most
+    # speculation_token_budget tokens per hour. speculation_model writes the
+    # suggestions (empty uses the smallest routing tier).
+    speculation_enabled: bool = False
+    speculation_max_suggestions: int = 3
+    speculation_max_live_requests: int = 4
+    speculation_max_concurrency: int = 2
+    speculation_token_budget: int = 50000
+    speculation_ttl: float = 600.0
+    speculation_model: Optional[str] = None
+    
+    # Points ledger: "sqlite" (local file), "postgres" (points_history) or "memory".
+    # Each worker loads a shared store once and then reads the rows added since its
+    # last refresh every points_ledger_refresh_interval seconds (0 = never).
+    points_ledger_backend: str = "sqlite"
+    points_ledger_path: str = "points_ledger.db"
+    points_ledger_dsn: Optional[str] = ""
+    points_ledger_batch_size: int = 500
+    points_ledger_flush_interval: float = 1.0
+    points_ledger_refresh_interval: float = 5.0
+
+    # Chat message persistence (chat_messages): "sqlite" (local file), "postgres"
+    # (platform schema, message_store_dsn or else points_ledger_dsn), "memory" or
+    # "none". Rows are written behind in batches; at most message_store_max_pending
+    # are held in memory, and rows that cannot be written go to the spill file
+    # (up to message_store_spill_max_mb, 0 = unlimited) until the database is back.
+    # Rows the database rejects (constraint or data errors) go to the dead-letter file.
+    message_store_backend: str = "sqlite"
+    message_store_path: str = "chat_messages.db"
+    message_store_dsn: Optional[str] = ""
+    message_store_batch_size: int = 500
+    message_store_flush_interval: float = 1.0
+    message_store_max_pending: int = 10000
+    message_store_spill_path: Optional[str] = "chat_messages.spill"
+    message_store_spill_max_mb: int = 100
+    message_store_dead_letter_path: Optional[str] = "chat_messages.rejected"
+
+    # Analytics rollups (/admin/analytics): per-persona aggregates of chats and
+    # sessions in analytics_bucket_seconds buckets, kept analytics_retention_hours.
+    # Every analytics_flush_interval seconds each worker writes its rollups to
+    # "sqlite" (shared by workers on one host), "redis" (all hosts) or "memory"
+    analytics_backend: str = "sqlite"
+    analytics_db_path: str = "analytics.db"
+    analytics_bucket_seconds: int = 300
+    analytics_retention_hours: int = 24
+    analytics_flush_interval: float = 10.0
+
+    # Maximum sessions per /api/session/metrics/batch request
+    points_batch_max_size: int = 10000
+
+    # Anonymous session to user merges (/api/session/merge): sessions per
+    # transaction and per /api/session/merge/batch request
+    session_merge_batch_size: int = 500
+    session_merge_max_size: int = 10000
+    
+    # Leaderboards: "memory" (per worker) or "redis" (sorted sets shared by all workers)
+    leaderboard_backend: str = "memory"
+    leaderboard_bucket_width: int = 10
+    leaderboard_snapshot_path: Optional[str] = "leaderboard_snapshot.json"
+    leaderboard_snapshot_interval: float = 60.0
+    
+    # Tracing: spans are exported to "memory" (readable via /admin/traces),
+    # "log" (one structured log record per span) or "none"
+    tracing_exporter: str = "memory"
+    tracing_sample_rate: float = 1.0
+    tracing_max_traces: int = 1000
+    
+    # Longest CPU profile capture accepted by /admin/profiling/cpu, in seconds
+    profiling_max_seconds: int = 60
+    
+    # Upstream token usage accounting: "sqlite" (shared by workers on one host),
+    # "redis" (shared across hosts) or "memory"
+    usage_backend: str = "sqlite"
+    usage_db_path: str = "usage.db"
+    usage_flush_interval: float = 5.0
+    
+    # Token quotas per API key (0 = unlimited), with per-key overrides
+    # "<api key id>=<daily>:<monthly>,..."
+    usage_daily_token_quota: int = 0
+    usage_monthly_token_quota: int = 0
+    usage_quota_overrides: Optional[str] = ""
+    
     # Rate limits
     chat_rate_limit: str = "10/minute"
     points_rate_limit: str = "30/minute"
+    leaderboard_rate_limit: str = "60/minute"
+    documents_rate_limit: str = "30/minute"
+    
+    # Idempotency-Key handling for /api/chat/generate and /api/session/metrics:
+    # "memory" (per worker) or "redis" (shared by all workers), seconds a
+    # successful response is kept for replay, and seconds a duplicate waits
+    # for the original request before getting a 409
+    idempotency_backend: str = "memory"
+    idempotency_ttl: float = 86400.0
+    idempotency_max_entries: int = 10000
+    idempotency_wait_timeout: float = 60.0
+    
+    # Chat WebSocket (/api/chat/ws): seconds between server pings on a quiet
+    # connection, seconds without client frames before it is closed, seconds a
+    # frame may wait on a slow client, and conversation messages kept per connection
+    chat_ws_heartbeat_interval: float = 20.0
+    chat_ws_idle_timeout: float = 300.0
+    chat_ws_send_timeout: float = 10.0
+    chat_ws_max_history: int = 20
+    
+    # Rate limit buckets: "memory" (per worker) or "redis" (shared by all workers).
+    # rate_limit_key lists the caller identities to key buckets by, first match wins;
+    # user_id/session_id are only taken from callers whose API key id is listed in
+    # rate_limit_trusted_keys (e.g. nandi-api forwarding its users' ids).
+    # A worker may spend up to rate_limit_lease_size tokens locally (0 disables)
+    # for rate_limit_lease_ttl seconds when a bucket is well under its limit.
+    rate_limit_backend: str = "memory"
+    rate_limit_key: str = "api_key,ip"
+    rate_limit_trusted_keys: Optional[str] = ""
+    rate_limit_lease_size: int = 5
+    rate_limit_lease_ttl: float = 1.0
     
     model_config = {
         "env_file": ".env",
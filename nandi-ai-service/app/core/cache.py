@@ -1,29 +1,52 @@
 import hashlib
+import threading
 from datetime import datetime, timedelta
 from app.config.settings import settings
+from app.config.prompt_loader import prompt_manager
 import logging
 
 logger = logging.getLogger(__name__)
 
 # Simple in-memory cache - consider using Redis for production
+# Entries are (data, cache_time, persona, prompt_version); responses are
+# encoded to JSON and compressed when they are cached so hits are written out as-is
 response_cache = {}
+# Prompt watchers invalidate entries from their own thread; every read-modify
+# of response_cache holds this lock (reentrant: saving may run a cleanup)
+_cache_lock = threading.RLock()
 CACHE_TTL = timedelta(minutes=settings.cache_ttl_minutes)
 
 
+def _persona_id(persona):
+    """Return the plain string identifier of a persona."""
+    return getattr(persona, "value", persona)
+
+
 def get_cache_key(persona, message):
     """Generate a deterministic cache key for a request."""
-    key_data = f"{persona}:{message}".encode()
+    key_data = f"{_persona_id(persona)}:{message}".encode()
     return hashlib.md5(key_data).hexdigest()
 
 
-def get_from_cache(persona, message):
-    """Get a cached response if available and valid."""
+def get_from_cache(persona, message, prompt_version=None):
+    """
+    Get a cached response if available and valid.
+
+    Entries produced by a different prompt version than ``prompt_version``
+    are treated as stale and dropped.
+    """
     if settings.environment == "development":
         return None  # Skip cache in development mode
-        
+
     cache_key = get_cache_key(persona, message)
-    if cache_key in response_cache:
-        cached_data, cache_time = response_cache[cache_key]
+    with _cache_lock:
+        entry = response_cache.get(cache_key)
+        if entry is None:
+            return None
+        cached_data, cache_time, _, cached_version = entry
+        if prompt_version is not None and cached_version != prompt_version:
+            response_cache.pop(cache_key, None)
+            return None
         # Check if cache is still valid
         if datetime.utcnow() - cache_time < CACHE_TTL:
             return cached_data
@@ -34,24 +57,71 @@ def save_to_cache(persona, message, data):
     """Save a response to the cache."""
     if settings.environment == "development":
         return  # Skip cache in development mode
-        
+
     cache_key = get_cache_key(persona, message)
-    response_cache[cache_key] = (data, datetime.utcnow())
-    
-    # Cleanup old cache entries
-    if len(response_cache) > 1000:  # Prevent unbounded growth
-        cleanup_cache()
+    prompt_version = getattr(data, "promptVersion", None)
+    if hasattr(data, "precompress"):
+        data.precompress()
+    with _cache_lock:
+        response_cache[cache_key] = (data, datetime.utcnow(), _persona_id(persona), prompt_version)
+
+        # Cleanup old cache entries
+        if len(response_cache) > 1000:  # Prevent unbounded growth
+            cleanup_cache()
 
 
 def cleanup_cache():
     """Remove expired entries from the cache."""
     now = datetime.utcnow()
-    keys_to_delete = [
-        k for k, (_, t) in response_cache.items() 
-        if now - t > CACHE_TTL
-    ]
-    for k in keys_to_delete:
-        del response_cache[k]
-    
+    with _cache_lock:
+        keys_to_delete = [
+            k for k, (_, t, _, _) in response_cache.items()
+            if now - t > CACHE_TTL
+        ]
+        for k in keys_to_delete:
+            del response_cache[k]
+
     if keys_to_delete:
-        logger.info(f"Cleaned up {len(keys_to_delete)} expired cache entries") 
\ No newline at end of file
+        logger.info("Cleaned up %d expired cache entries", len(keys_to_delete))
+
+
+def invalidate_prompt_versions(current_versions):
+    """
+    Remove cache entries produced by outdated persona prompts.
+
+    Args:
+        current_versions: Mapping of persona id to its current prompt version.
+            Only entries for these personas with a different version are removed.
+
+    Returns:
+        int: Number of entries removed
+    """
+    with _cache_lock:
+        keys_to_delete = [
+            k for k, (_, _, persona, version) in response_cache.items()
+            if persona in current_versions and version != current_versions[persona]
+        ]
+        for k in keys_to_delete:
+            del response_cache[k]
+
+    if keys_to_delete:
+        logger.info("Invalidated %d cache entries from previous prompt versions", len(keys_to_delete))
+    return len(keys_to_delete)
+
+
+def _on_prompts_changed(old_set, new_set):
+    """Invalidate cached answers only for personas whose prompts changed."""
+    changed = {
+        persona: compiled.version
+        for persona, compiled in new_set.personas.items()
+        if persona not in old_set.personas or old_set.personas[persona].version != compiled.version
+    }
+    # Personas removed from the file have no current version; drop their entries too
+    for persona in old_set.personas:
+        if persona not in new_set.personas:
+            changed[persona] = None
+    if changed:
+        invalidate_prompt_versions(changed)
+
+
+prompt_manager.add_listener(_on_prompts_changed)
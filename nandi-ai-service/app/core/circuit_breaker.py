@@ -0,0 +1,72 @@
+"""
+Circuit breaker for the optional shared backends (Redis).
+
+When a call to a shared store fails, callers skip the store for
+``cooldown`` seconds and use their local fallback instead of paying a
+connection timeout on every request while it is down. Once the cooldown
+has passed, a single caller is let through to probe the store; the others
+keep using the fallback until the probe succeeds.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Tracks whether a shared store should be called.
+
+    Args:
+        name: Store name used in log messages
+        cooldown: Seconds the store is skipped after a failure
+        clock: Monotonic clock, replaceable in tests
+    """
+
+    def __init__(self, name: str, cooldown: float = 5.0, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._open = False
+        self._retry_at = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        """True while the store is being skipped."""
+        return self._open
+
+    def allow(self) -> bool:
+        """
+        Return True if the caller should use the store.
+
+        While open, returns True once per cooldown, to the caller that
+        probes the store.
+        """
+        if not self._open:
+            return True
+        now = self._clock()
+        with self._lock:
+            if now < self._retry_at:
+                return False
+            self._retry_at = now + self.cooldown
+            return True
+
+    def record_success(self):
+        """Close the breaker after a successful call."""
+        if self._open:
+            with self._lock:
+                self._open = False
+            logger.info("%s is reachable again", self.name)
+
+    def record_failure(self, error: Exception):
+        """Open the breaker after a failed call."""
+        with self._lock:
+            opened = not self._open
+            self._open = True
+            self._retry_at = self._clock() + self.cooldown
+        if opened:
+            logger.error("%s unavailable, using the local fallback for %ss: %s", self.name, self.cooldown, error)
@@ -0,0 +1,139 @@
+"""
+Fast JSON encoding and decoding for the hot request and response paths.
+
+- ``FastJSONResponse`` renders response bodies with orjson (falling back to
+  the standard library when orjson is not installed)
+- ``encode_model`` serializes a pydantic model straight to JSON bytes with
+  pydantic-core, without building an intermediate dict; routes return the
+  bytes in a ``JSONBytesResponse`` so FastAPI does not validate and
+  serialize the model a second time
+- ``json_body`` parses and validates a request body in one pass, instead of
+  ``json.loads`` followed by model validation
+"""
+
+import json
+from typing import Any, Dict, Optional, Type
+
+from fastapi import Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is listed in requirements.txt
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode ``obj`` as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def loads(data) -> Any:
+    """Decode JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class JSONBytesResponse(Response):
+    """Response whose body is already-encoded JSON, written out unchanged."""
+
+    media_type = "application/json"
+
+
+def encode_model(model: BaseModel) -> bytes:
+    """
+    Serialize a model to JSON bytes, leaving out fields that are None.
+
+    Matches what the routes produce with ``response_model_exclude_none=True``.
+    """
+    return model.__pydantic_serializer__.to_json(model, exclude_none=True)
+
+
+def json_bytes_response(
+    body: bytes,
+    response: Optional[Response] = None,
+    encoding: Optional[str] = None
+) -> JSONBytesResponse:
+    """
+    Wrap pre-encoded JSON in a response.
+
+    FastAPI only applies headers set by dependencies (such as the rate limit
+    headers) to responses it builds itself, so they are copied over from the
+    route's ``response`` parameter.
+
+    Args:
+        body: Encoded JSON
+        response: The route's injected ``Response``, if any
+        encoding: Content-Encoding ``body`` is already compressed with, if any
+    """
+    result = JSONBytesResponse(body)
+    if response is not None:
+        result.headers.update(response.headers)
+    if encoding is not None:
+        result.headers["content-encoding"] = encoding
+        result.headers["vary"] = "Accept-Encoding"
+    return result
+
+
+def json_body(model: Type[BaseModel]):
+    """
+    Dependency parsing and validating a JSON request body in one pass.
+
+    pydantic-core reads the raw bytes directly, which is several times faster
+    than FastAPI's ``json.loads`` plus validation for large bodies (long chat
+    context lists, points batches). Invalid bodies get the usual 422 response.
+
+    Args:
+        model: Model the body must validate against
+    """
+    async def decode(request: Request):
+        body = await request.body()
+        try:
+            return model.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError([
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ])
+
+    return decode
+
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    if isinstance(node, dict):
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/$defs/"):
+            return _inline_refs(defs[ref[len("#/$defs/"):]], defs)
+        return {key: _inline_refs(value, defs) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_inline_refs(value, defs) for value in node]
+    return node
+
+
+def json_body_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    OpenAPI ``requestBody`` for routes reading their body with ``json_body``.
+    
+    The model's schema is inlined, since its ``$defs`` are not part of the
+    document's components.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _inline_refs(schema, defs)}},
+        }
+    }
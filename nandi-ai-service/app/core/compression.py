@@ -0,0 +1,166 @@
+"""
+Response compression with Accept-Encoding negotiation.
+
+Supported encodings are zstd (``zstandard`` package), brotli (``brotli``
+package) and gzip (standard library). Encodings whose package is not
+installed are skipped. The client's q-values decide first; among equally
+acceptable encodings the order of the ``compression_encodings`` setting wins.
+
+- ``compress_responses`` compresses JSON and text responses of at least
+  ``compression_min_size`` bytes at fast levels
+- cached chat responses are compressed once, at higher levels, when they are
+  cached (``ChatResponse.precompress``), so hits are written out without
+  compressing again; the middleware leaves responses that already carry a
+  ``Content-Encoding`` alone
+"""
+
+import gzip
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.config.settings import settings
+
+try:
+    import brotli
+except ImportError:  # optional, see requirements.txt
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, see requirements.txt
+    zstandard = None
+
+# Levels for responses compressed per request
+FAST_LEVELS = {"zstd": 3, "br": 4, "gzip": 5}
+
+# Levels for bodies compressed once and served many times (cache entries)
+STORED_LEVELS = {"zstd": 12, "br": 9, "gzip": 9}
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def available_encodings() -> List[str]:
+    """Encodings from ``compression_encodings`` whose codec is installed, in preference order."""
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    encodings = [e.strip().lower() for e in (settings.compression_encodings or "").split(",")]
+    return [e for e in encodings if installed.get(e)]
+
+
+SUPPORTED_ENCODINGS = available_encodings()
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parse an Accept-Encoding header into ``{coding: q}``.
+
+    Malformed q-values count as 0, i.e. not acceptable.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate(header: Optional[str], encodings: Optional[List[str]] = None) -> Optional[str]:
+    """
+    Pick the response encoding for an Accept-Encoding header.
+
+    Args:
+        header: The request's Accept-Encoding value
+        encodings: Candidate encodings in server preference order
+            (defaults to ``SUPPORTED_ENCODINGS``)
+
+    Returns:
+        Optional[str]: The encoding to use, or None to send the body as is
+    """
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for encoding in SUPPORTED_ENCODINGS if encodings is None else encodings:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """
+    Compress ``body`` with an encoding from ``SUPPORTED_ENCODINGS``.
+
+    Args:
+        body: The bytes to compress
+        encoding: "zstd", "br" or "gzip"
+        level: Compression level (defaults to ``FAST_LEVELS``)
+    """
+    if level is None:
+        level = FAST_LEVELS[encoding]
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported encoding: {encoding!r}")
+
+
+def decompress(body: bytes, encoding: str) -> bytes:
+    """Reverse ``compress``."""
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f"Unsupported encoding: {encoding!r}")
+
+
+def should_compress(request: Request, size: int) -> Optional[str]:
+    """Return the encoding for a body of ``size`` bytes, or None if it stays uncompressed."""
+    if size < settings.compression_min_size:
+        return None
+    return negotiate(request.headers.get("accept-encoding"))
+
+
+def _compressible(response: Response) -> bool:
+    if "content-encoding" in response.headers or response.status_code in (204, 304):
+        return False
+    content_type = response.headers.get("content-type", "")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+async def compress_responses(request: Request, call_next):
+    """Middleware compressing JSON and text responses the client accepts compressed."""
+    response = await call_next(request)
+    if not SUPPORTED_ENCODINGS or not _compressible(response):
+        return response
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    headers = dict(response.headers)
+    headers.pop("content-length", None)
+    if len(body) >= settings.compression_min_size:
+        body = compress(body, encoding)
+        headers["content-encoding"] = encoding
+    vary = headers.get("vary")
+    if not vary:
+        headers["vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["vary"] = f"{vary}, Accept-Encoding"
+    return Response(body, status_code=response.status_code, headers=headers)
@@ -0,0 +1,396 @@
+"""
+Idempotency-Key support for retried POST requests.
+
+nandi-api retries calls that time out. A request to one of
+``IDEMPOTENT_PATHS`` that carries an ``Idempotency-Key`` header is executed
+once per key:
+
+- the first request runs normally, and a successful (2xx) response is stored
+  for ``idempotency_ttl`` seconds
+- duplicates that arrive while it is still running wait for its response
+  instead of running again (on the same worker through a shared future,
+  across workers by polling the Redis store); the reservation is renewed
+  for as long as the request runs
+- later duplicates get the stored body byte-for-byte, with an
+  ``Idempotent-Replayed: true`` header, without touching rate limits,
+  quotas or the upstream API
+
+Keys are scoped to the caller's API key and the path. Reusing a key with a
+different request body is rejected with a 422. Failed requests are not
+stored, so their retries run again.
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Union
+
+from fastapi import Request, Response
+
+from app.config.settings import settings
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.codec import FastJSONResponse, dumps, loads
+from app.core.compression import decompress, negotiate
+from app.core.security import API_KEY_NAME, api_key_id
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# Routes whose POST requests honor the Idempotency-Key header
+IDEMPOTENT_PATHS = frozenset({"/api/chat/generate", "/api/session/metrics"})
+
+
+class IdempotencyRecord(NamedTuple):
+    """A stored response."""
+    status_code: int
+    content_type: Optional[str]
+    body: bytes
+    fingerprint: str
+    content_encoding: Optional[str] = None
+
+
+class Pending(NamedTuple):
+    """A key reserved by a request that is still running."""
+    fingerprint: str
+
+
+class IdempotencyError(Exception):
+    """A request cannot be served for its Idempotency-Key."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def encode_record(record: IdempotencyRecord) -> bytes:
+    """Pack a record as a JSON header line followed by the raw body."""
+    header = dumps({
+        "s": record.status_code,
+        "c": record.content_type,
+        "f": record.fingerprint,
+        "e": record.content_encoding
+    })
+    return header + b"\n" + record.body
+
+
+def decode_record(data: bytes) -> IdempotencyRecord:
+    """Unpack a record written by ``encode_record``."""
+    header, _, body = data.partition(b"\n")
+    fields = loads(header)
+    return IdempotencyRecord(fields["s"], fields["c"], body, fields["f"], fields.get("e"))
+
+
+class MemoryIdempotencyStore:
+    """Per-worker store with TTLs, holding at most ``max_entries`` keys."""
+
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (Pending or IdempotencyRecord, expires at)
+        self._entries: "OrderedDict[str, Tuple[Union[Pending, IdempotencyRecord], float]]" = OrderedDict()
+
+    def _get(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        return entry[0]
+
+    def reserve(self, key: str, fingerprint: str, lock_ttl: float) -> Union[None, Pending, IdempotencyRecord]:
+        """
+        Reserve ``key`` for a new request.
+
+        Returns:
+            None if the caller now owns the key, otherwise the pending
+            reservation or stored record already held under it
+        """
+        now = self._clock()
+        with self._lock:
+            current = self._get(key, now)
+            if current is not None:
+                return current
+            self._entries[key] = (Pending(fingerprint), now + lock_ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return None
+
+    def get(self, key: str) -> Union[None, Pending, IdempotencyRecord]:
+        """Return what is held under ``key``."""
+        with self._lock:
+            return self._get(key, self._clock())
+
+    def save(self, key: str, record: IdempotencyRecord, ttl: float):
+        """Store a completed response."""
+        with self._lock:
+            self._entries[key] = (record, self._clock() + ttl)
+            self._entries.move_to_end(key)
+
+    def release(self, key: str):
+        """Drop a reservation whose request failed."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def extend(self, key: str, lock_ttl: float):
+        """Keep a reservation for another ``lock_ttl`` seconds while its request runs."""
+        now = self._clock()
+        with self._lock:
+            current = self._get(key, now)
+            if isinstance(current, Pending):
+                self._entries[key] = (current, now + lock_ttl)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisIdempotencyStore:
+    """Store shared by all workers; reservations are taken with ``SET NX``."""
+
+    PENDING_PREFIX = b"pending:"
+
+    def __init__(self, client):
+        self._client = client
+
+    def _decode(self, data: Optional[bytes]) -> Union[None, Pending, IdempotencyRecord]:
+        if data is None:
+            return None
+        if data.startswith(self.PENDING_PREFIX):
+            return Pending(data[len(self.PENDING_PREFIX):].decode("ascii"))
+        return decode_record(data)
+
+    def reserve(self, key: str, fingerprint: str, lock_ttl: float) -> Union[None, Pending, IdempotencyRecord]:
+        """Reserve ``key`` for a new request (see ``MemoryIdempotencyStore.reserve``)."""
+        value = self.PENDING_PREFIX + fingerprint.encode("ascii")
+        if self._client.set(key, value, nx=True, px=max(1, int(lock_ttl * 1000))):
+            return None
+        return self._decode(self._client.get(key))
+
+    def get(self, key: str) -> Union[None, Pending, IdempotencyRecord]:
+        """Return what is held under ``key``."""
+        return self._decode(self._client.get(key))
+
+    def save(self, key: str, record: IdempotencyRecord, ttl: float):
+        """Store a completed response."""
+        self._client.set(key, encode_record(record), px=max(1, int(ttl * 1000)))
+
+    def release(self, key: str):
+        """Drop a reservation whose request failed."""
+        self._client.delete(key)
+
+    def extend(self, key: str, lock_ttl: float):
+        """Keep a reservation for another ``lock_ttl`` seconds while its request runs."""
+        self._client.pexpire(key, max(1, int(lock_ttl * 1000)))
+
+
+class IdempotencyManager:
+    """
+    Runs each idempotency key's request once and shares its response.
+
+    If the store fails, the manager falls back to a per-worker memory store
+    rather than rejecting requests, and skips the store until ``breaker``
+    lets a probe through. A shared store is called from a worker thread.
+    """
+
+    def __init__(
+        self,
+        store,
+        ttl: float = 86400.0,
+        wait_timeout: float = 60.0,
+        poll_interval: float = 0.05,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._fallback = store if isinstance(store, MemoryIdempotencyStore) else MemoryIdempotencyStore()
+        self._breaker = breaker or CircuitBreaker("Idempotency store")
+        # key -> (fingerprint, future resolving to the record, or None if the request failed)
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def _call(self, method: str, *args):
+        if self.store is self._fallback or not self._breaker.allow():
+            return getattr(self._fallback, method)(*args)
+        try:
+            result = await asyncio.to_thread(getattr(self.store, method), *args)
+        except Exception as e:
+            self._breaker.record_failure(e)
+            return getattr(self._fallback, method)(*args)
+        self._breaker.record_success()
+        return result
+
+    @staticmethod
+    def _check_fingerprint(expected: str, fingerprint: str):
+        if expected != fingerprint:
+            raise IdempotencyError(422, "Idempotency-Key was already used with a different request")
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        execute: Callable[[], Awaitable[IdempotencyRecord]]
+    ) -> Tuple[IdempotencyRecord, bool]:
+        """
+        Execute a request once per key.
+
+        Args:
+            key: Scoped idempotency key
+            fingerprint: Hash of the request, to detect key reuse
+            execute: Runs the request and returns its response as a record
+
+        Returns:
+            Tuple[IdempotencyRecord, bool]: The response, and whether it was
+            replayed rather than produced by ``execute``
+
+        Raises:
+            IdempotencyError: If the key was used for a different request, or
+            the original request is still running after ``wait_timeout``
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check_fingerprint(inflight[0], fingerprint)
+            return await self._wait_local(inflight[1]), True
+
+        current = await self._call("reserve", key, fingerprint, self.wait_timeout)
+        if isinstance(current, IdempotencyRecord):
+            self._check_fingerprint(current.fingerprint, fingerprint)
+            return current, True
+        if isinstance(current, Pending):
+            self._check_fingerprint(current.fingerprint, fingerprint)
+            return await self._poll(key), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, future)
+        # A chat with tier fallbacks can outlast wait_timeout: keep the
+        # reservation so other workers do not run the request again
+        keeper = asyncio.create_task(self._keep_reserved(key))
+        record = None
+        try:
+            record = await execute()
+        finally:
+            keeper.cancel()
+            del self._inflight[key]
+            future.set_result(record)
+            if record is not None and 200 <= record.status_code < 300:
+                await self._call("save", key, record, self.ttl)
+            else:
+                await self._call("release", key)
+        return record, False
+
+    async def _keep_reserved(self, key: str):
+        while True:
+            await asyncio.sleep(self.wait_timeout / 3)
+            await self._call("extend", key, self.wait_timeout)
+
+    async def _wait_local(self, future: asyncio.Future) -> IdempotencyRecord:
+        try:
+            record = await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+        except asyncio.TimeoutError:
+            record = None
+        if record is None:
+            raise IdempotencyError(409, "The original request for this Idempotency-Key did not complete; retry")
+        return record
+
+    async def _poll(self, key: str) -> IdempotencyRecord:
+        """Wait for a request running on another worker to store its response."""
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            current = await self._call("get", key)
+            if isinstance(current, IdempotencyRecord):
+                return current
+            if current is None:
+                break
+        raise IdempotencyError(409, "The original request for this Idempotency-Key did not complete; retry")
+
+
+def request_fingerprint(path: str, body: bytes) -> str:
+    """Hash identifying a request's path and body."""
+    return hashlib.sha256(path.encode("utf-8") + b"\0" + body).hexdigest()
+
+
+async def idempotent_requests(request: Request, call_next):
+    """Middleware executing POSTs to ``IDEMPOTENT_PATHS`` once per Idempotency-Key."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if key is None or request.method != "POST" or request.url.path not in IDEMPOTENT_PATHS:
+        return await call_next(request)
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return FastJSONResponse(
+            {"detail": f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters"},
+            status_code=400
+        )
+
+    body = await request.body()
+    caller = api_key_id(request.headers.get(API_KEY_NAME) or "")
+    scoped_key = f"idem:{caller}:{request.url.path}:{key}"
+    fingerprint = request_fingerprint(request.url.path, body)
+    original = None
+
+    async def execute() -> IdempotencyRecord:
+        nonlocal original
+        response = await call_next(request)
+        content = b"".join([chunk async for chunk in response.body_iterator])
+        original = Response(content, status_code=response.status_code, headers=dict(response.headers))
+        return IdempotencyRecord(
+            response.status_code,
+            response.headers.get("content-type"),
+            content,
+            fingerprint,
+            response.headers.get("content-encoding")
+        )
+
+    try:
+        record, replayed = await idempotency.run(scoped_key, fingerprint, execute)
+    except IdempotencyError as e:
+        headers = {"Retry-After": "1"} if e.status_code == 409 else None
+        return FastJSONResponse({"detail": e.detail}, status_code=e.status_code, headers=headers)
+
+    if not replayed:
+        return original
+    body = record.body
+    response = Response(status_code=record.status_code, media_type=record.content_type)
+    if record.content_encoding is not None:
+        # Stored compressed by the route; decompress for a retry that does not accept it
+        if negotiate(request.headers.get("accept-encoding"), [record.content_encoding]) is None:
+            body = decompress(body, record.content_encoding)
+        else:
+            response.headers["content-encoding"] = record.content_encoding
+            response.headers["vary"] = "Accept-Encoding"
+    response.body = body
+    response.headers["content-length"] = str(len(body))
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def create_store(backend: str):
+    """Create the idempotency store for a backend name ("memory" or "redis")."""
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis(
+            host=settings.redis_host,
+            port=int(settings.redis_port),
+            password=settings.redis_password or None,
+            db=int(settings.redis_db),
+            socket_timeout=0.5,
+        )
+        return RedisIdempotencyStore(client)
+    return MemoryIdempotencyStore(settings.idempotency_max_entries)
+
+
+# Create a singleton instance
+idempotency = IdempotencyManager(
+    create_store(settings.idempotency_backend),
+    ttl=settings.idempotency_ttl,
+    wait_timeout=settings.idempotency_wait_timeout,
+    breaker=CircuitBreaker("Idempotency store", settings.redis_failure_cooldown),
+)
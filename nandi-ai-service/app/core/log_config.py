@@ -0,0 +1,246 @@
+"""
+Non-blocking, structured logging.
+
+Application code logs through a ``QueueHandler`` that only enqueues the
+record; a ``QueueListener`` thread formats it (as one JSON object per line
+or the classic text format) and writes it to the console and a size-rotated
+log file. Nothing on the event loop thread touches the disk or formats a
+message, and a full queue drops records instead of blocking.
+
+Request-scoped fields (request id, persona, ...) bound with
+``bind_log_context`` are attached to every record logged while handling
+that request. Routine INFO records from high-volume loggers can be sampled.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+_direct_handlers: list = []
+
+
+def bind_log_context(**fields: Any):
+    """
+    Attach fields to every record logged in the current context (request or task).
+
+    Returns:
+        contextvars.Token: Pass to ``reset_log_context`` to restore the previous fields
+    """
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def reset_log_context(token):
+    """Restore the log context saved by ``bind_log_context``."""
+    _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the bound log context onto records, in the thread that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, value in _log_context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of INFO and lower records from high-volume loggers.
+
+    Warnings and errors, and records from other loggers, always pass.
+    """
+
+    def __init__(self, rate: float, logger_names: Iterable[str]):
+        super().__init__()
+        self.rate = rate
+        self.prefixes = tuple(name for name in logger_names if name)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1.0 or record.levelno > logging.INFO:
+            return True
+        if not record.name.startswith(self.prefixes):
+            return True
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues records without formatting them and drops them if the queue is full.
+
+    ``QueueHandler.prepare`` normally merges the arguments into the message
+    on the logging thread; here the record is passed through untouched and
+    formatted by the listener thread, so suppressed or sampled records
+    cost almost nothing and emitted ones cost a queue put.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object, including ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRS and not name.startswith("_"):
+                data[name] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+def configure_logging(
+    level: Optional[int] = None,
+    log_format: Optional[str] = None,
+    log_file: Optional[str] = None,
+    use_queue: bool = True,
+) -> Optional[logging.handlers.QueueListener]:
+    """
+    Route all logging through a queue to console and rotating file handlers.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level: Root log level (defaults to ``settings.log_level``)
+        log_format: "json" or "text" (defaults to ``settings.log_format``)
+        log_file: Log file path, empty to disable (defaults to ``settings.log_file``)
+        use_queue: False attaches the handlers to the root logger directly and
+            starts no thread (for the pre-fork master, which must stay single-threaded)
+
+    Returns:
+        Optional[logging.handlers.QueueListener]: The running listener, if any
+    """
+    global _listener, _queue_handler, _direct_handlers
+    shutdown_logging()
+
+    level = level if level is not None else settings.get_log_level()
+    log_format = log_format or settings.log_format
+    log_file = settings.log_file if log_file is None else log_file
+
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file,
+            maxBytes=settings.log_max_bytes,
+            backupCount=settings.log_backup_count,
+            encoding="utf-8",
+            delay=True,
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    filters = [
+        SamplingFilter(settings.log_sample_rate, settings.log_sampled_loggers.split(",")),
+        ContextFilter(),
+    ]
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if not use_queue:
+        for handler in handlers:
+            for log_filter in filters:
+                handler.addFilter(log_filter)
+            root.addHandler(handler)
+        _direct_handlers = handlers
+        return None
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    for log_filter in filters:
+        _queue_handler.addFilter(log_filter)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Stop the listener after it has written every queued record."""
+    global _listener, _direct_handlers
+    for handler in _direct_handlers:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+    _direct_handlers = []
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _queue_handler is not None and _queue_handler.dropped:
+        sys.stderr.write(f"Dropped {_queue_handler.dropped} log records: log queue was full\n")
+
+
+atexit.register(shutdown_logging)
+
+
+async def log_requests(request, call_next):
+    """
+    Middleware binding a request id to all logs of a request and logging its latency.
+
+    The id is taken from an ``x-request-id`` header when present and is
+    returned in the same response header.
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    token = bind_log_context(request_id=request_id)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+        response.headers["x-request-id"] = request_id
+        logger.info(
+            "%s %s %d",
+            request.method,
+            request.url.path,
+            response.status_code,
+            extra={
+                "path": request.url.path,
+                "status": response.status_code,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+            },
+        )
+        return response
+    finally:
+        reset_log_context(token)
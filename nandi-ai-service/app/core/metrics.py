@@ -0,0 +1,96 @@
+"""
+In-process metrics for upstream model usage.
+"""
+
+import logging
+from threading import Lock
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def usage_value(usage: Any, *path: str) -> int:
+    """
+    Read an integer token count from an OpenAI ``usage`` object.
+
+    Missing attributes (older API versions, mocked responses) count as zero.
+
+    Args:
+        usage: The ``response.usage`` object, or None
+        path: Attribute path, e.g. ("prompt_tokens_details", "cached_tokens")
+    """
+    value = usage
+    for name in path:
+        value = getattr(value, name, None)
+        if value is None:
+            return 0
+    return value if isinstance(value, int) else 0
+
+
+class PromptCacheMetrics:
+    """
+    Tracks how much of each stable prompt prefix the provider served from its prompt cache.
+
+    Counters are grouped by prefix hash, so a change in the prefix bytes (a
+    prompt edit or a layout change) shows up as a new group.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._prefixes: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, persona: str, prefix_hash: Optional[str], prefix_tokens: int, usage: Any):
+        """
+        Record the usage of one completion.
+
+        Args:
+            persona: The persona identifier
+            prefix_hash: Hash of the message prefix sent upstream
+            prefix_tokens: Token count of that prefix
+            usage: The ``response.usage`` object returned by the API
+        """
+        prompt_tokens = usage_value(usage, "prompt_tokens")
+        cached_tokens = usage_value(usage, "prompt_tokens_details", "cached_tokens")
+        key = prefix_hash or "unknown"
+        with self._lock:
+            entry = self._prefixes.get(key)
+            if entry is None:
+                entry = self._prefixes[key] = {
+                    "persona": persona,
+                    "prefix_tokens": prefix_tokens,
+                    "requests": 0,
+                    "cache_hits": 0,
+                    "prompt_tokens": 0,
+                    "cached_tokens": 0,
+                }
+            entry["requests"] += 1
+            entry["prompt_tokens"] += prompt_tokens
+            entry["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                entry["cache_hits"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return the counters per prefix hash plus overall totals.
+
+        ``cached_ratio`` is the share of prompt tokens served from the
+        provider's prompt cache.
+        """
+        with self._lock:
+            prefixes = {key: dict(entry) for key, entry in self._prefixes.items()}
+        totals = {"requests": 0, "cache_hits": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        for entry in prefixes.values():
+            for name in totals:
+                totals[name] += entry[name]
+            entry["cached_ratio"] = round(entry["cached_tokens"] / entry["prompt_tokens"], 4) if entry["prompt_tokens"] else 0.0
+        totals["cached_ratio"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+        return {"prefixes": prefixes, "totals": totals}
+
+    def reset(self):
+        """Clear all counters."""
+        with self._lock:
+            self._prefixes.clear()
+
+
+# Create a singleton instance
+prompt_cache_metrics = PromptCacheMetrics()
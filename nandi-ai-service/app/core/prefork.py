@@ -0,0 +1,552 @@
+"""
+Pre-forking multi-worker server.
+
+The master process imports the application once, so its modules and
+read-only data (prompts, numpy, the openai package) are shared with the
+workers copy-on-write, then forks ``workers`` uvicorn workers. Each worker
+binds its own listening socket with ``SO_REUSEPORT`` and the kernel spreads
+connections across them; where ``SO_REUSEPORT`` is unavailable the master
+binds one socket that every worker inherits. uvloop and httptools are used
+when installed.
+
+Signals to the master:
+- ``SIGHUP``: rolling restart; each replacement worker finishes its startup
+  before one old worker is stopped, so capacity never drops
+- ``SIGTERM`` / ``SIGINT``: graceful shutdown of all workers
+- ``SIGUSR1``: log per-worker stats
+
+Workers exit after ``max_requests`` requests (plus a random jitter, so they
+do not all recycle at once) and are replaced. Per-worker stats are kept in
+shared memory and can be read from any worker (``/admin/workers``).
+
+Unix only (``os.fork``).
+"""
+
+import importlib.util
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import uvicorn
+from uvicorn.importer import import_from_string
+
+logger = logging.getLogger(__name__)
+
+HAS_REUSEPORT = hasattr(socket, "SO_REUSEPORT")
+
+# Messages on a worker's status pipe
+READY = b"r"
+RECYCLE = b"c"
+
+STAT_FIELDS = ("pid", "generation", "started_at", "updated_at", "requests", "connections", "max_rss_kb")
+
+# Set in the master before forking, so workers inherit them
+worker_stats: Optional["WorkerStats"] = None
+worker_slot: Optional[int] = None
+
+
+def default_worker_count() -> int:
+    """Return the number of CPUs this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+# Backends whose state lives in each worker process, as (setting, value)
+PER_WORKER_BACKENDS = (
+    ("points_ledger_backend", "memory"),
+    ("leaderboard_backend", "memory"),
+    ("rate_limit_backend", "memory"),
+    ("idempotency_backend", "memory"),
+    ("usage_backend", "memory"),
+    ("analytics_backend", "memory"),
+)
+
+
+def per_worker_backends(config: Any) -> List[str]:
+    """
+    List the configured backends that are not shared between workers.
+
+    With several workers each of them keeps its own copy: leaderboards and
+    points diverge, rate limits and quotas are multiplied by the number of
+    workers and idempotency keys are only seen by one worker.
+
+    Returns:
+        List[str]: Environment-style ``NAME=value`` entries, e.g. ``LEADERBOARD_BACKEND=memory``
+    """
+    return [
+        f"{name.upper()}={value}"
+        for name, value in PER_WORKER_BACKENDS
+        if getattr(config, name, None) == value
+    ]
+
+
+def select_implementations() -> Tuple[str, str]:
+    """
+    Pick the fastest installed event loop and HTTP parser.
+
+    Returns:
+        Tuple[str, str]: uvicorn ``loop`` ("uvloop" or "asyncio") and ``http`` ("httptools" or "h11")
+    """
+    loop = "uvloop" if sys.platform != "win32" and importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return loop, http
+
+
+def bind_socket(host: str, port: int, reuse_port: bool = False, backlog: int = 2048) -> socket.socket:
+    """
+    Create a listening TCP socket.
+
+    Args:
+        host: Interface to bind
+        port: Port to bind
+        reuse_port: Set ``SO_REUSEPORT`` so several processes can bind the same port
+        backlog: Listen backlog
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def worker_path(path: str, slot: int) -> str:
+    """Return a worker's own copy of a file, e.g. ``snapshot.json`` -> ``snapshot.2.json``."""
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{slot}{ext}"
+
+
+def worker_log_file(log_file: str, slot: int) -> str:
+    """
+    Return a worker's own log file, e.g. ``nandi_service.log`` -> ``nandi_service.2.log``.
+
+    Size-based rotation is not safe with several processes writing one file.
+    """
+    return worker_path(log_file, slot)
+
+
+class WorkerStats:
+    """
+    Per-worker counters in anonymous shared memory.
+
+    The table is allocated by the master before forking, so every worker can
+    update its own slot and read all the others. Reads are not synchronized;
+    a row may mix values from two updates, which is fine for monitoring.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._values = multiprocessing.RawArray("d", slots * len(STAT_FIELDS))
+
+    def update(self, slot: int, **values: float):
+        """Set fields of a slot."""
+        base = slot * len(STAT_FIELDS)
+        for name, value in values.items():
+            self._values[base + STAT_FIELDS.index(name)] = value
+
+    def get(self, slot: int) -> Dict[str, float]:
+        """Return the fields of a slot."""
+        base = slot * len(STAT_FIELDS)
+        return {name: self._values[base + i] for i, name in enumerate(STAT_FIELDS)}
+
+    def clear(self, slot: int):
+        """Reset a slot after its worker exited."""
+        self.update(slot, **{name: 0 for name in STAT_FIELDS})
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return one row per running worker."""
+        now = time.time()
+        rows = []
+        for slot in range(self.slots):
+            row = self.get(slot)
+            if not row["pid"]:
+                continue
+            rows.append({
+                "slot": slot,
+                "pid": int(row["pid"]),
+                "generation": int(row["generation"]),
+                "uptime_seconds": round(now - row["started_at"], 1),
+                "requests": int(row["requests"]),
+                "connections": int(row["connections"]),
+                "max_rss_mb": round(row["max_rss_kb"] / 1024, 1),
+                "updated_seconds_ago": round(now - row["updated_at"], 1) if row["updated_at"] else None,
+            })
+        return rows
+
+
+class RequestCounter:
+    """
+    ASGI wrapper counting HTTP requests as they start.
+
+    uvicorn's own ``total_requests`` misses responses whose client hung up
+    before the final (empty) body chunk of a streaming middleware response,
+    so it undercounts this app and cannot drive max-requests recycling.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            self.requests += 1
+        await self.app(scope, receive, send)
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    uvicorn server reporting to the master over a status pipe.
+
+    Writes ``READY`` once startup is complete and ``RECYCLE`` after
+    ``max_requests`` requests; it keeps serving until the master has a
+    replacement running and stops it.
+    """
+
+    def __init__(self, config: uvicorn.Config, counter: RequestCounter, stats: WorkerStats, slot: int, status_fd: int, max_requests: int = 0):
+        super().__init__(config)
+        self._counter = counter
+        self._stats = stats
+        self._slot = slot
+        self._status_fd = status_fd
+        self._max_requests = max_requests
+        self._recycle_requested = False
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self._status_fd, READY)
+
+    async def on_tick(self, counter: int) -> bool:
+        if counter % 10 == 0:
+            self._report()
+        if self._max_requests and not self._recycle_requested and self._counter.requests >= self._max_requests:
+            self._recycle_requested = True
+            logger.info("Worker %d served %d requests, asking to be recycled", os.getpid(), self._counter.requests)
+            os.write(self._status_fd, RECYCLE)
+        return await super().on_tick(counter)
+
+    async def shutdown(self, sockets=None):
+        await super().shutdown(sockets=sockets)
+        self._report()
+
+    def _report(self):
+        self._stats.update(
+            self._slot,
+            updated_at=time.time(),
+            requests=self._counter.requests,
+            connections=len(self.server_state.connections),
+            max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        )
+
+
+class _Worker:
+    """Master-side record of a worker process."""
+
+    def __init__(self, pid: int, slot: int, generation: int, status_fd: int):
+        self.pid = pid
+        self.slot = slot
+        self.generation = generation
+        self.status_fd = status_fd
+        self.state = "booting"  # booting -> ready -> stopping
+        self.recycle = False
+        self.started = time.monotonic()
+
+
+class PreforkServer:
+    """
+    Master process supervising a fixed number of uvicorn workers.
+
+    Args:
+        app: The ASGI application, or an import string to load in each worker
+        host: Interface to bind
+        port: Port to bind
+        workers: Number of worker processes
+        max_requests: Requests after which a worker is replaced (0 = never)
+        max_requests_jitter: Random extra requests added per worker
+        graceful_timeout: Seconds a stopping worker may spend finishing requests
+        reuse_port: Bind one socket per worker with ``SO_REUSEPORT``
+    """
+
+    def __init__(
+        self,
+        app: Union[str, Any],
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        workers: int = 1,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        graceful_timeout: float = 30.0,
+        reuse_port: bool = HAS_REUSEPORT,
+    ):
+        global worker_stats
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = max(1, workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port and HAS_REUSEPORT
+        self.loop, self.http = select_implementations()
+        self.generation = 0
+
+        # Room for a surge worker per rolling restart and workers still draining
+        self.stats = worker_stats = WorkerStats(self.num_workers * 2 + 1)
+        self._free_slots = list(range(self.stats.slots))
+        self._workers: Dict[int, _Worker] = {}
+        self._listener: Optional[socket.socket] = None
+        self._signals: List[int] = []
+        self._running = True
+        self._boot_failed_at = 0.0
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+
+    # -- master ---------------------------------------------------------------
+
+    def run(self) -> int:
+        """
+        Fork the workers and supervise them until SIGTERM or SIGINT.
+
+        Returns:
+            int: Process exit code
+        """
+        from app.core.log_config import configure_logging
+
+        # The master forks throughout its life, so it must not run threads:
+        # log synchronously here and start the queue listener in each worker
+        configure_logging(use_queue=False)
+
+        if self.reuse_port:
+            # Fail fast if the port is taken; the probe is closed before it can accept
+            bind_socket(self.host, self.port, reuse_port=True).close()
+        else:
+            self._listener = bind_socket(self.host, self.port)
+
+        self._install_signal_handlers()
+        logger.info(
+            "Pre-fork master %d starting %d workers on %s:%d (loop=%s, http=%s, SO_REUSEPORT=%s)",
+            os.getpid(), self.num_workers, self.host, self.port, self.loop, self.http, self.reuse_port
+        )
+        try:
+            while self._running:
+                self._maintain()
+                self._wait(1.0)
+                self._reap()
+                self._handle_signals()
+        finally:
+            self._stop_all()
+        logger.info("Pre-fork master %d stopped", os.getpid())
+        return 0
+
+    def _install_signal_handlers(self):
+        signal.set_wakeup_fd(self._wakeup_w)
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGCHLD):
+            signal.signal(sig, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _handle_signals(self):
+        while self._signals:
+            sig = self._signals.pop(0)
+            if sig == signal.SIGHUP:
+                self.generation += 1
+                logger.info("SIGHUP: rolling restart of %d workers (generation %d)", self.num_workers, self.generation)
+            elif sig in (signal.SIGTERM, signal.SIGINT):
+                logger.info("Received %s, shutting down workers", signal.Signals(sig).name)
+                self._running = False
+            elif sig == signal.SIGUSR1:
+                self.log_stats()
+
+    def _active(self) -> List[_Worker]:
+        return [w for w in self._workers.values() if w.state != "stopping"]
+
+    def _maintain(self):
+        """Start workers until the target count is met, plus one surge worker during a rolling restart."""
+        if not self._running or time.monotonic() - self._boot_failed_at < 1.0:
+            return
+        active = self._active()
+        missing = self.num_workers - len(active)
+        old = [w for w in active if self._is_old(w)]
+        replacing = any(w.state == "booting" and not self._is_old(w) for w in active)
+        if missing <= 0 and old and not replacing:
+            missing = 1
+        for _ in range(missing):
+            self._spawn()
+
+    def _is_old(self, worker: _Worker) -> bool:
+        """Whether a worker is due for replacement (rolling restart or max requests)."""
+        return worker.recycle or worker.generation < self.generation
+
+    def _wait(self, timeout: float):
+        fds = [self._wakeup_r] + [w.status_fd for w in self._workers.values() if w.status_fd is not None]
+        try:
+            readable, _, _ = select.select(fds, [], [], timeout)
+        except InterruptedError:
+            return
+        for fd in readable:
+            if fd == self._wakeup_r:
+                try:
+                    while os.read(self._wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            worker = next((w for w in self._workers.values() if w.status_fd == fd), None)
+            data = os.read(fd, 64)
+            if worker is None:
+                os.close(fd)
+                continue
+            if not data:
+                # The worker exited; it is reaped separately
+                os.close(fd)
+                worker.status_fd = None
+                continue
+            if READY in data:
+                self._on_ready(worker)
+            if RECYCLE in data and worker.state != "stopping":
+                worker.recycle = True
+
+    def _on_ready(self, worker: _Worker):
+        if worker.state == "booting":
+            worker.state = "ready"
+        logger.info("Worker %d ready (slot %d, generation %d)", worker.pid, worker.slot, worker.generation)
+        # A replacement is serving: retire one worker due for replacement
+        active = self._active()
+        old = sorted((w for w in active if self._is_old(w)), key=lambda w: w.started)
+        if old and len(active) > self.num_workers:
+            self._stop_worker(old[0])
+
+    def _stop_worker(self, worker: _Worker, sig: int = signal.SIGTERM):
+        worker.state = "stopping"
+        try:
+            os.kill(worker.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self, block: bool = False):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.status_fd is not None:
+                os.close(worker.status_fd)
+            served = int(self.stats.get(worker.slot)["requests"])
+            self.stats.clear(worker.slot)
+            self._free_slots.append(worker.slot)
+            code = os.waitstatus_to_exitcode(status)
+            if worker.state == "booting":
+                self._boot_failed_at = time.monotonic()
+                logger.error("Worker %d exited during startup (exit code %d)", pid, code)
+            else:
+                logger.info("Worker %d exited (exit code %d) after %d requests", pid, code, served)
+            if block:
+                return
+
+    def _stop_all(self):
+        for worker in list(self._workers.values()):
+            self._stop_worker(worker)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self._workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for worker in list(self._workers.values()):
+            logger.warning("Worker %d did not stop in time, killing it", worker.pid)
+            self._stop_worker(worker, signal.SIGKILL)
+        while self._workers:
+            self._reap(block=True)
+        if self._listener is not None:
+            self._listener.close()
+        signal.set_wakeup_fd(-1)
+
+    def log_stats(self):
+        """Log one line per running worker."""
+        for row in self.stats.snapshot():
+            logger.info(
+                "Worker %d (slot %d, generation %d): %d requests, %d connections, %.1f MB max RSS, up %.0fs",
+                row["pid"], row["slot"], row["generation"], row["requests"],
+                row["connections"], row["max_rss_mb"], row["uptime_seconds"]
+            )
+
+    # -- worker ---------------------------------------------------------------
+
+    def _spawn(self):
+        slot = self._free_slots.pop(0)
+        max_requests = 0
+        if self.max_requests > 0:
+            max_requests = self.max_requests + random.randint(0, max(0, self.max_requests_jitter))
+        status_r, status_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(status_r)
+            code = 0
+            try:
+                self._run_worker(slot, status_w, max_requests)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                from app.core.log_config import shutdown_logging
+                shutdown_logging()
+            os._exit(code)
+        os.close(status_w)
+        self._workers[pid] = _Worker(pid, slot, self.generation, status_r)
+        self.stats.clear(slot)
+        self.stats.update(slot, pid=pid, generation=self.generation, started_at=time.time())
+
+    def _run_worker(self, slot: int, status_fd: int, max_requests: int):
+        global worker_slot
+        worker_slot = slot
+
+        # Drop the master's signal handling and file descriptors
+        signal.set_wakeup_fd(-1)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(sig, signal.SIG_DFL)
+        for sig in (signal.SIGHUP, signal.SIGUSR1):
+            signal.signal(sig, signal.SIG_IGN)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for worker in self._workers.values():
+            if worker.status_fd is not None:
+                os.close(worker.status_fd)
+
+        from app.config.settings import settings
+        from app.core.log_config import configure_logging
+
+        # Import before configuring logging: importing the app configures it too
+        app = import_from_string(self.app) if isinstance(self.app, str) else self.app
+        configure_logging(log_file=worker_log_file(settings.log_file, slot))
+
+        sock = self._listener or bind_socket(self.host, self.port, reuse_port=True)
+        counter = RequestCounter(app)
+        config = uvicorn.Config(
+            counter,
+            loop=self.loop,
+            http=self.http,
+            lifespan="on",
+            log_config=None,
+            access_log=False,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        WorkerServer(config, counter, self.stats, slot, status_fd, max_requests).run(sockets=[sock])
@@ -0,0 +1,244 @@
+"""
+On-demand profiling tools for a running worker.
+
+- ``LoopLagMonitor``: measures how late the event loop runs a periodic
+  callback and, when it is blocked for longer than a threshold, captures
+  the stack the loop thread was executing (e.g. a synchronous upstream call)
+- ``SamplingProfiler``: samples every thread's stack for a fixed duration
+  and aggregates them in folded-stack format (flamegraph.pl / speedscope)
+- ``tracemalloc`` snapshots of the top allocation sites
+
+Nothing here runs until it is started through the admin endpoints, so an
+idle worker pays no cost.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_stack(frame) -> List[str]:
+    """Return ``module:function:line`` entries from the outermost frame inward."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class LoopLagMonitor:
+    """
+    Detects event-loop blocking.
+
+    A task on the loop updates a heartbeat every ``interval`` seconds and
+    records how late it woke up. A watchdog thread checks the heartbeat and,
+    once the loop has been unresponsive for ``threshold`` seconds, captures
+    the loop thread's current stack; one stack is recorded per blocking episode.
+    """
+
+    def __init__(self, interval: float = 0.05, threshold: float = 0.1, max_events: int = 200):
+        self.interval = interval
+        self.threshold = threshold
+        self.events: deque = deque(maxlen=max_events)
+        self.samples = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.started_at: Optional[datetime] = None
+        self._heartbeat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._pending_stack: Optional[List[str]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Start monitoring the running event loop. Must be called from the loop."""
+        if self.running:
+            return
+        self.events.clear()
+        self.samples = 0
+        self.max_lag = self.total_lag = 0.0
+        self.started_at = datetime.utcnow()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("Event loop lag monitor started (threshold %.0fms)", self.threshold * 1000)
+
+    def stop(self):
+        """Stop monitoring."""
+        if not self.running:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+        logger.info("Event loop lag monitor stopped")
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.events.append({
+                    "at": datetime.utcnow().isoformat() + "Z",
+                    "lag_ms": round(lag * 1000, 2),
+                    "stack": self._pending_stack or [],
+                })
+            self._pending_stack = None
+
+    def _watch(self):
+        captured_for = None
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            if time.monotonic() - heartbeat < self.threshold or captured_for == heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._pending_stack = _frame_stack(frame)
+                captured_for = heartbeat
+
+    def report(self) -> Dict[str, Any]:
+        """Return lag statistics and the recorded blocking events."""
+        return {
+            "running": self.running,
+            "started_at": self.started_at.isoformat() + "Z" if self.started_at else None,
+            "threshold_ms": round(self.threshold * 1000, 2),
+            "samples": self.samples,
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "mean_lag_ms": round(self.total_lag / self.samples * 1000, 3) if self.samples else 0.0,
+            "events": list(self.events),
+        }
+
+    def report_text(self) -> str:
+        """Return the blocking events with their stacks as plain text."""
+        report = self.report()
+        lines = [
+            f"samples={report['samples']} max_lag_ms={report['max_lag_ms']} "
+            f"mean_lag_ms={report['mean_lag_ms']} threshold_ms={report['threshold_ms']}",
+        ]
+        for event in report["events"]:
+            lines.append("")
+            lines.append(f"{event['at']} blocked {event['lag_ms']}ms")
+            lines.extend(f"  {entry}" for entry in event["stack"])
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Statistical CPU profiler sampling thread stacks with ``sys._current_frames``.
+
+    Only one capture runs at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def capture(self, seconds: float, interval: float = 0.005) -> str:
+        """
+        Sample every thread's stack for ``seconds`` and return folded stacks.
+
+        Blocks the calling thread for the duration; run it with ``asyncio.to_thread``.
+
+        Returns:
+            str: One ``thread;frame;frame... count`` line per distinct stack
+
+        Raises:
+            RuntimeError: If another capture is running
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A CPU profile capture is already running")
+        try:
+            own_id = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            counts: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = ";".join([names.get(thread_id, str(thread_id))] + _frame_stack(frame))
+                    counts[stack] += 1
+                time.sleep(interval)
+            return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+        finally:
+            self._lock.release()
+
+
+def start_allocation_tracking(frames: int = 10) -> bool:
+    """
+    Start tracemalloc with ``frames`` frames per allocation traceback.
+
+    Returns:
+        bool: False if tracking was already running
+    """
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    logger.info("Allocation tracking started (%d frames)", frames)
+    return True
+
+
+def stop_allocation_tracking() -> bool:
+    """Stop tracemalloc and free its traces. Returns False if it was not running."""
+    if not tracemalloc.is_tracing():
+        return False
+    tracemalloc.stop()
+    logger.info("Allocation tracking stopped")
+    return True
+
+
+def allocation_snapshot(limit: int = 25, group_by: str = "lineno") -> str:
+    """
+    Return the top allocation sites of a tracemalloc snapshot as text.
+
+    Args:
+        limit: Number of allocation sites
+        group_by: "lineno", "filename" or "traceback"
+
+    Raises:
+        RuntimeError: If allocation tracking is not running
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Allocation tracking is not running")
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics(group_by)
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [f"traced_current_kib={current / 1024:.1f} traced_peak_kib={peak / 1024:.1f}"]
+    for index, stat in enumerate(stats[:limit], start=1):
+        lines.append("")
+        lines.append(f"#{index}: {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines.extend(f"  {line}" for line in stat.traceback.format())
+    return "\n".join(lines) + "\n"
+
+
+# Create singleton instances
+loop_lag_monitor = LoopLagMonitor()
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,397 @@
+"""
+Token-bucket rate limiting shared by all workers.
+
+Buckets live in Redis and are updated atomically by a Lua script, so a
+limit such as ``10/minute`` holds across every worker and host. Requests
+are keyed by caller identity (API key or client IP, in a configurable
+order). Trusted callers such as nandi-api may key requests by the user or
+session id they forward, so proxied traffic is not collapsed into a single
+bucket; ids sent by anyone else are ignored, since a client could change
+them to skip its limit or spend someone else's.
+
+When a bucket is clearly under its limit, the script grants the worker a
+small lease of extra tokens that it spends locally without a Redis round
+trip; near the limit every request goes to Redis. ``MemoryTokenBucketStore``
+implements the same script in-process, for tests, development and as the
+fallback when Redis cannot be reached.
+"""
+
+import asyncio
+import logging
+import re
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set
+
+from app.config.settings import settings
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.security import API_KEY, api_key_id
+
+logger = logging.getLogger(__name__)
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+_RATE_RE = re.compile(r"^\s*(\d+)\s*(?:/|per)\s*(\d*)\s*(second|minute|hour|day)s?\s*$", re.IGNORECASE)
+
+# Key types understood by request_identity
+KEY_TYPES = ("user_id", "session_id", "api_key", "ip")
+# Key types taken from the request only when the caller is trusted
+CALLER_ASSERTED_KEY_TYPES = ("user_id", "session_id")
+DEFAULT_KEY_TYPES = ("api_key", "ip")
+
+# Seconds between sweeps of expired buckets and leases
+PRUNE_INTERVAL = 60.0
+
+TOKEN_BUCKET_LUA = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local max_lease = tonumber(ARGV[5])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+  tokens = capacity
+  ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local lease = 0
+local retry_after = 0
+if tokens >= cost then
+  allowed = 1
+  tokens = tokens - cost
+  if max_lease > 0 and tokens >= capacity / 2 then
+    lease = math.min(max_lease, math.floor(tokens / 4))
+    tokens = tokens - lease
+  end
+else
+  retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(tokens), lease, tostring(retry_after)}
+"""
+
+
+class RateLimit(NamedTuple):
+    """A parsed limit: a bucket of ``capacity`` tokens refilled at ``rate`` per second."""
+    capacity: int
+    rate: float
+    spec: str
+
+
+class BucketResult(NamedTuple):
+    """Outcome of one token-bucket call."""
+    allowed: bool
+    remaining: float
+    lease: int
+    retry_after: float
+
+
+class RateLimitResult(NamedTuple):
+    """Outcome of a rate limit check."""
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: float
+
+
+def parse_rate(spec: str) -> RateLimit:
+    """
+    Parse a limit string in slowapi notation.
+
+    Args:
+        spec: e.g. ``"10/minute"``, ``"100 per hour"`` or ``"5/10second"``
+
+    Returns:
+        RateLimit: The bucket capacity and refill rate
+
+    Raises:
+        ValueError: If the string cannot be parsed
+    """
+    match = _RATE_RE.match(spec or "")
+    if not match:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    count, multiplier, period = match.groups()
+    seconds = _PERIODS[period.lower()] * int(multiplier or 1)
+    capacity = int(count)
+    if capacity <= 0:
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return RateLimit(capacity=capacity, rate=capacity / seconds, spec=spec)
+
+
+class MemoryTokenBucketStore:
+    """
+    In-process token buckets with the same semantics as the Redis script.
+
+    Like the Redis keys, a bucket expires once it would have refilled, and
+    expired buckets are dropped every ``PRUNE_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [tokens, last update, expires at]
+        self._buckets: Dict[str, List[float]] = {}
+        self._next_prune = 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + PRUNE_INTERVAL
+        expired = [key for key, bucket in self._buckets.items() if bucket[2] <= now]
+        for key in expired:
+            del self._buckets[key]
+
+    def consume(self, key: str, capacity: int, rate: float, now: float, cost: int = 1, max_lease: int = 0) -> BucketResult:
+        """Take ``cost`` tokens from a bucket, plus a lease when it is well under its limit."""
+        with self._lock:
+            self._prune(now)
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket[2] <= now:
+                bucket = self._buckets[key] = [float(capacity), now, 0.0]
+            tokens = min(capacity, bucket[0] + max(0.0, now - bucket[1]) * rate)
+            lease = 0
+            retry_after = 0.0
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+                if max_lease > 0 and tokens >= capacity / 2:
+                    lease = min(max_lease, int(tokens // 4))
+                    tokens -= lease
+            else:
+                retry_after = (cost - tokens) / rate
+            bucket[0], bucket[1], bucket[2] = tokens, now, now + capacity / rate + 1
+        return BucketResult(allowed=allowed, remaining=tokens, lease=lease, retry_after=retry_after)
+
+
+class RedisTokenBucketStore:
+    """Token buckets in Redis, updated atomically by ``TOKEN_BUCKET_LUA``."""
+
+    def __init__(self, client):
+        self._client = client
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+
+    def consume(self, key: str, capacity: int, rate: float, now: float, cost: int = 1, max_lease: int = 0) -> BucketResult:
+        """Take ``cost`` tokens from a bucket, plus a lease when it is well under its limit."""
+        allowed, remaining, lease, retry_after = self._script(
+            keys=[key], args=[capacity, repr(rate), repr(now), cost, max_lease]
+        )
+        return BucketResult(
+            allowed=bool(allowed),
+            remaining=float(remaining),
+            lease=int(lease),
+            retry_after=float(retry_after),
+        )
+
+
+class RateLimiter:
+    """
+    Checks requests against shared token buckets.
+
+    Tokens leased by the store are kept per key for ``lease_ttl`` seconds and
+    spent locally first. If the store fails, the limiter falls back to
+    per-worker in-memory buckets rather than letting all traffic through,
+    and skips the store until ``breaker`` lets a probe through.
+    """
+
+    def __init__(
+        self,
+        store,
+        lease_size: int = 0,
+        lease_ttl: float = 1.0,
+        clock: Callable[[], float] = time.time,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.store = store
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self._clock = clock
+        self._fallback = store if isinstance(store, MemoryTokenBucketStore) else MemoryTokenBucketStore()
+        self._breaker = breaker or CircuitBreaker("Rate limit store")
+        self._lock = threading.Lock()
+        # key -> [tokens left, expires at, remaining in the shared bucket when leased]
+        self._leases: Dict[str, List[float]] = {}
+        self._next_prune = 0.0
+
+    def _prune_leases(self, now: float):
+        """Drop expired leases of keys that stopped sending requests (lock held)."""
+        if now < self._next_prune:
+            return
+        self._next_prune = now + PRUNE_INTERVAL
+        expired = [key for key, lease in self._leases.items() if lease[1] <= now]
+        for key in expired:
+            del self._leases[key]
+
+    def _take_lease(self, key: str, now: float) -> Optional[int]:
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is None:
+                return None
+            if lease[1] <= now or lease[0] < 1:
+                del self._leases[key]
+                return None
+            lease[0] -= 1
+            return int(lease[0] + lease[2])
+
+    def hit(self, key: str, limit: RateLimit) -> RateLimitResult:
+        """
+        Spend one token for ``key``.
+
+        Args:
+            key: Bucket key, e.g. ``"rl:chat:user_id:42"``
+            limit: The limit to enforce
+
+        Returns:
+            RateLimitResult: Whether the request is allowed, and the header values
+        """
+        now = self._clock()
+        result = self._hit_locally(key, limit, now)
+        return result if result is not None else self._consume(key, limit, now)
+
+    async def hit_async(self, key: str, limit: RateLimit) -> RateLimitResult:
+        """
+        Spend one token for ``key`` without blocking the event loop.
+
+        Leases and local buckets are used on the loop; a shared store is
+        called from a worker thread.
+        """
+        now = self._clock()
+        result = self._hit_locally(key, limit, now)
+        if result is not None:
+            return result
+        if self.store is self._fallback:
+            return self._consume(key, limit, now)
+        return await asyncio.to_thread(self._consume, key, limit, now)
+
+    def _hit_locally(self, key: str, limit: RateLimit, now: float) -> Optional[RateLimitResult]:
+        """Answer from a lease, or from the local buckets while the store is skipped."""
+        remaining = self._take_lease(key, now)
+        if remaining is not None:
+            return RateLimitResult(allowed=True, limit=limit.capacity, remaining=remaining, retry_after=0.0)
+        if not self._breaker.allow():
+            result = self._fallback.consume(key, limit.capacity, limit.rate, now)
+            return RateLimitResult(
+                allowed=result.allowed,
+                limit=limit.capacity,
+                remaining=int(result.remaining),
+                retry_after=result.retry_after,
+            )
+        return None
+
+    def _consume(self, key: str, limit: RateLimit, now: float) -> RateLimitResult:
+        try:
+            result = self.store.consume(key, limit.capacity, limit.rate, now, max_lease=self.lease_size)
+        except Exception as e:
+            self._breaker.record_failure(e)
+            result = self._fallback.consume(key, limit.capacity, limit.rate, now)
+        else:
+            self._breaker.record_success()
+
+        if result.lease:
+            with self._lock:
+                self._prune_leases(now)
+                self._leases[key] = [result.lease, now + self.lease_ttl, int(result.remaining)]
+        return RateLimitResult(
+            allowed=result.allowed,
+            limit=limit.capacity,
+            remaining=int(result.remaining) + result.lease,
+            retry_after=result.retry_after,
+        )
+
+
+def request_identity(
+    key_types: Sequence[str],
+    headers,
+    query_params,
+    body: Optional[dict],
+    client_host: Optional[str],
+    trusted: bool = False,
+) -> str:
+    """
+    Pick the identity a request is limited by.
+
+    The first key type in ``key_types`` that the request carries wins.
+    User and session ids are read from the ``x-user-id``/``x-session-id``
+    headers, then the query string, then the JSON body (``userId``/``user_id``,
+    ``sessionId``/``session_id``), and only when ``trusted`` is set; otherwise
+    those key types are skipped. API keys are hashed before use.
+
+    Returns:
+        str: ``"<key type>:<value>"``
+    """
+    body = body if isinstance(body, dict) else {}
+    for key_type in key_types:
+        if key_type in CALLER_ASSERTED_KEY_TYPES and not trusted:
+            continue
+        value = None
+        if key_type == "user_id":
+            value = headers.get("x-user-id") or query_params.get("userId") or body.get("userId") or body.get("user_id")
+        elif key_type == "session_id":
+            value = (headers.get("x-session-id") or query_params.get("sessionId")
+                     or body.get("sessionId") or body.get("session_id"))
+        elif key_type == "api_key":
+            api_key = headers.get("x-api-key")
+            value = api_key_id(api_key) if api_key else None
+        elif key_type == "ip":
+            value = client_host
+        if value:
+            return f"{key_type}:{value}"
+    return f"ip:{client_host or 'unknown'}"
+
+
+def parse_key_types(spec: str) -> List[str]:
+    """
+    Parse the ``rate_limit_key`` setting, a comma separated list of key types.
+
+    Raises:
+        ValueError: If an unknown key type is listed
+    """
+    key_types = [part.strip() for part in (spec or "").split(",") if part.strip()]
+    for key_type in key_types:
+        if key_type not in KEY_TYPES:
+            raise ValueError(f"Unknown rate limit key type: {key_type!r}")
+    return key_types or list(DEFAULT_KEY_TYPES)
+
+
+def parse_trusted_keys(spec: Optional[str]) -> Set[str]:
+    """Parse the ``rate_limit_trusted_keys`` setting, a comma separated list of API key ids."""
+    return {part.strip() for part in (spec or "").split(",") if part.strip()}
+
+
+def is_trusted_caller(api_key: Optional[str], trusted_keys: Set[str]) -> bool:
+    """
+    Return True if the caller may key its requests by user or session id.
+
+    The caller must present the service API key, and that key's id must be
+    listed in ``trusted_keys``.
+    """
+    return bool(api_key) and api_key == API_KEY and api_key_id(api_key) in trusted_keys
+
+
+def create_store(backend: str):
+    """Create the token bucket store for a backend name ("memory" or "redis")."""
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis(
+            host=settings.redis_host,
+            port=int(settings.redis_port),
+            password=settings.redis_password or None,
+            db=int(settings.redis_db),
+            socket_timeout=0.5,
+        )
+        return RedisTokenBucketStore(client)
+    return MemoryTokenBucketStore()
+
+
+# Create a singleton instance
+rate_limiter = RateLimiter(
+    create_store(settings.rate_limit_backend),
+    lease_size=settings.rate_limit_lease_size,
+    lease_ttl=settings.rate_limit_lease_ttl,
+    breaker=CircuitBreaker("Rate limit store", settings.redis_failure_cooldown),
+)
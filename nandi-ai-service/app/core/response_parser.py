@@ -0,0 +1,354 @@
+"""
+Structured parsing of chat completion output.
+
+The persona prompts ask the model to report a question quality score either
+as a JSON object (``{"response", "quality_score", "quality_reasoning"}``) or
+as an inline ``[QUALITY:X:reason]`` marker. This module extracts the answer
+text and the score from either format in a single pass over the output, and
+provides an incremental parser for streamed completions.
+"""
+
+import json
+import re
+from typing import NamedTuple, Optional
+
+QUALITY_MARKER_PREFIX = "[QUALITY:"
+
+# Maximum characters held back while waiting for a marker's closing bracket
+MAX_MARKER_LENGTH = 512
+
+_MARKER_RE = re.compile(r"\[QUALITY:\s*(\d+)\s*:([^\]]*)\]")
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_RESPONSE_KEY_RE = re.compile(r'"response"\s*:\s*"')
+_SCORE_RE = re.compile(r'"quality_score"\s*:\s*"?(\d+)')
+_PLAIN_RUN_RE = re.compile(r'[^"\\]+')
+_FENCE = "```"
+# Characters kept while looking for the "response" key in a stream
+_KEY_OVERLAP = 32
+_JSON_ESCAPES = {
+    '"': '"', "\\": "\\", "/": "/", "b": "\b",
+    "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+}
+
+
+class ParsedResponse(NamedTuple):
+    """Answer text and quality evaluation extracted from a completion."""
+    message: str
+    quality_score: Optional[int] = None
+    quality_reason: Optional[str] = None
+
+
+def _clamp_score(value) -> Optional[int]:
+    """Convert a reported score to an int in the 1-10 range."""
+    try:
+        return max(1, min(10, int(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_json(text: str) -> Optional[ParsedResponse]:
+    """Parse JSON-mode output, optionally wrapped in a Markdown code fence."""
+    if text[0] == "`":
+        text = _FENCE_RE.sub("", text)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "response" not in data:
+        return None
+    reason = data.get("quality_reasoning")
+    return ParsedResponse(
+        message=str(data["response"]).strip(),
+        quality_score=_clamp_score(data.get("quality_score")),
+        quality_reason=str(reason).strip() if reason else None,
+    )
+
+
+def _parse_marker(text: str, start: int) -> ParsedResponse:
+    """
+    Extract the first quality marker and strip all markers.
+
+    The common case of a single trailing marker is handled with an anchored
+    match at ``start``; anything else falls back to one ``sub`` pass.
+    """
+    match = _MARKER_RE.match(text, start)
+    if match is not None and text.find(QUALITY_MARKER_PREFIX, match.end()) == -1:
+        return ParsedResponse(
+            message=(text[:start] + text[match.end():]).strip(),
+            quality_score=_clamp_score(match.group(1)),
+            quality_reason=match.group(2).strip() or None,
+        )
+
+    found = []
+
+    def _strip(match):
+        if not found:
+            found.append(match)
+        return ""
+
+    message = _MARKER_RE.sub(_strip, text).strip()
+    if not found:
+        return ParsedResponse(message=message)
+    match = found[0]
+    return ParsedResponse(
+        message=message,
+        quality_score=_clamp_score(match.group(1)),
+        quality_reason=match.group(2).strip() or None,
+    )
+
+
+def _recover_partial_json(text: str) -> Optional[ParsedResponse]:
+    """
+    Recover the answer from JSON output that was cut off (e.g. by max_tokens).
+
+    Returns:
+        Optional[ParsedResponse]: The decoded part of the response value, or
+        None if the text has no ``response`` key
+    """
+    if _RESPONSE_KEY_RE.search(text) is None:
+        return None
+    parser = StreamingResponseParser()
+    message = parser.feed(text)
+    score = _SCORE_RE.search(text)
+    return ParsedResponse(
+        message=message.strip(),
+        quality_score=_clamp_score(score.group(1)) if score else None,
+    )
+
+
+def parse_response(text: str) -> ParsedResponse:
+    """
+    Extract the answer text and quality evaluation from a completion.
+
+    Handles JSON-mode output (including JSON truncated by ``max_tokens``),
+    the ``[QUALITY:X:reason]`` marker format and plain text. Plain text
+    without a marker never touches the regex engine.
+
+    Args:
+        text: The raw completion text
+
+    Returns:
+        ParsedResponse: The cleaned message plus score and reason, if reported
+    """
+    text = (text or "").strip()
+    if not text:
+        return ParsedResponse(message="")
+
+    if text[0] in "{`":
+        parsed = _parse_json(text)
+        if parsed is not None:
+            return parsed
+        parsed = _recover_partial_json(text)
+        if parsed is not None:
+            return parsed
+
+    start = text.find(QUALITY_MARKER_PREFIX)
+    if start == -1:
+        return ParsedResponse(message=text)
+    return _parse_marker(text, start)
+
+
+def _detect_mode(head: str) -> Optional[str]:
+    """
+    Tell JSON output from plain text by the start of a stream.
+
+    Returns:
+        Optional[str]: "json", "text", or None if more text is needed
+    """
+    if not head:
+        return None
+    if head[0] == "{":
+        return "json"
+    if head[0] != "`":
+        return "text"
+    if len(head) < len(_FENCE):
+        return None if _FENCE.startswith(head) else "text"
+    if not head.startswith(_FENCE):
+        return "text"
+    # Only a fence opening a JSON object switches to JSON mode
+    after = head[len(_FENCE):]
+    label = after.lower()
+    if label.startswith("json") or after.lstrip().startswith("{"):
+        return "json"
+    if not after.strip() or "json".startswith(label):
+        return None
+    return "text"
+
+
+def _decode_unicode_escape(text: str, pos: int):
+    """
+    Decode the ``\\uXXXX`` escape at ``pos``, combining surrogate pairs.
+
+    Returns:
+        Tuple[str, int]: The decoded text and the characters consumed, or
+        ("", 0) if the escape (or the second half of a pair) is incomplete
+    """
+    if pos + 6 > len(text):
+        return "", 0
+    try:
+        code = int(text[pos + 2:pos + 6], 16)
+    except ValueError:
+        return "", 6
+    if 0xD800 <= code <= 0xDBFF:
+        follow = text[pos + 6:pos + 12]
+        if len(follow) < 6 and "\\u".startswith(follow[:2]):
+            # Wait for the low half of the pair
+            return "", 0
+        if follow.startswith("\\u"):
+            try:
+                low = int(follow[2:], 16)
+            except ValueError:
+                low = 0
+            if 0xDC00 <= low <= 0xDFFF:
+                return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), 12
+        # A lone surrogate cannot be encoded as UTF-8
+        return "\ufffd", 6
+    if 0xDC00 <= code <= 0xDFFF:
+        return "\ufffd", 6
+    return chr(code), 6
+
+
+class StreamingResponseParser:
+    """
+    Incremental parser for streamed completions.
+
+    ``feed`` returns only the text that is safe to show to the user: quality
+    markers are held back until they can be stripped, and in JSON mode only
+    the decoded ``response`` string value is emitted. ``close`` returns the
+    final ``ParsedResponse`` for the whole stream.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._mode = None
+        self._pending = ""
+        # Unconsumed JSON text; decoded text is dropped so feeding stays linear
+        self._json_text = ""
+        self._json_phase = "key"
+
+    def feed(self, chunk: str) -> str:
+        """
+        Consume a streamed chunk.
+
+        Args:
+            chunk: The next piece of completion text
+
+        Returns:
+            str: Text that can be forwarded to the client (may be empty)
+        """
+        if not chunk:
+            return ""
+        self._buffer.append(chunk)
+
+        if self._mode is None:
+            self._mode = _detect_mode((self._pending + chunk).lstrip())
+            if self._mode is None:
+                self._pending += chunk
+                return ""
+            chunk = self._pending + chunk
+            self._pending = ""
+
+        if self._mode == "json":
+            return self._feed_json(chunk)
+        return self._feed_text(chunk)
+
+    def _feed_text(self, chunk: str) -> str:
+        """Forward text, holding back anything that may be a quality marker."""
+        pending = self._pending + chunk
+        out = []
+        while pending:
+            idx = pending.find("[")
+            if idx == -1:
+                out.append(pending)
+                pending = ""
+                break
+            out.append(pending[:idx])
+            rest = pending[idx:]
+            probe = rest[:len(QUALITY_MARKER_PREFIX)]
+            if not QUALITY_MARKER_PREFIX.startswith(probe):
+                out.append("[")
+                pending = rest[1:]
+                continue
+            end = rest.find("]")
+            if end != -1:
+                if _MARKER_RE.fullmatch(rest[:end + 1]) is None:
+                    out.append(rest[:end + 1])
+                pending = rest[end + 1:]
+                continue
+            if len(rest) > MAX_MARKER_LENGTH:
+                out.append(rest)
+                pending = ""
+                break
+            pending = rest
+            break
+        self._pending = pending
+        return "".join(out)
+
+    def _feed_json(self, chunk: str) -> str:
+        """Decode the ``response`` string value of a JSON object as it arrives."""
+        if self._json_phase == "done":
+            return ""
+        text = self._json_text + chunk
+
+        if self._json_phase == "key":
+            match = _RESPONSE_KEY_RE.search(text)
+            if match is None:
+                # The key may be split across chunks
+                self._json_text = text[-_KEY_OVERLAP:]
+                return ""
+            text = text[match.end():]
+            self._json_phase = "value"
+
+        out = []
+        pos = 0
+        length = len(text)
+        while pos < length:
+            run = _PLAIN_RUN_RE.match(text, pos)
+            if run is not None:
+                out.append(run.group())
+                pos = run.end()
+                continue
+            if text[pos] == '"':
+                self._json_phase = "done"
+                pos = length
+                break
+            if pos + 1 >= length:
+                break
+            esc = text[pos + 1]
+            if esc == "u":
+                decoded, used = _decode_unicode_escape(text, pos)
+                if not used:
+                    break
+                out.append(decoded)
+                pos += used
+                continue
+            out.append(_JSON_ESCAPES.get(esc, esc))
+            pos += 2
+        self._json_text = text[pos:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        """
+        Release text held back at the end of the stream.
+
+        Returns:
+            str: Held text that turned out not to be a quality marker
+        """
+        pending, self._pending = self._pending, ""
+        if self._mode != "text" or not pending:
+            return ""
+        return _MARKER_RE.sub("", pending)
+
+    def close(self) -> ParsedResponse:
+        """
+        Finish the stream and return the parsed result.
+
+        Truncated JSON output still yields the decoded part of the answer and
+        any score that was already streamed (see ``parse_response``).
+        """
+        return parse_response("".join(self._buffer))
+
+    @property
+    def text(self) -> str:
+        """The raw text received so far."""
+        return "".join(self._buffer)
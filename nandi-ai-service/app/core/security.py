@@ -1,6 +1,7 @@
 from fastapi import HTTPException, Security, Request, Depends
 from fastapi.security.api_key import APIKeyHeader
 from app.config.settings import settings
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,6 +15,16 @@ api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 PUBLIC_PATHS = ["/", "/docs", "/redoc", "/openapi.json", "/health", "/admin/prompts/refresh"]
 
 
+def api_key_id(api_key: str) -> str:
+    """
+    Return a stable, non-reversible identifier for an API key.
+    
+    Used wherever a caller has to be identified in stored data (rate limit
+    buckets, usage accounting) without persisting the key itself.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
 async def get_api_key(api_key_header: str = Security(api_key_header)):
     """Dependency for validating the API key."""
     if api_key_header == API_KEY:
@@ -0,0 +1,178 @@
+"""
+Mergeable summaries of value distributions and distinct counts.
+
+Both sketches have a size that does not grow with the number of values
+added, and two sketches of the same configuration merge into the sketch of
+the combined data, so per-worker summaries can be added up in any order.
+"""
+
+import base64
+import hashlib
+import math
+from typing import Dict, Optional
+
+# Values at or below this are counted in the histogram's zero bucket
+MIN_TRACKED_VALUE = 1e-9
+
+
+class LogHistogram:
+    """
+    HDR-style histogram with logarithmic buckets.
+
+    Bucket bounds grow by a constant factor, so every quantile is reported
+    within ``relative_error`` of a value that was added, and the number of
+    buckets grows with the logarithm of the value range (a few hundred for
+    milliseconds up to hours at 1%) rather than with the number of values.
+    """
+
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, count: int = 1):
+        """Count ``value`` ``count`` times."""
+        if value <= MIN_TRACKED_VALUE:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LogHistogram"):
+        """
+        Add another histogram's counts to this one.
+
+        Raises:
+            ValueError: If the histograms have a different precision
+        """
+        if other.relative_error != self.relative_error:
+            raise ValueError("Cannot merge histograms with a different relative error")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate the value below which a fraction ``q`` (0-1) of the values fall.
+
+        Returns:
+            Optional[float]: The estimate, or None if the histogram is empty
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(0.0, self.min)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket, which bounds the relative error
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def to_dict(self) -> Dict:
+        """Serialize to plain JSON types."""
+        return {
+            "e": self.relative_error,
+            "b": {str(index): count for index, count in self.buckets.items()},
+            "z": self.zero_count,
+            "n": self.count,
+            "s": self.total,
+            "lo": self.min if self.count else None,
+            "hi": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LogHistogram":
+        """Rebuild a histogram serialized with ``to_dict``."""
+        histogram = cls(data["e"])
+        histogram.buckets = {int(index): count for index, count in data["b"].items()}
+        histogram.zero_count = data["z"]
+        histogram.count = data["n"]
+        histogram.total = data["s"]
+        if histogram.count:
+            histogram.min = data["lo"]
+            histogram.max = data["hi"]
+        return histogram
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimate of the number of distinct items.
+
+    Uses ``2 ** precision`` one-byte registers (1 KiB at the default
+    precision of 10, for a standard error of about 3%). Merging keeps the
+    larger value of each register.
+    """
+
+    def __init__(self, precision: int = 10):
+        if not 4 <= precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item: str):
+        """Add an item (e.g. a session id)."""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "big")
+        index = value >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = value & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        """
+        Add another sketch's items to this one.
+
+        Raises:
+            ValueError: If the sketches have a different precision
+        """
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with a different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Estimate the number of distinct items added."""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / math.fsum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self) -> Dict:
+        """Serialize to plain JSON types."""
+        return {"p": self.precision, "r": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "HyperLogLog":
+        """Rebuild a sketch serialized with ``to_dict``."""
+        sketch = cls(data["p"])
+        sketch.registers = bytearray(base64.b64decode(data["r"]))
+        return sketch
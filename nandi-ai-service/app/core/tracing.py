@@ -0,0 +1,276 @@
+"""
+Request tracing with W3C Trace Context propagation.
+
+Spans follow the OpenTelemetry data model (128-bit trace id, 64-bit span
+id, parent span id, start/end in Unix nanoseconds, attributes, status) and
+are exported as OTLP-style dictionaries. A ``traceparent`` header from
+nandi-api continues its trace; otherwise a new trace is started. Every
+response carries ``traceparent`` and ``x-trace-id`` headers.
+
+Exporters:
+- ``memory``: keeps the most recent spans, readable via ``/admin/traces``
+- ``log``: writes each finished span as a structured log record
+- ``none``: spans are timed but discarded
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from app.config.settings import settings
+from app.core.log_config import bind_log_context, reset_log_context
+
+logger = logging.getLogger(__name__)
+
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class SpanContext(NamedTuple):
+    """Identifies a span within a trace."""
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+
+def _random_id(bits: int) -> str:
+    value = 0
+    while not value:
+        value = random.getrandbits(bits)
+    return f"{value:0{bits // 4}x}"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """
+    Parse a W3C ``traceparent`` header.
+
+    Returns:
+        Optional[SpanContext]: The remote parent, or None if the header is missing or invalid
+    """
+    if not header:
+        return None
+    match = _TRACEPARENT_RE.match(header.strip().lower())
+    if not match:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id=trace_id, span_id=span_id, sampled=bool(int(flags, 16) & 1))
+
+
+def format_traceparent(context: SpanContext) -> str:
+    """Format a span context as a W3C ``traceparent`` header value."""
+    return f"00-{context.trace_id}-{context.span_id}-{'01' if context.sampled else '00'}"
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("name", "context", "parent_span_id", "kind", "attributes", "start_ns", "end_ns", "status", "status_message")
+
+    def __init__(self, name: str, context: SpanContext, parent_span_id: Optional[str], kind: str, attributes: Optional[Dict[str, Any]]):
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.status = "UNSET"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        """Set an attribute; None values are ignored."""
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_exception(self, error: BaseException):
+        """Mark the span as failed by ``error``."""
+        self.status = "ERROR"
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the span in OTLP JSON field names."""
+        return {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "parentSpanId": self.parent_span_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.status_message},
+        }
+
+
+class NoopSpanExporter:
+    """Discards spans."""
+
+    def export(self, span: Span):
+        pass
+
+
+class InMemorySpanExporter:
+    """
+    Keeps the spans of the most recent traces in memory.
+
+    Used by tests and by ``/admin/traces/{trace_id}``; at most ``max_traces``
+    traces are kept, oldest evicted first.
+    """
+
+    def __init__(self, max_traces: int = 1000):
+        self.max_traces = max_traces
+        self._lock = threading.Lock()
+        self._traces: "OrderedDict[str, deque]" = OrderedDict()
+
+    def export(self, span: Span):
+        with self._lock:
+            spans = self._traces.get(span.context.trace_id)
+            if spans is None:
+                spans = self._traces[span.context.trace_id] = deque(maxlen=256)
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            spans.append(span)
+
+    def get_trace(self, trace_id: str) -> List[Span]:
+        """Return a trace's finished spans ordered by start time."""
+        with self._lock:
+            spans = list(self._traces.get(trace_id, ()))
+        return sorted(spans, key=lambda s: s.start_ns)
+
+    def trace_ids(self) -> List[str]:
+        """Return the ids of the kept traces, most recent last."""
+        with self._lock:
+            return list(self._traces)
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+
+class LoggingSpanExporter:
+    """Writes each finished span as a structured log record."""
+
+    def __init__(self, span_logger: Optional[logging.Logger] = None):
+        self._logger = span_logger or logging.getLogger("app.tracing.spans")
+
+    def export(self, span: Span):
+        self._logger.info("span %s %.2fms", span.name, span.duration_ms, extra={"span": span.to_dict()})
+
+
+def create_exporter(name: str):
+    """Create the span exporter configured by ``tracing_exporter``."""
+    if name == "log":
+        return LoggingSpanExporter()
+    if name == "memory":
+        return InMemorySpanExporter(settings.tracing_max_traces)
+    return NoopSpanExporter()
+
+
+class Tracer:
+    """
+    Creates spans and tracks the current span per request.
+
+    Root spans are sampled with probability ``sample_rate``; child spans and
+    spans continuing a remote trace follow their parent's sampling decision.
+    """
+
+    def __init__(self, exporter, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def start_span(
+        self,
+        name: str,
+        attributes: Optional[Dict[str, Any]] = None,
+        parent: Optional[SpanContext] = None,
+        kind: str = "INTERNAL",
+    ) -> Iterator[Span]:
+        """
+        Start a span as a child of ``parent`` or of the current span.
+
+        Exceptions leaving the block mark the span as failed and are re-raised.
+
+        Args:
+            name: Operation name, e.g. ``"cache.lookup"``
+            attributes: Initial span attributes
+            parent: Remote parent (from ``traceparent``); defaults to the current span
+            kind: OpenTelemetry span kind
+        """
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        if parent is not None:
+            context = SpanContext(parent.trace_id, _random_id(64), parent.sampled)
+        else:
+            context = SpanContext(_random_id(128), _random_id(64), random.random() < self.sample_rate)
+
+        span = Span(name, context, parent.span_id if parent is not None else None, kind, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            if context.sampled:
+                try:
+                    self.exporter.export(span)
+                except Exception as e:
+                    logger.error("Error exporting span %s: %s", name, e)
+
+
+def current_span() -> Optional[Span]:
+    """Return the span active in the current context, if any."""
+    return _current_span.get()
+
+
+# Create a singleton instance
+tracer = Tracer(create_exporter(settings.tracing_exporter), sample_rate=settings.tracing_sample_rate)
+
+
+async def trace_requests(request, call_next):
+    """
+    Middleware wrapping each request in a server span.
+
+    Continues the caller's trace from a ``traceparent`` header and returns
+    ``traceparent`` and ``x-trace-id`` headers. The trace id is also bound to
+    the request's log records.
+    """
+    parent = parse_traceparent(request.headers.get("traceparent"))
+    with tracer.start_span(
+        f"{request.method} {request.url.path}",
+        attributes={"http.method": request.method, "http.target": request.url.path},
+        parent=parent,
+        kind="SERVER",
+    ) as span:
+        token = bind_log_context(trace_id=span.context.trace_id)
+        try:
+            response = await call_next(request)
+        finally:
+            reset_log_context(token)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.status = "ERROR"
+        response.headers["traceparent"] = format_traceparent(span.context)
+        response.headers["x-trace-id"] = span.context.trace_id
+        return response
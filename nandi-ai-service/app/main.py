@@ -1,29 +1,36 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
 import logging
 import uvicorn
 
 from app.config.settings import settings
+from app.config.prompt_loader import prompt_manager, PromptFileWatcher
+from app.services.points_ledger import points_ledger
+from app.services.message_store import message_store
+from app.services.answer_bank import answer_bank
+from app.services.leaderboard import leaderboard
+from app.services.usage_service import usage_tracker
+from app.services.analytics import analytics
+from app.services.session_merge import session_merger
+from app.services.speculation import speculator
+from app.services.ai_service import client as openai_client
 from app.core.security import process_api_key_header, log_exceptions
-from app.api.dependencies import limiter, API_TAGS_METADATA
-from app.api.routes import chat, health, points
+from app.core.log_config import configure_logging, log_requests
+from app.core.tracing import trace_requests
+from app.core.idempotency import idempotent_requests
+from app.core.compression import compress_responses
+from app.core.profiling import loop_lag_monitor
+from app.core.codec import FastJSONResponse
+from app.api.dependencies import API_TAGS_METADATA
+from app.api.routes import chat, chat_ws, health, points, documents, leaderboard as leaderboard_routes
 from app.api.endpoints import admin
 
-# Configure logging
-logging.basicConfig(
-    level=settings.get_log_level(),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("nandi_service.log")
-    ]
-)
+# Configure logging: records are queued and written by a background thread
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Log startup information
-logger.info(f"Starting Nandi AI Service in {settings.environment} environment")
+logger.info("Starting Nandi AI Service in %s environment", settings.environment)
 if settings.environment == "development":
     logger.info("Development mode: API key validation is relaxed")
 
@@ -32,6 +39,10 @@ def create_application() -> FastAPI:
     """
     Create and configure the FastAPI application.
     
+    This is the only application of the service; `server.py` re-exports it.
+    Heavy dependencies (prompts, the OpenAI client) are initialized by the
+    startup event rather than at import, so importing the module stays cheap.
+    
     Returns:
         FastAPI: The configured FastAPI application
     """
@@ -55,13 +66,10 @@ def create_application() -> FastAPI:
         redoc_url="/redoc",
         openapi_url="/openapi.json",
         openapi_tags=API_TAGS_METADATA,
+        default_response_class=FastJSONResponse,
         swagger_ui_parameters={"defaultModelsExpandDepth": -1}
     )
     
-    # Setup limiter
-    app.state.limiter = limiter
-    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-    
     # Add middlewares
     app.add_middleware(
         CORSMiddleware,
@@ -74,16 +82,83 @@ def create_application() -> FastAPI:
     # Add custom middlewares
     app.middleware("http")(process_api_key_header)
     app.middleware("http")(log_exceptions)
+    app.middleware("http")(idempotent_requests)
+    app.middleware("http")(compress_responses)
+    app.middleware("http")(log_requests)
+    app.middleware("http")(trace_requests)
     
     # Include routers
     app.include_router(health.router)
     app.include_router(chat.router)
+    app.include_router(chat_ws.router)
     app.include_router(points.router)
+    app.include_router(leaderboard_routes.router)
+    app.include_router(documents.router)
     app.include_router(admin.router)
     
+    # Load prompts and create the OpenAI client once the worker starts
+    app.add_event_handler("startup", prompt_manager.load)
+    app.add_event_handler("startup", answer_bank.load)
+    app.add_event_handler("startup", openai_client.get)
+    
+    # Hot reload prompts.json and the answer bank in every worker
+    if settings.prompts_watch_interval > 0:
+        prompt_watcher = PromptFileWatcher(prompt_manager, settings.prompts_watch_interval)
+        app.add_event_handler("startup", prompt_watcher.start)
+        app.add_event_handler("shutdown", prompt_watcher.stop)
+        answer_watcher = PromptFileWatcher(answer_bank, settings.prompts_watch_interval, path=answer_bank.path)
+        app.add_event_handler("startup", answer_watcher.start)
+        app.add_event_handler("shutdown", answer_watcher.stop)
+    
+    # Open the points ledger and message store off the event loop; the
+    # ledger is loaded before the leaderboards, which read its totals
+    app.add_event_handler("startup", points_ledger.start)
+    app.add_event_handler("startup", message_store.start)
+    
+    # Load leaderboards on start and snapshot them on exit
+    app.add_event_handler("startup", leaderboard.start)
+    app.add_event_handler("shutdown", leaderboard.stop)
+    
+    # Flush token usage counters periodically and on exit
+    app.add_event_handler("startup", usage_tracker.start)
+    app.add_event_handler("shutdown", usage_tracker.stop)
+    
+    # Flush analytics rollups periodically and on exit
+    app.add_event_handler("startup", analytics.start)
+    app.add_event_handler("shutdown", analytics.stop)
+    
+    # Cancel speculative follow-up jobs still running
+    app.add_event_handler("shutdown", speculator.stop)
+    
+    # Stop the event-loop lag monitor if it was started through the admin API
+    app.add_event_handler("shutdown", loop_lag_monitor.stop)
+    
+    # Write any queued points awards before the worker exits
+    app.add_event_handler("shutdown", points_ledger.close)
+    
+    # Write queued chat messages, spilling them if the database is down
+    app.add_event_handler("shutdown", message_store.close)
+    
+    # Close the session merge store's database connection
+    app.add_event_handler("shutdown", session_merger.close)
+    
     return app
 
 
+def preload():
+    """
+    Load read-only dependencies in a pre-fork master process.
+    
+    Workers forked afterwards share these modules and the prompts
+    copy-on-write. Each worker still creates its own OpenAI client, since
+    a connection pool must not be shared across processes.
+    """
+    import openai  # noqa: F401
+    import psutil  # noqa: F401
+    prompt_manager.load()
+    answer_bank.load()
+
+
 app = create_application()
 
 
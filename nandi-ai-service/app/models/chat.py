@@ -1,6 +1,9 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
+from app.config.settings import settings
+from app.core.codec import encode_model
+from app.core.compression import STORED_LEVELS, SUPPORTED_ENCODINGS, compress
 from enum import Enum
-from typing import Optional, List
+from typing import Dict, Optional, List, Literal
 from datetime import datetime
 
 
@@ -53,6 +56,8 @@ class ChatRequest(BaseModel):
     persona: Persona = Field(..., description="AI persona to respond with")
     session_id: Optional[str] = Field(None, description="Chat session ID")
     context: Optional[List[ConversationMessage]] = Field(None, description="Previous messages for context")
+    user_id: Optional[str] = Field(None, description="Registered user ID the messages are stored for; anonymous sessions use session_id")
+    chat_session_id: Optional[int] = Field(None, gt=0, description="ID of the chat_sessions row the messages belong to")
     
     model_config = {
         "json_schema_extra": {
@@ -66,6 +71,42 @@ class ChatRequest(BaseModel):
     }
 
 
+class ChatSocketFrame(BaseModel):
+    """A client frame on the chat WebSocket (/api/chat/ws)."""
+    type: Literal["message", "ping", "pong", "reset"] = Field(..., description="Frame type")
+    message: Optional[str] = Field(None, min_length=1, description="User message, for message frames")
+    persona: Optional[Persona] = Field(None, description="Persona to switch to from this turn on")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "type": "message",
+                "message": "How can I practice mindfulness in my daily life?"
+            }
+        }
+    }
+
+
+class ChatSuggestions(BaseModel):
+    """Follow-up questions suggested after the latest response of a session."""
+    sessionId: str = Field(..., description="Chat session ID")
+    responseId: Optional[str] = Field(None, description="ID of the response the suggestions follow")
+    suggestions: List[str] = Field(default_factory=list, description="Suggested follow-up questions, empty until they are ready")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "sessionId": "user_session_123",
+                "responseId": "chat-response-123456",
+                "suggestions": [
+                    "How can I stay mindful when I am stressed?",
+                    "How long should I practice each day?"
+                ]
+            }
+        }
+    }
+
+
 class ChatResponse(BaseModel):
     """Response model for the chat generation endpoint."""
     message: str = Field(..., description="AI response")
@@ -73,6 +114,13 @@ class ChatResponse(BaseModel):
     timestamp: str = Field(..., description="Response timestamp in ISO format")
     qualityScore: int = Field(..., ge=1, le=10, description="Quality score from 1-10")
     scoreReason: str = Field(..., description="Explanation for the quality score")
+    promptVersion: Optional[str] = Field(None, description="Version of the persona prompt that produced the response")
+    answerId: Optional[str] = Field(None, description="ID of the curated answer bank entry, for answers served from the bank")
+    
+    # Encoded JSON, kept so cached responses are never serialized twice
+    _json: Optional[bytes] = PrivateAttr(default=None)
+    # Compressed forms of the encoded JSON, by Content-Encoding
+    _compressed: Dict[str, bytes] = PrivateAttr(default_factory=dict)
     
     model_config = {
         "json_schema_extra": {
@@ -81,13 +129,21 @@ class ChatResponse(BaseModel):
                 "id": "chat-response-123456",
                 "timestamp": "2023-07-10T15:30:45Z",
                 "qualityScore": 7,
-                "scoreReason": "Good question that shows interest in practical spiritual growth"
+                "scoreReason": "Good question that shows interest in practical spiritual growth",
+                "promptVersion": "3f2a9c1d7b4e"
             }
         }
     }
     
     @classmethod
-    def create(cls, message: str, quality_score: int, quality_reason: str) -> "ChatResponse":
+    def create(
+        cls,
+        message: str,
+        quality_score: int,
+        quality_reason: str,
+        prompt_version: Optional[str] = None,
+        answer_id: Optional[str] = None
+    ) -> "ChatResponse":
         """Factory method to create a ChatResponse with auto-generated fields."""
         import uuid
         return cls(
@@ -95,5 +151,26 @@ class ChatResponse(BaseModel):
             id=f"chat-response-{uuid.uuid4().hex[:12]}",
             timestamp=datetime.utcnow().isoformat() + "Z",
             qualityScore=quality_score,
-            scoreReason=quality_reason
-        ) 
\ No newline at end of file
+            scoreReason=quality_reason,
+            promptVersion=prompt_version,
+            answerId=answer_id
+        )
+    
+    def to_json_bytes(self) -> bytes:
+        """Return the response as JSON bytes, encoding it on the first call only."""
+        if self._json is None:
+            self._json = encode_model(self)
+        return self._json
+    
+    def to_compressed_bytes(self, encoding: str) -> bytes:
+        """Return the JSON compressed with ``encoding``, compressing it on the first call only."""
+        body = self._compressed.get(encoding)
+        if body is None:
+            body = self._compressed[encoding] = compress(self.to_json_bytes(), encoding, STORED_LEVELS[encoding])
+        return body
+    
+    def precompress(self):
+        """Encode the response and compress it with every supported encoding, ahead of cache hits."""
+        if len(self.to_json_bytes()) >= settings.compression_min_size:
+            for encoding in SUPPORTED_ENCODINGS:
+                self.to_compressed_bytes(encoding)
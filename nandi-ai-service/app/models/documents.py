@@ -0,0 +1,38 @@
+from pydantic import BaseModel, Field
+from typing import Any, Dict
+
+
+class Document(BaseModel):
+    """Request model for document uploads."""
+    text: str = Field(..., description="Document text content")
+    metadata: Dict[str, Any] = Field(default_factory=dict, description="Document metadata")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "text": "This is a sample document with spiritual content.",
+                "metadata": {
+                    "title": "Introduction to Meditation",
+                    "author": "Nandi Team",
+                    "tags": ["meditation", "mindfulness"]
+                }
+            }
+        }
+    }
+
+
+class DocumentResponse(BaseModel):
+    """Response model for document uploads."""
+    id: str = Field(..., description="Document ID")
+    timestamp: str = Field(..., description="Timestamp of document creation")
+    status: str = Field(..., description="Processing status")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "id": "doc-123456",
+                "timestamp": "2023-07-10T15:30:45Z",
+                "status": "processed"
+            }
+        }
+    }
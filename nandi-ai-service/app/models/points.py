@@ -1,20 +1,24 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Optional
+from typing import Dict, List, Literal, Optional
 from .chat import Persona
 
 
 class SessionMetricsRequest(BaseModel):
     """Request model for session metrics calculation."""
     persona: Persona = Field(..., description="Persona used in the session")
-    durationSeconds: int = Field(..., description="Session duration in seconds")
-    messageCount: int = Field(..., description="Number of messages in the session")
+    durationSeconds: int = Field(..., ge=0, description="Session duration in seconds")
+    messageCount: int = Field(..., ge=0, description="Number of messages in the session")
+    userId: Optional[str] = Field(None, description="Registered user ID the points belong to")
+    sessionId: Optional[str] = Field(None, description="Anonymous session ID, used when there is no user ID")
+    averageQualityScore: Optional[float] = Field(None, ge=1, le=10, description="Average question quality score of the session")
     
     model_config = {
         "json_schema_extra": {
             "example": {
                 "persona": "dharma",
                 "durationSeconds": 720,
-                "messageCount": 12
+                "messageCount": 12,
+                "userId": "42"
             }
         }
     }
@@ -25,6 +29,7 @@ class PointsResponse(BaseModel):
     pointsEarned: int = Field(..., description="Points earned in this session")
     totalPoints: int = Field(..., description="Total accumulated points")
     breakdown: Dict[str, int] = Field(..., description="Breakdown of points by category")
+    streakDays: Optional[int] = Field(None, description="Consecutive days with activity, including this session")
     
     model_config = {
         "json_schema_extra": {
@@ -36,7 +41,8 @@ class PointsResponse(BaseModel):
                     "duration": 12,
                     "messages": 20,
                     "streak": 5
-                }
+                },
+                "streakDays": 1
             }
         }
     }
@@ -51,9 +57,107 @@ class PointsCalculation(BaseModel):
         "medium": 1.0,
         "high": 1.5
     }
+    # Streak bonus per consecutive day, capped at max_streak_bonus
     streak_bonus: int = 5
+    max_streak_bonus: int = 20
     milestone_bonuses: Dict[str, int] = {
         "5_questions": 10,
         "10_questions": 20,
         "25_questions": 50
-    } 
\ No newline at end of file
+    } 
+
+
+class BatchSessionMetricsRequest(BaseModel):
+    """Request model for calculating points for many sessions at once."""
+    sessions: List[SessionMetricsRequest] = Field(..., description="Session metrics to calculate points for")
+    format: Literal["rows", "columns"] = Field("rows", description="Return one object per session or one array per field")
+    record: bool = Field(False, description="Record the awards in the points ledger")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "sessions": [
+                    {"persona": "dharma", "durationSeconds": 720, "messageCount": 12, "userId": "42"},
+                    {"persona": "karma", "durationSeconds": 300, "messageCount": 4, "sessionId": "anon_123456789"}
+                ],
+                "format": "columns",
+                "record": False
+            }
+        }
+    }
+
+
+class BatchPointsResponse(BaseModel):
+    """Response model for batch points calculation."""
+    count: int = Field(..., description="Number of sessions calculated")
+    results: Optional[List[PointsResponse]] = Field(None, description="Row-wise results, in request order")
+    columns: Optional[Dict[str, List[int]]] = Field(None, description="Column-wise results, in request order")
+
+
+class SessionMergeRequest(BaseModel):
+    """Request model for merging an anonymous session into a registered user."""
+    sessionId: str = Field(..., min_length=1, description="Anonymous session ID to merge")
+    userId: str = Field(..., min_length=1, description="Registered user ID that receives the session's data")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "sessionId": "anon_1712345678_k3j9x2m1q",
+                "userId": "42"
+            }
+        }
+    }
+
+
+class SessionMergeResponse(BaseModel):
+    """Response model for a merged session."""
+    sessionId: str = Field(..., description="Anonymous session ID that was merged")
+    userId: str = Field(..., description="Registered user ID it was merged into")
+    pointsMerged: int = Field(..., description="Points moved from the session to the user")
+    messagesMerged: int = Field(..., description="Stored chat messages reassigned to the user")
+    totalPoints: int = Field(..., description="The user's total points after the merge")
+
+
+class BatchSessionMergeRequest(BaseModel):
+    """Request model for merging many anonymous sessions at once."""
+    merges: List[SessionMergeRequest] = Field(..., description="Sessions to merge; each session at most once")
+
+
+class BatchSessionMergeResponse(BaseModel):
+    """Response model for a batch of merged sessions."""
+    count: int = Field(..., description="Number of sessions merged")
+    results: List[SessionMergeResponse] = Field(..., description="Results, in request order")
+
+
+class LeaderboardEntryResponse(BaseModel):
+    """An owner's position on a leaderboard."""
+    owner: str = Field(..., description="Owner key: user:<userId> or anon:<sessionId>")
+    points: int = Field(..., description="Points on this board")
+    rank: int = Field(..., description="Rank, 1 is best; tied owners share a rank")
+    percentile: float = Field(..., description="Percentage of owners ranked at or below this owner")
+
+
+class LeaderboardResponse(BaseModel):
+    """Response model for the top of a leaderboard."""
+    board: str = Field(..., description="Board name: global or a persona")
+    size: int = Field(..., description="Number of owners on the board")
+    entries: List[LeaderboardEntryResponse] = Field(..., description="Entries ordered best first")
+    
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "board": "global",
+                "size": 1520,
+                "entries": [
+                    {"owner": "user:42", "points": 1250, "rank": 1, "percentile": 100.0},
+                    {"owner": "anon:anon_123456789", "points": 980, "rank": 2, "percentile": 99.93}
+                ]
+            }
+        }
+    }
+
+
+class RankResponse(LeaderboardEntryResponse):
+    """Response model for an owner's rank on a leaderboard."""
+    board: str = Field(..., description="Board name: global or a persona")
+    size: int = Field(..., description="Number of owners on the board")
@@ -1,113 +1,596 @@
-from openai import OpenAI
 from app.config.settings import settings
 from app.config.prompt_loader import prompt_manager
-from app.models.chat import ChatRequest, ChatResponse, Persona
+from app.models.chat import ChatRequest, ChatResponse, Persona, QualityScore
 from app.core.cache import get_from_cache, save_to_cache
-import re
+from app.core.response_parser import StreamingResponseParser, parse_response
+from app.core.metrics import prompt_cache_metrics, usage_value
+from app.services.quality_service import quality_service
+from app.services.answer_bank import answer_bank, AnswerMatch
+from app.services.model_router import model_router
+from app.services.speculation import speculator
+from app.services.message_store import message_store
+from app.services.analytics import analytics
+from app.services.usage_service import usage_tracker
+from app.core.log_config import bind_log_context, reset_log_context
+from app.core.tracing import tracer
+from typing import AsyncIterator, NamedTuple, Optional
+import asyncio
 import logging
-import traceback
+import threading
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
 
+
+class LazyOpenAIClient:
+    """
+    OpenAI client created on first use.
+    
+    Importing the openai package and building its client is the largest part
+    of importing the service, so it is deferred to the application's startup
+    event (or the first attribute access). Attributes are forwarded to the
+    real client, so `client.chat.completions.create` works as before.
+    """
+    
+    def __init__(self, api_key: str):
+        self._api_key = api_key
+        self._client = None
+    
+    def get(self):
+        """Return the OpenAI client, creating it if needed."""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=self._api_key)
+        return self._client
+    
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
 # Initialize OpenAI client
-client = OpenAI(api_key=settings.openai_api_key)
+client = LazyOpenAIClient(settings.openai_api_key)
 
 # Removed hardcoded prompts - now using prompt_manager
 
-async def generate_response(request: ChatRequest) -> ChatResponse:
+# Marks the end of an upstream stream in UpstreamStream's queue
+_END_OF_STREAM = object()
+
+
+class StreamEvent(NamedTuple):
+    """
+    An event of a streamed chat turn.
+    
+    ``token`` events carry answer text as it arrives, ``message`` the complete
+    cleaned answer and ``done`` the final ChatResponse with its quality score.
+    """
+    type: str
+    text: str = ""
+    response: Optional[ChatResponse] = None
+
+
+class UpstreamStream:
+    """
+    Reads a streamed completion on a thread and hands its text to the event loop.
+    
+    The OpenAI client is synchronous, so the stream is iterated on a daemon
+    thread and each delta is queued on the loop. ``chunks`` yields whatever
+    text arrived since the previous pull as one piece: a slow consumer gets
+    fewer, larger chunks while the upstream read never blocks on it.
+    """
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+        self.usage = None
+        threading.Thread(target=self._read, name="upstream-stream", daemon=True).start()
+    
+    def _put(self, item):
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is gone (worker shutting down)
+            self._closed = True
+    
+    def _read(self):
+        try:
+            for chunk in self._stream:
+                if self._closed:
+                    break
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    self.usage = usage
+                choices = getattr(chunk, "choices", None)
+                if choices:
+                    text = getattr(choices[0].delta, "content", None)
+                    if text:
+                        self._put(text)
+        except Exception as e:
+            self._put(e)
+        finally:
+            self._put(_END_OF_STREAM)
+    
+    async def chunks(self) -> AsyncIterator[str]:
+        """
+        Yield the streamed text, merging chunks that queued up in between.
+        
+        Raises:
+            Exception: Any error raised while reading the upstream stream
+        """
+        done = False
+        while not done:
+            items = [await self._queue.get()]
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            parts = []
+            for item in items:
+                if item is _END_OF_STREAM:
+                    done = True
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    parts.append(item)
+            if parts:
+                yield "".join(parts)
+    
+    def close(self):
+        """Stop reading and release the upstream connection."""
+        self._closed = True
+        close = getattr(self._stream, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+async def generate_response(request: ChatRequest, api_key: Optional[str] = None) -> ChatResponse:
     """
     Generate an AI response based on the user's message and selected persona.
     
+    Args:
+        request: The chat request
+        api_key: The caller's API key, used for token accounting and quotas
+    
     Returns a ChatResponse with the AI-generated text, quality score, and other metadata.
+    
+    Raises:
+        QuotaExceededError: If the caller has used up its token quota
     """
-    request_id = str(uuid.uuid4())
-    logger.info(f"Request ID: {request_id} - Processing chat request for persona: {request.persona}")
+    token = bind_log_context(chat_id=str(uuid.uuid4()), persona=request.persona.value)
+    start = time.perf_counter()
+    try:
+        with tracer.start_span("chat.generate_response", {"chat.persona": request.persona.value}):
+            result = await _generate_response(request, api_key)
+        # Persist both messages behind the response
+        message_store.record_turn(request, result)
+        _record_analytics(request, result, start)
+        return result
+    finally:
+        reset_log_context(token)
+
+
+def _record_analytics(request: ChatRequest, response: ChatResponse, start: float):
+    analytics.record_chat(
+        request.persona.value,
+        request.user_id or request.session_id,
+        response.qualityScore,
+        (time.perf_counter() - start) * 1000
+    )
+
+
+async def _generate_response(request: ChatRequest, api_key: Optional[str]) -> ChatResponse:
+    start = time.perf_counter()
+    logger.debug("Processing chat request")
+    
+    # Resolve the persona's current prompt version once for this request
+    persona_prompt = prompt_manager.get_persona(request.persona)
+    prompt_version = persona_prompt.version if persona_prompt is not None else None
     
     # Check cache for stateless requests
     if not request.context:
-        cached_response = get_from_cache(request.persona, request.message)
+        with tracer.start_span("cache.lookup") as span:
+            cached_response = get_from_cache(request.persona, request.message, prompt_version)
+            span.set_attribute("cache.hit", cached_response is not None)
         if cached_response:
-            logger.info(f"Request ID: {request_id} - Returning cached response")
+            logger.info(
+                "Returning cached response",
+                extra={"cache": "hit", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+            )
+            speculator.schedule(request, cached_response, api_key)
             return cached_response
     
+    # Answer generic first-turn questions from the curated answer bank
+    match = _match_answer_bank(request)
+    if match is not None:
+        result = await _answer_bank_response(request, match, prompt_version, start)
+        speculator.schedule(request, result, api_key)
+        return result
+    
+    # Serve follow-ups that were answered speculatively after the previous turn
+    speculative = await _take_speculative(request, start)
+    if speculative is not None:
+        speculator.schedule(request, speculative, api_key)
+        return speculative
+    
+    # Refuse before spending upstream tokens if the caller is over quota
+    await usage_tracker.check_quota(api_key)
+    
+    # Start quality scoring so it overlaps with the main completion
+    quality_task = quality_service.start(request, api_key)
+    
     try:
-        # Get the appropriate system prompt based on persona
-        persona_str = request.persona.lower()
-        system_prompt = prompt_manager.get_persona_prompt(persona_str)
-        quality_prompt = prompt_manager.get_quality_prompt()
+        # Assemble messages from the persona's precompiled prefix
+        include_quality = settings.quality_scoring_mode == "inline"
+        with tracer.start_span("prompt.assemble") as span:
+            messages = prompt_manager.build_messages(
+                persona_prompt or request.persona,
+                request.message,
+                request.context,
+                include_quality=include_quality
+            )
+            span.set_attribute("prompt.messages", len(messages))
+            span.set_attribute("prompt.version", prompt_version)
         
-        # Use default if prompt not found
-        if not system_prompt:
-            logger.warning(f"Request ID: {request_id} - Prompt not found for persona: {persona_str}, using default")
-            system_prompt = prompt_manager.get_persona_prompt("karma")
+        # Call OpenAI API on the routed tier, falling back to larger tiers on errors
+        response = None
+        last_error = None
+        for tier in model_router.candidates(request):
+            logger.debug("Calling OpenAI API with model %s (%s tier)", tier.model, tier.name)
+            upstream_start = time.perf_counter()
+            try:
+                with speculator.live_call(), tracer.start_span(
+                    "upstream.chat_completion",
+                    {"llm.model": tier.model, "llm.tier": tier.name, "llm.max_tokens": tier.max_tokens},
+                    kind="CLIENT"
+                ) as span:
+                    response = await asyncio.to_thread(
+                        client.chat.completions.create,
+                        model=tier.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=tier.max_tokens,
+                    )
+                    usage = getattr(response, "usage", None)
+                    span.set_attribute("llm.prompt_tokens", usage_value(usage, "prompt_tokens"))
+                    span.set_attribute("llm.completion_tokens", usage_value(usage, "completion_tokens"))
+                    span.set_attribute("llm.cached_tokens", usage_value(usage, "prompt_tokens_details", "cached_tokens"))
+                break
+            except Exception as e:
+                last_error = e
+                logger.warning("Model %s failed: %s", tier.model, e, extra={"model": tier.model})
+        if response is None:
+            if last_error is None:
+                raise RuntimeError("No model tiers to call; check the ROUTING_TIERS setting")
+            raise last_error
         
-        # Prepare messages for OpenAI
-        messages = [
-            {"role": "system", "content": system_prompt + quality_prompt},
-            {"role": "user", "content": request.message}
-        ]
+        upstream_ms = (time.perf_counter() - upstream_start) * 1000
         
-        # Add conversation context if provided
-        if request.context:
-            messages = [{"role": "system", "content": system_prompt + quality_prompt}]
-            for msg in request.context:
-                messages.append({"role": msg.role.lower(), "content": msg.content})
-            messages.append({"role": "user", "content": request.message})
+        # Account the tokens to the caller
+        usage_tracker.record(api_key, request.persona.value, tier.model, getattr(response, "usage", None))
         
-        # Call OpenAI API
-        logger.info(f"Request ID: {request_id} - Calling OpenAI API")
-        response = client.chat.completions.create(
-            model=settings.default_model,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1024,
+        # Track how much of the stable prefix the provider served from its prompt cache
+        prompt_cache_metrics.record(
+            request.persona.value,
+            prompt_manager.get_prefix_hash(persona_prompt or request.persona, include_quality),
+            prompt_manager.get_prefix_tokens(persona_prompt or request.persona, include_quality),
+            getattr(response, "usage", None)
         )
         
-        # Extract response text
-        response_text = response.choices[0].message.content.strip()
-        
-        # Extract quality score
-        quality_pattern = r"\[QUALITY:(\d+):([^\]]+)\]"
-        match = re.search(quality_pattern, response_text)
-        
-        quality_score = 5
-        quality_reason = "Question quality could not be evaluated"
+        # Extract response text and any quality evaluation (JSON or marker format)
+        with tracer.start_span("response.parse") as span:
+            parsed = parse_response(response.choices[0].message.content)
+            span.set_attribute("response.chars", len(parsed.message))
+        clean_response = parsed.message
         
-        if match:
-            quality_score = int(match.group(1))
-            quality_reason = match.group(2).strip()
+        inline_score = None
+        if parsed.quality_score is not None:
+            inline_score = QualityScore.model_construct(
+                score=parsed.quality_score,
+                reason=parsed.quality_reason or "Evaluated with the chat response"
+            )
         
-        # Clean response text by removing quality marker
-        clean_response = re.sub(r"\[QUALITY:\d+:[^\]]+\]", "", response_text).strip()
+        # Fall back to the quality model or heuristic scorer if the completion had no score
+        with tracer.start_span("quality.resolve") as span:
+            quality = await quality_service.resolve(request, quality_task, inline_score)
+            span.set_attribute("quality.score", quality.score)
+            span.set_attribute("quality.inline", inline_score is not None)
         
-        logger.info(f"Request ID: {request_id} - Successfully generated response with quality score: {quality_score}")
+        logger.info(
+            "Generated response",
+            extra={
+                "cache": "miss",
+                "model": tier.model,
+                "tier": tier.name,
+                "quality_score": quality.score,
+                "prompt_tokens": usage_value(getattr(response, "usage", None), "prompt_tokens"),
+                "upstream_ms": round(upstream_ms, 2),
+                "latency_ms": round((time.perf_counter() - start) * 1000, 2)
+            }
+        )
         
         # Create response object
         result = ChatResponse.create(
             message=clean_response,
-            quality_score=quality_score,
-            quality_reason=quality_reason
+            quality_score=quality.score,
+            quality_reason=quality.reason,
+            prompt_version=prompt_version
         )
         
         # Cache the result if appropriate
         if not request.context:
             save_to_cache(request.persona, request.message, result)
         
+        speculator.schedule(request, result, api_key)
         return result
     except Exception as e:
-        logger.error(f"Request ID: {request_id} - Error generating response: {str(e)}\n{traceback.format_exc()}")
+        logger.error("Error generating response: %s", e, exc_info=True, extra={"cache": "miss"})
+        return _fallback_response(request, prompt_version, e, quality_task)
+
+
+async def _take_speculative(request: ChatRequest, start: float) -> Optional[ChatResponse]:
+    """Look up a precomputed answer to a suggested follow-up question."""
+    if not request.session_id or not request.context:
+        return None
+    with tracer.start_span("speculation.lookup") as span:
+        result = await speculator.take(request)
+        span.set_attribute("speculation.hit", result is not None)
+    if result is not None:
+        logger.info(
+            "Returning speculative response",
+            extra={"cache": "speculative", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+        )
+    return result
+
+
+def _match_answer_bank(request: ChatRequest) -> Optional[AnswerMatch]:
+    """Look up a first-turn question in the answer bank."""
+    if request.context or not settings.answer_bank_enabled:
+        return None
+    with tracer.start_span("answer_bank.lookup") as span:
+        match = answer_bank.match(request.persona, request.message)
+        span.set_attribute("answer_bank.hit", match is not None)
+        if match is not None:
+            span.set_attribute("answer_bank.confidence", round(match.confidence, 3))
+    return match
+
+
+async def _answer_bank_response(
+    request: ChatRequest,
+    match: AnswerMatch,
+    prompt_version: Optional[str],
+    start: float
+) -> ChatResponse:
+    """Build the response for a question answered from the answer bank."""
+    # No scoring task is started, so this is the cached or heuristic score
+    quality = await quality_service.resolve(request)
+    logger.info(
+        "Answered from the answer bank",
+        extra={
+            "answer_id": match.answer.id,
+            "confidence": round(match.confidence, 3),
+            "latency_ms": round((time.perf_counter() - start) * 1000, 3)
+        }
+    )
+    return ChatResponse.create(
+        message=match.answer.answer,
+        quality_score=quality.score,
+        quality_reason=quality.reason,
+        prompt_version=prompt_version,
+        answer_id=match.answer.id
+    )
+
+
+def _fallback_response(
+    request: ChatRequest,
+    prompt_version: Optional[str],
+    error: Exception,
+    quality_task: Optional[asyncio.Task]
+) -> ChatResponse:
+    """
+    Build the response for a failed upstream call.
+    
+    The closest curated answer (or the persona's default one) is preferred
+    over the generic fallback text from prompts.json.
+    """
+    # Score the question locally so points stay meaningful during outages
+    if quality_task is not None:
+        quality_task.cancel()
+    quality = quality_service.score_heuristic(request)
+    
+    match = answer_bank.match(request.persona, request.message, settings.answer_bank_fallback_threshold)
+    answer = match.answer if match is not None else answer_bank.default_answer(request.persona)
+    if answer is not None:
+        return ChatResponse.create(
+            message=answer.answer,
+            quality_score=quality.score,
+            quality_reason=quality.reason,
+            prompt_version=prompt_version,
+            answer_id=answer.id
+        )
+    
+    # Get fallback response from prompt_manager
+    fallback_message = prompt_manager.get_fallback_response(request.persona)
+    if not fallback_message:
+        fallback_message = prompt_manager.get_fallback_response("karma")
         
-        # Get fallback response from prompt_manager
-        fallback_message = prompt_manager.get_fallback_response(request.persona)
-        if not fallback_message:
-            fallback_message = prompt_manager.get_fallback_response("karma")
-            
-        fallback_message = f"{fallback_message} (Note: Using fallback response due to API error: {str(e)})"
+    fallback_message = f"{fallback_message} (Note: Using fallback response due to API error: {str(error)})"
+    
+    # Return fallback response
+    return ChatResponse.create(
+        message=fallback_message,
+        quality_score=quality.score,
+        quality_reason=quality.reason,
+        prompt_version=prompt_version
+    )
+
+
+async def stream_response(request: ChatRequest, api_key: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+    """
+    Generate an AI response, yielding its text as the completion streams in.
+    
+    Quality markers (or the JSON envelope) are stripped from the streamed
+    text. The complete answer is yielded as a ``message`` event before the
+    quality score is resolved, then the ``done`` event carries the full
+    ChatResponse. Stateless requests use and fill the response cache like
+    ``generate_response``.
+    
+    Args:
+        request: The chat request
+        api_key: The caller's API key, used for token accounting and quotas
+    
+    Raises:
+        QuotaExceededError: If the caller has used up its token quota (before
+        any event is yielded)
+    """
+    start = time.perf_counter()
+    events = _stream_response(request, api_key)
+    try:
+        async for event in events:
+            if event.type == "done":
+                # Persist both messages behind the response
+                message_store.record_turn(request, event.response)
+                _record_analytics(request, event.response, start)
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def _stream_response(request: ChatRequest, api_key: Optional[str]) -> AsyncIterator[StreamEvent]:
+    start = time.perf_counter()
+    persona_prompt = prompt_manager.get_persona(request.persona)
+    prompt_version = persona_prompt.version if persona_prompt is not None else None
+    
+    if not request.context:
+        cached_response = get_from_cache(request.persona, request.message, prompt_version)
+        if cached_response:
+            logger.info("Streaming cached response", extra={"cache": "hit"})
+            yield StreamEvent("token", cached_response.message)
+            yield StreamEvent("message", cached_response.message)
+            speculator.schedule(request, cached_response, api_key)
+            yield StreamEvent("done", response=cached_response)
+            return
+    
+    # Curated and speculatively precomputed answers are sent in one piece
+    match = _match_answer_bank(request)
+    if match is not None:
+        result = await _answer_bank_response(request, match, prompt_version, start)
+    else:
+        result = await _take_speculative(request, start)
+    if result is not None:
+        speculator.schedule(request, result, api_key)
+        yield StreamEvent("token", result.message)
+        yield StreamEvent("message", result.message)
+        yield StreamEvent("done", response=result)
+        return
+    
+    await usage_tracker.check_quota(api_key)
+    quality_task = quality_service.start(request, api_key)
+    include_quality = settings.quality_scoring_mode == "inline"
+    messages = prompt_manager.build_messages(
+        persona_prompt or request.persona,
+        request.message,
+        request.context,
+        include_quality=include_quality
+    )
+    
+    parser = StreamingResponseParser()
+    upstream = None
+    streamed = False
+    # Streams hold upstream capacity until the last token has arrived
+    with speculator.live_call():
+        try:
+            # Open the stream on the routed tier, falling back to larger tiers on errors
+            last_error = None
+            for tier in model_router.candidates(request):
+                try:
+                    stream = await asyncio.to_thread(
+                        client.chat.completions.create,
+                        model=tier.model,
+                        messages=messages,
+                        temperature=0.7,
+                        max_tokens=tier.max_tokens,
+                        stream=True,
+                        extra_body={"stream_options": {"include_usage": True}},
+                    )
+                    upstream = UpstreamStream(stream)
+                    break
+                except Exception as e:
+                    last_error = e
+                    logger.warning("Model %s failed: %s", tier.model, e, extra={"model": tier.model})
+            if upstream is None:
+                if last_error is None:
+                    raise RuntimeError("No model tiers to call; check the ROUTING_TIERS setting")
+                raise last_error
         
-        # Return fallback response
-        return ChatResponse.create(
-            message=fallback_message,
-            quality_score=7,
-            quality_reason="Good question showing interest in spiritual growth"
-        ) 
\ No newline at end of file
+            try:
+                async for chunk in upstream.chunks():
+                    text = parser.feed(chunk)
+                    if text:
+                        streamed = True
+                        yield StreamEvent("token", text)
+            except Exception as e:
+                if not streamed:
+                    raise
+                # Keep the part of the answer the user has already seen
+                logger.error("Stream interrupted: %s", e, extra={"model": tier.model})
+            text = parser.flush()
+            if text:
+                yield StreamEvent("token", text)
+        except Exception as e:
+            logger.error("Error streaming response: %s", e, exc_info=True, extra={"cache": "miss"})
+            result = _fallback_response(request, prompt_version, e, quality_task)
+            yield StreamEvent("token", result.message)
+            yield StreamEvent("message", result.message)
+            yield StreamEvent("done", response=result)
+            return
+        except BaseException:
+            # The consumer went away (disconnect or cancellation)
+            if quality_task is not None:
+                quality_task.cancel()
+            raise
+        finally:
+            if upstream is not None:
+                upstream.close()
+    
+    usage_tracker.record(api_key, request.persona.value, tier.model, upstream.usage)
+    prompt_cache_metrics.record(
+        request.persona.value,
+        prompt_manager.get_prefix_hash(persona_prompt or request.persona, include_quality),
+        prompt_manager.get_prefix_tokens(persona_prompt or request.persona, include_quality),
+        upstream.usage
+    )
+    
+    parsed = parser.close()
+    yield StreamEvent("message", parsed.message)
+    
+    inline_score = None
+    if parsed.quality_score is not None:
+        inline_score = QualityScore.model_construct(
+            score=parsed.quality_score,
+            reason=parsed.quality_reason or "Evaluated with the chat response"
+        )
+    quality = await quality_service.resolve(request, quality_task, inline_score)
+    
+    logger.info(
+        "Streamed response",
+        extra={
+            "cache": "miss",
+            "model": tier.model,
+            "tier": tier.name,
+            "quality_score": quality.score,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+    )
+    
+    result = ChatResponse.create(
+        message=parsed.message,
+        quality_score=quality.score,
+        quality_reason=quality.reason,
+        prompt_version=prompt_version
+    )
+    if not request.context:
+        save_to_cache(request.persona, request.message, result)
+    speculator.schedule(request, result, api_key)
+    yield StreamEvent("done", response=result)
@@ -0,0 +1,451 @@
+"""
+Streaming analytics rollups for chats and sessions.
+
+Every chat turn and session-metrics call updates a rollup for the current
+time bucket (``analytics_bucket_seconds`` wide) and persona: message and
+session counts, a quality score distribution, HDR-style histograms of
+response latency, session duration and messages per session, and a
+HyperLogLog of distinct sessions. All of these are mergeable sketches of a
+fixed size, so each worker only keeps a few KB per active bucket.
+
+Rollups are only touched from the event loop. A background task writes
+this worker's rollups for the buckets that changed to a shared store every
+``analytics_flush_interval`` seconds, replacing the previous copy, and the
+dashboard merges every worker's rollups for the requested window. Its cost
+depends on the number of buckets, personas and workers, never on traffic.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+from app.core.sketches import HyperLogLog, LogHistogram
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+# (bucket start, persona) -> serialized rollup
+RollupRows = Dict[Tuple[int, str], Dict[str, Any]]
+
+
+class Rollup:
+    """Mergeable aggregates of the chats and sessions of one bucket and persona."""
+
+    def __init__(self):
+        self.messages = 0
+        self.sessions = 0
+        self.quality = [0] * 10
+        self.latency_ms = LogHistogram()
+        self.duration_seconds = LogHistogram()
+        self.messages_per_session = LogHistogram()
+        self.distinct_sessions = HyperLogLog()
+
+    def record_chat(self, session: Optional[str], quality_score: int, latency_ms: float):
+        self.messages += 1
+        if 1 <= quality_score <= 10:
+            self.quality[quality_score - 1] += 1
+        self.latency_ms.add(latency_ms)
+        if session:
+            self.distinct_sessions.add(session)
+
+    def record_session(self, session: Optional[str], duration_seconds: float, message_count: int):
+        self.sessions += 1
+        self.duration_seconds.add(duration_seconds)
+        self.messages_per_session.add(message_count)
+        if session:
+            self.distinct_sessions.add(session)
+
+    def merge(self, other: "Rollup"):
+        self.messages += other.messages
+        self.sessions += other.sessions
+        self.quality = [a + b for a, b in zip(self.quality, other.quality)]
+        self.latency_ms.merge(other.latency_ms)
+        self.duration_seconds.merge(other.duration_seconds)
+        self.messages_per_session.merge(other.messages_per_session)
+        self.distinct_sessions.merge(other.distinct_sessions)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "messages": self.messages,
+            "sessions": self.sessions,
+            "quality": self.quality,
+            "latency_ms": self.latency_ms.to_dict(),
+            "duration_seconds": self.duration_seconds.to_dict(),
+            "messages_per_session": self.messages_per_session.to_dict(),
+            "distinct_sessions": self.distinct_sessions.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Rollup":
+        rollup = cls()
+        rollup.messages = data["messages"]
+        rollup.sessions = data["sessions"]
+        rollup.quality = list(data["quality"])
+        rollup.latency_ms = LogHistogram.from_dict(data["latency_ms"])
+        rollup.duration_seconds = LogHistogram.from_dict(data["duration_seconds"])
+        rollup.messages_per_session = LogHistogram.from_dict(data["messages_per_session"])
+        rollup.distinct_sessions = HyperLogLog.from_dict(data["distinct_sessions"])
+        return rollup
+
+    def summary(self) -> Dict[str, Any]:
+        """Report the counts, distributions and percentiles of this rollup."""
+        scored = sum(self.quality)
+        return {
+            "messages": self.messages,
+            "sessions": self.sessions,
+            "distinct_sessions": self.distinct_sessions.count(),
+            "quality": {
+                "distribution": {str(score): count for score, count in enumerate(self.quality, 1)},
+                "mean": round(sum(s * c for s, c in enumerate(self.quality, 1)) / scored, 2) if scored else None,
+            },
+            "latency_ms": _describe(self.latency_ms),
+            "duration_seconds": _describe(self.duration_seconds),
+            "messages_per_session": _describe(self.messages_per_session),
+        }
+
+
+def _describe(histogram: LogHistogram) -> Dict[str, Any]:
+    description: Dict[str, Any] = {"count": histogram.count}
+    if histogram.count:
+        description["mean"] = round(histogram.mean, 2)
+        for name, q in QUANTILES:
+            description[name] = round(histogram.quantile(q), 2)
+        description["max"] = round(histogram.max, 2)
+    return description
+
+
+class MemoryAnalyticsStore:
+    """In-process rollup store, for tests and single-worker development."""
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, int, str], Dict[str, Any]] = {}
+
+    def put(self, worker: str, rows: RollupRows):
+        for (bucket, persona), data in rows.items():
+            self._rows[(worker, bucket, persona)] = data
+
+    def fetch(self, start_bucket: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+        return [
+            (bucket, persona, data)
+            for (_, bucket, persona), data in self._rows.items()
+            if bucket >= start_bucket
+        ]
+
+    def prune(self, before_bucket: int):
+        for key in [key for key in self._rows if key[1] < before_bucket]:
+            del self._rows[key]
+
+    def close(self):
+        pass
+
+
+class SQLiteAnalyticsStore:
+    """Rollups in a SQLite file shared by the workers on one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analytics_rollups (
+                worker TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                persona TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (worker, bucket, persona)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_analytics_rollups_bucket ON analytics_rollups (bucket)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def put(self, worker: str, rows: RollupRows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO analytics_rollups (worker, bucket, persona, data) VALUES (?, ?, ?, ?)",
+                [(worker, bucket, persona, json.dumps(data)) for (bucket, persona), data in rows.items()],
+            )
+
+    def fetch(self, start_bucket: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bucket, persona, data FROM analytics_rollups WHERE bucket >= ?", (start_bucket,)
+            ).fetchall()
+        return [(bucket, persona, json.loads(data)) for bucket, persona, data in rows]
+
+    def prune(self, before_bucket: int):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM analytics_rollups WHERE bucket < ?", (before_bucket,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisAnalyticsStore:
+    """
+    Rollups in Redis, shared by workers on every host.
+
+    Each bucket is a hash ``<prefix>:<bucket start>`` with one field per
+    ``<worker>|<persona>``; the hash expires with the retention window.
+    """
+
+    def __init__(self, client, bucket_seconds: int, retention_seconds: int, prefix: str = "nandi:analytics"):
+        self._client = client
+        self._bucket_seconds = bucket_seconds
+        self._ttl = retention_seconds + bucket_seconds
+        self._prefix = prefix
+
+    def put(self, worker: str, rows: RollupRows):
+        pipe = self._client.pipeline(transaction=False)
+        for (bucket, persona), data in rows.items():
+            key = f"{self._prefix}:{bucket}"
+            pipe.hset(key, f"{worker}|{persona}", json.dumps(data))
+            pipe.expire(key, self._ttl)
+        pipe.execute()
+
+    def fetch(self, start_bucket: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+        end_bucket = int(time.time()) // self._bucket_seconds * self._bucket_seconds
+        buckets = list(range(start_bucket, end_bucket + 1, self._bucket_seconds))
+        pipe = self._client.pipeline(transaction=False)
+        for bucket in buckets:
+            pipe.hgetall(f"{self._prefix}:{bucket}")
+        rows = []
+        for bucket, fields in zip(buckets, pipe.execute()):
+            for field, value in fields.items():
+                field = field.decode() if isinstance(field, bytes) else field
+                rows.append((bucket, field.rsplit("|", 1)[1], json.loads(value)))
+        return rows
+
+    def prune(self, before_bucket: int):
+        # Buckets expire on their own
+        pass
+
+    def close(self):
+        pass
+
+
+def create_store(backend: str):
+    """Create the rollup store configured by ``analytics_backend``."""
+    if backend == "redis":
+        import redis
+
+        return RedisAnalyticsStore(
+            redis.Redis(
+                host=settings.redis_host,
+                port=int(settings.redis_port),
+                password=settings.redis_password or None,
+                db=int(settings.redis_db),
+                socket_timeout=1.0,
+            ),
+            bucket_seconds=settings.analytics_bucket_seconds,
+            retention_seconds=settings.analytics_retention_hours * 3600,
+        )
+    if backend == "sqlite":
+        return SQLiteAnalyticsStore(settings.analytics_db_path)
+    return MemoryAnalyticsStore()
+
+
+def _worker_id() -> str:
+    # The random part keeps a restarted worker that reuses a pid from
+    # overwriting the rollups of its predecessor
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Analytics:
+    """
+    Per-worker analytics rollups with periodic flushes to a shared store.
+
+    ``record_chat``, ``record_session`` and ``dashboard`` must be called from
+    the event loop; store I/O runs in a thread.
+    """
+
+    def __init__(
+        self,
+        store_factory,
+        bucket_seconds: int = 300,
+        retention_seconds: int = 86400,
+        flush_interval: float = 10.0,
+        worker_id: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._store_factory = store_factory
+        self._store = None
+        self.bucket_seconds = bucket_seconds
+        self.retention_seconds = retention_seconds
+        self.flush_interval = flush_interval
+        self._fixed_worker_id = worker_id
+        self._worker_id: Optional[str] = None
+        self._worker_pid: Optional[int] = None
+        self._clock = clock
+        self._rollups: Dict[Tuple[int, str], Rollup] = {}
+        self._dirty: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = self._store_factory()
+        return self._store
+
+    @property
+    def worker_id(self) -> str:
+        # Created on first use in each process: the singleton is built
+        # before the pre-fork master forks its workers
+        if self._fixed_worker_id:
+            return self._fixed_worker_id
+        if self._worker_pid != os.getpid():
+            self._worker_pid = os.getpid()
+            self._worker_id = _worker_id()
+        return self._worker_id
+
+    def _bucket(self, now: Optional[float] = None) -> int:
+        now = self._clock() if now is None else now
+        return int(now) // self.bucket_seconds * self.bucket_seconds
+
+    def _rollup(self, persona: str) -> Rollup:
+        key = (self._bucket(), persona)
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            rollup = self._rollups[key] = Rollup()
+        self._dirty.add(key)
+        return rollup
+
+    def record_chat(self, persona: str, session: Optional[str], quality_score: int, latency_ms: float):
+        """
+        Count one answered chat message.
+
+        Args:
+            persona: The persona identifier
+            session: The user or anonymous session id, if known
+            quality_score: Quality score of the user's question (1-10)
+            latency_ms: Time taken to produce the answer
+        """
+        try:
+            self._rollup(persona).record_chat(session, quality_score, latency_ms)
+        except Exception as e:
+            logger.error("Error recording chat analytics: %s", e)
+
+    def record_session(self, persona: str, session: Optional[str], duration_seconds: float, message_count: int):
+        """
+        Count one finished session reported through the session metrics API.
+
+        Args:
+            persona: The persona identifier
+            session: The user or anonymous session id, if known
+            duration_seconds: Session duration
+            message_count: Messages in the session
+        """
+        try:
+            self._rollup(persona).record_session(session, duration_seconds, message_count)
+        except Exception as e:
+            logger.error("Error recording session analytics: %s", e)
+
+    async def flush(self) -> int:
+        """
+        Write this worker's changed rollups to the shared store.
+
+        Returns:
+            int: Number of rollups written
+        """
+        cutoff = self._bucket() - self.retention_seconds
+        for key in [key for key in self._rollups if key[0] < cutoff]:
+            del self._rollups[key]
+            self._dirty.discard(key)
+        dirty, self._dirty = self._dirty, set()
+        rows = {key: self._rollups[key].to_dict() for key in dirty}
+
+        try:
+            await asyncio.to_thread(self._write, rows, cutoff)
+        except Exception as e:
+            logger.error("Error writing analytics rollups, keeping them for the next flush: %s", e)
+            self._dirty |= {key for key in dirty if key in self._rollups}
+            return 0
+        return len(rows)
+
+    def _write(self, rows: RollupRows, cutoff: int):
+        if rows:
+            self.store.put(self.worker_id, rows)
+        self.store.prune(cutoff)
+
+    async def dashboard(self, window_seconds: int, persona: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Merge every worker's rollups over the last ``window_seconds``.
+
+        Args:
+            window_seconds: Length of the window, rounded up to whole buckets
+            persona: Only report this persona
+
+        Returns:
+            dict: Totals over all personas, per-persona summaries and the
+            message and session counts of each bucket
+        """
+        await self.flush()
+        end = self._bucket()
+        start = end - max(0, window_seconds - 1) // self.bucket_seconds * self.bucket_seconds
+        rows = await asyncio.to_thread(self.store.fetch, start)
+
+        total = Rollup()
+        personas: Dict[str, Rollup] = {}
+        series: Dict[int, List[int]] = {}
+        for bucket, row_persona, data in rows:
+            if persona is not None and row_persona != persona:
+                continue
+            rollup = Rollup.from_dict(data)
+            total.merge(rollup)
+            personas.setdefault(row_persona, Rollup()).merge(rollup)
+            counts = series.setdefault(bucket, [0, 0])
+            counts[0] += rollup.messages
+            counts[1] += rollup.sessions
+
+        return {
+            "start": start,
+            "end": end + self.bucket_seconds,
+            "bucket_seconds": self.bucket_seconds,
+            "total": total.summary(),
+            "personas": {name: rollup.summary() for name, rollup in sorted(personas.items())},
+            "series": [
+                {"bucket": bucket, "messages": counts[0], "sessions": counts[1]}
+                for bucket, counts in sorted(series.items())
+            ],
+        }
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        """Start the periodic flush task."""
+        if self._task is None and self.flush_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stop the flush task, write changed rollups and close the store."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+# Create a singleton instance
+analytics = Analytics(
+    lambda: create_store(settings.analytics_backend),
+    bucket_seconds=settings.analytics_bucket_seconds,
+    retention_seconds=settings.analytics_retention_hours * 3600,
+    flush_interval=settings.analytics_flush_interval,
+)
@@ -0,0 +1,310 @@
+"""
+Curated per-persona answers served without an upstream call.
+
+``app/config/answer_bank.json`` maps each persona to entries with an ``id``,
+a list of example ``questions`` and the curated ``answer``; one entry per
+persona may be marked ``"default": true``. The file is loaded into an
+immutable index per persona and swapped in as a whole on reload, like the
+prompt set.
+
+Matching is lexical: an exact hit on the normalized question, otherwise the
+cosine similarity of TF-IDF vectors over content words. Words are reduced
+to a canonical form first (plural stripping and ``SYNONYMS``), so "How can I
+start meditating?" matches "How should a beginner start meditation?". A
+lookup is a few dictionary operations per query word, well under a
+millisecond.
+
+First-turn chat requests whose best match reaches ``answer_bank_threshold``
+are answered from the bank. When the upstream call fails, matches down to
+``answer_bank_fallback_threshold``, then the persona's default entry,
+replace the generic fallback text.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import re
+from collections import defaultdict
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from app.config.settings import settings
+from app.services.quality_service import normalize_question
+
+logger = logging.getLogger(__name__)
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+# Words that carry no topic; dropped unless a question has nothing else
+STOPWORDS = frozenset({
+    "a", "about", "am", "an", "and", "any", "are", "as", "at", "be", "been",
+    "best", "but", "by", "can", "could", "do", "does", "did", "for", "from",
+    "get", "give", "has", "have", "how", "i", "if", "in", "into", "is", "it",
+    "its", "just", "me", "my", "of", "on", "or", "please", "really", "should",
+    "so", "some", "tell", "that", "the", "their", "there", "this", "to", "us",
+    "want", "way", "we", "what", "when", "where", "which", "who", "why",
+    "will", "with", "would", "you", "your",
+})
+
+# Words treated as the same term; the first word of each group is canonical
+SYNONYM_GROUPS = (
+    ("meditate", "meditation", "meditating", "meditative"),
+    ("mindful", "mindfulness", "mindfully"),
+    ("purpose", "meaning", "calling", "mission"),
+    ("self", "soul", "atma", "atman"),
+    ("forgive", "forgiveness", "forgiving", "forgave"),
+    ("career", "job", "work", "profession"),
+    ("decide", "decision", "choice", "choose", "choosing"),
+    ("calm", "quiet", "still", "stillness", "peace", "peaceful"),
+    ("thought", "thinking", "overthinking", "worry", "worrying"),
+    ("start", "begin", "beginner", "starting", "beginning"),
+    ("mistake", "wrong", "regret"),
+    ("resentment", "grudge", "anger", "bitterness"),
+    ("balance", "balancing", "juggle"),
+    ("duty", "responsibility", "obligation"),
+)
+SYNONYMS = {word: group[0] for group in SYNONYM_GROUPS for word in group}
+
+
+def terms(text: str) -> List[str]:
+    """
+    Reduce text to canonical content terms.
+
+    Stopwords are dropped unless nothing else remains ("Who am I?").
+    """
+    words = _TERM_RE.findall(text.lower())
+    result = []
+    for word in words:
+        canonical = SYNONYMS.get(word)
+        if canonical is None and len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            singular = word[:-3] + "y" if word.endswith("ies") and len(word) > 4 else word[:-1]
+            canonical = SYNONYMS.get(singular, singular)
+        result.append(canonical or word)
+    content = [term for term in result if term not in STOPWORDS]
+    return content or result
+
+
+class BankAnswer(NamedTuple):
+    """A curated answer."""
+    id: str
+    persona: str
+    answer: str
+    questions: Tuple[str, ...]
+
+
+class AnswerMatch(NamedTuple):
+    """The best answer for a question and how closely it matched (0-1)."""
+    answer: BankAnswer
+    confidence: float
+
+
+class PersonaIndex:
+    """TF-IDF index over the example questions of one persona's answers."""
+
+    def __init__(self, answers: List[BankAnswer]):
+        self.answers = answers
+        # normalized question -> answer position
+        self.exact: Dict[str, int] = {}
+        # example question (document) -> answer position
+        self.document_answer: List[int] = []
+        documents: List[Dict[str, int]] = []
+        for position, answer in enumerate(answers):
+            for question in answer.questions:
+                self.exact.setdefault(normalize_question(question), position)
+                counts: Dict[str, int] = defaultdict(int)
+                for term in terms(question):
+                    counts[term] += 1
+                if counts:
+                    documents.append(counts)
+                    self.document_answer.append(position)
+
+        document_frequency: Dict[str, int] = defaultdict(int)
+        for counts in documents:
+            for term in counts:
+                document_frequency[term] += 1
+        total = len(documents)
+        self.idf = {term: math.log((total + 1) / (df + 1)) + 1 for term, df in document_frequency.items()}
+        # Weight of terms that appear in no example question
+        self.unknown_idf = math.log(total + 1) + 1
+
+        # term -> [(document, weight in the L2-normalized document vector)]
+        postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for document, counts in enumerate(documents):
+            weights = {term: count * self.idf[term] for term, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            for term, weight in weights.items():
+                postings[term].append((document, weight / norm))
+        self.postings = dict(postings)
+
+    def search(self, question: str) -> Optional[AnswerMatch]:
+        """
+        Find the answer whose example question is closest to ``question``.
+
+        Returns:
+            Optional[AnswerMatch]: The best answer and its cosine similarity,
+            or None if no term matches
+        """
+        position = self.exact.get(normalize_question(question))
+        if position is not None:
+            return AnswerMatch(self.answers[position], 1.0)
+
+        counts: Dict[str, int] = defaultdict(int)
+        for term in terms(question):
+            counts[term] += 1
+        scores: Dict[int, float] = defaultdict(float)
+        query_norm = 0.0
+        for term, count in counts.items():
+            weight = count * self.idf.get(term, self.unknown_idf)
+            query_norm += weight * weight
+            for document, doc_weight in self.postings.get(term, ()):
+                scores[document] += weight * doc_weight
+        if not scores:
+            return None
+        document, score = max(scores.items(), key=lambda item: item[1])
+        return AnswerMatch(
+            self.answers[self.document_answer[document]],
+            min(1.0, score / math.sqrt(query_norm))
+        )
+
+
+class AnswerBankSet(NamedTuple):
+    """An immutable, indexed version of the answer bank file."""
+    version: str
+    indexes: Mapping[str, PersonaIndex]
+    defaults: Mapping[str, BankAnswer]
+    size: int
+
+
+EMPTY_ANSWER_BANK = AnswerBankSet(version="", indexes=MappingProxyType({}), defaults=MappingProxyType({}), size=0)
+
+
+def build_answer_bank(data: Mapping, version: str) -> AnswerBankSet:
+    """
+    Index the parsed answer bank file.
+
+    Raises:
+        ValueError: If an entry has no id, questions or answer
+    """
+    indexes = {}
+    defaults = {}
+    size = 0
+    for persona, entries in data.items():
+        answers = []
+        for entry in entries:
+            if not entry.get("id") or not entry.get("questions") or not entry.get("answer"):
+                raise ValueError(f"Answer bank entry for {persona} needs an id, questions and an answer")
+            answer = BankAnswer(
+                id=entry["id"],
+                persona=persona,
+                answer=entry["answer"].strip(),
+                questions=tuple(entry["questions"]),
+            )
+            answers.append(answer)
+            if entry.get("default") and persona not in defaults:
+                defaults[persona] = answer
+        indexes[persona] = PersonaIndex(answers)
+        size += len(answers)
+    return AnswerBankSet(
+        version=version,
+        indexes=MappingProxyType(indexes),
+        defaults=MappingProxyType(defaults),
+        size=size,
+    )
+
+
+class AnswerBank:
+    """
+    Loads the answer bank file and matches questions against it.
+
+    Reloading builds a complete new AnswerBankSet and swaps it in with one
+    assignment, so lookups never see a partially loaded bank.
+    """
+
+    def __init__(self, path=None, lazy: bool = False):
+        """
+        Args:
+            path: Path to the answer bank JSON file; defaults to
+                ``app/config/answer_bank.json``
+            lazy: Defer loading to ``load()`` or the first lookup
+        """
+        if path is None:
+            path = Path(__file__).resolve().parent.parent / "config" / "answer_bank.json"
+        self.path = path
+        self._current_set = EMPTY_ANSWER_BANK
+        self._loaded = False
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """Load the answer bank unless it has already been loaded."""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            self.refresh()
+        except Exception:
+            # Without a bank every question goes upstream
+            pass
+
+    def refresh(self):
+        """
+        Reload the answer bank file.
+
+        Raises:
+            Exception: If the file cannot be read or indexed; the previously
+            loaded answers stay in effect
+        """
+        try:
+            with open(self.path, "rb") as f:
+                content = f.read()
+            bank = build_answer_bank(json.loads(content), hashlib.sha256(content).hexdigest()[:12])
+        except Exception as e:
+            logger.error("Error loading answer bank from %s: %s", self.path, e)
+            raise
+        if bank.version != self._current_set.version:
+            self._current_set = bank
+            logger.info("Loaded %s curated answers from %s (version %s)", bank.size, self.path, bank.version)
+
+    @property
+    def answer_set(self) -> AnswerBankSet:
+        """The current indexed answer bank."""
+        if not self._loaded:
+            self.load()
+        return self._current_set
+
+    @property
+    def version(self) -> str:
+        """Version id of the loaded answer bank."""
+        return self.answer_set.version
+
+    def match(self, persona, question: str, threshold: Optional[float] = None) -> Optional[AnswerMatch]:
+        """
+        Find a curated answer for a question.
+
+        Args:
+            persona: The persona identifier (e.g., "karma", "dharma")
+            question: The user's question
+            threshold: Minimum confidence (defaults to ``answer_bank_threshold``)
+
+        Returns:
+            Optional[AnswerMatch]: The best match if it reaches the threshold
+        """
+        index = self.answer_set.indexes.get(getattr(persona, "value", persona))
+        if index is None:
+            return None
+        match = index.search(question)
+        if threshold is None:
+            threshold = settings.answer_bank_threshold
+        if match is None or match.confidence < threshold:
+            return None
+        return match
+
+    def default_answer(self, persona) -> Optional[BankAnswer]:
+        """Return the persona's default answer, used when nothing matches during an outage."""
+        return self.answer_set.defaults.get(getattr(persona, "value", persona))
+
+
+# Create a singleton instance
+answer_bank = AnswerBank(lazy=True)
@@ -0,0 +1,57 @@
+"""
+Server-side conversation state for WebSocket chat connections.
+
+A connection to ``/api/chat/ws`` is bound to one session id. Its recent
+turns are kept here, so clients send only the new message each turn instead
+of resending the whole ``context`` list.
+"""
+
+from collections import deque
+from typing import Deque, Optional
+
+from app.models.chat import ChatRequest, ConversationMessage, MessageRole, Persona
+
+
+class ChatSession:
+    """
+    Conversation history of one WebSocket connection.
+
+    Only the last ``max_history`` messages are kept, which bounds both the
+    memory held per connection and the prompt size of later turns.
+    """
+
+    def __init__(self, session_id: str, persona: Persona, max_history: int = 20):
+        self.session_id = session_id
+        self.persona = persona
+        self.history: Deque[ConversationMessage] = deque(maxlen=max(0, max_history))
+        self.turns = 0
+
+    def build_request(self, message: str, persona: Optional[Persona] = None) -> ChatRequest:
+        """
+        Create the chat request for the next turn.
+
+        Args:
+            message: The user's message
+            persona: Persona to switch to from this turn on, if any
+
+        Returns:
+            ChatRequest: The request, with the kept history as its context
+        """
+        if persona is not None:
+            self.persona = persona
+        return ChatRequest.model_construct(
+            message=message,
+            persona=self.persona,
+            session_id=self.session_id,
+            context=list(self.history) or None,
+        )
+
+    def record(self, message: str, answer: str):
+        """Add a completed turn to the history."""
+        self.history.append(ConversationMessage.model_construct(role=MessageRole.USER, content=message))
+        self.history.append(ConversationMessage.model_construct(role=MessageRole.ASSISTANT, content=answer))
+        self.turns += 1
+
+    def reset(self):
+        """Forget the conversation so far."""
+        self.history.clear()
@@ -0,0 +1,621 @@
+"""
+Leaderboards over accumulated points.
+
+Every award recorded by the points ledger updates a global board (owner
+totals) and a per-persona board (points earned with that persona). Each
+board is an order-statistics index: owners are grouped into fixed-width
+score buckets whose counts live in a Fenwick tree, so updates, top-N,
+rank and percentile queries are O(log n) in the number of buckets plus the
+size of one bucket.
+
+Boards are snapshotted to disk periodically and reloaded on start. With
+``leaderboard_backend=redis`` awards are also written to Redis sorted sets
+and queries are answered from Redis, so every worker sees the same ranking.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from bisect import bisect_right, insort
+from collections import deque
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.config.settings import settings
+from app.core import prefork
+from app.core.circuit_breaker import CircuitBreaker
+from app.models.chat import Persona
+from app.services.points_ledger import PointsAward, points_ledger
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_BOARD = "global"
+
+# Sorts after any owner key, so (score, _MAX_OWNER) bounds all entries with that score
+_MAX_OWNER = "\U0010ffff"
+
+
+class LeaderboardEntry(NamedTuple):
+    """An owner's position on a board."""
+    owner: str
+    points: int
+    rank: int
+    percentile: float
+    size: int
+
+
+class FenwickTree:
+    """
+    Binary indexed tree of integer counts with prefix sums and k-th lookups.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._tree = [0] * (size + 1)
+
+    def add(self, index: int, delta: int):
+        """Add ``delta`` to the count at ``index`` (0-based)."""
+        i = index + 1
+        while i <= self.size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index: int) -> int:
+        """Return the sum of counts at positions ``0..index`` inclusive."""
+        total = 0
+        i = min(index + 1, self.size)
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k: int) -> int:
+        """Return the smallest index whose prefix sum is at least ``k`` (k >= 1)."""
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and self._tree[nxt] < k:
+                pos = nxt
+                k -= self._tree[nxt]
+            step >>= 1
+        return pos
+
+
+class ScoreIndex:
+    """
+    Order-statistics index of owner scores.
+
+    Ties share a rank (competition ranking: 100, 90, 90, 80 rank 1, 2, 2, 4).
+    Negative scores are indexed in the lowest bucket.
+    """
+
+    def __init__(self, bucket_width: int = 10, initial_buckets: int = 1024):
+        self.bucket_width = max(1, bucket_width)
+        self._counts = FenwickTree(initial_buckets)
+        self._buckets: Dict[int, List[Tuple[int, str]]] = {}
+        self._scores: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def _bucket(self, score: int) -> int:
+        return max(0, score) // self.bucket_width
+
+    def _grow(self, bucket: int):
+        size = self._counts.size
+        while size <= bucket:
+            size *= 2
+        counts = FenwickTree(size)
+        for index, entries in self._buckets.items():
+            counts.add(index, len(entries))
+        self._counts = counts
+
+    def get(self, owner: str) -> Optional[int]:
+        """Return an owner's score, or None if the owner is not on the board."""
+        return self._scores.get(owner)
+
+    def set(self, owner: str, score: int):
+        """Set an owner's score."""
+        old = self._scores.get(owner)
+        if old == score:
+            return
+        if old is not None:
+            self._unindex(owner, old)
+
+        bucket = self._bucket(score)
+        if bucket >= self._counts.size:
+            self._grow(bucket)
+        insort(self._buckets.setdefault(bucket, []), (score, owner))
+        self._counts.add(bucket, 1)
+        self._scores[owner] = score
+
+    def _unindex(self, owner: str, score: int):
+        bucket = self._bucket(score)
+        entries = self._buckets[bucket]
+        entries.pop(bisect_right(entries, (score, owner)) - 1)
+        if not entries:
+            del self._buckets[bucket]
+        self._counts.add(bucket, -1)
+
+    def remove(self, owner: str) -> Optional[int]:
+        """Take an owner off the board and return its score, if it was on it."""
+        score = self._scores.pop(owner, None)
+        if score is not None:
+            self._unindex(owner, score)
+        return score
+
+    def increment(self, owner: str, delta: int) -> int:
+        """Add ``delta`` to an owner's score and return the new score."""
+        score = self._scores.get(owner, 0) + delta
+        self.set(owner, score)
+        return score
+
+    def count_above(self, score: int) -> int:
+        """Return how many owners have a strictly higher score."""
+        bucket = self._bucket(score)
+        higher = len(self._scores) - self._counts.prefix_sum(bucket)
+        entries = self._buckets.get(bucket, ())
+        return higher + len(entries) - bisect_right(entries, (score, _MAX_OWNER))
+
+    def rank(self, owner: str) -> Optional[LeaderboardEntry]:
+        """Return an owner's rank and percentile, or None if not on the board."""
+        score = self._scores.get(owner)
+        if score is None:
+            return None
+        size = len(self._scores)
+        above = self.count_above(score)
+        return LeaderboardEntry(
+            owner=owner,
+            points=score,
+            rank=above + 1,
+            percentile=round(100.0 * (size - above) / size, 2),
+            size=size,
+        )
+
+    def _descending(self) -> Iterator[Tuple[int, str]]:
+        size = len(self._scores)
+        seen = 0
+        while seen < size:
+            # The bucket holding the (seen + 1)-th highest score
+            bucket = self._counts.find(size - seen)
+            entries = self._buckets[bucket]
+            yield from reversed(entries)
+            seen += len(entries)
+
+    def top(self, limit: int) -> List[LeaderboardEntry]:
+        """Return the ``limit`` highest-scoring owners, best first."""
+        size = len(self._scores)
+        result: List[LeaderboardEntry] = []
+        previous = None
+        rank = 0
+        for position, (score, owner) in enumerate(self._descending(), start=1):
+            if len(result) >= limit:
+                break
+            if score != previous:
+                rank, previous = position, score
+            result.append(LeaderboardEntry(
+                owner=owner,
+                points=score,
+                rank=rank,
+                percentile=round(100.0 * (size - rank + 1) / size, 2),
+                size=size,
+            ))
+        return result
+
+    def items(self) -> Dict[str, int]:
+        """Return a copy of all owner scores."""
+        return dict(self._scores)
+
+
+# Moves ARGV[1]'s score to ARGV[2] on every board in KEYS, atomically, so
+# awards made while a session is merged are not lost
+MOVE_SCORE_LUA = """
+for _, key in ipairs(KEYS) do
+  local score = redis.call('ZSCORE', key, ARGV[1])
+  if score then
+    redis.call('ZINCRBY', key, score, ARGV[2])
+    redis.call('ZREM', key, ARGV[1])
+  end
+end
+return #KEYS
+"""
+
+
+class RedisLeaderboardStore:
+    """
+    Shares boards between workers as Redis sorted sets (``<prefix>:<board>``).
+    """
+
+    def __init__(self, client, prefix: str = "nandi:leaderboard"):
+        self._client = client
+        self._prefix = prefix
+        self._move = client.register_script(MOVE_SCORE_LUA)
+
+    def _key(self, board: str) -> str:
+        return f"{self._prefix}:{board}"
+
+    def increment(self, increments: List[Tuple[str, str, int]]):
+        """Apply ``(board, owner, delta)`` increments in one round trip."""
+        pipe = self._client.pipeline(transaction=False)
+        for board, owner, delta in increments:
+            pipe.zincrby(self._key(board), delta, owner)
+        pipe.execute()
+
+    def move(self, boards: List[str], source: str, target: str):
+        """Add ``source``'s score to ``target`` on each board and remove ``source``."""
+        self._move(keys=[self._key(board) for board in boards], args=[source, target])
+
+    def top(self, board: str, limit: int) -> List[LeaderboardEntry]:
+        """Return the ``limit`` highest-scoring owners of a board."""
+        key = self._key(board)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zcard(key)
+        pipe.zrevrange(key, 0, limit - 1, withscores=True)
+        size, rows = pipe.execute()
+        result: List[LeaderboardEntry] = []
+        previous = None
+        rank = 0
+        for position, (owner, score) in enumerate(rows, start=1):
+            score = int(score)
+            if score != previous:
+                rank, previous = position, score
+            result.append(LeaderboardEntry(
+                owner=owner.decode() if isinstance(owner, bytes) else owner,
+                points=score,
+                rank=rank,
+                percentile=round(100.0 * (size - rank + 1) / size, 2),
+                size=size,
+            ))
+        return result
+
+    def rank(self, board: str, owner: str) -> Optional[LeaderboardEntry]:
+        """Return an owner's rank on a board, or None if not on it."""
+        key = self._key(board)
+        score = self._client.zscore(key, owner)
+        if score is None:
+            return None
+        score = int(score)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zcard(key)
+        pipe.zcount(key, f"({score}", "+inf")
+        size, above = pipe.execute()
+        return LeaderboardEntry(
+            owner=owner,
+            points=score,
+            rank=above + 1,
+            percentile=round(100.0 * (size - above) / size, 2),
+            size=size,
+        )
+
+
+def create_redis_store() -> RedisLeaderboardStore:
+    """Create the Redis leaderboard store from the ``redis_*`` settings."""
+    import redis
+
+    client = redis.Redis(
+        host=settings.redis_host,
+        port=int(settings.redis_port),
+        password=settings.redis_password or None,
+        db=int(settings.redis_db),
+        socket_timeout=1.0,
+    )
+    return RedisLeaderboardStore(client)
+
+
+class Leaderboard:
+    """
+    Global and per-persona leaderboards fed by points ledger awards.
+
+    Local boards are always maintained. When a shared store is configured,
+    awards are mirrored to it by a background thread, so the award path
+    never waits on Redis, and queries are served from it, falling back to
+    the local boards while ``breaker`` reports it unreachable. Updates that
+    could not be mirrored are retried in order, keeping at most
+    ``max_pending``.
+    """
+
+    def __init__(
+        self,
+        bucket_width: int = 10,
+        snapshot_path: Optional[str] = None,
+        snapshot_interval: float = 0.0,
+        shared_store: Optional[RedisLeaderboardStore] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        max_pending: int = 10000,
+    ):
+        self.bucket_width = bucket_width
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.shared_store = shared_store
+        self.max_pending = max_pending
+        self._breaker = breaker or CircuitBreaker("Shared leaderboard")
+        self._lock = threading.Lock()
+        self._boards: Dict[str, ScoreIndex] = {}
+        self._dirty = False
+        self._stopped = threading.Event()
+        self._snapshotter: Optional[threading.Thread] = None
+        # ("increment", [(board, owner, delta)]) or ("move", (boards, source, target))
+        self._shared_pending: deque = deque()
+        self._shared_wake = threading.Event()
+        self._mirror: Optional[threading.Thread] = None
+
+    def _board(self, name: str) -> ScoreIndex:
+        board = self._boards.get(name)
+        if board is None:
+            board = self._boards[name] = ScoreIndex(self.bucket_width)
+        return board
+
+    def on_award(self, award: PointsAward, total: int):
+        """Points ledger listener: update the global and persona boards."""
+        with self._lock:
+            self._board(GLOBAL_BOARD).set(award.owner, total)
+            if award.persona:
+                self._board(award.persona).increment(award.owner, award.points)
+            self._dirty = True
+
+        if self.shared_store is not None:
+            increments = [(GLOBAL_BOARD, award.owner, award.points)]
+            if award.persona:
+                increments.append((award.persona, award.owner, award.points))
+            self._mirror_update(("increment", increments))
+
+    def merge_owner(self, source: str, target: str, target_total: int):
+        """
+        Move an owner's entries to another owner, e.g. an anonymous session to its user.
+
+        Args:
+            source: Owner key taken off every board
+            target: Owner key that receives the source's persona points
+            target_total: The target's total after the merge, for the global board
+        """
+        with self._lock:
+            for name, board in self._boards.items():
+                score = board.remove(source)
+                if name == GLOBAL_BOARD:
+                    board.set(target, target_total)
+                elif score is not None:
+                    board.increment(target, score)
+            self._dirty = True
+
+        if self.shared_store is not None:
+            boards = [GLOBAL_BOARD, *(persona.value for persona in Persona)]
+            self._mirror_update(("move", (boards, source, target)))
+
+    def _mirror_update(self, update: Tuple[str, object]):
+        with self._lock:
+            if len(self._shared_pending) >= self.max_pending:
+                self._shared_pending.popleft()
+                logger.error("Shared leaderboard update queue is full, dropping the oldest update")
+            self._shared_pending.append(update)
+        self._shared_wake.set()
+
+    def flush_shared(self) -> int:
+        """
+        Send queued updates to the shared store, consecutive increments in one round trip.
+
+        Returns:
+            int: Number of updates sent. On failure they stay queued.
+        """
+        sent = 0
+        while self._breaker.allow():
+            with self._lock:
+                if not self._shared_pending:
+                    return sent
+                kind, payload = self._shared_pending[0]
+                batch = [self._shared_pending.popleft()]
+                while kind == "increment" and self._shared_pending and self._shared_pending[0][0] == "increment":
+                    batch.append(self._shared_pending.popleft())
+            try:
+                if kind == "move":
+                    self.shared_store.move(*payload)
+                else:
+                    self.shared_store.increment([item for _, increments in batch for item in increments])
+            except Exception as e:
+                self._breaker.record_failure(e)
+                with self._lock:
+                    self._shared_pending.extendleft(reversed(batch))
+                return sent
+            self._breaker.record_success()
+            sent += len(batch)
+        return sent
+
+    def _run_mirror(self):
+        while not self._stopped.is_set():
+            # Wake up at least once per cooldown to retry after a failure
+            self._shared_wake.wait(self._breaker.cooldown)
+            self._shared_wake.clear()
+            self.flush_shared()
+
+    def top(self, limit: int = 10, persona: Optional[str] = None) -> List[LeaderboardEntry]:
+        """
+        Return the highest-ranked owners.
+
+        Args:
+            limit: Maximum number of entries
+            persona: Persona board to read, or None for the global board
+
+        Returns:
+            List[LeaderboardEntry]: Entries ordered best first
+        """
+        name = persona or GLOBAL_BOARD
+        if self._use_shared():
+            try:
+                entries = self.shared_store.top(name, limit)
+            except Exception as e:
+                self._breaker.record_failure(e)
+            else:
+                self._breaker.record_success()
+                return entries
+        with self._lock:
+            board = self._boards.get(name)
+            return board.top(limit) if board is not None else []
+
+    def rank(self, owner: str, persona: Optional[str] = None) -> Optional[LeaderboardEntry]:
+        """
+        Return an owner's rank and percentile.
+
+        Args:
+            owner: Ledger owner key (``user:<id>`` or ``anon:<session id>``)
+            persona: Persona board to read, or None for the global board
+
+        Returns:
+            Optional[LeaderboardEntry]: The entry, or None if the owner has no points there
+        """
+        name = persona or GLOBAL_BOARD
+        if self._use_shared():
+            try:
+                entry = self.shared_store.rank(name, owner)
+            except Exception as e:
+                self._breaker.record_failure(e)
+            else:
+                self._breaker.record_success()
+                return entry
+        with self._lock:
+            board = self._boards.get(name)
+            return board.rank(owner) if board is not None else None
+
+    def _use_shared(self) -> bool:
+        return self.shared_store is not None and self._breaker.allow()
+
+    async def top_async(self, limit: int = 10, persona: Optional[str] = None) -> List[LeaderboardEntry]:
+        """``top`` for the event loop: a shared store is read from a worker thread."""
+        if self.shared_store is None:
+            return self.top(limit, persona)
+        return await asyncio.to_thread(self.top, limit, persona)
+
+    async def rank_async(self, owner: str, persona: Optional[str] = None) -> Optional[LeaderboardEntry]:
+        """``rank`` for the event loop: a shared store is read from a worker thread."""
+        if self.shared_store is None:
+            return self.rank(owner, persona)
+        return await asyncio.to_thread(self.rank, owner, persona)
+
+    @property
+    def snapshot_file(self) -> Optional[str]:
+        """
+        This process's snapshot file.
+
+        Each pre-fork worker keeps its own boards, so it snapshots them to
+        its own file (``leaderboard_snapshot.<slot>.json``), which its
+        replacement loads.
+        """
+        if self.snapshot_path and prefork.worker_slot is not None:
+            return prefork.worker_path(self.snapshot_path, prefork.worker_slot)
+        return self.snapshot_path
+
+    def save_snapshot(self) -> bool:
+        """
+        Write all boards to ``snapshot_file`` if they changed since the last snapshot.
+
+        The file is replaced atomically, so a crash never leaves a partial snapshot.
+
+        Returns:
+            bool: True if a snapshot was written
+        """
+        path = self.snapshot_file
+        if not path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            data = {"boards": {name: board.items() for name, board in self._boards.items()}}
+            self._dirty = False
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error("Error writing leaderboard snapshot: %s", e)
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            with self._lock:
+                self._dirty = True
+            return False
+        return True
+
+    def load_snapshot(self) -> int:
+        """
+        Load boards from ``snapshot_file``.
+
+        Returns:
+            int: Number of boards loaded
+        """
+        path = self.snapshot_file
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error("Error reading leaderboard snapshot: %s", e)
+            return 0
+        with self._lock:
+            for name, scores in data.get("boards", {}).items():
+                board = self._board(name)
+                for owner, score in scores.items():
+                    board.set(owner, int(score))
+        return len(data.get("boards", {}))
+
+    def start(self):
+        """
+        Load the last snapshot, reconcile the global board with the ledger
+        totals and start the periodic snapshot and shared store threads.
+        """
+        loaded = self.load_snapshot()
+        totals = points_ledger.totals()
+        with self._lock:
+            board = self._board(GLOBAL_BOARD)
+            for owner, total in totals.items():
+                board.set(owner, total)
+        logger.info("Leaderboard loaded %s boards from snapshot, %d owners from the ledger", loaded, len(totals))
+
+        self._stopped.clear()
+        if self.shared_store is not None and self._mirror is None:
+            self._mirror = threading.Thread(target=self._run_mirror, name="leaderboard-mirror", daemon=True)
+            self._mirror.start()
+        if self.snapshot_path and self.snapshot_interval > 0 and self._snapshotter is None:
+            self._snapshotter = threading.Thread(target=self._run_snapshotter, name="leaderboard-snapshot", daemon=True)
+            self._snapshotter.start()
+
+    def _run_snapshotter(self):
+        while not self._stopped.wait(self.snapshot_interval):
+            self.save_snapshot()
+
+    def stop(self):
+        """Stop the background threads, write a final snapshot and send queued shared updates."""
+        self._stopped.set()
+        self._shared_wake.set()
+        for thread in (self._snapshotter, self._mirror):
+            if thread is not None:
+                thread.join(timeout=5)
+        self._snapshotter = self._mirror = None
+        self.save_snapshot()
+        if self.shared_store is not None:
+            self.flush_shared()
+
+
+def _create_leaderboard() -> Leaderboard:
+    shared_store = None
+    if settings.leaderboard_backend == "redis":
+        try:
+            shared_store = create_redis_store()
+        except Exception as e:
+            logger.error("Error connecting leaderboard to Redis, using local boards: %s", e)
+    return Leaderboard(
+        bucket_width=settings.leaderboard_bucket_width,
+        snapshot_path=settings.leaderboard_snapshot_path or None,
+        snapshot_interval=settings.leaderboard_snapshot_interval,
+        shared_store=shared_store,
+        breaker=CircuitBreaker("Shared leaderboard", settings.redis_failure_cooldown),
+    )
+
+
+# Create a singleton instance fed by every points award
+leaderboard = _create_leaderboard()
+points_ledger.add_listener(leaderboard.on_award)
@@ -0,0 +1,605 @@
+"""
+Write-behind persistence of chat messages.
+
+Every chat turn adds two rows to ``chat_messages``: the user's question with
+its quality score, and the AI answer. Rows are queued in memory and written
+by a background thread in batched multi-row inserts (COPY into the
+platform's PostgreSQL schema, ``executemany`` into a local SQLite stand-in)
+once ``message_store_batch_size`` rows are queued or every
+``message_store_flush_interval`` seconds, so nandi-api no longer has to
+round-trip each message and the request path never waits on the database.
+
+At most ``message_store_max_pending`` rows are held in memory. When the
+database cannot be reached, the failed batch, the rows queued behind it and
+rows that overflow the queue are appended to a spill file (JSON lines)
+instead, and replayed in order before new rows once writes succeed again.
+Replays are at-least-once: a crash between inserting a replayed batch and
+trimming the spill file stores that batch again. Workers on one host share
+the spill file; appends and replays are serialized with file locks.
+
+When the database rejects a batch because of its contents (a constraint or
+data error), the batch is bisected until the offending rows are isolated;
+those go to a dead-letter file and the rest are written.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.config.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking of the spill file
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# chat_messages.type values of the schema's message_type enum
+USER_MESSAGE = "USER"
+AI_MESSAGE = "AI"
+
+# Longest anonymous_sessions.session_id the schema accepts
+MAX_SESSION_ID_LENGTH = 100
+
+# Errors that mean the rows were rejected rather than the store being unavailable
+ROW_ERRORS = (ValueError, TypeError)
+
+# Columns written, in COPY and INSERT order
+COLUMNS = (
+    "type", "content", "persona", "user_id", "anonymous_session_id",
+    "chat_session_id", "created_at", "quality_score",
+)
+
+
+class ChatMessageRecord(NamedTuple):
+    """One row of ``chat_messages``."""
+    type: str
+    content: str
+    persona: str
+    user_id: Optional[str]
+    anonymous_session_id: Optional[str]
+    chat_session_id: Optional[int]
+    created_at: datetime
+    quality_score: Optional[int]
+
+    def to_json(self) -> str:
+        """Encode the record as one spill file line."""
+        data = self._asdict()
+        data["created_at"] = self.created_at.isoformat()
+        return json.dumps(data, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, line: str) -> "ChatMessageRecord":
+        """
+        Decode a spill file line.
+
+        Raises:
+            ValueError: If the line is not a valid record
+        """
+        data = json.loads(line)
+        try:
+            data["created_at"] = datetime.fromisoformat(data["created_at"])
+            return cls(**data)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid chat message record: {str(e)}") from e
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """
+    Hold an exclusive lock on ``path``, shared by every process on the host.
+
+    Yields:
+        bool: False if ``blocking`` is off and another process holds the lock
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def turn_records(request, response) -> List[ChatMessageRecord]:
+    """
+    Build the rows for one chat turn.
+
+    Messages belong to the request's ``user_id`` or, without one, to its
+    anonymous ``session_id``; turns with neither, or with a session id the
+    schema cannot hold, are not stored. NUL characters, which PostgreSQL
+    text cannot contain, are removed.
+
+    Args:
+        request: The ChatRequest
+        response: The ChatResponse returned for it
+
+    Returns:
+        List[ChatMessageRecord]: The user's message and the answer, or an empty list
+    """
+    user_id = getattr(request, "user_id", None)
+    session_id = None if user_id else request.session_id
+    if not user_id and not session_id:
+        return []
+    if session_id and len(session_id) > MAX_SESSION_ID_LENGTH:
+        logger.warning("Not storing chat messages of a session id longer than %s characters", MAX_SESSION_ID_LENGTH)
+        return []
+    persona = request.persona.value.upper()
+    chat_session_id = getattr(request, "chat_session_id", None)
+    now = datetime.utcnow()
+    return [
+        ChatMessageRecord(USER_MESSAGE, request.message.replace("\x00", ""), persona, user_id, session_id,
+                          chat_session_id, now, response.qualityScore),
+        ChatMessageRecord(AI_MESSAGE, response.message.replace("\x00", ""), persona, user_id, session_id,
+                          chat_session_id, now, None),
+    ]
+
+
+class MemoryMessageStore:
+    """Non-durable store for tests and development."""
+
+    row_errors = ROW_ERRORS
+
+    def __init__(self):
+        self.records: List[ChatMessageRecord] = []
+
+    def insert_many(self, records: List[ChatMessageRecord]):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+class SQLiteMessageStore:
+    """Local ``chat_messages`` table in a SQLite database file."""
+
+    row_errors = ROW_ERRORS + (sqlite3.IntegrityError, sqlite3.DataError)
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                persona TEXT NOT NULL,
+                user_id TEXT,
+                anonymous_session_id TEXT,
+                chat_session_id INTEGER,
+                created_at TEXT NOT NULL,
+                quality_score INTEGER
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_user_id ON chat_messages(user_id)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_messages_anonymous_session_id ON chat_messages(anonymous_session_id)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def insert_many(self, records: List[ChatMessageRecord]):
+        rows = [
+            (r.type, r.content, r.persona, r.user_id, r.anonymous_session_id,
+             r.chat_session_id, r.created_at.isoformat(), r.quality_score)
+            for r in records
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO chat_messages ({', '.join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _copy_field(value) -> str:
+    """Format a value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_text(rows: Iterable[tuple]) -> str:
+    """Render rows as COPY ... FROM STDIN text: tab separated, ``\\N`` for NULL."""
+    return "".join("\t".join(_copy_field(value) for value in row) + "\n" for row in rows)
+
+
+class PostgresMessageStore:
+    """
+    Production store on the platform's PostgreSQL schema.
+
+    Rows are streamed into ``chat_messages`` with one COPY per batch. The
+    anonymous sessions they reference are created (or touched) first, in the
+    same transaction, to satisfy the foreign key.
+    """
+
+    def __init__(self, dsn: str):
+        try:
+            import psycopg2
+            import psycopg2.extras
+        except ImportError as e:
+            raise RuntimeError("psycopg2 is required for the PostgreSQL message store") from e
+        self._extras = psycopg2.extras
+        self._conn = psycopg2.connect(dsn)
+        self._lock = threading.Lock()
+        # Constraint violations, over-long values, bad encodings
+        self.row_errors = ROW_ERRORS + (psycopg2.IntegrityError, psycopg2.DataError)
+
+    def insert_many(self, records: List[ChatMessageRecord]):
+        rows = []
+        sessions = set()
+        for r in records:
+            user_id = r.user_id
+            if user_id is not None:
+                try:
+                    user_id = int(user_id)
+                except ValueError:
+                    # users.id is an integer; such rows could never be inserted
+                    logger.warning("Skipping chat message of non-numeric user id %r", r.user_id)
+                    continue
+            elif r.anonymous_session_id:
+                sessions.add(r.anonymous_session_id)
+            rows.append((r.type, r.content, r.persona, user_id, r.anonymous_session_id,
+                         r.chat_session_id, r.created_at, r.quality_score))
+
+        with self._lock, self._conn, self._conn.cursor() as cur:
+            if sessions:
+                self._extras.execute_values(
+                    cur,
+                    "INSERT INTO anonymous_sessions (session_id) VALUES %s "
+                    "ON CONFLICT (session_id) DO UPDATE SET last_active_at = CURRENT_TIMESTAMP",
+                    [(session,) for session in sorted(sessions)],
+                )
+            if rows:
+                cur.copy_expert(
+                    f"COPY chat_messages ({', '.join(COLUMNS)}) FROM STDIN",
+                    io.StringIO(copy_text(rows)),
+                )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(backend: str):
+    """Create the message store configured by ``message_store_backend``."""
+    if backend == "postgres":
+        return PostgresMessageStore(settings.message_store_dsn or settings.points_ledger_dsn)
+    if backend == "sqlite":
+        return SQLiteMessageStore(settings.message_store_path)
+    return MemoryMessageStore()
+
+
+class MessageStore:
+    """
+    Queues chat messages and writes them behind the request in batches.
+
+    The store is opened by ``start`` (or on first use). A background thread writes queued
+    rows in batches of up to ``batch_size`` every ``flush_interval`` seconds,
+    or as soon as a full batch is queued. Rows that cannot be written go to
+    ``spill_path`` (if set) and are retried before newer rows; rows the
+    store rejects go to ``dead_letter_path`` (if set) and are not retried.
+    """
+
+    def __init__(
+        self,
+        store_factory: Callable[[], object],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        spill_path: Optional[str] = None,
+        spill_max_bytes: int = 0,
+        dead_letter_path: Optional[str] = None,
+        enabled: bool = True,
+    ):
+        self._store_factory = store_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path or None
+        self.spill_max_bytes = spill_max_bytes
+        self.dead_letter_path = dead_letter_path or None
+        self.enabled = enabled
+        self._store = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._pending: deque = deque()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._counters = {"written": 0, "spilled": 0, "replayed": 0, "dropped": 0, "failures": 0, "rejected": 0}
+
+    def _ensure_started(self):
+        if self._store is not None:
+            return
+        with self._lock:
+            if self._store is not None:
+                return
+            self._store = self._store_factory()
+            self._stopped.clear()
+            self._flusher = threading.Thread(target=self._run_flusher, name="chat-message-flusher", daemon=True)
+            self._flusher.start()
+            logger.info("Chat messages are written to %s", type(self._store).__name__)
+
+    async def start(self):
+        """Open the store without blocking the event loop."""
+        if self.enabled:
+            await asyncio.to_thread(self._ensure_started)
+
+    @property
+    def store(self):
+        """The message store, opened on first use."""
+        self._ensure_started()
+        return self._store
+
+    def record_turn(self, request, response):
+        """Queue the user's message and the answer of a chat turn."""
+        if self.enabled:
+            self.enqueue(turn_records(request, response))
+
+    def enqueue(self, records: List[ChatMessageRecord]):
+        """
+        Queue rows for the background writer.
+
+        Rows that do not fit in ``max_pending`` are appended to the spill file
+        without waiting for it to reach the disk.
+        """
+        if not records:
+            return
+        self._ensure_started()
+        with self._lock:
+            room = self.max_pending - len(self._pending)
+            self._pending.extend(records[:max(0, room)])
+            overflow = records[max(0, room):]
+            if len(self._pending) >= self.batch_size or overflow:
+                self._wake.set()
+        if overflow:
+            self._spill(overflow, sync=False)
+
+    def flush(self) -> int:
+        """
+        Write spilled rows, then all queued rows, to the store.
+
+        If the store fails, the failed batch and everything still queued is
+        moved to the spill file (or, without one, left queued).
+
+        Returns:
+            int: Number of rows written
+        """
+        if self._store is None:
+            return 0
+        with self._flush_lock:
+            written = self._replay_spill()
+            if written is None:
+                self._spill_pending()
+                return 0
+            while True:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return written
+                count, left = self._write(batch)
+                written += count
+                if left:
+                    with self._lock:
+                        self._pending.extendleft(reversed(left))
+                    self._spill_pending()
+                    return written
+
+    def _write(self, batch: List[ChatMessageRecord]) -> Tuple[int, List[ChatMessageRecord]]:
+        """
+        Insert rows, isolating the ones the store rejects.
+
+        A batch rejected for its contents is split in half until the
+        offending rows are found; those go to the dead-letter file and the
+        others are written. If the store is unavailable, the rows not yet
+        written are handed back in order.
+
+        Returns:
+            Tuple[int, List[ChatMessageRecord]]: Rows written and rows left over
+        """
+        try:
+            self._store.insert_many(batch)
+        except Exception as e:
+            if not isinstance(e, getattr(self._store, "row_errors", ROW_ERRORS)):
+                self._counters["failures"] += 1
+                logger.error("Error writing %s chat messages: %s", len(batch), e)
+                return 0, batch
+            if len(batch) == 1:
+                self._reject(batch[0], e)
+                return 0, []
+            middle = len(batch) // 2
+            written, left = self._write(batch[:middle])
+            if left:
+                return written, left + batch[middle:]
+            more, left = self._write(batch[middle:])
+            return written + more, left
+        self._counters["written"] += len(batch)
+        return len(batch), []
+
+    def _reject(self, record: ChatMessageRecord, error: Exception):
+        """Park a row the store rejected in the dead-letter file."""
+        self._counters["rejected"] += 1
+        logger.error("Chat message rejected by the store: %s", error)
+        if self.dead_letter_path is None:
+            return
+        line = json.dumps({"error": str(error), "record": json.loads(record.to_json())}, ensure_ascii=False)
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error("Error writing rejected chat message to %s: %s", self.dead_letter_path, e)
+
+    def _spill_pending(self):
+        """Move every queued row to the spill file."""
+        if self.spill_path is None:
+            return
+        with self._lock:
+            records = list(self._pending)
+            self._pending.clear()
+        self._spill(records)
+
+    def _spill(self, records: List[ChatMessageRecord], sync: bool = True):
+        """Append rows to the spill file; rows are dropped if there is none or it is full."""
+        if not records:
+            return
+        if self.spill_path is None:
+            self._counters["dropped"] += len(records)
+            logger.error("Dropped %d chat messages: queue full and no spill file configured", len(records))
+            return
+        data = "".join(record.to_json() + "\n" for record in records).encode("utf-8")
+        with self._spill_lock, _file_lock(f"{self.spill_path}.lock"):
+            if self.spill_max_bytes and self.spill_size() + len(data) > self.spill_max_bytes:
+                self._counters["dropped"] += len(records)
+                logger.error("Dropped %d chat messages: spill file %s is full", len(records), self.spill_path)
+                return
+            with open(self.spill_path, "ab") as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        self._counters["spilled"] += len(records)
+
+    def spill_size(self) -> int:
+        """Bytes of rows waiting in the spill files."""
+        size = 0
+        for path in (self.spill_path, f"{self.spill_path}.replay"):
+            if path is not None and os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _replay_spill(self) -> Optional[int]:
+        """
+        Write the rows of the spill file to the store, oldest first.
+
+        The spill file is renamed before it is read, so rows spilled meanwhile
+        start a new file. After a failure the rows not yet written are kept
+        for the next attempt. Only one worker replays at a time; the others
+        skip the replay until it is done.
+
+        Returns:
+            Optional[int]: Rows written, or None if the store failed
+        """
+        if self.spill_path is None:
+            return 0
+        replay_path = f"{self.spill_path}.replay"
+        if not os.path.exists(self.spill_path) and not os.path.exists(replay_path):
+            return 0
+        with _file_lock(f"{replay_path}.lock", blocking=False) as locked:
+            return self._replay_locked(replay_path) if locked else 0
+
+    def _replay_locked(self, replay_path: str) -> Optional[int]:
+        with self._spill_lock, _file_lock(f"{self.spill_path}.lock"):
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return 0
+                os.replace(self.spill_path, replay_path)
+
+        with open(replay_path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        records = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                records.append(ChatMessageRecord.from_json(line))
+            except ValueError as e:
+                logger.warning("Skipping unreadable spilled chat message: %s", e)
+
+        written = 0
+        for start in range(0, len(records), self.batch_size):
+            count, left = self._write(records[start:start + self.batch_size])
+            written += count
+            if left:
+                kept = left + records[start + self.batch_size:]
+                logger.error("Keeping %s spilled chat messages for the next replay", len(kept))
+                with open(replay_path, "w", encoding="utf-8") as f:
+                    f.write("".join(record.to_json() + "\n" for record in kept))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._counters["replayed"] += written
+                return None
+        os.remove(replay_path)
+        if written:
+            self._counters["replayed"] += written
+            logger.info("Replayed %s spilled chat messages", written)
+        return written
+
+    def _run_flusher(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing chat messages: %s", e)
+
+    @property
+    def pending(self) -> int:
+        """Number of rows waiting in memory."""
+        return len(self._pending)
+
+    def stats(self) -> Dict:
+        """Queue and spill state, for the admin API."""
+        return {
+            "enabled": self.enabled,
+            "store": type(self._store).__name__ if self._store is not None else None,
+            "pending": self.pending,
+            "spill_bytes": self.spill_size() if self.spill_path else 0,
+            **self._counters,
+        }
+
+    def close(self):
+        """Flush queued rows (spilling what cannot be written) and close the store."""
+        if self._store is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 5)
+        self.flush()
+        self._store.close()
+        self._store = None
+
+
+# Create a singleton instance
+message_store = MessageStore(
+    lambda: create_store(settings.message_store_backend),
+    batch_size=settings.message_store_batch_size,
+    flush_interval=settings.message_store_flush_interval,
+    max_pending=settings.message_store_max_pending,
+    spill_path=settings.message_store_spill_path,
+    spill_max_bytes=settings.message_store_spill_max_mb * 1024 * 1024,
+    dead_letter_path=settings.message_store_dead_letter_path,
+    enabled=settings.message_store_backend != "none",
+)
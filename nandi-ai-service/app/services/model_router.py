@@ -0,0 +1,159 @@
+"""
+Complexity-based routing of chat requests to model tiers.
+
+Requests are classified locally (message length, context depth, detected
+intent and predicted question quality) and sent to the smallest tier that
+fits. If a tier's call fails, the next larger tier is tried.
+"""
+
+import logging
+import re
+from typing import List, NamedTuple
+
+from app.config.settings import settings
+from app.models.chat import ChatRequest
+from app.services.quality_service import quality_service
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TOKENS = 1024
+
+# Highest complexity score produced by ModelRouter.complexity
+MAX_COMPLEXITY = 8
+
+_WORD_RE = re.compile(r"\w+")
+_SMALL_TALK_RE = re.compile(
+    r"^\s*(hi|hello|hey|namaste|thanks|thank you|good (morning|evening|night)|bye|ok|okay)\b[\s!.?]*$",
+    re.IGNORECASE,
+)
+_DEEP_INTENT_RE = re.compile(
+    r"\b(why|meaning|struggl\w*|conflict\w*|explain|difference|compare|suffer\w*|grief|purpose|relationship)\b",
+    re.IGNORECASE,
+)
+
+
+class ModelTier(NamedTuple):
+    """A model and the completion budget used for one routing tier."""
+    name: str
+    model: str
+    max_tokens: int
+
+
+class RouteDecision(NamedTuple):
+    """The routing outcome for a request."""
+    tier_index: int
+    complexity: int
+    reason: str
+
+
+def parse_model_tiers(spec: str, default_model: str) -> List[ModelTier]:
+    """
+    Parse a tier specification string.
+
+    The format is a comma separated list ordered from smallest to largest
+    tier, each entry ``name=model:max_tokens``, e.g.
+    ``small=gpt-4o-mini:256,medium=gpt-4o:512,large=gpt-4:1024``.
+    ``max_tokens`` is optional and only taken from a numeric last segment,
+    so fine-tuned ids such as ``ft:gpt-4o-mini:org:abc123`` keep their
+    colons. An empty spec yields a single tier using ``default_model``.
+
+    Args:
+        spec: The tier specification
+        default_model: Model used when no tiers are configured
+
+    Returns:
+        List[ModelTier]: Tiers ordered from smallest to largest
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    tiers = []
+    for index, entry in enumerate(part.strip() for part in (spec or "").split(",")):
+        if not entry:
+            continue
+        name, _, rest = entry.rpartition("=")
+        model, _, max_tokens = rest.rpartition(":")
+        if not max_tokens.isdigit():
+            model, max_tokens = rest, ""
+        if not model or model.endswith(":") or max_tokens and int(max_tokens) == 0:
+            raise ValueError(f"Invalid model tier entry: {entry!r}")
+        tiers.append(ModelTier(
+            name=name or f"tier{index}",
+            model=model,
+            max_tokens=int(max_tokens) if max_tokens else DEFAULT_MAX_TOKENS,
+        ))
+    if not tiers:
+        tiers.append(ModelTier(name="default", model=default_model, max_tokens=DEFAULT_MAX_TOKENS))
+    return tiers
+
+
+class ModelRouter:
+    """
+    Routes chat requests to model tiers by estimated complexity.
+    """
+
+    def __init__(self, tiers: List[ModelTier]):
+        if not tiers:
+            raise ValueError("At least one model tier is required")
+        self.tiers = tiers
+
+    def complexity(self, request: ChatRequest) -> int:
+        """
+        Estimate how demanding a request is, from 0 to MAX_COMPLEXITY.
+
+        Combines message length, conversation depth, deep-intent cues and the
+        heuristic quality score; greetings and thanks always score 0.
+        """
+        message = request.message
+        if _SMALL_TALK_RE.match(message):
+            return 0
+
+        words = len(_WORD_RE.findall(message))
+        score = 0 if words < 8 else 1 if words < 25 else 2 if words < 60 else 3
+
+        depth = len(request.context or ())
+        score += 0 if depth == 0 else 1 if depth <= 4 else 2
+
+        predicted = quality_service.score_heuristic(request).score
+        score += 0 if predicted <= 3 else 1 if predicted <= 6 else 2
+
+        if _DEEP_INTENT_RE.search(message):
+            score += 1
+        return min(score, MAX_COMPLEXITY)
+
+    def route(self, request: ChatRequest) -> RouteDecision:
+        """
+        Pick the tier for a request.
+
+        Returns:
+            RouteDecision: The chosen tier index and the complexity it was based on
+        """
+        if len(self.tiers) == 1:
+            return RouteDecision(tier_index=0, complexity=0, reason="single tier")
+        complexity = self.complexity(request)
+        tier_index = min(len(self.tiers) - 1, complexity * len(self.tiers) // (MAX_COMPLEXITY + 1))
+        return RouteDecision(
+            tier_index=tier_index,
+            complexity=complexity,
+            reason=f"complexity {complexity}/{MAX_COMPLEXITY}",
+        )
+
+    def candidates(self, request: ChatRequest) -> List[ModelTier]:
+        """
+        Return the tiers to try for a request, in order.
+
+        The routed tier comes first, followed by every larger tier as a fallback.
+        """
+        decision = self.route(request)
+        return self.tiers[decision.tier_index:]
+
+
+def _configured_tiers() -> List[ModelTier]:
+    try:
+        return parse_model_tiers(settings.routing_tiers, settings.default_model)
+    except ValueError as e:
+        raise ValueError(f"Invalid ROUTING_TIERS setting ({settings.routing_tiers!r}): {e}") from None
+
+
+# Create a singleton instance
+model_router = ModelRouter(_configured_tiers())
@@ -0,0 +1,689 @@
+"""
+Append-only points ledger with materialized totals and streaks.
+
+Every points award is appended to a durable store (SQLite locally, the
+``points_history`` table in PostgreSQL in production). Per-owner totals and
+consecutive-day streaks are kept in memory and updated incrementally, so
+answering ``/api/session/metrics`` never scans history. Store writes are
+batched by a background thread (write-behind) and never run on the
+request's critical path.
+
+Workers that share a store (SQLite on one host, PostgreSQL) each keep
+their own view. It is loaded once when the worker starts; afterwards only
+the rows written since the last refresh are read, every
+``refresh_interval`` seconds, so awards recorded by other workers show up.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Source of the entries that move points between owners; they are not activity
+TRANSFER_SOURCE = "TRANSFER"
+
+# points_history has no transfer source: points merged from an anonymous
+# session are recorded as CHAT with this description, and are not activity
+MERGE_DESCRIPTION_PREFIX = "Merged from anonymous session "
+
+# PostgreSQL ids are assigned before commit, so a row may become visible after
+# rows with higher ids; refreshes re-read this many ids below the last one seen
+REFRESH_ID_OVERLAP = 1000
+
+# Anonymous balances changed this long before the last refresh are read again
+REFRESH_BALANCE_OVERLAP = timedelta(minutes=1)
+
+# Owners per query when reloading streaks
+STREAK_QUERY_CHUNK = 500
+
+
+class PointsAward(NamedTuple):
+    """A single append-only ledger entry."""
+    owner: str
+    points: int
+    source: str
+    persona: Optional[str]
+    description: str
+    created_at: datetime
+
+
+class StreakState(NamedTuple):
+    """Consecutive-day activity streak of an owner."""
+    last_day: Optional[date]
+    days: int
+
+
+class LedgerChanges(NamedTuple):
+    """What other processes changed in a shared store since the last refresh."""
+    # Points added per owner
+    deltas: Dict[str, int]
+    # Current balances of owners kept as a running total (anonymous sessions in PostgreSQL)
+    balances: Dict[str, int]
+    # Current streaks of the owners with new activity
+    streaks: Dict[str, StreakState]
+
+
+def owner_key(user_id: Optional[str] = None, session_id: Optional[str] = None) -> Optional[str]:
+    """
+    Build the ledger owner key for a registered user or an anonymous session.
+
+    Returns:
+        Optional[str]: ``"user:<id>"``, ``"anon:<session id>"`` or None if neither is known
+    """
+    if user_id:
+        return f"user:{user_id}"
+    if session_id:
+        return f"anon:{session_id}"
+    return None
+
+
+def advance_streak(state: StreakState, day: date) -> StreakState:
+    """
+    Return the streak after recording activity on ``day``.
+
+    Activity on the same day keeps the streak, the next day extends it and
+    any gap restarts it at one day. Backdated activity leaves it unchanged.
+    """
+    if state.last_day is None:
+        return StreakState(last_day=day, days=1)
+    if day <= state.last_day:
+        return state
+    if day == state.last_day + timedelta(days=1):
+        return StreakState(last_day=day, days=state.days + 1)
+    return StreakState(last_day=day, days=1)
+
+
+def merge_streaks(first: StreakState, second: StreakState) -> StreakState:
+    """Combine the streaks of two owners merged into one: the more recent streak wins."""
+    if first.last_day is None:
+        return second
+    if second.last_day is None:
+        return first
+    return max(first, second, key=lambda state: (state.last_day, state.days))
+
+
+def streaks_from_days(rows: Iterable[Tuple[str, date]]) -> Dict[str, StreakState]:
+    """
+    Compute streaks from (owner, activity day) rows sorted by owner and day.
+    """
+    streaks: Dict[str, StreakState] = {}
+    for owner, day in rows:
+        streaks[owner] = advance_streak(streaks.get(owner, StreakState(None, 0)), day)
+    return streaks
+
+
+class MemoryLedgerStore:
+    """Non-durable store for tests and development."""
+
+    # Only visible to this process, so there is nothing to refresh from
+    shared = False
+
+    def __init__(self):
+        self.awards: List[PointsAward] = []
+
+    def validate_owner(self, owner: str):
+        pass
+
+    def append_many(self, awards: List[PointsAward]):
+        self.awards.extend(awards)
+
+    def load_state(self) -> Tuple[Dict[str, int], Dict[str, StreakState]]:
+        totals: Dict[str, int] = {}
+        for award in self.awards:
+            totals[award.owner] = totals.get(award.owner, 0) + award.points
+        days = sorted({(a.owner, a.created_at.date()) for a in self.awards if a.source != TRANSFER_SOURCE})
+        return totals, streaks_from_days(days)
+
+    def load_changes(self) -> LedgerChanges:
+        return LedgerChanges({}, {}, {})
+
+    def close(self):
+        pass
+
+
+class SQLiteLedgerStore:
+    """Local append-only ledger in a SQLite database file."""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS points_ledger (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                points INTEGER NOT NULL,
+                source TEXT NOT NULL,
+                persona TEXT,
+                description TEXT,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_points_ledger_owner ON points_ledger(owner)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+        # Highest row id loaded, and ids above it this process wrote itself
+        self._last_id = 0
+        self._own_ids: Set[int] = set()
+
+    def validate_owner(self, owner: str):
+        pass
+
+    def append_many(self, awards: List[PointsAward]):
+        rows = [
+            (a.owner, a.points, a.source, a.persona, a.description, a.created_at.isoformat())
+            for a in awards
+        ]
+        if not rows:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO points_ledger (owner, points, source, persona, description, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                # The transaction holds the write lock, so the ids are consecutive
+                last = self._conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            self._own_ids.update(range(last - len(rows) + 1, last + 1))
+
+    def load_state(self) -> Tuple[Dict[str, int], Dict[str, StreakState]]:
+        with self._lock:
+            # Writers commit in id order, so every row up to the highest id is visible
+            last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM points_ledger").fetchone()[0]
+            totals = dict(self._conn.execute(
+                "SELECT owner, SUM(points) FROM points_ledger WHERE id <= ? GROUP BY owner",
+                (last_id,)
+            ))
+            days = self._conn.execute(
+                "SELECT DISTINCT owner, substr(created_at, 1, 10) AS day FROM points_ledger "
+                "WHERE id <= ? AND source != ? ORDER BY owner, day",
+                (last_id, TRANSFER_SOURCE)
+            ).fetchall()
+            self._last_id = last_id
+            self._own_ids = {row_id for row_id in self._own_ids if row_id > last_id}
+        return totals, streaks_from_days((owner, date.fromisoformat(day)) for owner, day in days)
+
+    def load_changes(self) -> LedgerChanges:
+        """Read the rows other processes wrote since the last call."""
+        deltas: Dict[str, int] = {}
+        active = set()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, owner, points, source FROM points_ledger WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            ).fetchall()
+            for row_id, owner, points, source in rows:
+                self._last_id = row_id
+                if row_id in self._own_ids:
+                    self._own_ids.discard(row_id)
+                    continue
+                deltas[owner] = deltas.get(owner, 0) + points
+                if source != TRANSFER_SOURCE:
+                    active.add(owner)
+            streaks = self._load_streaks(sorted(active))
+        return LedgerChanges(deltas, {}, streaks)
+
+    def _load_streaks(self, owners: List[str]) -> Dict[str, StreakState]:
+        days = []
+        for start in range(0, len(owners), STREAK_QUERY_CHUNK):
+            chunk = owners[start:start + STREAK_QUERY_CHUNK]
+            days.extend(self._conn.execute(
+                "SELECT DISTINCT owner, substr(created_at, 1, 10) AS day FROM points_ledger "
+                f"WHERE source != ? AND owner IN ({','.join('?' * len(chunk))}) ORDER BY owner, day",
+                [TRANSFER_SOURCE, *chunk]
+            ).fetchall())
+        return streaks_from_days((owner, date.fromisoformat(day)) for owner, day in days)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresLedgerStore:
+    """
+    Production ledger on the platform's PostgreSQL schema.
+
+    Registered users' awards are appended to ``points_history`` (whose
+    trigger keeps ``users.total_points`` in sync); anonymous sessions
+    accumulate ``anonymous_sessions.temporary_points``.
+    """
+
+    shared = True
+
+    # Ledger sources map onto the points_source enum of the schema
+    SOURCES = {"CHAT", "QUEST", "MEDITATION", "DAILY_LOGIN", "STREAK"}
+
+    def __init__(self, dsn: str):
+        try:
+            import psycopg2
+            import psycopg2.extras
+        except ImportError as e:
+            raise RuntimeError("psycopg2 is required for the PostgreSQL points ledger") from e
+        self._extras = psycopg2.extras
+        self._conn = psycopg2.connect(dsn)
+        self._lock = threading.Lock()
+        # Highest points_history id loaded, ids near it that are already
+        # counted, and when anonymous balances were last read
+        self._last_id = 0
+        self._seen_ids: Set[int] = set()
+        self._balances_since: Optional[datetime] = None
+
+    def validate_owner(self, owner: str):
+        """
+        Raises:
+            ValueError: If a registered owner's id is not a ``users.id``
+        """
+        kind, _, ident = owner.partition(":")
+        if kind == "user" and not ident.isdigit():
+            raise ValueError(f"User ids must be numeric with the PostgreSQL points ledger, got {ident!r}")
+
+    def append_many(self, awards: List[PointsAward]):
+        users = []
+        anonymous: Dict[str, int] = {}
+        for a in awards:
+            kind, _, ident = a.owner.partition(":")
+            if kind == "user":
+                if not ident.isdigit():
+                    # Retrying would block every later award behind this one
+                    logger.error("Dropping points award for non-numeric user id %r", ident)
+                    continue
+                source = a.source if a.source in self.SOURCES else "CHAT"
+                users.append((int(ident), source, a.points, a.description[:255], a.created_at))
+            else:
+                anonymous[ident] = anonymous.get(ident, 0) + a.points
+
+        with self._lock, self._conn, self._conn.cursor() as cur:
+            if users:
+                row_ids = self._extras.execute_values(
+                    cur,
+                    "INSERT INTO points_history (user_id, source, points, description, created_at) VALUES %s "
+                    "RETURNING id",
+                    users,
+                    fetch=True,
+                )
+                self._seen_ids.update(row_id for row_id, in row_ids)
+            if anonymous:
+                self._extras.execute_values(
+                    cur,
+                    "INSERT INTO anonymous_sessions (session_id, temporary_points) VALUES %s "
+                    "ON CONFLICT (session_id) DO UPDATE SET "
+                    "temporary_points = anonymous_sessions.temporary_points + EXCLUDED.temporary_points, "
+                    "last_active_at = CURRENT_TIMESTAMP",
+                    list(anonymous.items()),
+                )
+
+    def load_state(self) -> Tuple[Dict[str, int], Dict[str, StreakState]]:
+        with self._lock, self._conn, self._conn.cursor() as cur:
+            # One snapshot for the totals and the ids they include
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("SELECT CURRENT_TIMESTAMP, COALESCE(MAX(id), 0) FROM points_history")
+            self._balances_since, self._last_id = cur.fetchone()
+            cur.execute("SELECT id FROM points_history WHERE id > %s", (self._last_id - REFRESH_ID_OVERLAP,))
+            self._seen_ids = {row_id for row_id, in cur.fetchall()}
+            cur.execute("SELECT id, total_points FROM users")
+            totals = {f"user:{user_id}": points or 0 for user_id, points in cur.fetchall()}
+            cur.execute("SELECT session_id, temporary_points FROM anonymous_sessions")
+            totals.update({f"anon:{sid}": points or 0 for sid, points in cur.fetchall()})
+            cur.execute(
+                "SELECT DISTINCT user_id, DATE(created_at) AS day FROM points_history "
+                "WHERE created_at >= CURRENT_DATE - INTERVAL '400 days' "
+                "AND (description IS NULL OR description NOT LIKE %s) ORDER BY user_id, day",
+                (MERGE_DESCRIPTION_PREFIX + "%",)
+            )
+            days = [(f"user:{user_id}", day) for user_id, day in cur.fetchall()]
+        return totals, streaks_from_days(days)
+
+    def load_changes(self) -> LedgerChanges:
+        """
+        Read the points_history rows other processes added since the last
+        call, and the anonymous balances changed meanwhile.
+        """
+        deltas: Dict[str, int] = {}
+        active = set()
+        with self._lock, self._conn, self._conn.cursor() as cur:
+            cur.execute("SELECT CURRENT_TIMESTAMP")
+            now = cur.fetchone()[0]
+            cur.execute(
+                "SELECT id, user_id, points, description FROM points_history WHERE id > %s ORDER BY id",
+                (self._last_id - REFRESH_ID_OVERLAP,)
+            )
+            for row_id, user_id, points, description in cur.fetchall():
+                if row_id in self._seen_ids:
+                    continue
+                self._seen_ids.add(row_id)
+                self._last_id = max(self._last_id, row_id)
+                owner = f"user:{user_id}"
+                deltas[owner] = deltas.get(owner, 0) + points
+                if not (description or "").startswith(MERGE_DESCRIPTION_PREFIX):
+                    active.add(user_id)
+            self._seen_ids = {row_id for row_id in self._seen_ids if row_id > self._last_id - REFRESH_ID_OVERLAP}
+
+            cur.execute(
+                "SELECT session_id, temporary_points FROM anonymous_sessions WHERE last_active_at >= %s",
+                (self._balances_since - REFRESH_BALANCE_OVERLAP,)
+            )
+            balances = {f"anon:{sid}": points or 0 for sid, points in cur.fetchall()}
+            self._balances_since = now
+
+            days = []
+            if active:
+                cur.execute(
+                    "SELECT DISTINCT user_id, DATE(created_at) AS day FROM points_history "
+                    "WHERE user_id = ANY(%s) AND created_at >= CURRENT_DATE - INTERVAL '400 days' "
+                    "AND (description IS NULL OR description NOT LIKE %s) ORDER BY user_id, day",
+                    (sorted(active), MERGE_DESCRIPTION_PREFIX + "%")
+                )
+                days = [(f"user:{user_id}", day) for user_id, day in cur.fetchall()]
+        return LedgerChanges(deltas, balances, streaks_from_days(days))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(backend: str):
+    """Create the ledger store configured by ``points_ledger_backend``."""
+    if backend == "postgres":
+        return PostgresLedgerStore(settings.points_ledger_dsn)
+    if backend == "sqlite":
+        return SQLiteLedgerStore(settings.points_ledger_path)
+    return MemoryLedgerStore()
+
+
+class PointsLedger:
+    """
+    Records points awards and serves per-owner totals and streaks from memory.
+
+    The store is opened and its state loaded by ``start`` (or on first use).
+    Awards update the in-memory view immediately and are written to the store
+    by a background thread in batches of up to ``batch_size`` or every
+    ``flush_interval`` seconds, whichever comes first. With a shared store the
+    same thread applies the rows other workers wrote every ``refresh_interval``
+    seconds (0 disables).
+    """
+
+    def __init__(
+        self,
+        store_factory: Callable[[], object],
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        refresh_interval: float = 0.0,
+    ):
+        self._store_factory = store_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self._store = None
+        self._lock = threading.Lock()
+        # Serializes store writes with refreshes, so a row is never both queued and read back
+        self._store_lock = threading.Lock()
+        self._totals: Dict[str, int] = {}
+        self._streaks: Dict[str, StreakState] = {}
+        self._pending: deque = deque()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[PointsAward, int], None]] = []
+
+    def _ensure_started(self):
+        if self._store is not None:
+            return
+        with self._lock:
+            if self._store is not None:
+                return
+            store = self._store_factory()
+            totals, streaks = store.load_state()
+            self._totals.update(totals)
+            self._streaks.update(streaks)
+            self._store = store
+            self._stopped.clear()
+            self._flusher = threading.Thread(target=self._run_flusher, name="points-ledger-flusher", daemon=True)
+            self._flusher.start()
+            logger.info("Points ledger loaded %d owners from %s", len(totals), type(store).__name__)
+
+    async def start(self):
+        """Open the store and load its state without blocking the event loop."""
+        await asyncio.to_thread(self._ensure_started)
+
+    @property
+    def store(self):
+        """The ledger store, opened on first use."""
+        self._ensure_started()
+        return self._store
+
+    def add_listener(self, listener: Callable[[PointsAward, int], None]):
+        """
+        Register a callback invoked as ``listener(award, new_total)`` after each award.
+        """
+        self._listeners.append(listener)
+
+    def validate_owner(self, owner: str):
+        """
+        Check that the store can record awards for ``owner``.
+
+        Raises:
+            ValueError: If the store cannot hold the owner's id
+        """
+        self._ensure_started()
+        self._store.validate_owner(owner)
+
+    def get_total(self, owner: str) -> int:
+        """Return an owner's accumulated points."""
+        self._ensure_started()
+        return self._totals.get(owner, 0)
+
+    def totals(self) -> Dict[str, int]:
+        """Return a copy of every owner's accumulated points."""
+        self._ensure_started()
+        with self._lock:
+            return dict(self._totals)
+
+    def get_streak(self, owner: str, today: Optional[date] = None) -> int:
+        """
+        Return an owner's current consecutive-day streak.
+
+        A streak whose last active day is before yesterday has lapsed and counts as 0.
+        """
+        self._ensure_started()
+        state = self._streaks.get(owner)
+        if state is None or state.last_day is None:
+            return 0
+        today = today or datetime.utcnow().date()
+        if state.last_day < today - timedelta(days=1):
+            return 0
+        return state.days
+
+    def preview_streak(self, owner: Optional[str], day: Optional[date] = None) -> int:
+        """
+        Return the streak an owner would have after being active on ``day``.
+
+        Owners without an identity always have a one-day streak.
+        """
+        if owner is None:
+            return 1
+        self._ensure_started()
+        day = day or datetime.utcnow().date()
+        state = self._streaks.get(owner, StreakState(None, 0))
+        return advance_streak(state, day).days
+
+    def award(
+        self,
+        owner: str,
+        points: int,
+        source: str = "CHAT",
+        persona: Optional[str] = None,
+        description: str = "",
+        created_at: Optional[datetime] = None,
+    ) -> int:
+        """
+        Record an award and return the owner's new total.
+
+        The in-memory total and streak are updated immediately; the ledger
+        entry is queued for the background writer.
+
+        Raises:
+            ValueError: If the store cannot hold the owner's id
+        """
+        self.validate_owner(owner)
+        award = PointsAward(
+            owner=owner,
+            points=int(points),
+            source=source,
+            persona=persona,
+            description=description,
+            created_at=created_at or datetime.utcnow(),
+        )
+        with self._lock:
+            total = self._totals.get(owner, 0) + award.points
+            self._totals[owner] = total
+            self._streaks[owner] = advance_streak(
+                self._streaks.get(owner, StreakState(None, 0)), award.created_at.date()
+            )
+            self._pending.append(award)
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+        for listener in self._listeners:
+            try:
+                listener(award, total)
+            except Exception as e:
+                logger.error("Error in points ledger listener %r: %s", listener, e)
+        return total
+
+    def apply_transfers(self, transfers: Sequence[Tuple[str, str, int]]) -> List[int]:
+        """
+        Move points between owners in the in-memory view.
+
+        Each ``(source, target, points)`` transfer must already be recorded
+        in the store; nothing is queued and listeners are not called. A
+        shared store is refreshed instead, which reads the transfers back
+        together with any awards to the source this view has not seen yet.
+        The source's streak is folded into the target's.
+
+        Returns:
+            List[int]: The targets' new totals
+        """
+        self._ensure_started()
+        shared = getattr(self._store, "shared", False)
+        if shared:
+            self.refresh()
+        totals = []
+        with self._lock:
+            for source, target, points in transfers:
+                if not shared:
+                    remaining = max(0, self._totals.get(source, 0) - points)
+                    if remaining:
+                        self._totals[source] = remaining
+                    else:
+                        self._totals.pop(source, None)
+                    self._totals[target] = self._totals.get(target, 0) + points
+                streak = self._streaks.pop(source, None)
+                if streak is not None:
+                    self._streaks[target] = merge_streaks(self._streaks.get(target, StreakState(None, 0)), streak)
+                totals.append(self._totals[target])
+        return totals
+
+    def flush(self) -> int:
+        """
+        Write all queued awards to the store.
+
+        Returns:
+            int: Number of awards written. On failure the batch stays queued.
+        """
+        written = 0
+        while True:
+            with self._store_lock:
+                with self._lock:
+                    batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+                if not batch:
+                    return written
+                try:
+                    self._store.append_many(batch)
+                except Exception as e:
+                    logger.error("Error writing %d points awards: %s", len(batch), e)
+                    with self._lock:
+                        self._pending.extendleft(reversed(batch))
+                    return written
+            written += len(batch)
+
+    def refresh(self) -> int:
+        """
+        Apply what other workers wrote to the store since the last refresh.
+
+        Totals move by the points of the new rows; balances the store keeps
+        as running totals are replaced, plus this worker's queued awards.
+        Owners with new activity get their streak reloaded.
+
+        Returns:
+            int: Number of owners whose total changed
+        """
+        self._ensure_started()
+        with self._store_lock:
+            changes = self._store.load_changes()
+            with self._lock:
+                queued: Dict[str, List[PointsAward]] = {}
+                for award in self._pending:
+                    queued.setdefault(award.owner, []).append(award)
+                for owner, points in changes.deltas.items():
+                    self._totals[owner] = self._totals.get(owner, 0) + points
+                for owner, balance in changes.balances.items():
+                    # Awards queued since the last flush are not in the store yet
+                    self._totals[owner] = balance + sum(a.points for a in queued.get(owner, ()))
+                for owner, state in changes.streaks.items():
+                    for award in queued.get(owner, ()):
+                        state = advance_streak(state, award.created_at.date())
+                    self._streaks[owner] = state
+        return len(changes.deltas.keys() | changes.balances.keys())
+
+    def _run_flusher(self):
+        refresh = self.refresh_interval > 0 and getattr(self._store, "shared", False)
+        next_refresh = time.monotonic() + self.refresh_interval
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if refresh and time.monotonic() >= next_refresh and not self._stopped.is_set():
+                next_refresh = time.monotonic() + self.refresh_interval
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error("Error refreshing points totals from the store: %s", e)
+
+    @property
+    def pending(self) -> int:
+        """Number of awards waiting to be written."""
+        return len(self._pending)
+
+    def close(self):
+        """Flush queued awards and close the store."""
+        if self._store is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 5)
+        self.flush()
+        self._store.close()
+        self._store = None
+
+
+# Create a singleton instance
+points_ledger = PointsLedger(
+    lambda: create_store(settings.points_ledger_backend),
+    batch_size=settings.points_ledger_batch_size,
+    flush_interval=settings.points_ledger_flush_interval,
+    refresh_interval=settings.points_ledger_refresh_interval,
+)
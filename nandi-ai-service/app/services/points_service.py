@@ -1,4 +1,15 @@
-from app.models.points import SessionMetricsRequest, PointsResponse, PointsCalculation
+from app.models.points import (
+    SessionMetricsRequest,
+    PointsResponse,
+    PointsCalculation,
+    BatchSessionMetricsRequest,
+    BatchPointsResponse,
+)
+from app.services.points_ledger import points_ledger, owner_key
+from app.services.analytics import analytics
+from app.core.tracing import tracer
+from typing import Dict, List, Optional, Sequence
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
@@ -6,53 +17,205 @@ logger = logging.getLogger(__name__)
 # Default points calculation constants
 POINTS_CALCULATION = PointsCalculation()
 
+# Duration points are capped at this many points per session
+MAX_DURATION_POINTS = 30
+
+# Quality score bands (inclusive lower bounds), matching the evaluation prompt
+QUALITY_MEDIUM_MIN = 4
+QUALITY_HIGH_MIN = 8
+
+# Breakdown categories, in the order they are reported
+BREAKDOWN_FIELDS = ("base", "duration", "streak", "quality", "milestone")
+
+# Milestone thresholds ("5_questions" -> 5) and bonuses, sorted by threshold
+_MILESTONES = sorted(
+    (int(name.split("_", 1)[0]), bonus)
+    for name, bonus in POINTS_CALCULATION.milestone_bonuses.items()
+)
+_MILESTONE_THRESHOLDS = np.array([t for t, _ in _MILESTONES], dtype=np.int64)
+_MILESTONE_BONUSES = np.array([b for _, b in _MILESTONES], dtype=np.int64)
+
+
+def compute_points(
+    message_counts: Sequence[int],
+    duration_seconds: Sequence[int],
+    streak_days: Sequence[int],
+    quality_scores: Optional[Sequence[Optional[float]]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Compute the points breakdown for many sessions with vectorized arithmetic.
+
+    Rules per session:
+    - base: ``base_points_per_question`` per message
+    - duration: ``time_points_per_minute`` per full minute, capped at 30
+    - streak: ``streak_bonus`` per consecutive day, capped at ``max_streak_bonus``
+    - quality: base points scaled by the low/medium/high quality multiplier
+      minus the base itself (missing scores count as medium)
+    - milestone: the bonus of the highest message-count milestone reached
+
+    Args:
+        message_counts: Messages per session
+        duration_seconds: Duration per session in seconds
+        streak_days: Streak length per session's owner, including the session day
+        quality_scores: Average quality score per session (None for unknown)
+
+    Returns:
+        Dict[str, np.ndarray]: One int64 column per breakdown field plus "total"
+    """
+    calc = POINTS_CALCULATION
+    counts = np.asarray(message_counts, dtype=np.int64)
+    durations = np.asarray(duration_seconds, dtype=np.int64)
+    streaks = np.asarray(streak_days, dtype=np.int64)
+
+    base = calc.base_points_per_question * counts
+    duration = np.minimum((durations // 60) * calc.time_points_per_minute, MAX_DURATION_POINTS)
+    streak = np.minimum(calc.streak_bonus * streaks, calc.max_streak_bonus)
+
+    if quality_scores is None:
+        quality = np.zeros_like(base)
+    else:
+        scores = np.array([np.nan if q is None else q for q in quality_scores], dtype=np.float64)
+        multipliers = np.where(
+            scores >= QUALITY_HIGH_MIN,
+            calc.quality_multipliers["high"],
+            np.where(scores >= QUALITY_MEDIUM_MIN, calc.quality_multipliers["medium"], calc.quality_multipliers["low"]),
+        )
+        multipliers = np.where(np.isnan(scores), calc.quality_multipliers["medium"], multipliers)
+        quality = np.trunc(base * (multipliers - 1.0)).astype(np.int64)
+
+    if len(_MILESTONE_THRESHOLDS):
+        reached = np.searchsorted(_MILESTONE_THRESHOLDS, counts, side="right") - 1
+        milestone = np.where(reached >= 0, _MILESTONE_BONUSES[np.clip(reached, 0, None)], 0)
+    else:
+        milestone = np.zeros_like(base)
+
+    columns = {
+        "base": base,
+        "duration": duration,
+        "streak": streak,
+        "quality": quality,
+        "milestone": milestone,
+    }
+    columns["total"] = base + duration + streak + quality + milestone
+    return columns
+
+
+def _compute_for_requests(requests: List[SessionMetricsRequest], owners: List[Optional[str]]):
+    """Run the points kernel over a list of session metrics requests."""
+    streak_days = [points_ledger.preview_streak(owner) for owner in owners]
+    columns = compute_points(
+        [r.messageCount for r in requests],
+        [r.durationSeconds for r in requests],
+        streak_days,
+        [r.averageQualityScore for r in requests],
+    )
+    return columns, streak_days
+
+
+def _record_award(request: SessionMetricsRequest, owner: Optional[str], earned: int) -> int:
+    """Record an award in the ledger and return the owner's new total."""
+    if owner is None:
+        return earned
+    return points_ledger.award(
+        owner,
+        earned,
+        source="CHAT",
+        persona=request.persona.value,
+        description=f"{request.persona.value} session: {request.messageCount} messages"
+    )
+
+
+def _record_analytics(request: SessionMetricsRequest):
+    analytics.record_session(
+        request.persona.value,
+        request.userId or request.sessionId,
+        request.durationSeconds,
+        request.messageCount
+    )
+
 
 async def calculate_session_points(request: SessionMetricsRequest) -> PointsResponse:
     """
     Calculate points earned from a chat session.
-    
+
     This function:
-    - Takes session metrics (duration, message count, persona)
+    - Takes session metrics (duration, message count, persona, quality)
     - Calculates points based on predefined rules
-    - Returns total points earned and breakdown
+    - Records the award in the points ledger when the session has an owner
+    - Returns points earned, the owner's accumulated total and breakdown
     """
     try:
-        # 1. Base points per message
-        base_points = POINTS_CALCULATION.base_points_per_question
-        message_points = base_points * request.messageCount
-        
-        # 2. Duration points (1 point per minute, max 30)
-        duration_minutes = request.durationSeconds / 60
-        duration_points = min(int(duration_minutes), 30)
-        
-        # 3. Streak bonus (mock implementation)
-        streak_bonus = POINTS_CALCULATION.streak_bonus
-        
-        # 4. Calculate total points
-        total_earned = message_points + duration_points + streak_bonus
-        
-        # 5. Mock total accumulated points (in a real system, would be fetched from database)
-        total_points = 1000 + total_earned
-        
+        with tracer.start_span("points.calculate", {"points.sessions": 1}) as span:
+            owner = owner_key(request.userId, request.sessionId)
+            columns, streak_days = _compute_for_requests([request], [owner])
+            total_earned = int(columns["total"][0])
+
+            # Record the award; totals are served from the ledger's in-memory view
+            total_points = _record_award(request, owner, total_earned)
+            span.set_attribute("points.earned", total_earned)
+            _record_analytics(request)
+
         # Return points response
         return PointsResponse(
-            pointsEarned=int(total_earned),
+            pointsEarned=total_earned,
             totalPoints=int(total_points),
-            breakdown={
-                "base": message_points,
-                "duration": duration_points,
-                "streak": streak_bonus
-            }
+            breakdown={name: int(columns[name][0]) for name in BREAKDOWN_FIELDS},
+            streakDays=streak_days[0]
         )
     except Exception as e:
         logger.error(f"Error calculating points: {str(e)}")
         raise
 
 
+async def calculate_batch_points(batch: BatchSessionMetricsRequest) -> BatchPointsResponse:
+    """
+    Calculate points for many sessions in one vectorized pass.
+
+    Intended for end-of-day reconciliation by nandi-api. Unless ``record`` is
+    set, nothing is written to the ledger and ``totalPoints`` is the owner's
+    current ledger total.
+    """
+    requests = batch.sessions
+    with tracer.start_span("points.calculate", {"points.sessions": len(requests), "points.record": batch.record}):
+        owners = [owner_key(r.userId, r.sessionId) for r in requests]
+        columns, streak_days = _compute_for_requests(requests, owners)
+        earned = columns["total"].tolist()
+
+        if batch.record:
+            # Reject the whole batch before anything is recorded
+            for owner in owners:
+                if owner is not None:
+                    points_ledger.validate_owner(owner)
+            totals = [_record_award(r, o, e) for r, o, e in zip(requests, owners, earned)]
+            for request in requests:
+                _record_analytics(request)
+        else:
+            totals = [points_ledger.get_total(o) if o is not None else 0 for o in owners]
+
+    if batch.format == "columns":
+        result_columns = {name: columns[name].tolist() for name in BREAKDOWN_FIELDS}
+        result_columns["pointsEarned"] = earned
+        result_columns["totalPoints"] = totals
+        result_columns["streakDays"] = streak_days
+        return BatchPointsResponse(count=len(requests), columns=result_columns)
+
+    breakdown_rows = zip(*(columns[name].tolist() for name in BREAKDOWN_FIELDS))
+    results = [
+        PointsResponse(
+            pointsEarned=points,
+            totalPoints=total,
+            breakdown=dict(zip(BREAKDOWN_FIELDS, row)),
+            streakDays=streak
+        )
+        for points, total, row, streak in zip(earned, totals, breakdown_rows, streak_days)
+    ]
+    return BatchPointsResponse(count=len(requests), results=results)
+
+
 def get_points_calculations() -> dict:
     """
     Get the constants used in points calculations.
-    
+
     Returns the base values used to calculate points for the client.
     """
     return {
@@ -60,5 +223,6 @@ def get_points_calculations() -> dict:
         "time_points_per_minute": POINTS_CALCULATION.time_points_per_minute,
         "quality_multipliers": POINTS_CALCULATION.quality_multipliers,
         "streak_bonus": POINTS_CALCULATION.streak_bonus,
+        "max_streak_bonus": POINTS_CALCULATION.max_streak_bonus,
         "milestone_bonuses": POINTS_CALCULATION.milestone_bonuses
-    } 
\ No newline at end of file
+    }
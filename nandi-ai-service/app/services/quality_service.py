@@ -0,0 +1,342 @@
+"""
+Question quality scoring, decoupled from the chat completion.
+
+Three sources feed the quality score used by the points system:
+
+* a local heuristic/lexical scorer that runs in microseconds,
+* an optional cheap-model scorer that runs concurrently with the main completion,
+* an LRU cache of previously evaluated scores keyed by the normalized question.
+"""
+
+import asyncio
+import json
+import logging
+import re
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Tuple
+
+from app.config.settings import settings
+from app.models.chat import ChatRequest, QualityScore
+from app.services.usage_service import usage_tracker
+
+logger = logging.getLogger(__name__)
+
+MIN_SCORE = 1
+MAX_SCORE = 10
+
+_WORD_RE = re.compile(r"[a-z']+")
+_NORMALIZE_RE = re.compile(r"[^a-z0-9 ]+")
+_SPACE_RE = re.compile(r"\s+")
+
+# Phrases that signal personal reflection or vulnerability
+REFLECTION_CUES = frozenset({
+    "i", "i'm", "i've", "my", "me", "myself", "feel", "feeling", "struggling",
+    "struggle", "afraid", "fear", "anxious", "lost", "confused", "why",
+    "how", "should", "balance", "meaning", "learn", "understand", "grow",
+})
+
+# General spiritual vocabulary shared by all personas
+SPIRITUAL_TERMS = frozenset({
+    "spiritual", "soul", "mindful", "mindfulness", "peace", "wisdom",
+    "compassion", "presence", "present", "practice", "growth", "inner",
+    "meditate", "meditation", "gratitude", "forgive", "forgiveness",
+})
+
+# Persona specific vocabulary used to judge relevance
+PERSONA_TERMS = {
+    "karma": frozenset({
+        "karma", "action", "actions", "consequence", "consequences", "cause",
+        "effect", "choice", "choices", "responsibility", "ethical", "habit",
+        "habits", "intention", "intentions", "decision", "decisions",
+    }),
+    "dharma": frozenset({
+        "dharma", "purpose", "duty", "duties", "values", "ethics", "ethical",
+        "righteous", "career", "calling", "responsibility", "responsibilities",
+        "principles", "discipline", "path", "family",
+    }),
+    "atma": frozenset({
+        "atma", "self", "consciousness", "awareness", "aware", "ego",
+        "awakening", "enlightenment", "meditation", "meditate", "transcend",
+        "oneness", "unity", "breath", "stillness", "silence",
+    }),
+}
+
+# Messages made only of these words are small talk or tests of the system
+SMALL_TALK_WORDS = frozenset({
+    "hi", "hello", "hey", "test", "testing", "ok", "okay", "thanks", "thank",
+    "you", "lol", "there", "nandi", "karma", "dharma", "atma",
+})
+
+# Questions about the system itself; low-effort unless the message goes on
+SYSTEM_PROBE_RE = re.compile(r"favou?rite colou?r|are you (a |an )?(bot|ai|human)")
+MAX_PROBE_WORDS = 8
+
+
+def normalize_question(message: str) -> str:
+    """
+    Normalize a question for cache lookups.
+
+    Lowercases, strips punctuation and collapses whitespace so trivially
+    different phrasings of the same question share a cache entry.
+    """
+    text = _NORMALIZE_RE.sub(" ", message.lower())
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def is_small_talk(words) -> bool:
+    """Return True if a message has no words besides greetings and fillers (or none at all)."""
+    return all(word in SMALL_TALK_WORDS for word in words)
+
+
+class HeuristicQualityScorer:
+    """
+    Fast local scorer based on length, reflection cues and persona relevance.
+    """
+
+    def score(self, message: str, persona: str) -> QualityScore:
+        """
+        Score a question without any network call.
+
+        Args:
+            message: The user's question
+            persona: The persona identifier (e.g., "karma", "dharma")
+
+        Returns:
+            QualityScore: The estimated score and a short reason
+        """
+        lowered = message.lower().strip()
+        words = _WORD_RE.findall(lowered)
+        word_count = len(words)
+
+        if (
+            is_small_talk(words)
+            or (word_count <= MAX_PROBE_WORDS and SYSTEM_PROBE_RE.search(lowered))
+        ):
+            return QualityScore.model_construct(
+                score=2, reason="Off-topic or low-effort question"
+            )
+
+        word_set = set(words)
+        reflection_hits = len(word_set & REFLECTION_CUES)
+        persona_hits = len(word_set & PERSONA_TERMS.get(persona, frozenset()))
+        spiritual_hits = len(word_set & SPIRITUAL_TERMS)
+
+        score = 3
+        if word_count >= 6:
+            score += 1
+        if word_count >= 15:
+            score += 1
+        if word_count >= 30:
+            score += 1
+        score += min(reflection_hits // 2, 2)
+        score += min(persona_hits, 2)
+        if spiritual_hits:
+            score += 1
+        score = max(MIN_SCORE, min(MAX_SCORE, score))
+
+        reasons = []
+        if reflection_hits >= 2:
+            reasons.append("shows personal reflection")
+        if persona_hits or spiritual_hits:
+            reasons.append("relevant to spiritual growth")
+        if word_count >= 15:
+            reasons.append("clearly detailed")
+        if not reasons:
+            reasons.append("general question with little personal context")
+
+        return QualityScore.model_construct(
+            score=score, reason=f"Heuristic evaluation: {', '.join(reasons)}"
+        )
+
+
+class QualityScoreCache:
+    """
+    Thread-safe LRU cache of quality scores keyed by persona and normalized question.
+    """
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, str], QualityScore]" = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, persona: str, message: str) -> Optional[QualityScore]:
+        """Return the cached score for a question, if any."""
+        key = (persona, normalize_question(message))
+        with self._lock:
+            score = self._entries.get(key)
+            if score is not None:
+                self._entries.move_to_end(key)
+            return score
+
+    def set(self, persona: str, message: str, score: QualityScore):
+        """Store a score for a question, evicting the least recently used entry."""
+        key = (persona, normalize_question(message))
+        with self._lock:
+            self._entries[key] = score
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached scores."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ModelQualityScorer:
+    """
+    Scores questions with a small, cheap model in a worker thread.
+
+    The tokens it spends are charged to the caller's API key like the chat
+    completion itself.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def _complete(self, message: str, persona: str):
+        """Blocking call to the scoring model; run via asyncio.to_thread."""
+        from app.config.prompt_loader import prompt_manager
+        from app.services.ai_service import client
+
+        messages = [
+            {
+                "role": "system",
+                "content": (
+                    prompt_manager.get_quality_prompt()
+                    + "\n\nOnly evaluate the question. Reply with a JSON object containing "
+                    "\"quality_score\" and \"quality_reasoning\"."
+                ),
+            },
+            {"role": "user", "content": f"Persona: {persona}\nQuestion: {message}"},
+        ]
+        return client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0,
+            max_tokens=80,
+        )
+
+    def _parse(self, response) -> Optional[QualityScore]:
+        """Read the score from the model's JSON reply."""
+        content = response.choices[0].message.content or ""
+        try:
+            data = json.loads(content[content.index("{"):content.rindex("}") + 1])
+            score = int(data["quality_score"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Quality model returned an unparseable evaluation: %s", content[:200])
+            return None
+        return QualityScore.model_construct(
+            score=max(MIN_SCORE, min(MAX_SCORE, score)),
+            reason=str(data.get("quality_reasoning", "")).strip() or "Evaluated by quality model",
+        )
+
+    async def score(self, message: str, persona: str, api_key: Optional[str] = None) -> Optional[QualityScore]:
+        """
+        Score a question without blocking the event loop.
+
+        Args:
+            message: The user's question
+            persona: The persona identifier
+            api_key: The caller's API key, charged for the tokens
+
+        Returns:
+            Optional[QualityScore]: The model's evaluation, or None if it failed
+        """
+        try:
+            response = await asyncio.to_thread(self._complete, message, persona)
+        except Exception as e:
+            logger.warning("Quality model scoring failed: %s", e)
+            return None
+        usage_tracker.record(api_key, persona, self.model, getattr(response, "usage", None))
+        return self._parse(response)
+
+
+class QualityService:
+    """
+    Combines the heuristic scorer, the optional model scorer and the score cache.
+
+    Typical use from the chat path::
+
+        task = quality_service.start(request, api_key)  # before the main completion
+        ...
+        score = await quality_service.resolve(request, task, inline_score)
+
+    The model scorer only runs in "separate" mode. In "inline" mode the
+    completion reports the score itself, and a missing score falls back to
+    the cache and the heuristic instead of a second upstream call.
+    """
+
+    def __init__(self, model: Optional[str] = None, cache_size: int = 2048, mode: str = "separate"):
+        self.heuristic = HeuristicQualityScorer()
+        self.model_scorer = ModelQualityScorer(model) if model else None
+        self.cache = QualityScoreCache(cache_size)
+        self.mode = mode
+
+    def score_heuristic(self, request: ChatRequest) -> QualityScore:
+        """Return the local heuristic score for a request."""
+        return self.heuristic.score(request.message, request.persona.value)
+
+    def start(self, request: ChatRequest, api_key: Optional[str] = None) -> Optional[asyncio.Task]:
+        """
+        Launch model scoring for a request so it overlaps with the main completion.
+
+        Args:
+            request: The chat request
+            api_key: The caller's API key, charged for the scoring tokens
+
+        Returns:
+            Optional[asyncio.Task]: The scoring task, or None when the score is
+            already cached, no scoring model is configured or the completion
+            scores inline
+        """
+        if self.model_scorer is None or self.mode != "separate":
+            return None
+        if self.cache.get(request.persona.value, request.message) is not None:
+            return None
+        return asyncio.create_task(
+            self.model_scorer.score(request.message, request.persona.value, api_key)
+        )
+
+    async def resolve(
+        self,
+        request: ChatRequest,
+        task: Optional[asyncio.Task] = None,
+        inline_score: Optional[QualityScore] = None,
+    ) -> QualityScore:
+        """
+        Pick the best available score for a request.
+
+        Precedence: score reported inline by the completion, model scorer
+        result, cached score, then the local heuristic.
+        """
+        persona = request.persona.value
+        if inline_score is not None:
+            if task is not None:
+                task.cancel()
+            self.cache.set(persona, request.message, inline_score)
+            return inline_score
+
+        if task is not None:
+            model_score = await task
+            if model_score is not None:
+                self.cache.set(persona, request.message, model_score)
+                return model_score
+
+        cached = self.cache.get(persona, request.message)
+        if cached is not None:
+            return cached
+
+        return self.score_heuristic(request)
+
+
+# Create a singleton instance
+quality_service = QualityService(
+    model=settings.quality_model,
+    cache_size=settings.quality_cache_size,
+    mode=settings.quality_scoring_mode,
+)
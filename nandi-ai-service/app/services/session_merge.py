@@ -0,0 +1,350 @@
+"""
+Merging anonymous sessions into registered users.
+
+When an anonymous visitor registers (see
+``docs/karmaCafe/User-Management-Strategy.md``), everything the service
+keeps for their session moves to the new user id: accumulated points, the
+stored conversation (``chat_sessions`` and ``chat_messages``) and the
+leaderboard entries. The durable part of a batch of merges is one
+transaction, which also reads the balances to move, so awards from other
+workers are included; the in-memory ledger view and the leaderboards are
+updated once it has committed.
+
+Merges run in a worker thread, one batch of ``session_merge_batch_size``
+sessions at a time, so live chat traffic keeps being served while a bulk
+migration is in progress. Merging a session twice is harmless: the second
+merge has nothing left to move.
+
+Speculative follow-up answers are keyed by the conversation's session id,
+which the client keeps after registering, so they stay where they are.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.config.settings import settings
+from app.services.leaderboard import leaderboard
+from app.services.message_store import message_store
+from app.services.points_ledger import (
+    MERGE_DESCRIPTION_PREFIX,
+    TRANSFER_SOURCE,
+    PointsAward,
+    owner_key,
+    points_ledger,
+)
+
+logger = logging.getLogger(__name__)
+
+# (anonymous session id, user id)
+MergeRow = Tuple[str, str]
+
+# Per session: (points moved, messages moved)
+MergeCounts = Dict[str, Tuple[int, int]]
+
+
+class SessionMerge(NamedTuple):
+    """An anonymous session and the user it is merged into."""
+    session_id: str
+    user_id: str
+
+
+class MergeResult(NamedTuple):
+    """What a merge moved."""
+    session_id: str
+    user_id: str
+    points_merged: int
+    messages_merged: int
+    total_points: int
+
+
+class MemoryMergeStore:
+    """Merges the contents of in-memory ledger and message stores."""
+
+    def __init__(self, ledger_store=None, message_store=None):
+        self._ledger_store = ledger_store
+        self._message_store = message_store
+
+    def merge(self, rows: List[MergeRow]) -> MergeCounts:
+        now = datetime.utcnow()
+        points = {session_id: 0 for session_id, _ in rows}
+        if self._ledger_store is not None:
+            sessions = {owner_key(session_id=session_id): session_id for session_id, _ in rows}
+            for award in self._ledger_store.awards:
+                session_id = sessions.get(award.owner)
+                if session_id is not None:
+                    points[session_id] += award.points
+            self._ledger_store.append_many([
+                award
+                for session_id, user_id in rows if points[session_id]
+                for award in _transfer_awards(session_id, user_id, points[session_id], now)
+            ])
+        moved = dict.fromkeys(points, 0)
+        if self._message_store is not None:
+            users = dict(rows)
+            records = self._message_store.records
+            for i, record in enumerate(records):
+                user_id = users.get(record.anonymous_session_id)
+                if user_id is not None:
+                    moved[record.anonymous_session_id] += 1
+                    records[i] = record._replace(user_id=user_id, anonymous_session_id=None)
+        return {session_id: (points[session_id], moved[session_id]) for session_id in points}
+
+    def close(self):
+        pass
+
+
+class SQLiteMergeStore:
+    """
+    Merges in the local SQLite ledger, with the message database attached.
+
+    Both files are changed in one transaction. In WAL mode SQLite only
+    guarantees atomicity per file, so a crash at commit may leave the
+    points moved but not the messages; merging the session again finishes
+    the job.
+    """
+
+    def __init__(self, ledger_path: str, message_path: Optional[str] = None):
+        self._conn = sqlite3.connect(ledger_path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._attached = bool(message_path)
+        if message_path:
+            self._conn.execute("ATTACH DATABASE ? AS messages", (message_path,))
+        self._lock = threading.Lock()
+
+    def _has_messages(self) -> bool:
+        # The table only exists once the message store has been opened
+        return self._attached and self._conn.execute(
+            "SELECT 1 FROM messages.sqlite_master WHERE type = 'table' AND name = 'chat_messages'"
+        ).fetchone() is not None
+
+    def merge(self, rows: List[MergeRow]) -> MergeCounts:
+        now = datetime.utcnow()
+        moved = {session_id: 0 for session_id, _ in rows}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                points = {
+                    session_id: self._conn.execute(
+                        "SELECT COALESCE(SUM(points), 0) FROM points_ledger WHERE owner = ?",
+                        (owner_key(session_id=session_id),),
+                    ).fetchone()[0]
+                    for session_id, _ in rows
+                }
+                awards = [
+                    (a.owner, a.points, a.source, a.persona, a.description, a.created_at.isoformat())
+                    for session_id, user_id in rows if points[session_id]
+                    for a in _transfer_awards(session_id, user_id, points[session_id], now)
+                ]
+                self._conn.executemany(
+                    "INSERT INTO points_ledger (owner, points, source, persona, description, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    awards,
+                )
+                if self._has_messages():
+                    for session_id, user_id in rows:
+                        moved[session_id] = self._conn.execute(
+                            "UPDATE messages.chat_messages SET user_id = ?, anonymous_session_id = NULL "
+                            "WHERE anonymous_session_id = ?",
+                            (user_id, session_id),
+                        ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {session_id: (points[session_id], moved[session_id]) for session_id in moved}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresMergeStore:
+    """
+    Merges on the platform's PostgreSQL schema in one transaction.
+
+    The session's ``anonymous_sessions.temporary_points`` are read with the
+    row locked, added to ``points_history`` (whose trigger updates
+    ``users.total_points``) and reset to 0; its ``chat_sessions`` and
+    ``chat_messages`` rows are reassigned to the user. The
+    ``anonymous_sessions`` row itself is kept, with ``last_active_at``
+    bumped so ledger refreshes read the new balance. ``points_history`` has no
+    transfer source, so the entry is recorded as CHAT with a description
+    starting with ``MERGE_DESCRIPTION_PREFIX``, which is not streak activity.
+    """
+
+    def __init__(self, dsn: str):
+        try:
+            import psycopg2
+            import psycopg2.extras
+        except ImportError as e:
+            raise RuntimeError("psycopg2 is required for PostgreSQL session merges") from e
+        self._extras = psycopg2.extras
+        self._conn = psycopg2.connect(dsn)
+        self._lock = threading.Lock()
+
+    def merge(self, rows: List[MergeRow]) -> MergeCounts:
+        try:
+            users = [(session_id, int(user_id)) for session_id, user_id in rows]
+        except ValueError:
+            raise ValueError("User ids must be numeric to merge sessions into the platform database")
+        moved = {session_id: 0 for session_id, _ in rows}
+
+        with self._lock, self._conn, self._conn.cursor() as cur:
+            cur.execute(
+                "SELECT session_id, temporary_points FROM anonymous_sessions "
+                "WHERE session_id = ANY(%s) FOR UPDATE",
+                (list(moved),),
+            )
+            balances = {session_id: n or 0 for session_id, n in cur.fetchall()}
+            points = [
+                (session_id, user_id, balances[session_id])
+                for session_id, user_id in users if balances.get(session_id)
+            ]
+            if points:
+                cur.execute(
+                    "UPDATE anonymous_sessions SET temporary_points = 0, last_active_at = CURRENT_TIMESTAMP "
+                    "WHERE session_id = ANY(%s)",
+                    ([session_id for session_id, _, _ in points],),
+                )
+                self._extras.execute_values(
+                    cur,
+                    "INSERT INTO points_history (user_id, source, points, description) VALUES %s",
+                    [(user_id, "CHAT", n, f"{MERGE_DESCRIPTION_PREFIX}{session_id}"[:255])
+                     for session_id, user_id, n in points],
+                )
+            self._extras.execute_values(
+                cur,
+                "UPDATE chat_sessions AS c SET user_id = m.user_id, anonymous_session_id = NULL "
+                "FROM (VALUES %s) AS m (session_id, user_id) WHERE c.anonymous_session_id = m.session_id",
+                users,
+            )
+            counts = self._extras.execute_values(
+                cur,
+                "WITH moved AS ("
+                "UPDATE chat_messages AS c SET user_id = m.user_id, anonymous_session_id = NULL "
+                "FROM (VALUES %s) AS m (session_id, user_id) WHERE c.anonymous_session_id = m.session_id "
+                "RETURNING m.session_id) "
+                "SELECT session_id, COUNT(*) FROM moved GROUP BY session_id",
+                users,
+                fetch=True,
+            )
+        moved.update(dict(counts))
+        return {session_id: (balances.get(session_id, 0), moved[session_id]) for session_id in moved}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _transfer_awards(session_id: str, user_id: str, points: int, now: datetime) -> List[PointsAward]:
+    source, target = owner_key(session_id=session_id), owner_key(user_id=user_id)
+    return [
+        PointsAward(source, -points, TRANSFER_SOURCE, None, f"Merged into {target}", now),
+        PointsAward(target, points, TRANSFER_SOURCE, None, f"Merged from {source}", now),
+    ]
+
+
+def create_store(ledger_backend: str, message_backend: str):
+    """Create the merge store for the configured points ledger and message store."""
+    if ledger_backend == "postgres":
+        return PostgresMergeStore(settings.points_ledger_dsn)
+    if ledger_backend == "sqlite":
+        return SQLiteMergeStore(
+            settings.points_ledger_path,
+            settings.message_store_path if message_backend == "sqlite" else None,
+        )
+    return MemoryMergeStore(
+        points_ledger.store,
+        message_store.store if message_backend == "memory" else None,
+    )
+
+
+class SessionMerger:
+    """
+    Merges anonymous sessions into users, one transaction per batch.
+
+    Merges are serialized per worker; each batch runs in a worker thread so
+    the event loop stays free for chat requests.
+    """
+
+    def __init__(self, store_factory, batch_size: int = 500):
+        self._store_factory = store_factory
+        self._store = None
+        self.batch_size = max(1, batch_size)
+        self._lock = asyncio.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = self._store_factory()
+        return self._store
+
+    async def merge(self, session_id: str, user_id: str) -> MergeResult:
+        """Merge one anonymous session into a user."""
+        return (await self.merge_many([SessionMerge(session_id, user_id)]))[0]
+
+    async def merge_many(self, merges: Sequence[SessionMerge]) -> List[MergeResult]:
+        """
+        Merge anonymous sessions into users.
+
+        Args:
+            merges: Sessions and their users; a session may appear only once
+
+        Returns:
+            List[MergeResult]: One result per merge, in order
+
+        Raises:
+            ValueError: If a session appears more than once or an id is empty
+        """
+        session_ids = [m.session_id for m in merges]
+        if len(set(session_ids)) != len(session_ids):
+            raise ValueError("Each session can only be merged once per request")
+        if any(not m.session_id or not m.user_id for m in merges):
+            raise ValueError("Session and user ids must not be empty")
+
+        results: List[MergeResult] = []
+        async with self._lock:
+            for start in range(0, len(merges), self.batch_size):
+                results.extend(await self._merge_batch(merges[start:start + self.batch_size]))
+        return results
+
+    async def _merge_batch(self, merges: Sequence[SessionMerge]) -> List[MergeResult]:
+        # Write this worker's queued messages and awards first, so the
+        # transaction moves them too
+        await asyncio.to_thread(message_store.flush)
+        await asyncio.to_thread(points_ledger.flush)
+        rows = [(m.session_id, m.user_id) for m in merges]
+        moved, totals = await asyncio.to_thread(self._merge_rows, rows)
+        for (session_id, user_id), total in zip(rows, totals):
+            leaderboard.merge_owner(owner_key(session_id=session_id), owner_key(user_id=user_id), total)
+        logger.info("Merged %d anonymous sessions into users", len(rows))
+        return [
+            MergeResult(session_id, user_id, points, messages, total)
+            for (session_id, user_id), (points, messages), total in zip(rows, moved, totals)
+        ]
+
+    def _merge_rows(self, rows: List[MergeRow]) -> Tuple[List[Tuple[int, int]], List[int]]:
+        merged = self.store.merge(rows)
+        moved = [merged.get(session_id, (0, 0)) for session_id, _ in rows]
+        # With a shared ledger this reads the transfer rows back from the store
+        totals = points_ledger.apply_transfers([
+            (owner_key(session_id=session_id), owner_key(user_id=user_id), points)
+            for (session_id, user_id), (points, _) in zip(rows, moved)
+        ])
+        return moved, totals
+
+    def close(self):
+        """Close the store."""
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+# Create a singleton instance
+session_merger = SessionMerger(
+    lambda: create_store(settings.points_ledger_backend, settings.message_store_backend),
+    batch_size=settings.session_merge_batch_size,
+)
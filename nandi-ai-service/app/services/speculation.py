@@ -0,0 +1,501 @@
+"""
+Speculative pre-generation of follow-up answers.
+
+After a chat turn that carries a session id, a background job asks a small
+model for a few likely follow-up questions, publishes them for the client
+(``GET /api/chat/suggestions`` and a ``suggestions`` frame on the chat
+WebSocket) and then answers them one by one into a session-scoped cache. When
+the user sends one of the suggestions as the next turn, its answer is served
+without an upstream call; a tap that arrives while its answer is still being
+generated waits for that call instead of starting another one.
+
+Speculation never competes with live traffic:
+
+* a job only starts while fewer than ``speculation_max_live_requests`` live
+  upstream calls are in flight, and stops before its next call once they are,
+* at most ``speculation_max_concurrency`` jobs run at once; turns that find
+  no free slot are not queued,
+* the tokens spent are capped by ``speculation_token_budget`` per hour and
+  still count towards the caller's token quota.
+
+All state is per worker and only touched from the event loop.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from app.config.prompt_loader import prompt_manager
+from app.config.settings import settings
+from app.core.metrics import usage_value
+from app.core.response_parser import parse_response
+from app.models.chat import ChatRequest, ChatResponse, ConversationMessage, MessageRole, QualityScore
+from app.services.model_router import model_router
+from app.services.quality_service import normalize_question, quality_service
+from app.services.usage_service import QuotaExceededError, usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Sessions whose latest suggestions are kept
+MAX_SESSIONS = 10000
+
+# Completion budget of the suggestion call
+SUGGESTION_MAX_TOKENS = 150
+
+SUGGESTION_INSTRUCTIONS = (
+    "You help a spiritual guidance app anticipate the user's next question. "
+    "Given the user's question and the guide's answer, write {count} short follow-up "
+    "questions the user is most likely to ask next, in the user's own voice. "
+    "Reply with a JSON array of strings only."
+)
+
+BUDGET_WINDOW = 3600.0
+
+SuggestionListener = Callable[["Suggestions"], Awaitable[None]]
+
+
+class Suggestions(NamedTuple):
+    """Follow-up questions suggested after one response of a session."""
+    session_id: str
+    response_id: str
+    questions: Tuple[str, ...]
+
+
+def parse_suggestions(text: str, limit: int) -> List[str]:
+    """
+    Extract follow-up questions from the suggestion model's output.
+
+    Accepts a JSON array (optionally surrounded by other text) or one
+    question per line, and drops duplicates and empty entries.
+
+    Args:
+        text: The raw completion text
+        limit: Maximum number of questions returned
+    """
+    text = (text or "").strip()
+    items = None
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            items = [str(item) for item in data if isinstance(item, (str, int, float))]
+    if items is None:
+        items = [line.lstrip("-*0123456789.) ").strip() for line in text.splitlines()]
+
+    questions = []
+    seen = set()
+    for item in items:
+        question = item.strip().strip('"').strip()
+        key = normalize_question(question)
+        if key and key not in seen:
+            seen.add(key)
+            questions.append(question)
+        if len(questions) >= limit:
+            break
+    return questions
+
+
+def _digest(text: str) -> str:
+    """Short fingerprint of an answer, used to tie follow-ups to the turn they follow."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def follow_up_context(request: ChatRequest, answer: str) -> List[ConversationMessage]:
+    """Return the conversation a follow-up to ``request`` is asked in."""
+    return list(request.context or ()) + [
+        ConversationMessage.model_construct(role=MessageRole.USER, content=request.message),
+        ConversationMessage.model_construct(role=MessageRole.ASSISTANT, content=answer),
+    ]
+
+
+class SpeculationBudget:
+    """
+    Tokens speculation may spend per rolling hour window.
+
+    The limit is read from ``speculation_token_budget`` on every check, so it
+    can be changed at runtime; 0 disables speculation.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._window_start = clock()
+        self.spent = 0
+
+    def _roll(self):
+        now = self._clock()
+        if now - self._window_start >= BUDGET_WINDOW:
+            self._window_start = now
+            self.spent = 0
+
+    def available(self) -> bool:
+        """Whether the current window has tokens left."""
+        self._roll()
+        return self.spent < settings.speculation_token_budget
+
+    def spend(self, tokens: int):
+        """Charge tokens to the current window."""
+        self._roll()
+        self.spent += max(0, tokens)
+
+
+class _Entry:
+    """A speculative answer, pending or computed."""
+    __slots__ = ("future", "parent", "expires", "started")
+
+    def __init__(self, future: asyncio.Future, parent: str, expires: float):
+        self.future = future
+        self.parent = parent
+        self.expires = expires
+        self.started = False
+
+
+def _release(entry: Optional[_Entry]):
+    """Resolve a pending entry without an answer, releasing anyone waiting on it."""
+    if entry is not None and not entry.future.done():
+        entry.future.set_result(None)
+
+
+class SpeculativeAnswerCache:
+    """
+    Precomputed follow-up answers keyed by session, persona and normalized question.
+
+    Entries are single use: an answer is removed when it is served, and all
+    of a session's entries are dropped when a new turn replaces its
+    suggestions.
+    """
+
+    def __init__(self, max_entries: int = 3 * MAX_SESSIONS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+
+    @staticmethod
+    def key(session_id: str, persona, question: str) -> Tuple[str, str, str]:
+        """Cache key of a follow-up question."""
+        return (session_id, getattr(persona, "value", persona), normalize_question(question))
+
+    def reserve(self, key: Tuple[str, str, str], parent: str) -> _Entry:
+        """Add a pending entry whose answer is filled in by the speculation job."""
+        entry = _Entry(asyncio.get_running_loop().create_future(), parent, self._clock() + settings.speculation_ttl)
+        _release(self._entries.pop(key, None))
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            _release(self._entries.popitem(last=False)[1])
+        return entry
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[_Entry]:
+        """Return the live entry for a key, if any."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= self._clock():
+            _release(self._entries.pop(key))
+            return None
+        return entry
+
+    def pop(self, key: Tuple[str, str, str]) -> Optional[_Entry]:
+        """Remove and return the entry for a key."""
+        return self._entries.pop(key, None)
+
+    def contains(self, key: Tuple[str, str, str], entry: _Entry) -> bool:
+        """Whether ``entry`` is still the cached entry for ``key``."""
+        return self._entries.get(key) is entry
+
+    def drop_session(self, session_id: str) -> int:
+        """Remove all entries of a session."""
+        keys = [key for key in self._entries if key[0] == session_id]
+        for key in keys:
+            _release(self._entries.pop(key))
+        return len(keys)
+
+    def clear(self):
+        for entry in self._entries.values():
+            _release(entry)
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Speculator:
+    """
+    Schedules speculation jobs after chat turns and serves their answers.
+
+    Typical use from the chat path::
+
+        response = await speculator.take(request)      # before the upstream call
+        ...
+        with speculator.live_call():                   # around live upstream calls
+            ...
+        speculator.schedule(request, response, api_key)  # after a successful turn
+    """
+
+    def __init__(self, budget: Optional[SpeculationBudget] = None, cache: Optional[SpeculativeAnswerCache] = None):
+        self.budget = budget or SpeculationBudget()
+        self.cache = cache or SpeculativeAnswerCache()
+        self.live_requests = 0
+        self.active_jobs = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._suggestions: "OrderedDict[str, Suggestions]" = OrderedDict()
+        self._listeners: Dict[str, Set[SuggestionListener]] = {}
+        self._counters = {
+            "jobs": 0, "skipped": 0, "suggestions": 0, "answers": 0,
+            "hits": 0, "waited": 0, "stale": 0, "failures": 0,
+        }
+
+    @contextmanager
+    def live_call(self):
+        """Count a live upstream call while it is in flight."""
+        self.live_requests += 1
+        try:
+            yield
+        finally:
+            self.live_requests -= 1
+
+    def has_capacity(self) -> bool:
+        """Whether live traffic and the token budget leave room for another speculative call."""
+        return self.live_requests < settings.speculation_max_live_requests and self.budget.available()
+
+    def schedule(self, request: ChatRequest, response: ChatResponse, api_key: Optional[str] = None) -> bool:
+        """
+        Start a speculation job for the turn that produced ``response``.
+
+        Only turns with a session id are speculated on. Nothing is queued: the
+        turn is skipped when speculation is disabled, a slot is not free or
+        the upstream is busy with live traffic.
+
+        Returns:
+            bool: True if a job was started
+        """
+        session_id = request.session_id
+        if not settings.speculation_enabled or not session_id:
+            return False
+        # A new turn makes the previous suggestions of the session irrelevant
+        self.cache.drop_session(session_id)
+        self._suggestions.pop(session_id, None)
+        if self.active_jobs >= settings.speculation_max_concurrency or not self.has_capacity():
+            self._counters["skipped"] += 1
+            return False
+        self.active_jobs += 1
+        self._counters["jobs"] += 1
+        task = asyncio.create_task(self._run(request, response, api_key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, request: ChatRequest, response: ChatResponse, api_key: Optional[str]):
+        pending = []
+        try:
+            await usage_tracker.check_quota(api_key)
+            questions = await self._suggest(request, response, api_key)
+            if not questions:
+                return
+            suggestions = Suggestions(request.session_id, response.id, tuple(questions))
+            self._publish(suggestions)
+
+            context = follow_up_context(request, response.message)
+            parent = _digest(response.message)
+            for question in questions:
+                key = SpeculativeAnswerCache.key(request.session_id, request.persona, question)
+                pending.append((question, key, self.cache.reserve(key, parent)))
+            for question, key, entry in pending:
+                if not self.cache.contains(key, entry):
+                    # Taken by the user before its turn came, or replaced by a newer turn
+                    continue
+                if not self.has_capacity():
+                    self.cache.pop(key)
+                    _release(entry)
+                    continue
+                entry.started = True
+                follow_up = ChatRequest.model_construct(
+                    message=question,
+                    persona=request.persona,
+                    session_id=request.session_id,
+                    context=context,
+                )
+                answer = await self._answer(follow_up, api_key)
+                if not entry.future.done():
+                    entry.future.set_result(answer)
+                if answer is None:
+                    self.cache.pop(key)
+        except QuotaExceededError:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._counters["failures"] += 1
+            logger.warning("Speculation failed: %s", e)
+        finally:
+            for _, key, entry in pending:
+                if not entry.future.done():
+                    self.cache.pop(key)
+                    _release(entry)
+            self.active_jobs -= 1
+
+    async def _complete(self, model: str, messages: List[Dict], max_tokens: int, request: ChatRequest, api_key: Optional[str]):
+        """Run one speculative completion in a worker thread and charge its tokens."""
+        from app.services.ai_service import client
+
+        response = await asyncio.to_thread(
+            client.chat.completions.create,
+            model=model,
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+        )
+        usage = getattr(response, "usage", None)
+        tokens = usage_value(usage, "prompt_tokens") + usage_value(usage, "completion_tokens")
+        self.budget.spend(tokens or max_tokens)
+        usage_tracker.record(api_key, request.persona.value, model, usage)
+        return response
+
+    async def _suggest(self, request: ChatRequest, response: ChatResponse, api_key: Optional[str]) -> List[str]:
+        """Ask the suggestion model for likely follow-up questions."""
+        limit = settings.speculation_max_suggestions
+        if limit <= 0:
+            return []
+        messages = [
+            {"role": "system", "content": SUGGESTION_INSTRUCTIONS.format(count=limit)},
+            {
+                "role": "user",
+                "content": f"Persona: {request.persona.value}\nQuestion: {request.message}\nAnswer: {response.message}"
+            },
+        ]
+        model = settings.speculation_model or model_router.tiers[0].model
+        completion = await self._complete(model, messages, SUGGESTION_MAX_TOKENS, request, api_key)
+        questions = parse_suggestions(completion.choices[0].message.content, limit)
+        self._counters["suggestions"] += len(questions)
+        return questions
+
+    async def _answer(self, request: ChatRequest, api_key: Optional[str]) -> Optional[ChatResponse]:
+        """Answer a suggested follow-up on its routed tier; None if the call fails."""
+        persona_prompt = prompt_manager.get_persona(request.persona)
+        include_quality = settings.quality_scoring_mode == "inline"
+        messages = prompt_manager.build_messages(
+            persona_prompt or request.persona,
+            request.message,
+            request.context,
+            include_quality=include_quality
+        )
+        tier = model_router.candidates(request)[0]
+        try:
+            completion = await self._complete(tier.model, messages, tier.max_tokens, request, api_key)
+        except Exception as e:
+            self._counters["failures"] += 1
+            logger.warning("Speculative answer failed: %s", e, extra={"model": tier.model})
+            return None
+
+        parsed = parse_response(completion.choices[0].message.content)
+        if not parsed.message:
+            return None
+        inline_score = None
+        if parsed.quality_score is not None:
+            inline_score = QualityScore.model_construct(
+                score=parsed.quality_score,
+                reason=parsed.quality_reason or "Evaluated with the chat response"
+            )
+        quality = await quality_service.resolve(request, None, inline_score)
+        self._counters["answers"] += 1
+        return ChatResponse.create(
+            message=parsed.message,
+            quality_score=quality.score,
+            quality_reason=quality.reason,
+            prompt_version=persona_prompt.version if persona_prompt is not None else None
+        )
+
+    async def take(self, request: ChatRequest) -> Optional[ChatResponse]:
+        """
+        Serve a precomputed answer for a follow-up turn.
+
+        The request must come from the same session and persona, ask one of
+        the suggested questions and continue the conversation the suggestion
+        was made in. An answer whose generation is under way is awaited; one
+        that has not started yet is given up so the live call runs right away.
+
+        Returns:
+            Optional[ChatResponse]: The answer, or None if there is none to serve
+        """
+        if not request.session_id or not request.context or not len(self.cache):
+            return None
+        key = SpeculativeAnswerCache.key(request.session_id, request.persona, request.message)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        last = request.context[-1]
+        if getattr(last, "role", None) != MessageRole.ASSISTANT or _digest(last.content) != entry.parent:
+            return None
+
+        self.cache.pop(key)
+        if not entry.future.done():
+            if not entry.started:
+                _release(entry)
+                return None
+            self._counters["waited"] += 1
+        answer = await asyncio.shield(entry.future)
+        if answer is None:
+            return None
+        persona_prompt = prompt_manager.get_persona(request.persona)
+        if persona_prompt is not None and answer.promptVersion != persona_prompt.version:
+            self._counters["stale"] += 1
+            return None
+        self._counters["hits"] += 1
+        return answer
+
+    def _publish(self, suggestions: Suggestions):
+        """Store a session's suggestions and push them to its listeners."""
+        self._suggestions[suggestions.session_id] = suggestions
+        self._suggestions.move_to_end(suggestions.session_id)
+        while len(self._suggestions) > MAX_SESSIONS:
+            self._suggestions.popitem(last=False)
+        for listener in list(self._listeners.get(suggestions.session_id, ())):
+            task = asyncio.create_task(listener(suggestions))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def suggestions_for(self, session_id: str) -> Optional[Suggestions]:
+        """Return the latest suggestions of a session, if any."""
+        return self._suggestions.get(session_id)
+
+    def subscribe(self, session_id: str, listener: SuggestionListener):
+        """Call ``listener`` with the suggestions published for a session from now on."""
+        self._listeners.setdefault(session_id, set()).add(listener)
+
+    def unsubscribe(self, session_id: str, listener: SuggestionListener):
+        """Stop calling a listener added with ``subscribe``."""
+        listeners = self._listeners.get(session_id)
+        if listeners is not None:
+            listeners.discard(listener)
+            if not listeners:
+                del self._listeners[session_id]
+
+    def stats(self) -> Dict:
+        """Counters and current load, for the admin API."""
+        self.budget.available()
+        return {
+            "enabled": settings.speculation_enabled,
+            "live_requests": self.live_requests,
+            "active_jobs": self.active_jobs,
+            "cached_answers": len(self.cache),
+            "budget_tokens": settings.speculation_token_budget,
+            "budget_spent": self.budget.spent,
+            **self._counters,
+        }
+
+    async def stop(self):
+        """Cancel running speculation jobs (on shutdown)."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.cache.clear()
+
+
+# Create a singleton instance
+speculator = Speculator()
@@ -0,0 +1,449 @@
+"""
+Upstream token usage accounting and per-API-key quotas.
+
+Every completion's ``response.usage`` is added to per-worker counters keyed
+by (API key id, persona, model). The counters are only touched from the
+event loop, so recording needs no locks; a background task swaps them out
+and adds them to a shared store (SQLite on one host, Redis across hosts)
+every ``usage_flush_interval`` seconds.
+
+Daily and monthly token quotas are checked before the upstream call,
+against the shared totals as of the last flush plus this worker's
+unflushed usage. API keys are identified by ``api_key_id``, never stored.
+"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from app.config.settings import settings
+from app.core.metrics import usage_value
+from app.core.security import api_key_id
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS_CALLER = "anonymous"
+
+# (api key id, persona, model) -> [requests, prompt tokens, completion tokens]
+UsageCounters = Dict[Tuple[str, str, str], List[int]]
+
+
+class UsageRow(NamedTuple):
+    """Aggregated usage of one caller, persona and model on one day."""
+    day: str
+    api_key: str
+    persona: str
+    model: str
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class Quota(NamedTuple):
+    """Token limits of an API key; 0 means unlimited."""
+    daily: int
+    monthly: int
+
+
+class QuotaExceededError(Exception):
+    """Raised before an upstream call when the caller has used up its token quota."""
+
+    def __init__(self, api_key: str, period: str, used: int, limit: int, retry_after: int):
+        super().__init__(f"Token quota exceeded for {period}: {used}/{limit}")
+        self.api_key = api_key
+        self.period = period
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def parse_quota_overrides(spec: str) -> Dict[str, Quota]:
+    """
+    Parse per-key quota overrides.
+
+    The format is a comma separated list of ``<api key id>=<daily>:<monthly>``
+    entries, e.g. ``3f2a9c1d7b4e5a60=200000:5000000``.
+
+    Raises:
+        ValueError: If an entry is malformed
+    """
+    overrides = {}
+    for entry in (part.strip() for part in (spec or "").split(",")):
+        if not entry:
+            continue
+        key, _, limits = entry.partition("=")
+        daily, _, monthly = limits.partition(":")
+        if not key or not daily:
+            raise ValueError(f"Invalid usage quota entry: {entry!r}")
+        overrides[key] = Quota(daily=int(daily), monthly=int(monthly or 0))
+    return overrides
+
+
+class MemoryUsageStore:
+    """In-process usage store, for tests and single-worker development."""
+
+    def __init__(self):
+        self._rows: Dict[Tuple[str, str, str, str], List[int]] = {}
+
+    def add(self, day: str, counters: UsageCounters):
+        for (api_key, persona, model), values in counters.items():
+            row = self._rows.setdefault((day, api_key, persona, model), [0, 0, 0])
+            for i, value in enumerate(values):
+                row[i] += value
+
+    def token_totals(self, api_key: str, day: str) -> Tuple[int, int]:
+        month = day[:7]
+        daily = monthly = 0
+        for (row_day, row_key, _, _), values in self._rows.items():
+            if row_key == api_key and row_day.startswith(month):
+                tokens = values[1] + values[2]
+                monthly += tokens
+                if row_day == day:
+                    daily += tokens
+        return daily, monthly
+
+    def query(self, start_day: str, end_day: str, api_key: Optional[str] = None) -> List[UsageRow]:
+        return [
+            UsageRow(day, key, persona, model, *values)
+            for (day, key, persona, model), values in sorted(self._rows.items())
+            if start_day <= day <= end_day and (api_key is None or key == api_key)
+        ]
+
+    def close(self):
+        pass
+
+
+class SQLiteUsageStore:
+    """Usage totals in a SQLite file shared by the workers on one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS token_usage (
+                day TEXT NOT NULL,
+                api_key TEXT NOT NULL,
+                persona TEXT NOT NULL,
+                model TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, api_key, persona, model)
+            )
+            """
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def add(self, day: str, counters: UsageCounters):
+        rows = [(day, key, persona, model, *values) for (key, persona, model), values in counters.items()]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO token_usage (day, api_key, persona, model, requests, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, api_key, persona, model) DO UPDATE SET "
+                "requests = requests + excluded.requests, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens",
+                rows,
+            )
+
+    def token_totals(self, api_key: str, day: str) -> Tuple[int, int]:
+        with self._lock:
+            daily, monthly = self._conn.execute(
+                "SELECT "
+                "COALESCE(SUM(CASE WHEN day = ? THEN prompt_tokens + completion_tokens END), 0), "
+                "COALESCE(SUM(prompt_tokens + completion_tokens), 0) "
+                "FROM token_usage WHERE api_key = ? AND day LIKE ?",
+                (day, api_key, f"{day[:7]}-%"),
+            ).fetchone()
+        return daily, monthly
+
+    def query(self, start_day: str, end_day: str, api_key: Optional[str] = None) -> List[UsageRow]:
+        sql = ("SELECT day, api_key, persona, model, requests, prompt_tokens, completion_tokens "
+               "FROM token_usage WHERE day BETWEEN ? AND ?")
+        params: List[Any] = [start_day, end_day]
+        if api_key is not None:
+            sql += " AND api_key = ?"
+            params.append(api_key)
+        with self._lock:
+            return [UsageRow(*row) for row in self._conn.execute(sql + " ORDER BY day, api_key, persona, model", params)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisUsageStore:
+    """
+    Usage totals in Redis, shared by workers on every host.
+
+    Each day is a hash ``<prefix>:<day>`` with fields
+    ``<api key>|<persona>|<model>|<counter>``; per-key token totals for the
+    day and month are kept in separate counters so quota checks are O(1).
+    """
+
+    COUNTERS = ("requests", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, client, prefix: str = "nandi:usage", retention_days: int = 400):
+        self._client = client
+        self._prefix = prefix
+        self._ttl = retention_days * 86400
+
+    def add(self, day: str, counters: UsageCounters):
+        month = day[:7]
+        tokens_by_key: Dict[str, int] = {}
+        pipe = self._client.pipeline(transaction=False)
+        day_key = f"{self._prefix}:{day}"
+        for (api_key, persona, model), values in counters.items():
+            for name, value in zip(self.COUNTERS, values):
+                if value:
+                    pipe.hincrby(day_key, f"{api_key}|{persona}|{model}|{name}", value)
+            tokens_by_key[api_key] = tokens_by_key.get(api_key, 0) + values[1] + values[2]
+        pipe.expire(day_key, self._ttl)
+        for api_key, tokens in tokens_by_key.items():
+            for period in (day, month):
+                total_key = f"{self._prefix}:tokens:{period}:{api_key}"
+                pipe.incrby(total_key, tokens)
+                pipe.expire(total_key, self._ttl)
+        pipe.execute()
+
+    def token_totals(self, api_key: str, day: str) -> Tuple[int, int]:
+        daily, monthly = self._client.mget(
+            f"{self._prefix}:tokens:{day}:{api_key}",
+            f"{self._prefix}:tokens:{day[:7]}:{api_key}",
+        )
+        return int(daily or 0), int(monthly or 0)
+
+    def query(self, start_day: str, end_day: str, api_key: Optional[str] = None) -> List[UsageRow]:
+        rows: List[UsageRow] = []
+        day = datetime.strptime(start_day, "%Y-%m-%d").date()
+        end = datetime.strptime(end_day, "%Y-%m-%d").date()
+        while day <= end:
+            day_str = day.isoformat()
+            grouped: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+            for field, value in self._client.hgetall(f"{self._prefix}:{day_str}").items():
+                field = field.decode() if isinstance(field, bytes) else field
+                key, persona, model, name = field.rsplit("|", 3)
+                if api_key is None or key == api_key:
+                    grouped.setdefault((key, persona, model), {})[name] = int(value)
+            for (key, persona, model), values in sorted(grouped.items()):
+                rows.append(UsageRow(day_str, key, persona, model, *(values.get(n, 0) for n in self.COUNTERS)))
+            day += timedelta(days=1)
+        return rows
+
+    def close(self):
+        pass
+
+
+def create_store(backend: str):
+    """Create the usage store configured by ``usage_backend``."""
+    if backend == "redis":
+        import redis
+
+        return RedisUsageStore(redis.Redis(
+            host=settings.redis_host,
+            port=int(settings.redis_port),
+            password=settings.redis_password or None,
+            db=int(settings.redis_db),
+            socket_timeout=1.0,
+        ))
+    if backend == "sqlite":
+        return SQLiteUsageStore(settings.usage_db_path)
+    return MemoryUsageStore()
+
+
+def _today() -> str:
+    return datetime.utcnow().date().isoformat()
+
+
+def _seconds_until(period: str, now: datetime) -> int:
+    if period == "day":
+        boundary = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    else:
+        boundary = datetime(now.year + (now.month == 12), now.month % 12 + 1, 1)
+    return max(1, int((boundary - now).total_seconds()))
+
+
+class UsageTracker:
+    """
+    Per-worker token usage counters with periodic flushes and quota checks.
+
+    ``record`` and ``check_quota`` must be called from the event loop; store
+    I/O runs in a thread so it never blocks request handling.
+    """
+
+    def __init__(
+        self,
+        store_factory,
+        flush_interval: float = 5.0,
+        daily_quota: int = 0,
+        monthly_quota: int = 0,
+        quota_overrides: Optional[Dict[str, Quota]] = None,
+    ):
+        self._store_factory = store_factory
+        self._store = None
+        self.flush_interval = flush_interval
+        self.default_quota = Quota(daily=daily_quota, monthly=monthly_quota)
+        self.quota_overrides = quota_overrides or {}
+        self._day = _today()
+        self._pending: UsageCounters = {}
+        # api key id -> (day, daily tokens, monthly tokens) in the shared store
+        self._shared: Dict[str, Tuple[str, int, int]] = {}
+        self._shared_loaded_at: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = self._store_factory()
+        return self._store
+
+    def quota_for(self, caller: str) -> Quota:
+        """Return the token quota of an API key id."""
+        return self.quota_overrides.get(caller, self.default_quota)
+
+    def _roll_day(self, day: str) -> Optional[Tuple[str, UsageCounters]]:
+        """Start new counters when the UTC day changes; return the previous day's pending counters."""
+        if day == self._day:
+            return None
+        previous = (self._day, self._pending)
+        self._day, self._pending = day, {}
+        return previous
+
+    def record(self, api_key: Optional[str], persona: str, model: str, usage: Any):
+        """
+        Add one completion's ``response.usage`` to the counters.
+
+        Args:
+            api_key: The caller's API key (None for unauthenticated calls)
+            persona: The persona identifier
+            model: The upstream model that served the request
+            usage: The ``response.usage`` object returned by the API
+        """
+        day = _today()
+        if day != self._day:
+            previous = self._roll_day(day)
+            if previous and previous[1]:
+                self._spawn(self._write(*previous))
+        caller = api_key_id(api_key) if api_key else ANONYMOUS_CALLER
+        counters = self._pending.get((caller, persona, model))
+        if counters is None:
+            counters = self._pending[(caller, persona, model)] = [0, 0, 0]
+        counters[0] += 1
+        counters[1] += usage_value(usage, "prompt_tokens")
+        counters[2] += usage_value(usage, "completion_tokens")
+
+    def _pending_tokens(self, caller: str) -> int:
+        return sum(v[1] + v[2] for (key, _, _), v in self._pending.items() if key == caller)
+
+    async def check_quota(self, api_key: Optional[str]):
+        """
+        Raise if the caller has used up its daily or monthly token quota.
+
+        Shared totals are re-read at most once per flush interval per caller.
+
+        Raises:
+            QuotaExceededError: If a quota is exhausted
+        """
+        if not api_key:
+            return
+        caller = api_key_id(api_key)
+        quota = self.quota_for(caller)
+        if not quota.daily and not quota.monthly:
+            return
+
+        day = _today()
+        loop = asyncio.get_running_loop()
+        shared = self._shared.get(caller)
+        if shared is None or shared[0] != day or loop.time() - self._shared_loaded_at.get(caller, 0) > self.flush_interval:
+            try:
+                daily, monthly = await asyncio.to_thread(self.store.token_totals, caller, day)
+                shared = self._shared[caller] = (day, daily, monthly)
+                self._shared_loaded_at[caller] = loop.time()
+            except Exception as e:
+                logger.error("Error reading token usage for quota check: %s", e)
+                shared = shared if shared is not None and shared[0] == day else (day, 0, 0)
+
+        pending = self._pending_tokens(caller) if self._day == day else 0
+        now = datetime.utcnow()
+        for period, used, limit in (("day", shared[1] + pending, quota.daily), ("month", shared[2] + pending, quota.monthly)):
+            if limit and used >= limit:
+                raise QuotaExceededError(caller, period, used, limit, _seconds_until(period, now))
+
+    async def _write(self, day: str, counters: UsageCounters) -> bool:
+        try:
+            await asyncio.to_thread(self.store.add, day, counters)
+        except Exception as e:
+            logger.error("Error writing token usage, keeping it for the next flush: %s", e)
+            if day == self._day:
+                for key, values in counters.items():
+                    current = self._pending.setdefault(key, [0, 0, 0])
+                    for i, value in enumerate(values):
+                        current[i] += value
+            return False
+        for caller in {key for key, _, _ in counters}:
+            self._shared_loaded_at.pop(caller, None)
+        return True
+
+    async def flush(self) -> int:
+        """
+        Add the pending counters to the shared store.
+
+        Returns:
+            int: Number of counter rows written
+        """
+        previous = self._roll_day(_today())
+        if previous and previous[1]:
+            await self._write(*previous)
+        day, counters = self._day, self._pending
+        if not counters:
+            return 0
+        self._pending = {}
+        return len(counters) if await self._write(day, counters) else 0
+
+    def _spawn(self, coro):
+        try:
+            asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self):
+        """Start the periodic flush task."""
+        if self._task is None and self.flush_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run_flusher())
+
+    async def stop(self):
+        """Stop the flush task, write pending usage and close the store."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    async def query(self, start_day: str, end_day: str, caller: Optional[str] = None) -> List[UsageRow]:
+        """Flush this worker's counters and return the shared usage rows in a day range."""
+        await self.flush()
+        return await asyncio.to_thread(self.store.query, start_day, end_day, caller)
+
+
+# Create a singleton instance
+usage_tracker = UsageTracker(
+    lambda: create_store(settings.usage_backend),
+    flush_interval=settings.usage_flush_interval,
+    daily_quota=settings.usage_daily_token_quota,
+    monthly_quota=settings.usage_monthly_token_quota,
+    quota_overrides=parse_quota_overrides(settings.usage_quota_overrides),
+)
@@ -7,19 +7,22 @@ It provides a command-line interface for running the service with various option
 
 Usage:
     python run.py [--port PORT] [--host HOST] [--reload] [--test]
+    python run.py --prod [--workers N] [--max-requests N] [--max-requests-jitter N] [--no-preload]
     
 Options:
     --port PORT   Port to run the server on (default: 8000)
     --host HOST   Host to run the server on (default: 127.0.0.1)
     --reload      Enable auto-reload for development
     --test        Run tests instead of the server
+    --prod        Run the pre-fork multi-worker server (see app/core/prefork.py):
+                  SIGHUP restarts workers one by one, SIGUSR1 logs per-worker stats
 """
 
 import sys
 import os
 import uvicorn
 import argparse
-from app.config import settings
+from app.config.settings import settings
 
 
 def parse_args():
@@ -29,6 +32,11 @@ def parse_args():
     parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to run the server on")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload for development")
     parser.add_argument("--test", action="store_true", help="Run tests instead of the server")
+    parser.add_argument("--prod", action="store_true", help="Run the pre-fork multi-worker server")
+    parser.add_argument("--workers", type=int, default=settings.workers, help="Worker processes with --prod (default: one per CPU)")
+    parser.add_argument("--max-requests", type=int, default=settings.max_requests, help="Replace a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=settings.max_requests_jitter, help="Random extra requests per worker before it is replaced")
+    parser.add_argument("--no-preload", action="store_true", help="Import the app in each worker instead of once in the master")
     return parser.parse_args()
 
 
@@ -38,6 +46,39 @@ def run_tests():
     sys.exit(pytest.main(["-v"]))
 
 
+def run_production(args):
+    """Run the pre-fork multi-worker server."""
+    from app.core.prefork import PreforkServer, default_worker_count, per_worker_backends
+    
+    workers = args.workers or default_worker_count()
+    per_worker = per_worker_backends(settings)
+    if per_worker and not args.workers:
+        # Keep per-worker state consistent until it is moved to shared backends
+        workers = 1
+        print(f"Running 1 worker: {', '.join(per_worker)} keep state per worker; set WORKERS to override")
+    elif per_worker and workers > 1:
+        print(f"WARNING: {', '.join(per_worker)} keep state per worker; with {workers} workers "
+              f"leaderboards and points diverge and rate limits are multiplied by {workers}")
+    
+    if args.no_preload:
+        app = "app.main:app"
+    else:
+        # Import once in the master so workers share it copy-on-write
+        from app.main import app, preload
+        preload()
+    
+    server = PreforkServer(
+        app,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        graceful_timeout=settings.graceful_timeout,
+    )
+    sys.exit(server.run())
+
+
 def main():
     """Main entry point for the application."""
     args = parse_args()
@@ -47,17 +88,21 @@ def main():
         return
     
     # Print startup info
-    print(f"Starting Nandi AI Service in {settings.ENVIRONMENT} environment")
+    print(f"Starting Nandi AI Service in {settings.environment} environment")
     print(f"Server will run at http://{args.host}:{args.port}")
     
+    if args.prod:
+        run_production(args)
+        return
+    
     # Run the application
     uvicorn.run(
-        "server:app",
+        "app.main:app",
         host=args.host,
         port=args.port,
-        reload=args.reload and settings.ENVIRONMENT == "development"
+        reload=args.reload and settings.environment == "development"
     )
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
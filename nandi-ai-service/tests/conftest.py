@@ -18,7 +18,7 @@ os.environ["API_KEY"] = "test-api-key"
 
 # Import app after environment is set
 from fastapi.testclient import TestClient
-from server import app
+from app.main import app
 
 
 @pytest.fixture
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import random
+from unittest.mock import patch
+
+import pytest
+
+from app.core.sketches import HyperLogLog, LogHistogram
+from app.models.points import SessionMetricsRequest
+from app.services import points_service
+from app.services.analytics import Analytics, MemoryAnalyticsStore, SQLiteAnalyticsStore
+
+NOW = 1_770_000_000
+
+
+def test_histogram_quantiles_within_relative_error():
+    """Test that merged histograms report percentiles within their relative error."""
+    values = [random.Random(7).lognormvariate(6, 1) for _ in range(5000)]
+    halves = LogHistogram(), LogHistogram()
+    for i, value in enumerate(values):
+        halves[i % 2].add(value)
+    merged = LogHistogram.from_dict(halves[0].to_dict())
+    merged.merge(halves[1])
+
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(merged.quantile(q) - exact) / exact < 0.03
+    assert merged.count == 5000
+    assert len(merged.buckets) < 1000
+
+
+def test_hyperloglog_counts_distinct_across_merges():
+    """Test that distinct counts survive merging overlapping sketches."""
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        first.add(f"session-{i}")
+    for i in range(2000, 6000):
+        second.add(f"session-{i}")
+    first.merge(HyperLogLog.from_dict(second.to_dict()))
+    assert abs(first.count() - 6000) / 6000 < 0.1
+
+    small = HyperLogLog()
+    for _ in range(3):
+        small.add("anon-1")
+    small.add("anon-2")
+    assert small.count() == 2
+
+
+def test_dashboard_merges_workers(tmp_path):
+    """Test that rollups written by two workers are merged by persona."""
+    path = str(tmp_path / "analytics.db")
+    workers = [
+        Analytics(lambda: SQLiteAnalyticsStore(path), worker_id=f"w{i}", clock=lambda: NOW)
+        for i in range(2)
+    ]
+    workers[0].record_chat("karma", "anon-1", 6, 120)
+    workers[0].record_chat("karma", "anon-1", 8, 480)
+    workers[1].record_chat("karma", "anon-2", 8, 300)
+    workers[1].record_chat("atma", "anon-3", 3, 900)
+    workers[1].record_session("karma", "anon-2", 600, 12)
+
+    async def main():
+        await workers[0].flush()
+        # Repeated flushes replace a worker's copy instead of adding to it
+        await workers[0].flush()
+        workers[0].record_chat("karma", "anon-1", 7, 200)
+        return await workers[1].dashboard(3600), await workers[0].dashboard(3600, "karma")
+
+    everything, karma = asyncio.run(main())
+    for worker in workers:
+        asyncio.run(worker.stop())
+
+    assert everything["total"]["messages"] == 4
+    assert everything["total"]["distinct_sessions"] == 3
+    assert everything["personas"]["atma"]["quality"]["distribution"]["3"] == 1
+    assert karma["total"]["messages"] == 4
+    assert karma["total"]["quality"]["distribution"]["8"] == 2
+    assert karma["total"]["latency_ms"]["max"] == 480
+    assert karma["total"]["duration_seconds"]["p50"] == 600
+    assert list(karma["personas"]) == ["karma"]
+    assert karma["series"] == [{"bucket": NOW // 300 * 300, "messages": 4, "sessions": 1}]
+
+
+def test_old_buckets_are_dropped():
+    """Test that rollups older than the retention window are pruned."""
+    now = [NOW]
+    store = MemoryAnalyticsStore()
+    tracker = Analytics(lambda: store, retention_seconds=3600, worker_id="w", clock=lambda: now[0])
+    tracker.record_chat("dharma", None, 5, 100)
+    asyncio.run(tracker.flush())
+    now[0] += 7200
+    tracker.record_chat("dharma", None, 5, 100)
+
+    dashboard = asyncio.run(tracker.dashboard(86400))
+    assert dashboard["total"]["messages"] == 1
+    assert len(store.fetch(0)) == 1
+
+
+def test_session_metrics_are_recorded():
+    """Test that the session metrics API feeds the analytics rollups."""
+    tracker = Analytics(MemoryAnalyticsStore, worker_id="w", clock=lambda: NOW)
+    request = SessionMetricsRequest(persona="dharma", durationSeconds=720, messageCount=12, sessionId="anon-9")
+
+    with patch.object(points_service, "analytics", tracker):
+        asyncio.run(points_service.calculate_session_points(request))
+        dashboard = asyncio.run(tracker.dashboard(300))
+
+    dharma = dashboard["personas"]["dharma"]
+    assert dharma["sessions"] == 1 and dharma["distinct_sessions"] == 1
+    assert dharma["messages_per_session"]["p50"] == 12
+
+
+def test_analytics_endpoint(client, api_key_headers):
+    """Test the analytics admin endpoint."""
+    response = client.get("/admin/analytics", params={"window": 600, "persona": "karma"}, headers=api_key_headers)
+    assert response.status_code == 200
+    assert set(response.json()) >= {"total", "personas", "series"}
+    assert client.get("/admin/analytics", params={"window": 10 ** 7}, headers=api_key_headers).status_code == 400
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_workers_get_their_own_id():
+    """Test that a worker id is created per process, not inherited from the master."""
+    tracker = Analytics(MemoryAnalyticsStore)
+    parent = tracker.worker_id
+    reader, writer = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(writer, tracker.worker_id.encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    child = os.read(reader, 256).decode()
+    assert child != parent and f":{pid}:" in child
+    assert tracker.worker_id == parent
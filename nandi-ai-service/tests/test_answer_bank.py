@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+from unittest.mock import patch
+
+from app.models.chat import ChatRequest
+from app.services import ai_service
+from app.services.answer_bank import AnswerBank, answer_bank, terms
+
+
+def _bank(tmp_path, data):
+    path = tmp_path / "answer_bank.json"
+    path.write_text(json.dumps(data))
+    return AnswerBank(path)
+
+
+def test_terms_canonicalize_words():
+    """Test stopword removal, plural stripping and synonyms."""
+    assert terms("How can I start meditating?") == ["start", "meditate"]
+    assert terms("What are my duties?") == ["duty"]
+    assert terms("Who am I?") == ["who", "am", "i"]
+
+
+def test_match_confidence_and_threshold():
+    """Test exact, paraphrased and unrelated questions against the shipped bank."""
+    exact = answer_bank.match("karma", "what is KARMA?!")
+    assert exact.answer.id == "karma-what-is-karma" and exact.confidence == 1.0
+
+    paraphrase = answer_bank.match("atma", "How can I begin a meditation practice?")
+    assert paraphrase.answer.id == "atma-how-to-meditate"
+
+    assert answer_bank.match("karma", "What is karma yoga and how does it differ from bhakti?") is None
+    assert answer_bank.match("dharma", "What is karma?") is None
+    assert answer_bank.match("karma", "Tell me about quantum physics", threshold=0.0) is None
+
+
+def test_lookup_is_sub_millisecond():
+    """Test that a lookup takes well under a millisecond."""
+    answer_bank.load()
+    start = time.perf_counter()
+    for _ in range(1000):
+        answer_bank.match("atma", "How do I stop overthinking at night?")
+    assert (time.perf_counter() - start) / 1000 < 0.001
+
+
+def test_first_turn_question_answered_without_upstream():
+    """Test that a bank hit skips the OpenAI call."""
+    request = ChatRequest(message="How do I meditate?", persona="atma")
+    with patch("app.services.ai_service.client.chat.completions.create") as create:
+        result = asyncio.run(ai_service.generate_response(request))
+    create.assert_not_called()
+    assert result.answerId == "atma-how-to-meditate"
+    assert 1 <= result.qualityScore <= 10
+
+
+def test_follow_up_turns_go_upstream():
+    """Test that questions with conversation context are not answered from the bank."""
+    request = ChatRequest(
+        message="How do I meditate?",
+        persona="atma",
+        context=[{"role": "user", "content": "I tried breathing exercises."}]
+    )
+    with patch("app.services.ai_service.client.chat.completions.create") as create:
+        create.return_value.choices[0].message.content = "Try sitting for five minutes. [QUALITY:7:Good]"
+        result = asyncio.run(ai_service.generate_response(request))
+    create.assert_called_once()
+    assert result.answerId is None
+
+
+def test_upstream_failure_uses_closest_answer():
+    """Test that an outage falls back to the closest curated answer, then the persona default."""
+    with patch("app.services.ai_service.client.chat.completions.create", side_effect=RuntimeError("down")):
+        near = asyncio.run(ai_service.generate_response(ChatRequest(
+            message="How can I make up for past mistakes?",
+            persona="karma",
+            context=[{"role": "user", "content": "Hi"}]
+        )))
+        unrelated = asyncio.run(ai_service.generate_response(ChatRequest(
+            message="Tell me about quantum physics",
+            persona="dharma",
+            context=[{"role": "user", "content": "Hi"}]
+        )))
+    assert near.answerId == "karma-bad-karma"
+    assert unrelated.answerId == "dharma-find-purpose"
+    assert "API error" not in unrelated.message
+
+
+def test_reload_keeps_previous_bank_on_error(tmp_path):
+    """Test that a broken file leaves the loaded answers in place."""
+    bank = _bank(tmp_path, {"karma": [{"id": "k1", "questions": ["What is karma?"], "answer": "Action."}]})
+    version = bank.version
+    bank.path.write_text(json.dumps({"karma": [{"id": "k2", "answer": "No questions"}]}))
+    try:
+        bank.refresh()
+    except ValueError:
+        pass
+    assert bank.version == version
+    assert bank.match("karma", "What is karma?").answer.id == "k1"
+    assert bank.default_answer("karma") is None
@@ -98,6 +98,22 @@ def test_session_metrics_endpoint(mock_calculate, client, api_key_headers):
     mock_calculate.assert_called_once()
 
 
+@patch("app.services.points_service.calculate_session_points")
+def test_session_metrics_reject_negative_counts(mock_calculate, client, api_key_headers):
+    """Test that negative durations and message counts are rejected before any award."""
+    for field in ("durationSeconds", "messageCount"):
+        session = {"persona": "dharma", "durationSeconds": 720, "messageCount": 12, field: -1000}
+        single = client.post("/api/session/metrics", json=session, headers=api_key_headers)
+        batch = client.post(
+            "/api/session/metrics/batch",
+            json={"sessions": [session], "record": True},
+            headers=api_key_headers
+        )
+        assert single.status_code == 422
+        assert batch.status_code == 422
+    mock_calculate.assert_not_called()
+
+
 @patch("app.services.points_service.get_points_calculations")
 def test_points_calculations_endpoint(mock_get_points, client, api_key_headers):
     """Test the points calculations endpoint."""
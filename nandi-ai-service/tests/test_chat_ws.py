@@ -0,0 +1,108 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.models.chat import Persona
+from app.services.ai_service import UpstreamStream
+from app.services.chat_session import ChatSession
+
+
+def _chunks(*parts):
+    """Fake upstream stream: one delta per part, then a usage-only chunk."""
+    chunks = [
+        SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], usage=None)
+        for part in parts
+    ]
+    chunks.append(SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=12, completion_tokens=5)))
+    return chunks
+
+
+def _receive_turn(websocket):
+    """Collect frames until the turn's quality frame."""
+    frames = []
+    while True:
+        frame = websocket.receive_json()
+        frames.append(frame)
+        if frame["type"] in ("quality", "error"):
+            return frames
+
+
+def test_chat_socket_streams_tokens_and_keeps_history(client, api_key_headers):
+    """Test that tokens stream, the score arrives separately and history stays on the server."""
+    session_id = f"ws-{uuid.uuid4().hex}"
+    with patch("app.services.ai_service.client.chat.completions.create") as create:
+        create.side_effect = [
+            _chunks("Breathe ", "slowly.", " [QUALITY:", "8:Sincere question]"),
+            _chunks("Notice each breath. [QUALITY:6:Follow-up]"),
+        ]
+        with client.websocket_connect(f"/api/chat/ws?sessionId={session_id}", headers=api_key_headers) as websocket:
+            assert websocket.receive_json() == {"type": "ready", "sessionId": session_id, "persona": "karma"}
+
+            websocket.send_json({"type": "message", "message": f"How do I calm down? {session_id}"})
+            frames = _receive_turn(websocket)
+            text = "".join(f["text"] for f in frames if f["type"] == "token")
+            assert text.strip() == "Breathe slowly."
+            assert "QUALITY" not in text
+            assert frames[-2] == {"type": "message", "message": "Breathe slowly."}
+            assert frames[-1]["qualityScore"] == 8
+            assert frames[-1]["scoreReason"] == "Sincere question"
+
+            websocket.send_json({"type": "message", "message": "And then?", "persona": "atma"})
+            frames = _receive_turn(websocket)
+            assert frames[-1]["qualityScore"] == 6
+
+    assert create.call_args_list[0].kwargs["stream"] is True
+    messages = create.call_args_list[1].kwargs["messages"]
+    contents = [m["content"] for m in messages]
+    assert "Breathe slowly." in contents
+    assert contents[-1] == "And then?"
+
+
+def test_chat_socket_rejects_invalid_api_key(client):
+    """Test that connections without a valid API key are refused."""
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect("/api/chat/ws?sessionId=abc", headers={"x-api-key": "wrong"}) as websocket:
+            websocket.receive_json()
+    assert exc_info.value.code == 1008
+
+
+def test_chat_socket_control_frames(client, api_key_headers):
+    """Test ping, reset and invalid frames."""
+    with client.websocket_connect(f"/api/chat/ws?sessionId=ws-{uuid.uuid4().hex}", headers=api_key_headers) as websocket:
+        websocket.receive_json()
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+        websocket.send_json({"type": "reset"})
+        assert websocket.receive_json() == {"type": "reset"}
+        websocket.send_json({"type": "shout"})
+        error = websocket.receive_json()
+        assert error["type"] == "error" and error["status"] == 422
+
+
+def test_upstream_stream_merges_queued_chunks():
+    """Test that chunks arriving while the consumer is busy are sent as one."""
+    async def consume():
+        stream = UpstreamStream(iter(_chunks("a", "b", "c")))
+        await asyncio.sleep(0.05)
+        received = [chunk async for chunk in stream.chunks()]
+        return received, stream.usage
+
+    received, usage = asyncio.run(consume())
+    assert received == ["abc"]
+    assert usage.completion_tokens == 5
+
+
+def test_chat_session_keeps_recent_history():
+    """Test that only the last max_history messages are kept."""
+    session = ChatSession("s1", Persona.KARMA, max_history=4)
+    assert session.build_request("first").context is None
+    for i in range(3):
+        session.record(f"question {i}", f"answer {i}")
+    request = session.build_request("next", Persona.DHARMA)
+    assert [m.content for m in request.context] == ["question 1", "answer 1", "question 2", "answer 2"]
+    assert request.persona == Persona.DHARMA
+    assert session.turns == 3
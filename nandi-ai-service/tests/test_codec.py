@@ -0,0 +1,75 @@
+import json
+from unittest.mock import patch
+
+from app.core import cache
+from app.config.prompt_loader import prompt_manager
+from app.core.codec import FastJSONResponse, dumps, encode_model
+from app.models.chat import ChatResponse
+
+
+def test_fast_json_response_renders_compact_json():
+    """Test that responses are rendered as compact UTF-8 JSON."""
+    response = FastJSONResponse({"message": "ॐ", "scores": [1, 2]})
+    assert response.body == '{"message":"ॐ","scores":[1,2]}'.encode("utf-8")
+    assert dumps({1: "a"}) == b'{"1":"a"}'
+
+
+def test_chat_response_encoded_once():
+    """Test that a response is encoded on the first call only, without None fields."""
+    result = ChatResponse.create("Be present.", 7, "Good question")
+    with patch("app.models.chat.encode_model", wraps=encode_model) as encoder:
+        body = result.to_json_bytes()
+        assert result.to_json_bytes() is body
+    assert encoder.call_count == 1
+    assert json.loads(body) == result.model_dump(exclude_none=True)
+    assert "promptVersion" not in json.loads(body)
+
+
+def test_cache_hit_served_from_encoded_bytes(client, api_key_headers):
+    """Test that a cache hit writes the bytes encoded when it was cached."""
+    cache.response_cache.clear()
+    version = prompt_manager.get_persona("karma").version
+    cached = ChatResponse.create("Breathe.", 8, "Thoughtful question", prompt_version=version)
+    cache.save_to_cache("karma", "What is breath?", cached)
+    assert cached._json is not None
+    
+    with patch("app.models.chat.encode_model") as encoder:
+        response = client.post(
+            "/api/chat/generate",
+            json={"message": "What is breath?", "persona": "karma"},
+            headers=api_key_headers
+        )
+    cache.response_cache.clear()
+    
+    assert response.status_code == 200
+    assert response.content == cached.to_json_bytes()
+    assert response.headers["content-type"] == "application/json"
+    assert "x-ratelimit-limit" in response.headers
+    encoder.assert_not_called()
+
+
+def test_invalid_body_rejected_with_422(client, api_key_headers):
+    """Test that the one-pass decoder reports errors like FastAPI does."""
+    response = client.post(
+        "/api/chat/generate",
+        json={"message": "Hi", "persona": "unknown"},
+        headers=api_key_headers
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "persona"]
+    
+    response = client.post("/api/chat/generate", content=b"{not json", headers=api_key_headers)
+    assert response.status_code == 422
+
+
+def test_batch_points_decoded_and_encoded(client, api_key_headers):
+    """Test the batch endpoint through the fast decoder and encoder."""
+    sessions = [{"persona": "karma", "durationSeconds": 600, "messageCount": 6}] * 3
+    response = client.post(
+        "/api/session/metrics/batch",
+        json={"sessions": sessions, "format": "columns"},
+        headers=api_key_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["columns"]["pointsEarned"] == [response.json()["columns"]["pointsEarned"][0]] * 3
+    assert "x-ratelimit-remaining" in response.headers
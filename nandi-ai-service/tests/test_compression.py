@@ -0,0 +1,62 @@
+import gzip
+import json
+import uuid
+from unittest.mock import patch
+
+from app.core import cache
+from app.core.compression import compress, decompress, negotiate
+from app.config.prompt_loader import prompt_manager
+from app.models.chat import ChatResponse
+
+
+def test_negotiate_uses_q_values_then_server_preference():
+    """Test Accept-Encoding negotiation."""
+    encodings = ["zstd", "br", "gzip"]
+    assert negotiate("gzip, br", encodings) == "br"
+    assert negotiate("gzip;q=1.0, br;q=0.5", encodings) == "gzip"
+    assert negotiate("*", encodings) == "zstd"
+    assert negotiate("br;q=0, *;q=0.1", encodings) == "zstd"
+    assert negotiate("identity", encodings) is None
+    assert negotiate("gzip;q=0", encodings) is None
+    assert negotiate(None, encodings) is None
+
+
+def test_gzip_round_trip():
+    """Test that compressed bodies decompress to the original bytes."""
+    body = b'{"message":"' + b"breathe " * 200 + b'"}'
+    compressed = compress(body, "gzip")
+    assert len(compressed) < len(body)
+    assert decompress(compressed, "gzip") == body
+
+
+def test_large_responses_are_compressed(client):
+    """Test that the middleware compresses large JSON responses the client accepts compressed."""
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.json()["info"]["title"] == "Nandi AI Service"
+
+    response = client.get("/openapi.json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_cache_hit_served_precompressed(client, api_key_headers):
+    """Test that cache hits are written out from the bytes compressed when they were cached."""
+    cache.response_cache.clear()
+    version = prompt_manager.get_persona("karma").version
+    message = f"What is stillness? {uuid.uuid4().hex}"
+    cached = ChatResponse.create("Stillness is " + "being here, now. " * 60, 8, "Thoughtful", prompt_version=version)
+    cache.save_to_cache("karma", message, cached)
+    stored = cached._compressed["gzip"]
+
+    with patch("app.models.chat.compress") as compressor, patch("app.core.compression.compress") as middleware_compressor:
+        response = client.post(
+            "/api/chat/generate",
+            json={"message": message, "persona": "karma"},
+            headers={**api_key_headers, "Accept-Encoding": "gzip"}
+        )
+    compressor.assert_not_called()
+    middleware_compressor.assert_not_called()
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == json.loads(gzip.decompress(stored))
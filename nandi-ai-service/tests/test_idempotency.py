@@ -0,0 +1,130 @@
+import asyncio
+import uuid
+from unittest.mock import patch
+
+from app.core.idempotency import (
+    IdempotencyManager,
+    IdempotencyRecord,
+    MemoryIdempotencyStore,
+    Pending,
+    decode_record,
+    encode_record,
+)
+from app.models.chat import ChatResponse
+
+
+CHAT_RESULT = {
+    "message": "Be present.",
+    "id": "chat-response-123456",
+    "timestamp": "2024-05-01T10:00:00Z",
+    "qualityScore": 7,
+    "scoreReason": "Good question"
+}
+
+
+@patch("app.services.ai_service.generate_response")
+def test_duplicate_chat_request_is_replayed(mock_generate, client, api_key_headers):
+    """Test that a retried request gets the stored bytes without running again."""
+    mock_generate.return_value = CHAT_RESULT
+    headers = {**api_key_headers, "Idempotency-Key": uuid.uuid4().hex}
+    body = {"message": "What is presence?", "persona": "karma"}
+
+    first = client.post("/api/chat/generate", json=body, headers=headers)
+    second = client.post("/api/chat/generate", json=body, headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert mock_generate.call_count == 1
+
+    # Same key, different body
+    reused = client.post("/api/chat/generate", json={**body, "message": "Other"}, headers=headers)
+    assert reused.status_code == 422
+    assert mock_generate.call_count == 1
+
+
+@patch("app.services.points_service.calculate_session_points")
+def test_failed_request_is_not_stored(mock_points, client, api_key_headers):
+    """Test that a failed request runs again on retry."""
+    mock_points.side_effect = RuntimeError("ledger down")
+    headers = {**api_key_headers, "Idempotency-Key": uuid.uuid4().hex}
+    body = {"persona": "karma", "durationSeconds": 600, "messageCount": 10, "sessionId": "s-1"}
+
+    assert client.post("/api/session/metrics", json=body, headers=headers).status_code == 500
+    assert client.post("/api/session/metrics", json=body, headers=headers).status_code == 500
+    assert mock_points.call_count == 2
+
+
+def test_concurrent_duplicates_share_one_execution():
+    """Test that duplicates arriving while a request runs wait for its response."""
+    manager = IdempotencyManager(MemoryIdempotencyStore(), ttl=60, wait_timeout=5)
+    calls = []
+
+    async def execute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return IdempotencyRecord(200, "application/json", b'{"ok":true}', "fp")
+
+    async def main():
+        return await asyncio.gather(*(manager.run("k", "fp", execute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [replayed for _, replayed in results].count(False) == 1
+    assert all(record.body == b'{"ok":true}' for record, _ in results)
+
+
+def test_reservation_outlives_wait_timeout_while_running():
+    """Test that a request running longer than wait_timeout keeps its key reserved."""
+    store = MemoryIdempotencyStore()
+    manager = IdempotencyManager(store, ttl=60, wait_timeout=0.06)
+
+    async def execute():
+        await asyncio.sleep(0.2)
+        return IdempotencyRecord(200, "application/json", b"{}", "fp")
+
+    async def main():
+        task = asyncio.create_task(manager.run("k", "fp", execute))
+        await asyncio.sleep(0.15)
+        # What another worker would see after the original lock TTL
+        held = store.get("k")
+        await task
+        return held
+
+    assert asyncio.run(main()) == Pending("fp")
+    assert isinstance(store.get("k"), IdempotencyRecord)
+
+def test_memory_store_reservations_expire():
+    """Test reservations, TTLs and the size bound of the memory store."""
+    now = [0.0]
+    store = MemoryIdempotencyStore(max_entries=2, clock=lambda: now[0])
+    assert store.reserve("a", "fp", lock_ttl=10) is None
+    assert store.reserve("a", "fp", lock_ttl=10) == Pending("fp")
+    now[0] = 11
+    assert store.reserve("a", "fp", lock_ttl=10) is None
+    store.reserve("b", "fp", lock_ttl=10)
+    store.reserve("c", "fp", lock_ttl=10)
+    assert len(store) == 2 and store.get("a") is None
+
+
+def test_record_encoding_round_trip():
+    """Test the Redis value format keeps the body byte-for-byte."""
+    record = IdempotencyRecord(201, "application/json", b'{"a":"x\\ny"}\n', "abc")
+    assert decode_record(encode_record(record)) == record
+
+
+@patch("app.services.ai_service.generate_response")
+def test_replay_of_compressed_response(mock_generate, client, api_key_headers):
+    """Test that a stored compressed response is decompressed for a retry that does not accept it."""
+    mock_generate.return_value = ChatResponse.create("Let go. " * 200, 8, "Sincere question")
+    headers = {**api_key_headers, "Idempotency-Key": uuid.uuid4().hex}
+    body = {"message": "How do I let go?", "persona": "karma", "context": [{"role": "user", "content": "Hi"}]}
+
+    first = client.post("/api/chat/generate", json=body, headers={**headers, "Accept-Encoding": "gzip"})
+    assert first.headers["content-encoding"] == "gzip"
+    replay = client.post("/api/chat/generate", json=body, headers={**headers, "Accept-Encoding": "identity"})
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert "content-encoding" not in replay.headers
+    assert replay.json() == first.json()
+    assert mock_generate.call_count == 1
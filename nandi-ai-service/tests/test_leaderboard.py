@@ -0,0 +1,129 @@
+import os
+import random
+from unittest.mock import patch
+
+from app.core import prefork
+from app.core.circuit_breaker import CircuitBreaker
+from app.services.leaderboard import Leaderboard, RedisLeaderboardStore, ScoreIndex
+from app.services.points_ledger import MemoryLedgerStore, PointsLedger
+
+
+def test_score_index_matches_sorted_ranking():
+    """Test rank, top-N and percentile against a brute-force sort, including bucket growth."""
+    rng = random.Random(7)
+    index = ScoreIndex(bucket_width=10, initial_buckets=4)
+    scores = {}
+    for _ in range(2000):
+        owner = f"user:{rng.randrange(300)}"
+        delta = rng.randrange(1, 120)
+        scores[owner] = index.increment(owner, delta)
+
+    ordered = sorted(scores.values(), reverse=True)
+    for owner, score in list(scores.items())[:50]:
+        entry = index.rank(owner)
+        assert entry.rank == ordered.index(score) + 1
+        assert entry.size == len(scores)
+
+    top = index.top(25)
+    assert [e.points for e in top] == ordered[:25]
+    assert top[0].rank == 1 and top[0].percentile == 100.0
+
+
+def test_score_index_ties_share_rank():
+    """Test competition ranking for tied scores."""
+    index = ScoreIndex(bucket_width=50)
+    for owner, score in (("a", 100), ("b", 90), ("c", 90), ("d", 80)):
+        index.set(owner, score)
+
+    assert [(e.owner, e.rank) for e in index.top(10)] == [("a", 1), ("c", 2), ("b", 2), ("d", 4)]
+    assert index.rank("d").percentile == 25.0
+    assert index.rank("missing") is None
+
+
+def test_leaderboard_fed_by_ledger_with_snapshot(tmp_path):
+    """Test global and persona boards fed by ledger awards, and snapshot reload."""
+    ledger = PointsLedger(MemoryLedgerStore)
+    path = str(tmp_path / "leaderboard.json")
+    board = Leaderboard(bucket_width=5, snapshot_path=path)
+    ledger.add_listener(board.on_award)
+
+    ledger.award("user:1", 30, persona="karma")
+    ledger.award("user:2", 20, persona="atma")
+    ledger.award("user:2", 25, persona="karma")
+
+    assert [(e.owner, e.points) for e in board.top(10)] == [("user:2", 45), ("user:1", 30)]
+    assert [(e.owner, e.points) for e in board.top(10, persona="karma")] == [("user:1", 30), ("user:2", 25)]
+    assert board.rank("user:1").rank == 2
+    assert board.rank("user:1", persona="atma") is None
+
+    assert board.save_snapshot() is True
+    assert board.save_snapshot() is False  # Unchanged since the last snapshot
+
+    restored = Leaderboard(bucket_width=5, snapshot_path=path)
+    assert restored.load_snapshot() == 3
+    assert restored.rank("user:2", persona="atma").points == 20
+    assert restored.top(1)[0].owner == "user:2"
+    ledger.close()
+
+
+def test_redis_move_is_one_script_call():
+    """Test that moving an owner's scores runs atomically in Redis."""
+    calls = []
+
+    class Client:
+        def register_script(self, script):
+            return lambda keys, args: calls.append((keys, args))
+
+    store = RedisLeaderboardStore(Client(), prefix="lb")
+    store.move(["global", "karma"], "anon:s-1", "user:42")
+    assert calls == [(["lb:global", "lb:karma"], ["anon:s-1", "user:42"])]
+
+
+def test_prefork_workers_snapshot_to_their_own_files(tmp_path):
+    """Test that each pre-fork worker writes and reloads its own snapshot."""
+    path = str(tmp_path / "board.json")
+    board = Leaderboard(snapshot_path=path)
+    ledger = PointsLedger(MemoryLedgerStore)
+    ledger.add_listener(board.on_award)
+    ledger.award("user:1", 10, persona="karma")
+
+    with patch.object(prefork, "worker_slot", 2):
+        assert board.save_snapshot() is True
+        assert Leaderboard(snapshot_path=path).load_snapshot() == 2
+    assert os.listdir(tmp_path) == ["board.2.json"]
+    assert Leaderboard(snapshot_path=path).load_snapshot() == 0
+
+
+def test_shared_updates_are_mirrored_in_order_after_an_outage():
+    """Test that awards are queued for the shared store and retried once it is back."""
+    now = [0.0]
+    sent = []
+    down = [True]
+
+    class Store:
+        def increment(self, increments):
+            if down[0]:
+                raise ConnectionError("redis down")
+            sent.append(("increment", increments))
+
+        def move(self, boards, source, target):
+            sent.append(("move", source, target))
+
+    board = Leaderboard(shared_store=Store(), breaker=CircuitBreaker("test", cooldown=5, clock=lambda: now[0]))
+    ledger = PointsLedger(MemoryLedgerStore)
+    ledger.add_listener(board.on_award)
+    ledger.award("anon:s-1", 10)
+
+    assert board.flush_shared() == 0
+    ledger.award("anon:s-1", 5)
+    board.merge_owner("anon:s-1", "user:1", 15)
+    down[0] = False
+    assert board.flush_shared() == 0  # Still cooling down
+    assert [e.points for e in board.top()] == [15]  # Served locally meanwhile
+
+    now[0] += 5
+    assert board.flush_shared() == 3
+    assert sent == [
+        ("increment", [("global", "anon:s-1", 10), ("global", "anon:s-1", 5)]),
+        ("move", "anon:s-1", "user:1"),
+    ]
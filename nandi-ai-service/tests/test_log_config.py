@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+
+import pytest
+
+from app.core.log_config import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SamplingFilter,
+    bind_log_context,
+    configure_logging,
+    reset_log_context,
+    shutdown_logging,
+)
+
+
+def test_records_are_written_by_listener_as_json(tmp_path):
+    """Test the queue pipeline: JSON lines with bound context and extra fields, written off-thread."""
+    log_file = tmp_path / "service.log"
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    try:
+        configure_logging(level=logging.INFO, log_format="json", log_file=str(log_file))
+        token = bind_log_context(request_id="req-1", persona="karma")
+        logging.getLogger("app.test").info("Answered in %d ms", 12, extra={"cache": "hit"})
+        reset_log_context(token)
+        logging.getLogger("app.test").debug("Filtered by level")
+        shutdown_logging()
+
+        lines = [json.loads(line) for line in log_file.read_text().splitlines()]
+    finally:
+        shutdown_logging()
+        root.handlers[:] = saved_handlers
+        root.setLevel(saved_level)
+
+    assert len(lines) == 1
+    assert lines[0]["message"] == "Answered in 12 ms"
+    assert lines[0]["request_id"] == "req-1"
+    assert lines[0]["persona"] == "karma"
+    assert lines[0]["cache"] == "hit"
+
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    """Test that enqueueing never formats the message and never blocks."""
+    import queue
+
+    class Expensive:
+        formatted = 0
+
+        def __str__(self):
+            Expensive.formatted += 1
+            return "expensive"
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    for _ in range(3):
+        handler.handle(logging.LogRecord("app", logging.INFO, "", 0, "%s", (Expensive(),), None))
+
+    assert Expensive.formatted == 0
+    assert handler.dropped == 2
+    assert json.loads(JsonFormatter().format(handler.queue.get_nowait()))["message"] == "expensive"
+
+
+def test_sampling_only_affects_info_of_listed_loggers():
+    """Test that sampling keeps warnings and other loggers' records."""
+    sampler = SamplingFilter(0.0, ["app.services.ai_service"])
+
+    def record(name, level):
+        return logging.LogRecord(name, level, "", 0, "msg", (), None)
+
+    assert not sampler.filter(record("app.services.ai_service", logging.INFO))
+    assert sampler.filter(record("app.services.ai_service", logging.WARNING))
+    assert sampler.filter(record("app.services.points_service", logging.INFO))
+
+
+@pytest.mark.benchmark
+def test_benchmark_enqueue_cost():
+    """Logging an emitted record costs a queue put, not disk I/O."""
+    import queue
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=100000))
+    log = logging.getLogger("app.bench.enqueue")
+    log.propagate = False
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    start = time.perf_counter()
+    for i in range(10000):
+        log.info("Generated response %d", i, extra={"cache": "miss"})
+    elapsed = time.perf_counter() - start
+    log.removeHandler(handler)
+
+    assert handler.queue.qsize() == 10000
+    assert elapsed / 10000 < 0.001
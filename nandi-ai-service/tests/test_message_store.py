@@ -0,0 +1,193 @@
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from app.models.chat import ChatRequest
+from app.services import ai_service
+from app.services.message_store import (
+    ChatMessageRecord,
+    MemoryMessageStore,
+    MessageStore,
+    SQLiteMessageStore,
+    _file_lock,
+    copy_text,
+)
+
+
+class FlakyStore(MemoryMessageStore):
+    """Memory store that fails while ``fail`` is set."""
+    fail = True
+
+    def insert_many(self, records):
+        if self.fail:
+            raise ConnectionError("database down")
+        super().insert_many(records)
+
+
+def _spilled(path):
+    """Rows waiting in a spill file, including one being replayed."""
+    files = [path, path.with_name(path.name + ".replay")]
+    return sum(len(f.read_text().splitlines()) for f in files if f.exists())
+
+
+def _record(content, created_at=datetime(2026, 3, 1, 12)):
+    return ChatMessageRecord("USER", content, "KARMA", None, "anon-1", None, created_at, 6)
+
+
+def test_generate_response_queues_both_messages():
+    """Test that a chat turn is queued as a user and an AI row."""
+    store = MemoryMessageStore()
+    messages = MessageStore(lambda: store, flush_interval=60)
+    request = ChatRequest(
+        message="How do I stay patient?",
+        persona="karma",
+        session_id="anon-1",
+        context=[{"role": "user", "content": "Hi"}]
+    )
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content="Breathe first. [QUALITY:6:Sincere]"))]
+
+    with patch.object(ai_service, "message_store", messages), \
+            patch("app.services.ai_service.client.chat.completions.create", return_value=response):
+        asyncio.run(ai_service.generate_response(request))
+    messages.close()
+
+    user, ai = store.records
+    assert (user.type, user.content, user.persona, user.quality_score) == ("USER", "How do I stay patient?", "KARMA", 6)
+    assert (ai.type, ai.content, ai.quality_score) == ("AI", "Breathe first.", None)
+    assert user.anonymous_session_id == ai.anonymous_session_id == "anon-1"
+    assert user.user_id is None
+
+
+def test_batches_reach_sqlite(tmp_path):
+    """Test that queued rows are written to SQLite in batches."""
+    path = str(tmp_path / "messages.db")
+    messages = MessageStore(lambda: SQLiteMessageStore(path), batch_size=2, flush_interval=60)
+    messages.enqueue([_record(f"Question {i}") for i in range(5)])
+    messages.flush()
+    assert messages.pending == 0
+    messages.close()
+
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute("SELECT content, persona, quality_score FROM chat_messages ORDER BY id").fetchall()
+    assert rows == [(f"Question {i}", "KARMA", 6) for i in range(5)]
+
+
+def test_outage_spills_and_replays_in_order(tmp_path):
+    """Test that rows survive a database outage in the spill file and are written first afterwards."""
+    spill = tmp_path / "messages.spill"
+    store = FlakyStore()
+    messages = MessageStore(lambda: store, batch_size=10, flush_interval=60, spill_path=str(spill))
+    messages.enqueue([_record("first"), _record("second"), _record("third")])
+
+    assert messages.flush() == 0
+    assert messages.pending == 0
+    assert _spilled(spill) == 3
+
+    messages.enqueue([_record("fourth")])
+    store.fail = False
+    assert messages.flush() == 4
+    assert [r.content for r in store.records] == ["first", "second", "third", "fourth"]
+    assert messages.spill_size() == 0
+    assert messages.stats()["replayed"] == 3
+    messages.close()
+
+
+def test_flush_without_spilled_rows_creates_no_lock_files(tmp_path):
+    """Test that flushing with an empty spill path leaves the directory untouched."""
+    store = MemoryMessageStore()
+    messages = MessageStore(lambda: store, flush_interval=60, spill_path=str(tmp_path / "messages.spill"))
+    messages.enqueue([_record("hello")])
+
+    assert messages.flush() == 1
+    assert list(tmp_path.iterdir()) == []
+    messages.close()
+
+
+def test_queue_is_bounded(tmp_path):
+    """Test that rows beyond max_pending go to the spill file, or are dropped without one."""
+    spill = tmp_path / "messages.spill"
+    messages = MessageStore(FlakyStore, flush_interval=60, max_pending=2, spill_path=str(spill))
+    messages.enqueue([_record(str(i)) for i in range(5)])
+    assert _spilled(spill) >= 3
+    messages.close()
+
+    unspilled = MessageStore(FlakyStore, flush_interval=60, max_pending=2)
+    unspilled.enqueue([_record(str(i)) for i in range(5)])
+    # A failed write keeps the rows queued when there is nowhere to spill them
+    assert unspilled.flush() == 0
+    assert unspilled.pending == 2
+    assert unspilled.stats()["dropped"] == 3
+    unspilled.close()
+
+
+def test_copy_text_escapes_values():
+    """Test the COPY text format used for PostgreSQL."""
+    row = ("USER", "Line one\nTab\there \\ end", "KARMA", None, "anon-1", None, datetime(2026, 3, 1, 12, 30), 7)
+    assert copy_text([row]) == (
+        "USER\tLine one\\nTab\\there \\\\ end\tKARMA\t\\N\tanon-1\t\\N\t2026-03-01 12:30:00\t7\n"
+    )
+
+
+class PickyStore(MemoryMessageStore):
+    """Memory store that rejects rows whose content is "bad", like a constraint violation."""
+
+    def insert_many(self, records):
+        if any(r.content == "bad" for r in records):
+            raise ValueError("violates foreign key constraint")
+        super().insert_many(records)
+
+
+def test_rejected_rows_are_isolated(tmp_path):
+    """Test that a row the store rejects is dead-lettered without holding back the others."""
+    store = PickyStore()
+    dead_letter = tmp_path / "messages.rejected"
+    messages = MessageStore(lambda: store, batch_size=10, flush_interval=60, dead_letter_path=str(dead_letter))
+    messages.enqueue([_record(c) for c in ("1", "2", "bad", "4", "5", "6")])
+
+    assert messages.flush() == 5
+    assert [r.content for r in store.records] == ["1", "2", "4", "5", "6"]
+    assert messages.stats()["rejected"] == 1 and messages.stats()["failures"] == 0
+    assert '"content": "bad"' in dead_letter.read_text()
+    messages.close()
+
+
+def test_unstorable_session_ids_are_skipped():
+    """Test that turns of a session id longer than the schema allows are not queued."""
+    store = MemoryMessageStore()
+    messages = MessageStore(lambda: store, flush_interval=60)
+    request = ChatRequest(message="Hi\x00", persona="karma", session_id="s" * 101)
+    response = MagicMock(message="Hello", qualityScore=5)
+    messages.record_turn(request, response)
+    assert messages.pending == 0
+
+    messages.record_turn(request.model_copy(update={"session_id": "anon-1"}), response)
+    messages.flush()
+    assert store.records[0].content == "Hi"
+    messages.close()
+
+
+def test_one_worker_replays_a_shared_spill_file(tmp_path):
+    """Test that workers sharing a spill file do not replay it twice."""
+    spill = tmp_path / "messages.spill"
+    spill.write_text("".join(_record(str(i)).to_json() + "\n" for i in range(20)))
+    store = MemoryMessageStore()
+    workers = [MessageStore(lambda: store, flush_interval=60, spill_path=str(spill)) for _ in range(2)]
+    for worker in workers:
+        worker.enqueue([_record("new")])
+
+    with _file_lock(f"{spill}.replay.lock"):
+        # Another worker is replaying: this one leaves the spill file alone
+        assert workers[0].flush() == 1
+        assert _spilled(spill) == 20
+
+    threads = [threading.Thread(target=worker.flush) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(r.content for r in store.records) == sorted([str(i) for i in range(20)] + ["new", "new"])
+    for worker in workers:
+        worker.close()
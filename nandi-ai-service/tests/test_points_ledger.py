@@ -0,0 +1,154 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from app.models.chat import Persona
+from app.models.points import SessionMetricsRequest
+from app.services.points_ledger import (
+    MemoryLedgerStore,
+    PointsLedger,
+    PostgresLedgerStore,
+    SQLiteLedgerStore,
+    owner_key,
+)
+
+
+def test_totals_and_streaks_are_incremental():
+    """Test totals and consecutive-day streaks without reading the store."""
+    ledger = PointsLedger(MemoryLedgerStore)
+    day1 = datetime(2026, 3, 1, 9)
+
+    assert ledger.award("user:1", 10, created_at=day1) == 10
+    assert ledger.award("user:1", 5, created_at=day1 + timedelta(hours=3)) == 15
+    ledger.award("user:1", 7, created_at=day1 + timedelta(days=1))
+
+    assert ledger.get_total("user:1") == 22
+    assert ledger.get_streak("user:1", today=date(2026, 3, 2)) == 2
+    assert ledger.preview_streak("user:1", date(2026, 3, 3)) == 3
+    assert ledger.preview_streak("user:1", date(2026, 3, 5)) == 1
+    assert ledger.get_streak("user:1", today=date(2026, 3, 5)) == 0
+    assert ledger.preview_streak(None) == 1
+    ledger.close()
+
+
+def test_write_behind_batches_and_reload(tmp_path):
+    """Test that queued awards reach SQLite in batches and state survives a restart."""
+    path = str(tmp_path / "ledger.db")
+    ledger = PointsLedger(lambda: SQLiteLedgerStore(path), batch_size=2, flush_interval=60)
+    start = datetime(2026, 3, 1, 12)
+    for day in range(3):
+        ledger.award("anon:abc", 4, created_at=start + timedelta(days=day))
+
+    # Reaching batch_size wakes the background writer; flush drains the rest
+    ledger.flush()
+    assert ledger.pending == 0
+    ledger.close()
+
+    reloaded = PointsLedger(lambda: SQLiteLedgerStore(path))
+    assert reloaded.get_total("anon:abc") == 12
+    assert reloaded.get_streak("anon:abc", today=date(2026, 3, 3)) == 3
+    reloaded.close()
+
+
+def test_failed_flush_keeps_awards_queued():
+    """Test that a store outage does not lose awards."""
+    class FailingStore(MemoryLedgerStore):
+        fail = True
+
+        def append_many(self, awards):
+            if self.fail:
+                raise ConnectionError("database down")
+            super().append_many(awards)
+
+    store = FailingStore()
+    ledger = PointsLedger(lambda: store, flush_interval=60)
+    ledger.award("user:2", 3)
+
+    assert ledger.flush() == 0
+    assert ledger.pending == 1
+    store.fail = False
+    assert ledger.flush() == 1
+    assert len(store.awards) == 1
+    ledger.close()
+
+
+@pytest.mark.asyncio
+async def test_session_points_accumulate_per_owner():
+    """Test that /api/session/metrics totals come from the ledger."""
+    from unittest.mock import patch
+    from app.services import points_service
+
+    ledger = PointsLedger(MemoryLedgerStore, flush_interval=60)
+    request = SessionMetricsRequest(
+        persona=Persona.KARMA, durationSeconds=120, messageCount=2, sessionId="anon_1"
+    )
+    with patch.object(points_service, "points_ledger", ledger):
+        first = await points_service.calculate_session_points(request)
+        second = await points_service.calculate_session_points(request)
+
+    assert first.pointsEarned == 17  # 10 (base) + 2 (duration) + 5 (streak)
+    assert second.totalPoints == 34
+    assert second.streakDays == 1
+    assert ledger.get_total(owner_key(session_id="anon_1")) == 34
+    ledger.close()
+
+
+def test_refresh_sees_other_workers_awards(tmp_path):
+    """Test that a worker's view picks up awards written by another worker."""
+    path = str(tmp_path / "ledger.db")
+    first = PointsLedger(lambda: SQLiteLedgerStore(path), flush_interval=60)
+    second = PointsLedger(lambda: SQLiteLedgerStore(path), flush_interval=60)
+    first.award("user:1", 10, created_at=datetime(2026, 3, 1, 12))
+    second.award("user:1", 5, created_at=datetime(2026, 3, 2, 12))
+    first.flush()
+    second.award("user:1", 1, created_at=datetime(2026, 3, 3, 12))
+
+    # The queued award is kept on top of what the store has
+    assert second.refresh() == 1
+    assert second.get_total("user:1") == 16
+    assert second.get_streak("user:1", today=date(2026, 3, 3)) == 3
+    second.flush()
+    first.refresh()
+    assert first.get_total("user:1") == 16
+    first.close()
+    second.close()
+
+
+def test_refresh_reads_only_new_rows(tmp_path):
+    """Test that a refresh applies the rows written since the last one instead of reloading the store."""
+    class CountingStore(SQLiteLedgerStore):
+        loads = 0
+
+        def load_state(self):
+            CountingStore.loads += 1
+            return super().load_state()
+
+    path = str(tmp_path / "ledger.db")
+    first = PointsLedger(lambda: CountingStore(path), flush_interval=60)
+    second = PointsLedger(lambda: SQLiteLedgerStore(path), flush_interval=60)
+    first.award("user:1", 10)
+    first.flush()
+    second.award("user:2", 5)
+    second.flush()
+
+    assert first.refresh() == 1
+    assert first.refresh() == 0
+    assert first.totals() == {"user:1": 10, "user:2": 5}
+    assert CountingStore.loads == 1
+    first.close()
+    second.close()
+
+
+
+def test_owners_the_store_cannot_hold_are_rejected():
+    """Test that an award for an invalid owner fails before anything is queued."""
+    class NumericStore(MemoryLedgerStore):
+        validate_owner = PostgresLedgerStore.validate_owner
+
+    ledger = PointsLedger(NumericStore)
+    assert ledger.award("user:42", 5) == 5
+    assert ledger.award("anon:s-1", 5) == 5
+    with pytest.raises(ValueError):
+        ledger.award("user:alice", 5)
+    assert ledger.get_total("user:alice") == 0
+    assert ledger.pending == 2
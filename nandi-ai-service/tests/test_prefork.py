@@ -0,0 +1,124 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.prefork import (
+    HAS_REUSEPORT,
+    RequestCounter,
+    WorkerStats,
+    bind_socket,
+    per_worker_backends,
+    select_implementations,
+    worker_log_file,
+)
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_worker_stats_table():
+    """Test updating, reading and clearing per-worker slots."""
+    stats = WorkerStats(3)
+    stats.update(1, pid=42, started_at=time.time() - 5, requests=7, max_rss_kb=2048)
+    rows = stats.snapshot()
+    assert [row["pid"] for row in rows] == [42]
+    assert rows[0]["slot"] == 1 and rows[0]["requests"] == 7 and rows[0]["max_rss_mb"] == 2.0
+    stats.clear(1)
+    assert stats.snapshot() == []
+
+
+def test_worker_log_file_and_implementations():
+    """Test per-worker log files and loop/parser selection."""
+    assert worker_log_file("nandi_service.log", 2) == "nandi_service.2.log"
+    assert worker_log_file("", 2) == ""
+    loop, http = select_implementations()
+    assert loop in ("uvloop", "asyncio") and http in ("httptools", "h11")
+
+
+def test_per_worker_backends_are_reported():
+    """Test the check used by the pre-fork launcher."""
+    config = SimpleNamespace(leaderboard_backend="memory", rate_limit_backend="redis", points_ledger_backend="sqlite")
+    assert per_worker_backends(config) == ["LEADERBOARD_BACKEND=memory"]
+
+
+@pytest.mark.skipif(not HAS_REUSEPORT, reason="SO_REUSEPORT not supported")
+def test_reuse_port_sockets_share_a_port():
+    """Test that several workers can bind the same port."""
+    first = bind_socket("127.0.0.1", 0, reuse_port=True)
+    port = first.getsockname()[1]
+    second = bind_socket("127.0.0.1", port, reuse_port=True)
+    assert second.getsockname()[1] == port
+    first.close()
+    second.close()
+
+
+def test_request_counter_counts_http_requests():
+    """Test that only HTTP requests are counted."""
+    async def app(scope, receive, send):
+        pass
+
+    counter = RequestCounter(app)
+    asyncio.run(counter({"type": "http"}, None, None))
+    asyncio.run(counter({"type": "lifespan"}, None, None))
+    assert counter.requests == 1
+
+
+def _get(port, path, headers=None):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", headers=headers or {})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status, json.loads(response.read())
+
+
+def _wait_for(predicate, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            result = predicate()
+            if result:
+                return result
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise AssertionError("condition not met in time")
+
+
+@pytest.mark.skipif(not hasattr(os, "fork") or not HAS_REUSEPORT, reason="pre-fork needs fork and SO_REUSEPORT")
+def test_prefork_serves_recycles_and_rolls():
+    """Test the launcher end to end: serving, max-requests recycling, SIGHUP and SIGTERM."""
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    env = dict(os.environ, API_KEY="prefork-key", LOG_FILE="", LOG_LEVEL="WARNING")
+    master = subprocess.Popen(
+        [sys.executable, "run.py", "--prod", "--port", str(port), "--workers", "2", "--max-requests", "5"],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    headers = {"x-api-key": "prefork-key"}
+    try:
+        def workers():
+            return _get(port, "/admin/workers", headers)[1]["workers"]
+
+        initial = _wait_for(lambda: len(workers()) == 2 and workers())
+        assert {row["generation"] for row in initial} == {0}
+
+        # Every request is served while workers are replaced after 5 requests
+        for _ in range(20):
+            assert _get(port, "/api/test")[0] == 200
+        _wait_for(lambda: not {row["pid"] for row in initial} & {row["pid"] for row in workers()})
+
+        master.send_signal(signal.SIGHUP)
+        rolled = _wait_for(lambda: (lambda rows: len(rows) == 2 and all(r["generation"] == 1 for r in rows) and rows)(workers()))
+        assert len({row["pid"] for row in rolled}) == 2
+    finally:
+        master.send_signal(signal.SIGTERM)
+        assert master.wait(timeout=30) == 0
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core.profiling import (
+    LoopLagMonitor,
+    SamplingProfiler,
+    allocation_snapshot,
+    start_allocation_tracking,
+    stop_allocation_tracking,
+)
+
+
+def _blocking_call():
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_captures_blocking_stack():
+    """Test that a synchronous call on the loop is recorded with its stack."""
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.1)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    _blocking_call()
+    await asyncio.sleep(0.05)
+    monitor.stop()
+
+    report = monitor.report()
+    assert not report["running"]
+    assert report["max_lag_ms"] >= 250
+    assert any("_blocking_call" in entry for event in report["events"] for entry in event["stack"])
+    assert "_blocking_call" in monitor.report_text()
+
+
+def test_sampling_profiler_folds_busy_thread_stacks():
+    """Test that a busy thread shows up in the folded stacks."""
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_worker, name="busy")
+    thread.start()
+    try:
+        folded = SamplingProfiler().capture(0.2, interval=0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+    lines = [line for line in folded.splitlines() if line.startswith("busy;")]
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("busy_worker" in line for line in lines)
+
+
+def test_allocation_snapshot_lists_top_sites():
+    """Test tracemalloc snapshots and that they require tracking to be started."""
+    with pytest.raises(RuntimeError):
+        allocation_snapshot()
+
+    assert start_allocation_tracking(5)
+    try:
+        retained = [bytearray(1024) for _ in range(200)]
+        report = allocation_snapshot(limit=5)
+    finally:
+        assert stop_allocation_tracking()
+
+    assert report.startswith("traced_current_kib=")
+    assert "test_profiling.py" in report
+    assert len(retained) == 200
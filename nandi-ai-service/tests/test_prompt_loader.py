@@ -0,0 +1,206 @@
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.config import prompt_loader
+from app.config.prompt_loader import PromptManager, count_tokens
+from app.models.chat import ConversationMessage, MessageRole, Persona
+
+
+@pytest.fixture
+def prompts_file(tmp_path):
+    """Write a small prompts.json and return its path."""
+    path = tmp_path / "prompts.json"
+    path.write_text(json.dumps({
+        "personas": {
+            "karma": {"system_prompt": "You are Karma."},
+            "atma": {"system_prompt": "You are Atma."}
+        },
+        "quality": {"evaluation_prompt": " Rate the question."},
+        "fallbacks": {"karma": "Breathe."}
+    }))
+    return path
+
+
+def test_build_messages_reuses_precompiled_prefix(prompts_file):
+    """Test that the system message is shared across calls rather than rebuilt."""
+    manager = PromptManager(prompts_file)
+    context = [ConversationMessage(role=MessageRole.USER, content="Hi")]
+
+    first = manager.build_messages(Persona.ATMA, "Who am I?", context)
+    second = manager.build_messages("atma", "Who am I?")
+
+    assert first[0] is second[0]
+    assert first[0]["content"] == "You are Atma. Rate the question."
+    assert first[1:] == [
+        {"role": "user", "content": "Hi"},
+        {"role": "user", "content": "Who am I?"}
+    ]
+    assert manager.build_messages("atma", "x", include_quality=False)[0]["content"] == "You are Atma."
+    with pytest.raises(TypeError):
+        first[0]["content"] = "mutated"
+
+
+def test_unknown_persona_uses_default_and_token_counts(prompts_file):
+    """Test the default persona fallback and precomputed prefix token counts."""
+    manager = PromptManager(prompts_file)
+
+    messages = manager.build_messages("dharma", "What is my purpose?")
+
+    assert messages[0]["content"].startswith("You are Karma.")
+    assert manager.get_prefix_tokens("karma") == count_tokens("You are Karma. Rate the question.")
+    assert manager.get_prefix_tokens("karma", include_quality=False) == count_tokens("You are Karma.")
+    assert manager.get_fallback_response(Persona.KARMA) == "Breathe."
+
+
+def test_failed_refresh_keeps_previous_prompts(prompts_file):
+    """Test that a broken prompts file never replaces the loaded prompt set."""
+    manager = PromptManager(prompts_file)
+    previous = manager.prompt_set
+
+    prompts_file.write_text("{not json")
+    with pytest.raises(ValueError):
+        manager.refresh()
+
+    assert manager.prompt_set is previous
+    assert manager.get_persona_prompt("karma") == "You are Karma."
+
+
+def test_file_watcher_reloads_and_versions_personas(prompts_file):
+    """Test that the watcher picks up edits and only changed personas get a new version."""
+    import os
+    from app.config.prompt_loader import PromptFileWatcher
+
+    manager = PromptManager(prompts_file)
+    watcher = PromptFileWatcher(manager, interval=60)
+    changes = []
+    manager.add_listener(lambda old, new: changes.append((old, new)))
+    old_set = manager.prompt_set
+
+    assert watcher.check() is False
+
+    data = json.loads(prompts_file.read_text())
+    data["personas"]["atma"]["system_prompt"] = "You are Solis."
+    prompts_file.write_text(json.dumps(data))
+    stat = os.stat(prompts_file)
+    os.utime(prompts_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert watcher.check() is True
+    new_set = manager.prompt_set
+    assert new_set.version != old_set.version
+    assert new_set.personas["atma"].version != old_set.personas["atma"].version
+    assert new_set.personas["karma"].version == old_set.personas["karma"].version
+    assert changes == [(old_set, new_set)]
+
+
+def test_prompt_change_invalidates_only_changed_persona_cache():
+    """Test that cached answers survive unless their persona's prompt changed."""
+    from app.config.prompt_loader import build_prompt_set
+    from app.core import cache
+    from app.models.chat import ChatResponse
+
+    old_set = build_prompt_set({"personas": {
+        "karma": {"system_prompt": "Karma v1"},
+        "atma": {"system_prompt": "Atma v1"}
+    }})
+    new_set = build_prompt_set({"personas": {
+        "karma": {"system_prompt": "Karma v1"},
+        "atma": {"system_prompt": "Atma v2"}
+    }})
+    karma_version = old_set.personas["karma"].version
+    atma_version = old_set.personas["atma"].version
+
+    cache.response_cache.clear()
+    cache.save_to_cache("karma", "q", ChatResponse.create("k", 5, "r", prompt_version=karma_version))
+    cache.save_to_cache("atma", "q", ChatResponse.create("a", 5, "r", prompt_version=atma_version))
+
+    cache._on_prompts_changed(old_set, new_set)
+
+    assert cache.get_from_cache("karma", "q", karma_version).message == "k"
+    assert cache.get_from_cache("atma", "q") is None
+    assert len(cache.response_cache) == 1
+    cache.response_cache.clear()
+
+
+def test_stable_prefix_layout_shares_quality_block(prompts_file):
+    """Test that the stable layout puts the shared quality block ahead of persona text."""
+    manager = PromptManager(prompts_file, layout="stable_prefix")
+    context = [ConversationMessage(role=MessageRole.ASSISTANT, content="Earlier answer")]
+
+    karma = manager.build_messages("karma", "Q1", context, passages=["A passage"])
+    atma = manager.build_messages("atma", "Q2")
+
+    assert karma[0] is atma[0]
+    assert karma[0]["content"] == "Rate the question."
+    assert [m["content"] for m in karma[1:]] == [
+        "You are Karma.",
+        "Reference passages:\n\nA passage",
+        "Earlier answer",
+        "Q1"
+    ]
+    assert manager.get_prefix_hash("karma") != manager.get_prefix_hash("atma")
+    assert manager.get_prefix_hash("karma") == PromptManager(prompts_file, layout="stable_prefix").get_prefix_hash("karma")
+    assert manager.get_prefix_hash("karma") != PromptManager(prompts_file).get_prefix_hash("karma")
+
+
+def test_prompt_cache_metrics_records_cached_tokens():
+    """Test that cached token counts from the usage field are aggregated per prefix."""
+    from types import SimpleNamespace
+    from app.core.metrics import PromptCacheMetrics
+
+    metrics = PromptCacheMetrics()
+    metrics.record("karma", "abc", 600, SimpleNamespace(
+        prompt_tokens=700, prompt_tokens_details=SimpleNamespace(cached_tokens=512)
+    ))
+    metrics.record("karma", "abc", 600, SimpleNamespace(prompt_tokens=700, prompt_tokens_details=None))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["prefixes"]["abc"]["requests"] == 2
+    assert snapshot["prefixes"]["abc"]["cache_hits"] == 1
+    assert snapshot["totals"]["cached_tokens"] == 512
+    assert snapshot["totals"]["cached_ratio"] == round(512 / 1400, 4)
+
+
+def test_watcher_invalidation_runs_safely_beside_cache_writes():
+    """Test that invalidating from the watcher thread does not break concurrent saves and cleanups."""
+    import threading
+    from app.core import cache
+    from app.models.chat import ChatResponse
+
+    cache.response_cache.clear()
+    errors = []
+    done = threading.Event()
+
+    def invalidate():
+        try:
+            while not done.is_set():
+                cache.invalidate_prompt_versions({"atma": "v2"})
+        except Exception as e:
+            errors.append(e)
+
+    watcher = threading.Thread(target=invalidate)
+    watcher.start()
+    try:
+        for i in range(3000):
+            cache.save_to_cache("atma", f"q{i}", ChatResponse.create("a", 5, "r", prompt_version="v1"))
+            cache.cleanup_cache()
+    finally:
+        done.set()
+        watcher.join()
+
+    assert errors == []
+    cache.invalidate_prompt_versions({"atma": "v2"})
+    assert len(cache.response_cache) == 0
+
+
+def test_count_tokens_loads_the_encoding_lazily():
+    """Test that the encoding loads on first use and a failed load falls back to an estimate."""
+    tiktoken = MagicMock()
+    tiktoken.get_encoding.side_effect = OSError("no network")
+    with patch.dict(sys.modules, {"tiktoken": tiktoken}), \
+            patch.multiple(prompt_loader, _encoding=None, _encoding_loaded=False):
+        assert count_tokens("a" * 10) == 3
+        assert count_tokens("a" * 10) == 3
+        tiktoken.get_encoding.assert_called_once_with("cl100k_base")
@@ -0,0 +1,208 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.dependencies import rate_limit
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.rate_limit import (
+    MemoryTokenBucketStore,
+    RateLimiter,
+    RedisTokenBucketStore,
+    parse_rate,
+    request_identity,
+)
+from app.core.security import api_key_id
+
+
+class FakeClock:
+    """Manually advanced clock for deterministic refills."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class DownStore:
+    """Shared store that is unreachable."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def consume(self, *args, **kwargs):
+        self.calls += 1
+        raise ConnectionError("redis down")
+
+
+def test_parse_rate():
+    """Test slowapi-style limit strings."""
+    assert parse_rate("10/minute")[:2] == (10, 10 / 60)
+    assert parse_rate("100 per hour").capacity == 100
+    assert parse_rate("5/10second").rate == 0.5
+    with pytest.raises(ValueError):
+        parse_rate("ten a minute")
+
+
+def test_bucket_limits_and_refills():
+    """Test that a bucket rejects once empty and refills over time."""
+    clock = FakeClock()
+    limiter = RateLimiter(MemoryTokenBucketStore(), clock=clock)
+    limit = parse_rate("3/minute")
+
+    assert [limiter.hit("k", limit).allowed for _ in range(4)] == [True, True, True, False]
+    rejected = limiter.hit("k", limit)
+    assert rejected.retry_after == pytest.approx(20.0)
+
+    clock.now += 20
+    assert limiter.hit("k", limit).allowed
+    assert limiter.hit("other", limit).allowed
+
+
+def test_idle_buckets_and_leases_expire():
+    """Test that buckets and leases of keys that stopped sending requests are dropped."""
+    clock = FakeClock()
+    store = MemoryTokenBucketStore()
+    limiter = RateLimiter(store, lease_size=5, lease_ttl=1, clock=clock)
+    limit = parse_rate("30/minute")
+
+    for i in range(50):
+        assert limiter.hit(f"session_id:{i}", limit).allowed
+    assert len(store) == 50 and len(limiter._leases) == 50
+
+    clock.now += 120
+    limiter.hit("session_id:new", limit)
+    assert len(store) == 1
+    assert list(limiter._leases) == ["session_id:new"]
+
+
+def test_workers_share_limit_with_local_leases():
+    """Test that leases save store round trips without exceeding the shared limit."""
+    clock = FakeClock()
+    store = MemoryTokenBucketStore()
+    calls = []
+    consume = store.consume
+    store.consume = lambda *args, **kwargs: calls.append(args) or consume(*args, **kwargs)
+    workers = [RateLimiter(store, lease_size=5, lease_ttl=60, clock=clock) for _ in range(4)]
+    limit = parse_rate("40/minute")
+
+    allowed = sum(worker.hit("user_id:1", limit).allowed for _ in range(20) for worker in workers)
+
+    assert allowed == 40
+    assert len(calls) < 80
+
+
+def test_request_identity_order():
+    """Test key type precedence and API key hashing."""
+    headers = {"x-api-key": "secret"}
+    body = {"session_id": "s1"}
+    assert request_identity(["user_id", "session_id", "ip"], headers, {}, body, "1.2.3.4", trusted=True) == "session_id:s1"
+    assert request_identity(["user_id", "ip"], {"x-user-id": "42"}, {}, None, "1.2.3.4", trusted=True) == "user_id:42"
+    key = request_identity(["api_key"], headers, {}, None, "1.2.3.4")
+    assert key.startswith("api_key:") and "secret" not in key
+    assert request_identity(["user_id"], {}, {}, None, "1.2.3.4", trusted=True) == "ip:1.2.3.4"
+
+
+def test_untrusted_callers_cannot_choose_their_bucket():
+    """Test that user and session ids sent by untrusted callers are ignored."""
+    assert request_identity(["user_id", "session_id", "ip"], {"x-user-id": "42"}, {}, {"sessionId": "s1"}, "1.2.3.4") == "ip:1.2.3.4"
+
+
+def test_rate_limit_dependency_returns_429():
+    """Test the FastAPI dependency: headers, 429 with Retry-After, ids ignored by default."""
+    app = FastAPI()
+
+    @app.post("/limited", dependencies=[Depends(rate_limit("2/minute", "test-dependency"))])
+    async def limited():
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        responses = [client.post("/limited", json={"sessionId": f"s{i}"}) for i in range(3)]
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert responses[0].headers["X-RateLimit-Limit"] == "2"
+    assert int(responses[2].headers["Retry-After"]) >= 1
+
+
+def test_trusted_caller_gets_per_user_buckets(monkeypatch, api_key_headers):
+    """Test that a trusted API key may key its requests by the user id it forwards."""
+    from app.config.settings import settings
+
+    monkeypatch.setattr(settings, "rate_limit_key", "user_id,api_key,ip")
+    monkeypatch.setattr(settings, "rate_limit_trusted_keys", api_key_id(api_key_headers["X-API-Key"]))
+    app = FastAPI()
+
+    @app.post("/limited", dependencies=[Depends(rate_limit("2/minute", "test-trusted"))])
+    async def limited():
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        responses = [client.post("/limited", json={"userId": "a"}, headers=api_key_headers) for _ in range(3)]
+        other_user = client.post("/limited", json={"userId": "b"}, headers=api_key_headers)
+        untrusted = [client.post("/limited", json={"userId": f"u{i}"}) for i in range(3)]
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert other_user.status_code == 200
+    assert [r.status_code for r in untrusted] == [200, 200, 429]
+
+
+@pytest.fixture
+def redis_client():
+    """Start a throwaway redis-server, if one is installed."""
+    if shutil.which("redis-server") is None:
+        pytest.skip("redis-server is not installed")
+    redis = pytest.importorskip("redis")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen(
+        ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL,
+    )
+    client = redis.Redis(port=port)
+    for _ in range(50):
+        try:
+            client.ping()
+            break
+        except redis.ConnectionError:
+            time.sleep(0.05)
+    yield client
+    process.terminate()
+    process.wait()
+
+
+def test_redis_script_matches_memory_store(redis_client):
+    """Test that the Lua token bucket behaves like the in-memory stand-in."""
+    redis_store = RedisTokenBucketStore(redis_client)
+    memory_store = MemoryTokenBucketStore()
+    now = 1000.0
+    for step in range(12):
+        now += 0.5 * (step % 3)
+        expected = memory_store.consume("k", 5, 0.5, now, max_lease=2)
+        actual = redis_store.consume("k", 5, 0.5, now, max_lease=2)
+        assert actual.allowed == expected.allowed
+        assert actual.lease == expected.lease
+        assert actual.remaining == pytest.approx(expected.remaining)
+
+
+def test_unreachable_store_is_skipped_until_the_cooldown_passes():
+    """Test that a failed store is not called again until the breaker lets a probe through."""
+    clock = FakeClock()
+    store = DownStore()
+    limiter = RateLimiter(store, clock=clock, breaker=CircuitBreaker("test", cooldown=5, clock=clock))
+    limit = parse_rate("3/minute")
+
+    results = [asyncio.run(limiter.hit_async("k", limit)).allowed for _ in range(4)]
+    assert results == [True, True, True, False]
+    assert store.calls == 1
+
+    clock.now += 5
+    limiter.hit("k", limit)
+    limiter.hit("k", limit)
+    assert store.calls == 2
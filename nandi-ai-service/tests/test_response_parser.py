@@ -0,0 +1,200 @@
+import json
+import re
+import time
+
+import pytest
+
+from app.core.response_parser import StreamingResponseParser, parse_response
+
+
+def _stream(parser, text, size):
+    """Feed text to a streaming parser in fixed-size chunks."""
+    out = [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+    out.append(parser.flush())
+    return "".join(out)
+
+
+def test_parse_marker_format():
+    """Test that the marker is extracted and stripped from the message."""
+    result = parse_response("Breathe deeply. [QUALITY:8:Shows deep reflection]")
+
+    assert result.message == "Breathe deeply."
+    assert result.quality_score == 8
+    assert result.quality_reason == "Shows deep reflection"
+
+
+def test_parse_json_format():
+    """Test JSON-mode output as requested by prompts.json."""
+    text = json.dumps({
+        "response": "Your purpose unfolds through action.",
+        "quality_score": 9,
+        "quality_reasoning": "Personal and specific"
+    })
+    result = parse_response(text)
+
+    assert result.message == "Your purpose unfolds through action."
+    assert result.quality_score == 9
+    assert result.quality_reason == "Personal and specific"
+
+
+def test_parse_fenced_json_and_clamps_score():
+    """Test JSON wrapped in a Markdown code fence with an out-of-range score."""
+    text = '```json\n{"response": "Stillness.", "quality_score": 14}\n```'
+    result = parse_response(text)
+
+    assert result.message == "Stillness."
+    assert result.quality_score == 10
+    assert result.quality_reason is None
+
+
+def test_parse_plain_text():
+    """Test that text without any evaluation is returned unchanged."""
+    result = parse_response("  Just an answer [with brackets].  ")
+
+    assert result.message == "Just an answer [with brackets]."
+    assert result.quality_score is None
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 64])
+def test_streaming_marker_is_hidden(size):
+    """Test that a streamed marker never reaches the client, whatever the chunking."""
+    text = "Act with [intention] and care. [QUALITY:6:Good question]"
+    parser = StreamingResponseParser()
+
+    streamed = _stream(parser, text, size)
+    result = parser.close()
+
+    assert "QUALITY" not in streamed
+    assert streamed.strip() == "Act with [intention] and care."
+    assert result.quality_score == 6
+
+
+@pytest.mark.parametrize("size", [1, 5, 32])
+def test_streaming_json_emits_response_value(size):
+    """Test that only the decoded response value is streamed in JSON mode."""
+    text = json.dumps({
+        "response": "Line one\nLine \"two\" é",
+        "quality_score": 7,
+        "quality_reasoning": "Clear"
+    })
+    parser = StreamingResponseParser()
+
+    streamed = _stream(parser, text, size)
+    result = parser.close()
+
+    assert streamed == "Line one\nLine \"two\" é"
+    assert result.message == streamed
+    assert result.quality_score == 7
+
+
+def test_streaming_truncated_json():
+    """Test that a JSON stream cut off by max_tokens still yields the answer."""
+    parser = StreamingResponseParser()
+    parser.feed('{"quality_score": 4, "response": "The self is')
+    result = parser.close()
+
+    assert result.message == "The self is"
+    assert result.quality_score == 4
+
+
+@pytest.mark.parametrize("size", [1, 5, 7, 64])
+def test_streaming_json_non_bmp_characters(size):
+    """Test that escaped surrogate pairs are streamed as one character."""
+    text = json.dumps({"response": "Namaste \U0001f64f\U0001f549 \ud83d!", "quality_score": 5})
+    parser = StreamingResponseParser()
+
+    streamed = _stream(parser, text, size)
+
+    assert streamed == "Namaste \U0001f64f\U0001f549 \ufffd!"
+    streamed.encode("utf-8")
+
+
+@pytest.mark.parametrize("text", ["`karma` is action. [QUALITY:5:ok]", "```\nbreathe in\n``` [QUALITY:5:ok]"])
+def test_streaming_text_starting_with_backticks(text):
+    """Test that Markdown code at the start of a plain answer is not taken for JSON."""
+    parser = StreamingResponseParser()
+    streamed = _stream(parser, text, 2)
+    assert streamed.strip() == text.replace(" [QUALITY:5:ok]", "")
+
+
+@pytest.mark.parametrize("prefix", ["```json\n", "```\n"])
+def test_streaming_fenced_json(prefix):
+    """Test that a fence opening a JSON object switches to JSON mode."""
+    parser = StreamingResponseParser()
+    streamed = _stream(parser, prefix + json.dumps({"response": "Be still"}) + "\n```", 3)
+    assert streamed == "Be still"
+
+
+def test_large_marker_response():
+    """Test single-pass parsing of a large response with a trailing marker."""
+    body = "Mindfulness is the practice of returning to the present moment. " * 4000
+    result = parse_response(body + "[QUALITY:7:Good question about practice]")
+
+    assert result.quality_score == 7
+    assert result.message == body.strip()
+
+
+def test_large_json_response_streamed_in_small_chunks():
+    """Test streaming a large JSON response 16 characters at a time."""
+    body = "The Self is discovered through patient inquiry. " * 4000
+    json_text = json.dumps({"response": body, "quality_score": 8, "quality_reasoning": "Deep"})
+
+    parser = StreamingResponseParser()
+    streamed = "".join(parser.feed(json_text[i:i + 16]) for i in range(0, len(json_text), 16))
+
+    assert streamed == body
+    assert parser.close().message == body.strip()
+
+
+@pytest.mark.benchmark
+def test_benchmark_large_marker_response():
+    """Microbenchmark: single-pass parsing vs the legacy search + sub over a large response."""
+    body = "Mindfulness is the practice of returning to the present moment. " * 4000
+    text = body + "[QUALITY:7:Good question about practice]"
+    iterations = 50
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = parse_response(text)
+    parsed_time = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        re.search(r"\[QUALITY:(\d+):([^\]]+)\]", text)
+        re.sub(r"\[QUALITY:\d+:[^\]]+\]", "", text).strip()
+    legacy_time = (time.perf_counter() - start) / iterations
+
+    print(f"\n{len(text)} chars: parse_response {parsed_time * 1e6:.1f}us, legacy {legacy_time * 1e6:.1f}us")
+    assert result.quality_score == 7
+
+
+@pytest.mark.benchmark
+def test_benchmark_large_plain_and_json_responses():
+    """Microbenchmark: plain text skips the regex engine; JSON goes through json.loads."""
+    body = "The Self is discovered through patient inquiry. " * 4000
+    json_text = json.dumps({"response": body, "quality_score": 8, "quality_reasoning": "Deep"})
+    iterations = 50
+
+    timings = {}
+    for label, text in (("plain", body), ("json", json_text)):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            parse_response(text)
+        timings[label] = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    parser = StreamingResponseParser()
+    for i in range(0, len(json_text), 16):
+        parser.feed(json_text[i:i + 16])
+    timings["json_stream_16b_chunks"] = time.perf_counter() - start
+
+    print("\n" + ", ".join(f"{k} {v * 1e6:.1f}us" for k, v in timings.items()))
+    assert parser.close().message == body.strip()
+
+
+def test_parse_truncated_json():
+    """Test that JSON cut off by a small max_tokens still yields the answer text."""
+    result = parse_response('{"response": "Begin with one breath.\\nThen')
+
+    assert result.message == "Begin with one breath.\nThen"
+    assert result.quality_score is None
@@ -9,12 +9,16 @@ from app.services.points_service import calculate_session_points, get_points_cal
 
 @pytest.mark.asyncio
 @patch("app.services.ai_service.client.chat.completions.create")
+@patch("app.services.ai_service.answer_bank.match")
 @patch("app.services.ai_service.get_from_cache")
-async def test_generate_response(mock_get_cache, mock_create):
+async def test_generate_response(mock_get_cache, mock_match, mock_create):
     """Test the generate_response service function."""
     # Mock cache miss
     mock_get_cache.return_value = None
     
+    # Mock answer bank miss
+    mock_match.return_value = None
+    
     # Mock OpenAI response
     mock_response = MagicMock()
     mock_response.choices = [
@@ -87,12 +91,14 @@ async def test_calculate_session_points():
     
     # Check the result
     assert result is not None
-    assert result.pointsEarned == 77  # 60 (base) + 12 (duration) + 5 (streak)
-    assert result.totalPoints == 1077  # 1000 (mock total) + 77
+    assert result.pointsEarned == 97  # 60 (base) + 12 (duration) + 5 (streak) + 20 (milestone)
+    assert result.totalPoints == 97  # No user or session ID, so nothing accumulated
     assert result.breakdown == {
         "base": 60,  # 5 points * 12 messages
         "duration": 12,  # 12 minutes
-        "streak": 5  # Default streak bonus
+        "streak": 5,  # Default streak bonus
+        "quality": 0,  # No quality score reported: medium multiplier
+        "milestone": 20  # Reached the 10 questions milestone
     }
 
 
@@ -107,4 +113,228 @@ def test_get_points_calculations():
     assert result["time_points_per_minute"] == 1
     assert "quality_multipliers" in result
     assert "streak_bonus" in result
-    assert "milestone_bonuses" in result 
\ No newline at end of file
+    assert "milestone_bonuses" in result 
+
+def test_heuristic_quality_scorer_bands():
+    """Test that the heuristic scorer separates low, medium and high quality questions."""
+    from app.services.quality_service import HeuristicQualityScorer
+
+    scorer = HeuristicQualityScorer()
+    low = scorer.score("What's your favorite color?", "karma")
+    medium = scorer.score("How can I be more mindful during my day?", "karma")
+    high = scorer.score(
+        "I've been struggling with balancing my career ambitions with my desire to be "
+        "more present with my family. How can I approach this conflict through the lens of dharma?",
+        "dharma"
+    )
+
+    assert low.score <= 3
+    assert 4 <= medium.score <= 7
+    assert high.score >= 8
+
+
+
+def test_heuristic_scorer_only_flags_pure_small_talk():
+    """Test that a greeting in front of a real question does not make it low-effort."""
+    from app.services.quality_service import HeuristicQualityScorer
+
+    scorer = HeuristicQualityScorer()
+    for message in ("Hi", "hello there!", "Ok, thanks", "Hey Nandi", "Are you a bot?"):
+        assert scorer.score(message, "karma").score == 2, message
+
+    greeting = scorer.score(
+        "Hi Nandi, I have been struggling with my purpose lately. How do I find my dharma?", "dharma"
+    )
+    filler = scorer.score("Ok so I feel anxious about a decision at work, what should I do?", "karma")
+    assert greeting.score >= 6
+    assert filler.score >= 4
+
+
+@pytest.mark.asyncio
+async def test_model_scorer_only_starts_in_separate_mode():
+    """Test that inline scoring does not spend a second upstream call per chat."""
+    from app.services.quality_service import QualityService
+
+    request = ChatRequest(message="What is dharma?", persona=Persona.DHARMA)
+    assert QualityService(model="gpt-4o-mini", mode="inline").start(request) is None
+
+    separate = QualityService(model="gpt-4o-mini", mode="separate")
+    with patch.object(separate.model_scorer, "score", return_value=None) as score:
+        task = separate.start(request)
+        assert task is not None
+        await separate.resolve(request, task)
+    score.assert_called_once()
+
+
+@pytest.mark.asyncio
+@patch("app.services.quality_service.usage_tracker.record")
+@patch("app.services.ai_service.client.chat.completions.create")
+async def test_model_scorer_charges_the_caller(mock_create, mock_record):
+    """Test that the scoring model's tokens are recorded under the caller's API key."""
+    from app.services.quality_service import ModelQualityScorer
+
+    mock_response = MagicMock()
+    mock_response.choices = [
+        MagicMock(message=MagicMock(content='{"quality_score": 7, "quality_reasoning": "Thoughtful"}'))
+    ]
+    mock_create.return_value = mock_response
+
+    result = await ModelQualityScorer("gpt-4o-mini").score("What is dharma?", "dharma", "caller-key")
+
+    assert result.score == 7
+    mock_record.assert_called_once_with("caller-key", "dharma", "gpt-4o-mini", mock_response.usage)
+
+
+def test_quality_score_cache_normalizes_questions():
+    """Test that the score cache matches questions regardless of case and punctuation."""
+    from app.models.chat import QualityScore
+    from app.services.quality_service import QualityScoreCache
+
+    cache = QualityScoreCache(max_size=2)
+    cache.set("karma", "What is Karma?", QualityScore(score=6, reason="cached"))
+
+    assert cache.get("karma", "  what is karma ").reason == "cached"
+    assert cache.get("dharma", "What is Karma?") is None
+
+    cache.set("karma", "one", QualityScore(score=3, reason="one"))
+    cache.set("karma", "two", QualityScore(score=3, reason="two"))
+    assert len(cache) == 2
+    assert cache.get("karma", "What is Karma?") is None
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.client.chat.completions.create")
+@patch("app.services.ai_service.get_from_cache")
+async def test_generate_response_without_quality_marker(mock_get_cache, mock_create):
+    """Test that a missing quality marker falls back to the quality scorer instead of 5."""
+    from app.services.quality_service import quality_service
+
+    mock_get_cache.return_value = None
+    mock_response = MagicMock()
+    mock_response.choices = [MagicMock(message=MagicMock(content="Be present with each breath."))]
+    mock_create.return_value = mock_response
+
+    request = ChatRequest(
+        message="What's your favorite color?",
+        persona=Persona.ATMA,
+        session_id="test_session"
+    )
+    result = await generate_response(request)
+
+    expected = quality_service.score_heuristic(request)
+    assert result.message == "Be present with each breath."
+    assert result.qualityScore == expected.score
+    assert result.scoreReason == expected.reason
+
+
+def test_model_router_routes_by_complexity():
+    """Test that small talk goes to the smallest tier and deep questions to the largest."""
+    from app.models.chat import ConversationMessage, MessageRole
+    from app.services.model_router import ModelRouter, parse_model_tiers
+
+    router = ModelRouter(parse_model_tiers("small=mini:256,medium=mid:512,large=big:1024", "gpt-4"))
+
+    greeting = ChatRequest(message="Hello!", persona=Persona.KARMA)
+    deep = ChatRequest(
+        message="I've been struggling with balancing my career ambitions with my desire to be "
+                "more present with my family. Why does this conflict feel so heavy, and how can I "
+                "approach it through the lens of dharma?",
+        persona=Persona.DHARMA,
+        context=[ConversationMessage(role=MessageRole.USER, content="Hi")] * 3
+    )
+
+    assert [t.name for t in router.candidates(greeting)] == ["small", "medium", "large"]
+    assert [t.name for t in router.candidates(deep)] == ["large"]
+    assert router.tiers[0].max_tokens == 256
+    assert parse_model_tiers("", "gpt-4")[0].model == "gpt-4"
+
+
+def test_model_tiers_with_fine_tuned_models():
+    """Test that fine-tuned model ids keep their colons."""
+    from app.services.model_router import DEFAULT_MAX_TOKENS, parse_model_tiers
+
+    small, large = parse_model_tiers("small=ft:gpt-4o-mini:acme:abc123,large=ft:gpt-4o:acme:xyz9:1024", "gpt-4")
+    assert (small.model, small.max_tokens) == ("ft:gpt-4o-mini:acme:abc123", DEFAULT_MAX_TOKENS)
+    assert (large.model, large.max_tokens) == ("ft:gpt-4o:acme:xyz9", 1024)
+    for spec in ("small=:256", "small=gpt-4o:", "small=gpt-4o:0"):
+        with pytest.raises(ValueError):
+            parse_model_tiers(spec, "gpt-4")
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.client.chat.completions.create")
+@patch("app.services.ai_service.get_from_cache")
+async def test_generate_response_falls_back_to_larger_tier(mock_get_cache, mock_create):
+    """Test that a failing tier is retried on the next larger tier."""
+    from app.services.model_router import ModelRouter, parse_model_tiers
+
+    mock_get_cache.return_value = None
+    mock_response = MagicMock()
+    mock_response.choices = [MagicMock(message=MagicMock(content="Answer [QUALITY:4:Simple]"))]
+    mock_create.side_effect = [RuntimeError("overloaded"), mock_response]
+
+    router = ModelRouter(parse_model_tiers("small=mini:256,large=big:1024", "gpt-4"))
+    with patch("app.services.ai_service.model_router", router):
+        result = await generate_response(ChatRequest(message="Hi", persona=Persona.KARMA))
+
+    assert result.message == "Answer"
+    assert [c.kwargs["model"] for c in mock_create.call_args_list] == ["mini", "big"]
+    assert mock_create.call_args_list[0].kwargs["max_tokens"] == 256
+
+
+@pytest.mark.asyncio
+@patch("app.services.ai_service.client.chat.completions.create")
+@patch("app.services.ai_service.get_from_cache")
+async def test_generate_response_without_model_tiers(mock_get_cache, mock_create):
+    """Test that an empty tier list fails with an explicit error instead of raising None."""
+    mock_get_cache.return_value = None
+    router = MagicMock()
+    router.candidates.return_value = []
+
+    with patch("app.services.ai_service.model_router", router), \
+            patch("app.services.ai_service._fallback_response") as fallback:
+        await generate_response(ChatRequest(message="Hi", persona=Persona.KARMA))
+
+    error = fallback.call_args.args[2]
+    assert isinstance(error, RuntimeError) and "ROUTING_TIERS" in str(error)
+    mock_create.assert_not_called()
+
+
+def test_compute_points_vectorized_rules():
+    """Test quality multipliers, milestones and caps in the vectorized points kernel."""
+    from app.services.points_service import compute_points
+
+    columns = compute_points(
+        message_counts=[2, 5, 12, 30],
+        duration_seconds=[59, 600, 3600, 7200],
+        streak_days=[1, 2, 3, 10],
+        quality_scores=[2, None, 8.5, 5]
+    )
+
+    assert columns["base"].tolist() == [10, 25, 60, 150]
+    assert columns["duration"].tolist() == [0, 10, 30, 30]
+    assert columns["streak"].tolist() == [5, 10, 15, 20]
+    assert columns["quality"].tolist() == [-5, 0, 30, 0]
+    assert columns["milestone"].tolist() == [0, 10, 20, 50]
+    assert columns["total"].tolist() == [10, 55, 155, 250]
+
+
+@pytest.mark.asyncio
+async def test_calculate_batch_points_matches_single_session():
+    """Test that batch results equal the single-session endpoint, row-wise and columnar."""
+    from app.models.points import BatchSessionMetricsRequest
+    from app.services.points_service import calculate_batch_points
+
+    sessions = [
+        SessionMetricsRequest(persona=Persona.DHARMA, durationSeconds=720, messageCount=12),
+        SessionMetricsRequest(persona=Persona.ATMA, durationSeconds=90, messageCount=3, averageQualityScore=9)
+    ]
+    singles = [await calculate_session_points(s) for s in sessions]
+
+    rows = await calculate_batch_points(BatchSessionMetricsRequest(sessions=sessions))
+    columns = await calculate_batch_points(BatchSessionMetricsRequest(sessions=sessions, format="columns"))
+
+    assert rows.count == 2
+    assert [r.breakdown for r in rows.results] == [s.breakdown for s in singles]
+    assert columns.columns["pointsEarned"] == [s.pointsEarned for s in singles]
+    assert columns.columns["quality"] == [0, 7]
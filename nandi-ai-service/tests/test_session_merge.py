@@ -0,0 +1,120 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+
+from app.services import session_merge
+from app.services.leaderboard import Leaderboard
+from app.services.message_store import ChatMessageRecord, MemoryMessageStore, MessageStore, SQLiteMessageStore
+from app.services.points_ledger import MemoryLedgerStore, PointsLedger, SQLiteLedgerStore
+from app.services.session_merge import (
+    MemoryMergeStore,
+    SQLiteMergeStore,
+    SessionMerge,
+    SessionMerger,
+)
+
+
+def _record(session_id, content="How do I let go?"):
+    return ChatMessageRecord("USER", content, "KARMA", None, session_id, None, datetime(2026, 3, 1, 12), 6)
+
+
+def _patched(ledger, messages, board):
+    return patch.multiple(session_merge, points_ledger=ledger, message_store=messages, leaderboard=board)
+
+
+def test_merge_moves_points_messages_and_leaderboard():
+    """Test that a session's points, messages and board entries move to the user."""
+    ledger = PointsLedger(MemoryLedgerStore)
+    board = Leaderboard()
+    ledger.add_listener(board.on_award)
+    ledger.award("anon:s-1", 30, persona="karma")
+    ledger.award("user:42", 10, persona="karma")
+    store = MemoryMessageStore()
+    messages = MessageStore(lambda: store, flush_interval=60)
+    messages.enqueue([_record("s-1"), _record("s-1", "Thank you"), _record("s-2")])
+    merger = SessionMerger(lambda: MemoryMergeStore(ledger.store, store))
+
+    with _patched(ledger, messages, board):
+        result = asyncio.run(merger.merge("s-1", "42"))
+        again = asyncio.run(merger.merge("s-1", "42"))
+    messages.close()
+
+    assert (result.points_merged, result.messages_merged, result.total_points) == (30, 2, 40)
+    assert (again.points_merged, again.messages_merged, again.total_points) == (0, 0, 40)
+    assert ledger.get_total("anon:s-1") == 0 and ledger.get_total("user:42") == 40
+    assert [(e.owner, e.points) for e in board.top(10)] == [("user:42", 40)]
+    assert [(e.owner, e.points) for e in board.top(10, persona="karma")] == [("user:42", 40)]
+    assert [(r.user_id, r.anonymous_session_id) for r in store.records] == [("42", None), ("42", None), (None, "s-2")]
+
+
+def test_bulk_merge_is_durable_in_sqlite(tmp_path):
+    """Test a bulk merge split into transactions, and the ledger state reloaded from SQLite."""
+    ledger_path, message_path = str(tmp_path / "ledger.db"), str(tmp_path / "messages.db")
+    ledger = PointsLedger(lambda: SQLiteLedgerStore(ledger_path), flush_interval=60)
+    for i in range(5):
+        ledger.award(f"anon:s-{i}", 10 * (i + 1), created_at=datetime(2026, 3, 1, 12))
+    messages = MessageStore(lambda: SQLiteMessageStore(message_path), flush_interval=60)
+    messages.enqueue([_record(f"s-{i}") for i in range(5)])
+    merger = SessionMerger(lambda: SQLiteMergeStore(ledger_path, message_path), batch_size=2)
+
+    merges = [SessionMerge(f"s-{i}", str(100 + i % 2)) for i in range(5)]
+    with _patched(ledger, messages, Leaderboard()):
+        results = asyncio.run(merger.merge_many(merges))
+    merger.close()
+    ledger.close()
+    messages.close()
+
+    assert [r.points_merged for r in results] == [10, 20, 30, 40, 50]
+    assert all(r.messages_merged == 1 for r in results)
+    totals, streaks = SQLiteLedgerStore(ledger_path).load_state()
+    assert totals["user:100"] == 90 and totals["user:101"] == 60
+    assert all(totals[f"anon:s-{i}"] == 0 for i in range(5))
+    # Moving points is not activity
+    assert "user:100" not in streaks
+    with sqlite3.connect(message_path) as conn:
+        rows = conn.execute("SELECT user_id, anonymous_session_id FROM chat_messages ORDER BY id").fetchall()
+    assert rows == [("100", None), ("101", None), ("100", None), ("101", None), ("100", None)]
+
+
+def test_merge_rejects_duplicate_sessions():
+    """Test that a session can only appear once in a bulk merge."""
+    merger = SessionMerger(MemoryMergeStore)
+    with pytest.raises(ValueError):
+        asyncio.run(merger.merge_many([SessionMerge("s-1", "1"), SessionMerge("s-1", "2")]))
+
+
+def test_merge_endpoints(client, api_key_headers):
+    """Test the single and bulk merge endpoints."""
+    response = client.post("/api/session/merge", json={"sessionId": "anon-merge", "userId": "7"}, headers=api_key_headers)
+    assert response.status_code == 200
+    assert response.json()["pointsMerged"] == 0
+
+    duplicate = {"merges": [{"sessionId": "a", "userId": "1"}, {"sessionId": "a", "userId": "2"}]}
+    assert client.post("/api/session/merge/batch", json=duplicate, headers=api_key_headers).status_code == 400
+
+
+def test_merge_moves_awards_made_by_other_workers(tmp_path):
+    """Test that the points moved are read from the store, not this worker's view."""
+    path = str(tmp_path / "ledger.db")
+    ledger = PointsLedger(lambda: SQLiteLedgerStore(path), flush_interval=60)
+    ledger.award("anon:s-1", 10)
+    other = PointsLedger(lambda: SQLiteLedgerStore(path), flush_interval=60)
+    other.award("anon:s-1", 25)
+    other.close()
+    merger = SessionMerger(lambda: SQLiteMergeStore(path))
+
+    with _patched(ledger, MessageStore(MemoryMessageStore, flush_interval=60), Leaderboard()):
+        result = asyncio.run(merger.merge("s-1", "42"))
+    merger.close()
+
+    assert result.points_merged == 35
+    assert ledger.get_total("anon:s-1") == 0 and ledger.get_total("user:42") == 35
+    # The other worker's award and the transfer were read back, not counted twice
+    ledger.refresh()
+    assert ledger.get_total("anon:s-1") == 0 and ledger.get_total("user:42") == 35
+    totals, _ = SQLiteLedgerStore(path).load_state()
+    assert totals["anon:s-1"] == 0 and totals["user:42"] == 35
+    ledger.close()
@@ -0,0 +1,120 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+from app.config.settings import settings
+from app.models.chat import ChatRequest, ConversationMessage
+from app.services import ai_service
+from app.services.speculation import Speculator, follow_up_context, parse_suggestions
+
+SUGGESTED = ["How long should I meditate?", "What if my mind keeps wandering?"]
+CONTEXT = [ConversationMessage(role="user", content="I want to be calmer.")]
+
+
+def _completion(content):
+    response = MagicMock()
+    response.choices = [MagicMock(message=MagicMock(content=content))]
+    response.usage = None
+    return response
+
+
+def _fake_create(**kwargs):
+    """Answer suggestion calls with SUGGESTED and chat calls with an echo of the question."""
+    messages = kwargs["messages"]
+    if "follow-up questions" in messages[0]["content"]:
+        return _completion('["How long should I meditate?", "What if my mind keeps wandering?", ""]')
+    return _completion(f"Answer to: {messages[-1]['content']} [QUALITY:7:Good]")
+
+
+async def _settle(speculator):
+    while speculator.active_jobs:
+        await asyncio.sleep(0.01)
+
+
+def test_parse_suggestions():
+    """Test JSON and line-based suggestion output."""
+    assert parse_suggestions('Sure: ["A?", "B?", "a"]', 3) == ["A?", "B?"]
+    assert parse_suggestions("1. First?\n2. Second?\n3. Third?", 2) == ["First?", "Second?"]
+    assert parse_suggestions("", 3) == []
+
+
+def test_follow_up_answered_from_speculation():
+    """Test that a suggested follow-up is served without another upstream call."""
+    speculator = Speculator()
+    request = ChatRequest(message="How do I start meditating?", persona="atma", session_id="s-1", context=CONTEXT)
+
+    async def main():
+        first = await ai_service.generate_response(request)
+        await _settle(speculator)
+        suggestions = speculator.suggestions_for("s-1")
+        calls = create.call_count
+        follow_up = ChatRequest(
+            message=suggestions.questions[1],
+            persona="atma",
+            session_id="s-1",
+            context=follow_up_context(request, first.message)
+        )
+        second = await ai_service.generate_response(follow_up)
+        return first, suggestions, calls, create.call_count - calls, second
+
+    with patch.object(settings, "speculation_enabled", True), \
+            patch.object(ai_service, "speculator", speculator), \
+            patch("app.services.ai_service.client.chat.completions.create", side_effect=_fake_create) as create:
+        first, suggestions, calls, follow_up_calls, second = asyncio.run(main())
+
+    assert suggestions.response_id == first.id
+    assert list(suggestions.questions) == SUGGESTED
+    # One live answer, one suggestion call and two speculative answers
+    assert calls == 4 and follow_up_calls == 0
+    assert second.message == "Answer to: What if my mind keeps wandering?"
+    assert second.qualityScore == 7
+    assert speculator.stats()["hits"] == 1
+
+
+def test_follow_up_in_other_conversation_goes_upstream():
+    """Test that a precomputed answer is only used for the conversation it was made for."""
+    speculator = Speculator()
+    request = ChatRequest(message="How do I start meditating?", persona="atma", session_id="s-2", context=CONTEXT)
+
+    async def main():
+        await ai_service.generate_response(request)
+        await _settle(speculator)
+        other = ChatRequest(
+            message=SUGGESTED[0],
+            persona="atma",
+            session_id="s-2",
+            context=CONTEXT + [ConversationMessage(role="assistant", content="A different answer.")]
+        )
+        return await speculator.take(other)
+
+    with patch.object(settings, "speculation_enabled", True), \
+            patch.object(ai_service, "speculator", speculator), \
+            patch("app.services.ai_service.client.chat.completions.create", side_effect=_fake_create):
+        assert asyncio.run(main()) is None
+
+
+def test_speculation_yields_to_live_traffic_and_budget():
+    """Test that nothing is scheduled while live calls are at the limit or the budget is spent."""
+    speculator = Speculator()
+    request = ChatRequest(message="What is karma?", persona="karma", session_id="s-3")
+    response = MagicMock(id="r-1", message="Action.")
+
+    async def main():
+        with speculator.live_call(), speculator.live_call():
+            busy = speculator.schedule(request, response)
+        speculator.budget.spend(100)
+        exhausted = speculator.schedule(request, response)
+        return busy, exhausted
+
+    with patch.object(settings, "speculation_enabled", True), \
+            patch.object(settings, "speculation_max_live_requests", 2), \
+            patch.object(settings, "speculation_token_budget", 100):
+        assert asyncio.run(main()) == (False, False)
+    assert speculator.stats()["skipped"] == 2
+    assert speculator.live_requests == 0
+
+
+def test_suggestions_endpoint(client, api_key_headers):
+    """Test the suggestions of a session without speculation."""
+    response = client.get("/api/chat/suggestions", params={"sessionId": "unknown"}, headers=api_key_headers)
+    assert response.status_code == 200
+    assert response.json() == {"sessionId": "unknown", "suggestions": []}
@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.config.prompt_loader import prompt_manager
+from app.services.ai_service import LazyOpenAIClient, client
+from app.services.message_store import message_store
+from app.services.points_ledger import points_ledger
+
+SERVICE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+IMPORT_BENCHMARK = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+from app.config.prompt_loader import prompt_manager
+print(json.dumps({{
+    "seconds": elapsed,
+    "openai": "openai" in sys.modules,
+    "psutil": "psutil" in sys.modules,
+    "prompts_loaded": prompt_manager._loaded,
+}}))
+"""
+
+
+def _import_in_subprocess(module):
+    env = dict(os.environ, LOG_FILE="", LOG_LEVEL="WARNING")
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_BENCHMARK.format(module=module)],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True, timeout=60, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_defers_heavy_dependencies():
+    """Importing the application must not load openai, psutil or the prompts file."""
+    for module in ("app.main", "server"):
+        stats = _import_in_subprocess(module)
+        print(f"import {module}: {stats['seconds'] * 1000:.0f}ms")
+        assert not stats["openai"]
+        assert not stats["psutil"]
+        assert not stats["prompts_loaded"]
+
+
+def test_server_reexports_single_application():
+    import server
+    assert server.app is app
+
+
+def test_startup_initializes_dependencies():
+    with TestClient(app):
+        assert prompt_manager._loaded
+        assert prompt_manager.get_persona("karma") is not None
+        assert client._client is not None
+        # Stores are opened by the startup hooks, not by the first request
+        assert points_ledger._store is not None
+        assert message_store._store is not None
+
+
+def test_lazy_openai_client_created_on_first_use():
+    lazy = LazyOpenAIClient("test-key")
+    assert lazy._client is None
+    completions = lazy.chat.completions
+    assert lazy._client is not None
+    assert completions is lazy.get().chat.completions
@@ -0,0 +1,100 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.tracing import (
+    InMemorySpanExporter,
+    SpanContext,
+    Tracer,
+    format_traceparent,
+    parse_traceparent,
+    trace_requests,
+)
+from app.models.chat import ChatRequest, Persona
+
+REMOTE = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_traceparent_round_trip_and_invalid_headers():
+    """Test W3C traceparent parsing, formatting and rejection of invalid values."""
+    context = parse_traceparent(REMOTE)
+
+    assert context == SpanContext("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert format_traceparent(context) == REMOTE
+    assert parse_traceparent("00-00000000000000000000000000000000-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("ff-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("garbage") is None
+
+
+def test_nested_spans_share_trace_and_record_errors():
+    """Test parent/child links, remote parents and error status."""
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+
+    with tracer.start_span("outer", parent=parse_traceparent(REMOTE)) as outer:
+        with tracer.start_span("inner") as inner:
+            pass
+        with pytest.raises(ValueError):
+            with tracer.start_span("failing"):
+                raise ValueError("boom")
+
+    spans = {s.name: s for s in exporter.get_trace(outer.context.trace_id)}
+    assert outer.context.trace_id == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert outer.parent_span_id == "00f067aa0ba902b7"
+    assert inner.parent_span_id == outer.context.span_id
+    assert spans["failing"].status == "ERROR"
+    assert set(spans) == {"outer", "inner", "failing"}
+
+
+def test_unsampled_remote_trace_is_not_exported():
+    """Test that the caller's sampling decision is respected."""
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+
+    with tracer.start_span("server", parent=parse_traceparent(REMOTE[:-2] + "00")):
+        pass
+
+    assert exporter.trace_ids() == []
+
+
+def test_middleware_continues_trace_and_returns_headers():
+    """Test that the middleware continues nandi-api's trace and returns its id."""
+    app = FastAPI()
+    app.middleware("http")(trace_requests)
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        continued = client.get("/ping", headers={"traceparent": REMOTE})
+        started = client.get("/ping")
+
+    assert continued.headers["x-trace-id"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert parse_traceparent(continued.headers["traceparent"]).span_id != "00f067aa0ba902b7"
+    assert len(started.headers["x-trace-id"]) == 32
+    assert started.headers["x-trace-id"] != continued.headers["x-trace-id"]
+
+
+@pytest.mark.asyncio
+async def test_chat_request_spans():
+    """Test the spans recorded for an uncached chat request."""
+    from app.services import ai_service
+
+    exporter = InMemorySpanExporter()
+    tracer = Tracer(exporter)
+    request = ChatRequest(message="How do I find my dharma?", persona=Persona.DHARMA, context=[])
+    mock_response = MagicMock()
+    mock_response.choices = [MagicMock(message=MagicMock(content="Act without attachment. [QUALITY:8:Purposeful]"))]
+
+    with patch.object(ai_service, "tracer", tracer), \
+            patch("app.services.ai_service.get_from_cache", return_value=None), \
+            patch("app.services.ai_service.client.chat.completions.create", return_value=mock_response):
+        with tracer.start_span("POST /api/chat/generate", kind="SERVER") as root:
+            await ai_service.generate_response(request)
+
+    names = [s.name for s in exporter.get_trace(root.context.trace_id)]
+    assert names[:3] == ["POST /api/chat/generate", "chat.generate_response", "cache.lookup"]
+    assert {"prompt.assemble", "upstream.chat_completion", "response.parse", "quality.resolve"} <= set(names)
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.core.security import api_key_id
+from app.models.chat import ChatRequest, Persona
+from app.services.usage_service import (
+    MemoryUsageStore,
+    QuotaExceededError,
+    SQLiteUsageStore,
+    UsageTracker,
+    parse_quota_overrides,
+)
+
+
+def _usage(prompt, completion):
+    return SimpleNamespace(prompt_tokens=prompt, completion_tokens=completion)
+
+
+@pytest.mark.asyncio
+async def test_usage_is_aggregated_and_flushed(tmp_path):
+    """Test per key/persona/model aggregation and the SQLite upsert on flush."""
+    store = SQLiteUsageStore(str(tmp_path / "usage.db"))
+    tracker = UsageTracker(lambda: store, flush_interval=0)
+
+    tracker.record("key-a", "karma", "gpt-4", _usage(100, 20))
+    tracker.record("key-a", "karma", "gpt-4", _usage(50, 10))
+    tracker.record("key-b", "atma", "gpt-4o-mini", _usage(10, 5))
+    assert await tracker.flush() == 2
+    tracker.record("key-a", "karma", "gpt-4", _usage(1, 1))
+
+    rows = await tracker.query("2000-01-01", "2999-12-31", api_key_id("key-a"))
+
+    assert len(rows) == 1
+    assert (rows[0].requests, rows[0].prompt_tokens, rows[0].completion_tokens) == (3, 151, 31)
+    assert "key-a" not in {row.api_key for row in rows}
+    await tracker.stop()
+
+
+@pytest.mark.asyncio
+async def test_quota_counts_shared_and_unflushed_usage():
+    """Test that quotas see other workers' flushed usage and this worker's pending usage."""
+    store = MemoryUsageStore()
+    caller = api_key_id("key-a")
+    other_worker = UsageTracker(lambda: store, flush_interval=0)
+    worker = UsageTracker(
+        lambda: store,
+        flush_interval=0,
+        daily_quota=1000,
+        quota_overrides=parse_quota_overrides("unused=5:0")
+    )
+
+    other_worker.record("key-a", "karma", "gpt-4", _usage(600, 100))
+    await other_worker.flush()
+    await worker.check_quota("key-a")
+
+    worker.record("key-a", "karma", "gpt-4", _usage(250, 50))
+    with pytest.raises(QuotaExceededError) as exc:
+        await worker.check_quota("key-a")
+
+    assert exc.value.period == "day"
+    assert exc.value.used == 1000
+    assert exc.value.api_key == caller
+    await worker.check_quota("key-b")  # Other callers are unaffected
+    await worker.check_quota(None)
+
+
+@pytest.mark.asyncio
+async def test_generate_response_refuses_over_quota_without_upstream_call():
+    """Test that an exhausted quota stops the request before the OpenAI call."""
+    from app.services import ai_service
+
+    tracker = UsageTracker(MemoryUsageStore, flush_interval=0, daily_quota=10)
+    tracker.record("key-a", "karma", "gpt-4", _usage(20, 0))
+    create = MagicMock()
+    request = ChatRequest(message="What is my duty today?", persona=Persona.DHARMA, context=[])
+
+    with patch.object(ai_service, "usage_tracker", tracker), \
+            patch("app.services.ai_service.client.chat.completions.create", create):
+        with pytest.raises(QuotaExceededError):
+            await ai_service.generate_response(request, api_key="key-a")
+
+    create.assert_not_called()